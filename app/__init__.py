@@ -1,6 +1,7 @@
 from flask import Flask
 from config import Config
 from app.extensions import db, login_manager, mail, limiter
+from app.services.cache import api_cache
 from bson import ObjectId
 
 
@@ -13,6 +14,7 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     mail.init_app(app)
     limiter.init_app(app)
+    api_cache.init_app(app)
     login_manager.login_view = "auth.login"
     login_manager.login_message = "Por favor inicia sesión para acceder a esta página."
     login_manager.login_message_category = "info"
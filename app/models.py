@@ -102,7 +102,10 @@ class Tenant(db.Document):
     name = db.StringField(max_length=100, unique=True, required=True)
     slug = db.StringField(max_length=50, unique=True, required=True)
     created_at = db.DateTimeField(default=utc_now)
-    meta = {'collection': 'tenants'}
+    stock_units = db.IntField()  # Unidades totales en stock (contador materializado)
+    bundle_version = db.IntField(default=0)  # Invalida el grafo de bundles en caché
+    cache_version = db.IntField(default=0)  # Invalida las respuestas en caché (app.services.cache)
+    meta = {'collection': 'tenants', 'auto_create_index': False}
 
 
 class Supplier(db.Document):
@@ -113,7 +116,7 @@ class Supplier(db.Document):
     is_active = db.BooleanField(default=True)
     tenant = db.ReferenceField(Tenant)
     created_at = db.DateTimeField(default=utc_now)
-    meta = {'collection': 'suppliers'}
+    meta = {'collection': 'suppliers', 'auto_create_index': False}
 
 
 class User(db.Document, UserMixin):
@@ -126,7 +129,7 @@ class User(db.Document, UserMixin):
     tenant = db.ReferenceField(Tenant)
     created_at = db.DateTimeField(default=utc_now)
     last_login = db.DateTimeField()
-    meta = {'collection': 'users'}
+    meta = {'collection': 'users', 'auto_create_index': False}
 
     def get_id(self):
         return str(self.id)
@@ -172,19 +175,29 @@ class Product(db.Document):
     description = db.StringField()
     expiry_date = db.DateField()
     shopify_id = db.StringField(max_length=50)  # Link to Shopify product
+    sync_hash = db.StringField(max_length=40)  # Hash del payload de Shopify (ver app.services.shopify)
+    # Contador materializado: suma de quantity_current de los lotes.
+    # Lo mantiene app.services.inventory.adjust_stock (None = aún no calculado)
+    stock_current = db.IntField()
+    # Tiene filas en product_bundles como bundle (lo mantiene app.services.bundles)
+    is_bundle = db.BooleanField(default=False)
+    # Prefijos de nombre y SKU para la búsqueda indexada (ver app.services.search)
+    search_tokens = db.ListField(db.StringField(max_length=20), default=list)
     tenant = db.ReferenceField(Tenant)
-    meta = {'collection': 'products'}
+    meta = {'collection': 'products', 'auto_create_index': False}
+
+    def clean(self):
+        """Recalcula los campos de búsqueda"""
+        from app.services.search import product_search_fields
+        self.search_tokens = product_search_fields(self.name, self.sku)['search_tokens']
 
     @property
     def total_stock(self):
+        if self.stock_current is not None:
+            return self.stock_current
         lots = Lot.objects(product=self, quantity_current__gt=0)
         return sum(lot.quantity_current for lot in lots)
 
-    @property
-    def is_bundle(self):
-        """Check if this product is a bundle containing other products"""
-        return ProductBundle.objects(bundle=self).count() > 0
-
     @property
     def lots(self):
         return Lot.objects(product=self)
@@ -200,7 +213,7 @@ class ProductBundle(db.Document):
     component = db.ReferenceField(Product, required=True)
     quantity = db.IntField(default=1, required=True)
     tenant = db.ReferenceField(Tenant)
-    meta = {'collection': 'product_bundles'}
+    meta = {'collection': 'product_bundles', 'auto_create_index': False}
 
 
 class InboundOrderLineItem(db.EmbeddedDocument):
@@ -226,6 +239,7 @@ class InboundOrder(db.Document):
     tenant = db.ReferenceField(Tenant)
     meta = {
         'collection': 'inbound_orders',
+        'auto_create_index': False,
         'indexes': ['tenant', 'status', '-created_at']
     }
 
@@ -256,7 +270,7 @@ class Lot(db.Document):
     unit_cost = db.DecimalField(precision=2, default=0)
     expiry_date = db.DateField()
     created_at = db.DateTimeField(default=utc_now)
-    meta = {'collection': 'lots'}
+    meta = {'collection': 'lots', 'auto_create_index': False}
 
 
 class Sale(db.Document):
@@ -306,29 +320,57 @@ class Sale(db.Document):
     shopify_order_id = db.StringField(max_length=50)  # Shopify order ID for sync tracking
     shopify_order_number = db.IntField()  # Shopify order number (#1001, etc.)
 
+    # Totales materializados (los mantiene app.services.sales.add_to_totals;
+    # None = aún no calculados). En MongoDB se llaman total_amount/total_paid/balance.
+    amount_total = db.DecimalField(precision=2, db_field='total_amount')
+    amount_paid = db.DecimalField(precision=2, db_field='total_paid')
+    amount_balance = db.DecimalField(precision=2, db_field='balance')
+
+    # Tokens de conciliación bancaria (nombre, RUT, N° pedido); ver app.services.match_tokens
+    match_tokens = db.ListField(db.StringField(max_length=50), default=list)
+
     # References
     tenant = db.ReferenceField(Tenant)
 
-    meta = {'collection': 'sales'}
+    meta = {'collection': 'sales', 'auto_create_index': False}
+
+    def clean(self):
+        """Calcula los tokens de conciliación si no se asignaron al crear la venta"""
+        if not self.match_tokens:
+            from app.services.match_tokens import sale_tokens
+            self.match_tokens = sale_tokens(self.customer_name, self.shopify_order_number)
 
     @property
     def items(self):
+        # BatchLoader.prefetch_sale_items deja los items ya cargados
+        prefetched = getattr(self, '_prefetched_items', None)
+        if prefetched is not None:
+            return prefetched
         return SaleItem.objects(sale=self)
 
     @property
     def total_amount(self):
-        """Calcula el monto total de la venta"""
+        """Monto total de la venta (guardado, o calculado desde los items)"""
+        if self.amount_total is not None:
+            return float(self.amount_total)
         return sum(item.quantity * float(item.unit_price) for item in self.items)
 
     @property
     def total_paid(self):
-        """Suma todos los pagos registrados"""
+        """Suma de los pagos registrados (guardada, o calculada desde los pagos)"""
+        if self.amount_paid is not None:
+            return float(self.amount_paid)
         from app.models import Payment  # Import here to avoid circular dependency
-        return sum(float(p.amount) for p in Payment.objects(sale=self))
+        payments = getattr(self, '_prefetched_payments', None)
+        if payments is None:
+            payments = Payment.objects(sale=self)
+        return sum(float(p.amount) for p in payments)
 
     @property
     def balance_pending(self):
         """Calcula saldo pendiente"""
+        if self.amount_total is not None and self.amount_paid is not None:
+            return float(self.amount_total) - float(self.amount_paid)
         return self.total_amount - self.total_paid
 
     @property
@@ -363,7 +405,7 @@ class SaleItem(db.Document):
     product = db.ReferenceField(Product, required=True)
     quantity = db.IntField(required=True)
     unit_price = db.DecimalField(precision=2, required=True)  # FIXED: Decimal for monetary precision
-    meta = {'collection': 'sale_items'}
+    meta = {'collection': 'sale_items', 'auto_create_index': False}
 
     @property
     def subtotal(self):
@@ -378,7 +420,7 @@ class Wastage(db.Document):
     notes = db.StringField()
     date_created = db.DateTimeField(default=utc_now)
     tenant = db.ReferenceField(Tenant)
-    meta = {'collection': 'wastages'}
+    meta = {'collection': 'wastages', 'auto_create_index': False}
 
 
 class Payment(db.Document):
@@ -405,6 +447,7 @@ class Payment(db.Document):
 
     meta = {
         'collection': 'payments',
+        'auto_create_index': False,
         'indexes': [
             'sale',
             'tenant',
@@ -414,6 +457,59 @@ class Payment(db.Document):
     }
 
 
+JOB_STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+
+class Job(db.Document):
+    """
+    Trabajo en segundo plano (ver app.services.jobs). Lo ejecuta
+    `scripts/job_worker.py`; el archivo resultado queda en disco en
+    `artifact_path`.
+    """
+    kind = db.StringField(max_length=50, required=True)  # nombre registrado con @job_handler
+    status = db.StringField(max_length=20, default='queued', choices=JOB_STATUSES)
+    params = db.DictField()
+    progress = db.IntField(default=0)  # 0-100
+    message = db.StringField(max_length=200)
+    result = db.DictField()
+    error = db.StringField()
+    artifact_path = db.StringField()
+    artifact_name = db.StringField(max_length=200)
+    cancel_requested = db.BooleanField(default=False)
+    worker = db.StringField(max_length=200)  # host:pid:thread
+    heartbeat_at = db.DateTimeField()
+    created_at = db.DateTimeField(default=utc_now)
+    started_at = db.DateTimeField()
+    finished_at = db.DateTimeField()
+    user = db.ReferenceField(User)
+    tenant = db.ReferenceField(Tenant, required=True)
+
+    meta = {'collection': 'jobs', 'auto_create_index': False}
+
+
+class SalesDaily(db.Document):
+    """
+    Rollup diario de ventas por tenant y canal.
+    Lo mantiene app.services.sales con $inc; se reconstruye con
+    `python scripts/maintenance.py rebuild-sales-daily`.
+    """
+    tenant = db.ReferenceField(Tenant, required=True)
+    day = db.DateTimeField(required=True)  # Medianoche UTC del día de la venta
+    channel = db.StringField(max_length=20)  # Sale.sales_channel
+    sales_count = db.IntField(default=0)
+    units = db.IntField(default=0)
+    revenue = db.FloatField(default=0)
+    paid = db.FloatField(default=0)
+
+    meta = {
+        'collection': 'sales_daily',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['tenant', 'day', 'channel'], 'unique': True}
+        ]
+    }
+
+
 # ============================================
 # ACTIVITY LOG - MONITOR DE ACTIVIDADES
 # ============================================
@@ -437,6 +533,7 @@ class ActivityLog(db.Document):
     created_at = db.DateTimeField(default=utc_now)
     meta = {
         'collection': 'activity_logs',
+        'auto_create_index': False,
         'indexes': [
             '-created_at',
             'user',
@@ -502,8 +599,13 @@ class ShopifyCustomer(db.Document):
     
     # Shopify fields
     shopify_id = db.StringField(max_length=50, unique=True, sparse=True)
+    sync_hash = db.StringField(max_length=40)  # Hash del payload de Shopify (ver app.services.shopify)
     tags = db.ListField(db.StringField(max_length=50), default=list)
     
+    # Búsqueda indexada: prefijos de nombre/email y teléfono solo dígitos (ver app.services.search)
+    search_tokens = db.ListField(db.StringField(max_length=20), default=list)
+    phone_keys = db.ListField(db.StringField(max_length=50), default=list)
+    
     # Stats (calculated from orders)
     total_orders = db.IntField(default=0)
     total_spent = db.DecimalField(precision=2, default=0)
@@ -517,6 +619,7 @@ class ShopifyCustomer(db.Document):
     
     meta = {
         'collection': 'shopify_customers',
+        'auto_create_index': False,
         'indexes': [
             'shopify_id',
             'email',
@@ -528,6 +631,13 @@ class ShopifyCustomer(db.Document):
         ]
     }
     
+    def clean(self):
+        """Recalcula los campos de búsqueda"""
+        from app.services.search import customer_search_fields
+        fields = customer_search_fields(self.name, self.email, self.phone)
+        self.search_tokens = fields['search_tokens']
+        self.phone_keys = fields['phone_keys']
+    
     @property
     def orders(self):
         """Get all orders for this customer"""
@@ -572,15 +682,19 @@ class BankTransaction(db.Document):
     matched_at = db.DateTimeField()
     matched_by = db.ReferenceField('User')
     match_type = db.StringField(max_length=20)  # 'manual' o 'auto'
+    match_run = db.ObjectIdField()  # Ejecución de auto-conciliación que la concilió
     
     # Metadata
     source_file = db.StringField(max_length=200)  # Nombre del archivo importado
     row_number = db.IntField()  # Fila original en el Excel
+    # Huella de deduplicación (ver app.services.bank_import.fingerprint); única por tenant
+    fingerprint = db.StringField(max_length=40)
     created_at = db.DateTimeField(default=utc_now)
     tenant = db.ReferenceField(Tenant)
     
     meta = {
         'collection': 'bank_transactions',
+        'auto_create_index': False,
         'indexes': [
             'tenant',
             'date',
@@ -610,6 +724,7 @@ class ShopifyOrder(db.Document):
     """Orden sincronizada desde Shopify (solo lectura)"""
     order_number = db.IntField()
     shopify_id = db.StringField(max_length=50, unique=True, required=True)
+    sync_hash = db.StringField(max_length=40)  # Hash del payload de Shopify (ver app.services.shopify)
     
     # Customer info
     customer = db.ReferenceField(ShopifyCustomer)
@@ -656,6 +771,7 @@ class ShopifyOrder(db.Document):
     
     meta = {
         'collection': 'shopify_orders',
+        'auto_create_index': False,
         'indexes': [
             'shopify_id',
             'customer',
@@ -667,3 +783,65 @@ class ShopifyOrder(db.Document):
         ],
         'ordering': ['-created_at']
     }
+
+
+SHOPIFY_SYNC_RESOURCES = ('customers', 'orders', 'products')
+
+
+class ShopifySyncState(db.Document):
+    """
+    Punto de control de la sincronización incremental con Shopify, por
+    tenant y recurso (ver app.services.shopify.checkpointed_pages).
+    `updated_at_min` es la marca desde la que se piden cambios; `cursor`
+    la URL de la página siguiente de una corrida en curso (para retomar
+    después de una caída).
+    """
+    tenant = db.ReferenceField(Tenant, required=True)
+    resource = db.StringField(max_length=20, required=True, choices=SHOPIFY_SYNC_RESOURCES)
+    updated_at_min = db.DateTimeField()
+    cursor = db.StringField()
+    run_started_at = db.DateTimeField()  # Inicio de la corrida en curso (o la última)
+    last_completed_at = db.DateTimeField()
+    records = db.IntField(default=0)  # Registros de la corrida en curso (o la última)
+
+    meta = {
+        'collection': 'shopify_sync_state',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['tenant', 'resource'], 'unique': True}
+        ]
+    }
+
+
+SHOPIFY_WEBHOOK_TOPICS = ('orders/create', 'orders/updated', 'customers/update', 'products/update')
+SHOPIFY_WEBHOOK_STATUSES = ('pending', 'processing', 'done', 'failed')
+
+
+class ShopifyWebhook(db.Document):
+    """
+    Bandeja de entrada de webhooks de Shopify (ver app.services.shopify_webhooks).
+    El endpoint solo verifica la firma y guarda el cuerpo crudo; el consumidor
+    los procesa por lotes con los upserts de la sincronización.
+    `webhook_id` (header X-Shopify-Webhook-Id) se repite en los reenvíos.
+    """
+    tenant = db.ReferenceField(Tenant, required=True)
+    topic = db.StringField(max_length=50, required=True, choices=SHOPIFY_WEBHOOK_TOPICS)
+    webhook_id = db.StringField(max_length=100, required=True)
+    shop_domain = db.StringField(max_length=200)
+    body = db.StringField()  # JSON tal como lo envió Shopify
+    status = db.StringField(max_length=20, default='pending', choices=SHOPIFY_WEBHOOK_STATUSES)
+    attempts = db.IntField(default=0)
+    error = db.StringField()
+    worker = db.StringField(max_length=200)  # host:pid:thread del consumidor que lo tomó
+    received_at = db.DateTimeField(default=utc_now)
+    claimed_at = db.DateTimeField()
+    processed_at = db.DateTimeField()
+
+    meta = {
+        'collection': 'shopify_webhooks',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['tenant', 'webhook_id'], 'unique': True},
+            {'fields': ['status', 'received_at']},
+        ]
+    }
@@ -5,6 +5,8 @@ Gestión de usuarios y monitor de actividades
 from flask import Blueprint, render_template, request, jsonify, g, abort
 from flask_login import login_required, current_user
 from app.models import User, Tenant, ActivityLog, ROLE_PERMISSIONS, utc_now
+from app.services.cache import api_cache, invalidate
+from app.services.pagination import paginate, InvalidCursor
 from functools import wraps
 from bson import ObjectId
 from mongoengine import DoesNotExist
@@ -325,10 +327,6 @@ def get_activity_log():
     """Obtener log de actividades"""
     tenant = g.current_tenant
 
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
-
     # Filters
     user_filter = request.args.get('user')
     action_filter = request.args.get('action')
@@ -351,8 +349,11 @@ def get_activity_log():
         from datetime import datetime, timedelta
         query = query.filter(created_at__lt=datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
 
-    total = query.count()
-    logs = query.order_by('-created_at').skip((page - 1) * per_page).limit(per_page)
+    # Pagination (?cursor= para keyset, ?page= clásico)
+    try:
+        page = paginate(query, 'created_at', default_per_page=50)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
 
     return jsonify({
         'success': True,
@@ -367,10 +368,9 @@ def get_activity_log():
             'target_type': log.target_type,
             'ip_address': log.ip_address,
             'created_at': log.created_at.strftime('%d/%m/%Y %H:%M:%S')
-        } for log in logs],
-        'total': total,
-        'pages': (total + per_page - 1) // per_page,
-        'current_page': page
+        } for log in page.items],
+        'current_page': page.page,
+        **page.meta()
     })
 
 
@@ -405,6 +405,29 @@ def get_activity_stats():
     })
 
 
+# ============================================
+# CACHÉ DE API
+# ============================================
+
+@bp.route('/api/cache', methods=['GET'])
+@login_required
+@permission_required('activity_log', 'view')
+def get_cache_stats():
+    """Aciertos/fallos de la caché de endpoints (contadores de este worker)"""
+    return jsonify({'success': True, **api_cache.stats()})
+
+
+@bp.route('/api/cache/clear', methods=['POST'])
+@login_required
+@permission_required('users', 'edit')
+def clear_cache():
+    """Descarta las respuestas en caché del tenant actual en todos los workers"""
+    tenant = g.current_tenant
+    invalidate(tenant)
+    removed = api_cache.clear(tenant)
+    return jsonify({'success': True, 'removed': removed})
+
+
 # ============================================
 # ROLES & PERMISSIONS INFO
 # ============================================
@@ -1,9 +1,18 @@
-from flask import Blueprint, jsonify, request, g, abort, current_app
+from flask import Blueprint, jsonify, request, g, abort, current_app, send_file
 from flask_login import current_user, login_required
-from app.models import Product, Sale, SaleItem, Lot, InboundOrder, ProductBundle, ActivityLog, Payment, Tenant, Wastage, User, utc_now, ShopifyCustomer, SALES_CHANNELS
+from app.models import Product, Sale, SaleItem, Lot, InboundOrder, ProductBundle, ActivityLog, Payment, Tenant, Wastage, User, Job, SHOPIFY_WEBHOOK_TOPICS, utc_now
 from app.extensions import limiter
+from app.services.inventory import adjust_stock, StockAllocation, InventoryError, InsufficientStockError, StockConflictError
+from app.services.loaders import get_loader
+from app.services.cache import api_cache
+from app.services.jobs import serialize_job, request_cancel
+from app.services.pagination import paginate, InvalidCursor
+from app.services.search import search_filter, search_products
+from app.services.shopify_webhooks import HMAC_HEADER, store_webhook, verify_hmac
+from app.services.sales import add_to_totals, record_sale, discard_sale
+from app.services.dashboard_metrics import stats_metrics, finance_metrics, operations_metrics
+from app.services.bundles import get_bundle_graph, buildable_units, set_bundle_components, remove_product_from_bundles
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
 from bson import ObjectId
 from mongoengine import DoesNotExist
 from functools import wraps
@@ -39,6 +48,7 @@ def permission_required(module, action='view'):
 def get_products():
     tenant = g.current_tenant
     products = Product.objects(tenant=tenant)
+    buildable = buildable_units(tenant)
     results = []
     for p in products:
         results.append({
@@ -49,7 +59,9 @@ def get_products():
             'category': p.category,
             'base_price': float(p.base_price) if p.base_price else 0,
             'critical_stock': p.critical_stock,
-            'stock': p.total_stock
+            'stock': p.total_stock,
+            'is_bundle': p.is_bundle,
+            'buildable': buildable.get(p.pk) if p.is_bundle else None
         })
     return jsonify(results)
 
@@ -77,6 +89,7 @@ def create_product():
             category=data.get('category', 'Otros'),
             base_price=data.get('base_price', 0),
             critical_stock=data.get('critical_stock', 10),
+            stock_current=0,
             tenant=tenant
         )
         new_product.save()
@@ -124,17 +137,11 @@ def create_product():
                 created_at=datetime.now()
             )
             initial_lot.save()
+            adjust_stock(new_product, initial_stock, tenant=tenant)
 
         # Handle bundle components
         if 'bundle_components' in data and data['bundle_components']:
-            for component in data['bundle_components']:
-                bundle_item = ProductBundle(
-                    bundle=new_product,
-                    component=Product.objects.get(id=ObjectId(component['component_id'])),
-                    quantity=component['quantity'],
-                    tenant=tenant
-                )
-                bundle_item.save()
+            set_bundle_components(new_product, data['bundle_components'], tenant)
 
         # Log activity
         stock_msg = f', stock inicial: {initial_stock}' if initial_stock > 0 else ''
@@ -168,12 +175,12 @@ def delete_product(id):
         product_name = product.name
         product_sku = product.sku
 
-        # Delete associated lots first
+        # Delete associated lots first (descontando su stock del tenant)
+        adjust_stock(product, -product.total_stock, tenant=tenant)
         Lot.objects(product=product).delete()
 
         # Delete bundle relationships if this product is part of any bundles
-        ProductBundle.objects(component=product).delete()
-        ProductBundle.objects(bundle=product).delete()
+        remove_product_from_bundles(product, tenant)
 
         # Delete the product
         product.delete()
@@ -235,17 +242,8 @@ def update_product(id):
 
         # Handle bundle components update
         if 'bundle_components' in data:
-            # Delete existing components
-            ProductBundle.objects(bundle=product).delete()
-            # Add new components
-            for component in data['bundle_components']:
-                bundle_item = ProductBundle(
-                    bundle=product,
-                    component=Product.objects.get(id=ObjectId(component['component_id'])),
-                    quantity=component['quantity'],
-                    tenant=tenant
-                )
-                bundle_item.save()
+            # Replace existing components
+            set_bundle_components(product, data['bundle_components'], tenant)
             changes.append('componentes de bundle actualizados')
 
         product.save()
@@ -297,32 +295,23 @@ def update_product(id):
                     created_at=datetime.now()
                 )
                 new_lot.save()
+                adjust_stock(product, stock_adjustment_qty, tenant=tenant)
 
                 reason_text = f' ({stock_adjustment_reason})' if stock_adjustment_reason else ''
                 changes.append(f'stock +{stock_adjustment_qty} unidades{reason_text}')
 
             elif stock_adjustment_type == 'subtract':
-                # Subtract stock: validate and deduct from lots (FIFO), create Wastage record
-                current_stock = product.total_stock
-                if stock_adjustment_qty > current_stock:
-                    return jsonify({
-                        'error': f'No se puede restar {stock_adjustment_qty} unidades. Stock disponible: {current_stock}'
-                    }), 400
-
-                # Deduct from lots using FIFO
-                remaining_to_deduct = stock_adjustment_qty
-                available_lots = sorted(
-                    [l for l in product.lots if l.quantity_current > 0],
-                    key=lambda x: x.created_at
-                )
-
-                for lot in available_lots:
-                    if remaining_to_deduct <= 0:
-                        break
-                    deduct = min(lot.quantity_current, remaining_to_deduct)
-                    lot.quantity_current -= deduct
-                    remaining_to_deduct -= deduct
-                    lot.save()
+                # Subtract stock: deduct from lots (FIFO), create Wastage record
+                try:
+                    with StockAllocation(tenant) as allocation:
+                        allocation.deduct(
+                            product, stock_adjustment_qty,
+                            message='No se puede restar {requested} unidades. Stock disponible: {available}'
+                        )
+                except InsufficientStockError as e:
+                    return jsonify({'error': str(e)}), 400
+                except StockConflictError as e:
+                    return jsonify({'error': str(e)}), 409
 
                 # Create wastage record for the adjustment
                 wastage_reason = stock_adjustment_reason or 'Ajuste de inventario'
@@ -362,8 +351,6 @@ def update_product(id):
 @login_required
 def get_sales():
     tenant = g.current_tenant
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
     date_filter = request.args.get('date')  # YYYY-MM-DD or YYYY-MM
 
     query = Sale.objects(tenant=tenant)
@@ -382,9 +369,13 @@ def get_sales():
                 end_dt = start_dt.replace(month=start_dt.month + 1)
             query = query.filter(date_created__gte=start_dt, date_created__lt=end_dt)
 
-    # Pagination
-    total = query.count()
-    sales = query.order_by('-date_created').skip((page - 1) * per_page).limit(per_page)
+    # Pagination (?cursor= para keyset, ?page= clásico)
+    try:
+        page = paginate(query, 'date_created', default_per_page=20)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    sales = page.items
+    get_loader().prefetch_sale_items(sales)
 
     results = []
     for s in sales:
@@ -417,27 +408,22 @@ def get_sales():
 
     return jsonify({
         'sales': results,
-        'total': total,
-        'pages': (total + per_page - 1) // per_page,
-        'current_page': page
+        'current_page': page.page,
+        **page.meta()
     })
 
 
 @bp.route('/dashboard', methods=['GET'])
 @login_required
+@api_cache.cached(ttl=30)
 def get_dashboard_stats():
     tenant = g.current_tenant
     range_type = request.args.get('range', 'last_7')
 
-    total_sales = Sale.objects(tenant=tenant).count()
+    # Totales y serie de ingresos desde el rollup diario (una agregación)
+    metrics = stats_metrics(tenant, range_type, request.args.get('month'), today=utc_now().date())
     total_products = Product.objects(tenant=tenant).count()
 
-    # Calculate total revenue
-    revenue = 0
-    for sale in Sale.objects(tenant=tenant):
-        for item in sale.items:
-            revenue += item.quantity * float(item.unit_price)
-
     recent_sales = Sale.objects(tenant=tenant).order_by('-date_created').limit(5)
     recent_sales_data = [{
         'id': str(s.id),
@@ -445,259 +431,31 @@ def get_dashboard_stats():
         'status': s.status
     } for s in recent_sales]
 
-    # Chart Data Logic
-    end_date = utc_now().date()
-    start_date = end_date - timedelta(days=6)
-    group_by = 'day'
-
-    if range_type == 'last_30':
-        start_date = end_date - timedelta(days=29)
-    elif range_type == 'this_month':
-        start_date = end_date.replace(day=1)
-    elif range_type == 'last_month':
-        start_date = (end_date.replace(day=1) - relativedelta(months=1))
-        end_date = end_date.replace(day=1) - timedelta(days=1)
-    elif range_type == 'year':
-        start_date = end_date.replace(month=1, day=1)
-        group_by = 'month'
-    elif range_type == 'last_6_months':
-        start_date = (end_date.replace(day=1) - relativedelta(months=5))
-        group_by = 'month'
-    elif range_type == 'all_time':
-        earliest_sale = Sale.objects(tenant=tenant).order_by('date_created').first()
-        if earliest_sale:
-            start_date = earliest_sale.date_created.date().replace(day=1)
-        else:
-            start_date = end_date.replace(day=1)
-        group_by = 'month'
-    elif range_type == 'specific_month':
-        month_str = request.args.get('month')
-        if month_str:
-            try:
-                start_date = datetime.strptime(month_str, '%Y-%m').date()
-                next_month = start_date + relativedelta(months=1)
-                end_date = next_month - timedelta(days=1)
-            except ValueError:
-                start_date = end_date.replace(day=1)
-        else:
-            start_date = end_date.replace(day=1)
-        group_by = 'day'
-
-    chart_labels = []
-    chart_values = []
-    chart_keys = []
-
-    if group_by == 'day':
-        delta = (end_date - start_date).days
-        dates = [start_date + timedelta(days=i) for i in range(delta + 1)]
-
-        for d in dates:
-            daily_revenue = 0
-            day_start = datetime.combine(d, datetime.min.time())
-            day_end = datetime.combine(d + timedelta(days=1), datetime.min.time())
-
-            for sale in Sale.objects(tenant=tenant, date_created__gte=day_start, date_created__lt=day_end):
-                for item in sale.items:
-                    daily_revenue += item.quantity * float(item.unit_price)
-
-            chart_labels.append(d.strftime('%d/%m'))
-            chart_values.append(daily_revenue)
-            chart_keys.append(d.strftime('%Y-%m-%d'))
-
-    elif group_by == 'month':
-        curr = start_date
-        while curr <= end_date:
-            next_month = curr + relativedelta(months=1)
-            month_start = datetime.combine(curr, datetime.min.time())
-            month_end = datetime.combine(next_month, datetime.min.time())
-
-            monthly_revenue = 0
-            for sale in Sale.objects(tenant=tenant, date_created__gte=month_start, date_created__lt=month_end):
-                for item in sale.items:
-                    monthly_revenue += item.quantity * float(item.unit_price)
-
-            chart_labels.append(curr.strftime('%B'))
-            chart_values.append(monthly_revenue)
-            chart_keys.append(curr.strftime('%Y-%m'))
-            curr = next_month
-
     return jsonify({
-        'total_sales': total_sales,
+        'total_sales': metrics['total_sales'],
         'total_products': total_products,
-        'total_revenue': revenue,
+        'total_revenue': metrics['total_revenue'],
         'recent_sales': recent_sales_data,
-        'chart_data': {
-            'labels': chart_labels,
-            'values': chart_values,
-            'keys': chart_keys
-        }
+        'chart_data': metrics['chart_data']
     })
 
 
 @bp.route('/dashboard/finances', methods=['GET'])
 @login_required
+@api_cache.cached(ttl=60)
 def get_dashboard_finances():
     tenant = g.current_tenant
-
-    now = datetime.utcnow()
-    current_month_start = datetime.combine(now.date().replace(day=1), datetime.min.time())
-    next_month = current_month_start + relativedelta(months=1)
-    prev_month_start = current_month_start - relativedelta(months=1)
-    prev_month_end = current_month_start
-
-    # === Comparison: current vs previous month ===
-    current_sales = Sale.objects(tenant=tenant, date_created__gte=current_month_start, date_created__lt=next_month)
-    prev_sales = Sale.objects(tenant=tenant, date_created__gte=prev_month_start, date_created__lt=prev_month_end)
-
-    def calc_revenue(sales_qs):
-        total = 0
-        for sale in sales_qs:
-            for item in sale.items:
-                total += item.quantity * float(item.unit_price)
-        return total
-
-    current_count = current_sales.count()
-    prev_count = prev_sales.count()
-    current_revenue = calc_revenue(current_sales)
-    prev_revenue = calc_revenue(prev_sales)
-
-    sales_change_pct = ((current_count - prev_count) / prev_count * 100) if prev_count > 0 else (100.0 if current_count > 0 else 0)
-    revenue_change_pct = ((current_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else (100.0 if current_revenue > 0 else 0)
-
-    # === Sales by channel ===
-    by_channel = {}
-    for channel_key in SALES_CHANNELS:
-        channel_sales = Sale.objects(tenant=tenant, date_created__gte=current_month_start, date_created__lt=next_month, sales_channel=channel_key)
-        count = channel_sales.count()
-        revenue = calc_revenue(channel_sales)
-        by_channel[channel_key] = {'count': count, 'revenue': revenue}
-
-    # === Pending payments ===
-    unpaid_sales = Sale.objects(tenant=tenant, payment_status__in=['pendiente', 'parcial']).order_by('date_created')
-
-    total_pending = 0
-    unpaid_list = []
-    for sale in unpaid_sales:
-        sale_total = 0
-        for item in sale.items:
-            sale_total += item.quantity * float(item.unit_price)
-        paid = float(sale.total_paid) if hasattr(sale, 'total_paid') else 0
-        pending_amount = sale_total - paid
-        if pending_amount > 0:
-            total_pending += pending_amount
-            days_old = (now - sale.date_created).days if sale.date_created else 0
-            unpaid_list.append({
-                'id': str(sale.id),
-                'customer': sale.customer_name or 'Sin nombre',
-                'total': sale_total,
-                'pending': pending_amount,
-                'days_old': days_old,
-                'status': sale.payment_status
-            })
-
-    avg_age = sum(u['days_old'] for u in unpaid_list) / len(unpaid_list) if unpaid_list else 0
-
-    return jsonify({
-        'success': True,
-        'comparison': {
-            'current_month_sales': current_count,
-            'current_month_revenue': current_revenue,
-            'prev_month_sales': prev_count,
-            'prev_month_revenue': prev_revenue,
-            'sales_change_pct': round(sales_change_pct, 1),
-            'revenue_change_pct': round(revenue_change_pct, 1)
-        },
-        'by_channel': by_channel,
-        'pending_payments': {
-            'total_pending': total_pending,
-            'count': len(unpaid_list),
-            'avg_age_days': round(avg_age, 1),
-            'oldest_unpaid': unpaid_list[:5]
-        }
-    })
+    metrics = finance_metrics(tenant, now=datetime.utcnow())
+    return jsonify(dict(success=True, **metrics))
 
 
 @bp.route('/dashboard/operations', methods=['GET'])
 @login_required
+@api_cache.cached(ttl=30)
 def get_dashboard_operations():
     tenant = g.current_tenant
-
-    now = datetime.utcnow()
-    current_month_start = datetime.combine(now.date().replace(day=1), datetime.min.time())
-    next_month = current_month_start + relativedelta(months=1)
-    prev_month_start = current_month_start - relativedelta(months=1)
-
-    # === New customers this month vs previous ===
-    current_customers = ShopifyCustomer.objects(
-        tenant=tenant,
-        created_at__gte=current_month_start,
-        created_at__lt=next_month
-    ).count()
-
-    prev_customers = ShopifyCustomer.objects(
-        tenant=tenant,
-        created_at__gte=prev_month_start,
-        created_at__lt=current_month_start
-    ).count()
-
-    customers_change_pct = ((current_customers - prev_customers) / prev_customers * 100) if prev_customers > 0 else (100.0 if current_customers > 0 else 0)
-
-    # === Critical stock (all products below minimum) ===
-    critical_stock = []
-    for p in Product.objects(tenant=tenant):
-        if hasattr(p, 'total_stock') and hasattr(p, 'critical_stock'):
-            if p.total_stock <= p.critical_stock:
-                critical_stock.append({
-                    'id': str(p.id),
-                    'name': p.name,
-                    'stock': p.total_stock,
-                    'critical': p.critical_stock,
-                    'sku': p.sku or ''
-                })
-
-    # === Pending inbound orders ===
-    pending_orders = []
-    for order in InboundOrder.objects(tenant=tenant, status='pending').order_by('-created_at').limit(10):
-        supplier_name = order.supplier_name
-        if not supplier_name and order.supplier:
-            try:
-                supplier_name = order.supplier.name
-            except Exception:
-                supplier_name = 'Sin proveedor'
-        pending_orders.append({
-            'id': str(order.id),
-            'supplier': supplier_name or 'Sin proveedor',
-            'status': order.status,
-            'created_at': order.created_at.strftime('%Y-%m-%d') if order.created_at else '',
-            'total': float(order.total) if order.total else 0
-        })
-
-    # === Recent sales (last 10) ===
-    recent_sales = []
-    for sale in Sale.objects(tenant=tenant).order_by('-date_created').limit(10):
-        sale_total = 0
-        for item in sale.items:
-            sale_total += item.quantity * float(item.unit_price)
-        recent_sales.append({
-            'id': str(sale.id),
-            'customer': sale.customer_name or 'Sin nombre',
-            'total': sale_total,
-            'status': sale.status,
-            'channel': sale.sales_channel or 'manual',
-            'date': sale.date_created.strftime('%Y-%m-%d') if sale.date_created else ''
-        })
-
-    return jsonify({
-        'success': True,
-        'new_customers': {
-            'current_month': current_customers,
-            'prev_month': prev_customers,
-            'change_pct': round(customers_change_pct, 1)
-        },
-        'critical_stock': critical_stock,
-        'pending_orders': pending_orders,
-        'recent_sales': recent_sales
-    })
+    metrics = operations_metrics(tenant, now=datetime.utcnow())
+    return jsonify(dict(success=True, **metrics))
 
 
 @bp.route('/products/<id>', methods=['GET'])
@@ -711,7 +469,7 @@ def get_product(id):
 
     # Get bundle components if this is a bundle
     bundle_components = []
-    for bundle_rel in ProductBundle.objects(bundle=product):
+    for bundle_rel in get_loader().resolve(list(ProductBundle.objects(bundle=product)), 'component'):
         if bundle_rel.component:
             bundle_components.append({
                 'id': str(bundle_rel.id),
@@ -742,6 +500,9 @@ def get_sale(id):
     except DoesNotExist:
         return jsonify({'error': 'Venta no encontrada'}), 404
 
+    loader = get_loader()
+    loader.prefetch_sale_items([sale])
+
     items = []
     total = 0
     for item in sale.items:
@@ -755,7 +516,8 @@ def get_sale(id):
         })
 
     # Obtener historial de pagos
-    payments = Payment.objects(sale=sale).order_by('-date_created')
+    payments = loader.resolve(list(Payment.objects(sale=sale).order_by('-date_created')), 'created_by')
+    sale._prefetched_payments = payments
     payments_list = []
     for p in payments:
         payments_list.append({
@@ -814,14 +576,7 @@ def create_sale():
     if not data or 'customer' not in data:
         return jsonify({'error': 'Faltan datos requeridos (customer)'}), 400
 
-    # Track modified lots for rollback
-    modified_lots = []  # List of (lot, original_quantity) tuples
-
-    def rollback_stock():
-        """Restore stock to all modified lots"""
-        for lot, original_qty in modified_lots:
-            lot.quantity_current = original_qty
-            lot.save()
+    allocation = None
 
     try:
         # Determinar tipo de venta
@@ -851,122 +606,73 @@ def create_sale():
             payment_method=data.get('payment_method', 'Efectivo'),
             payment_confirmed=data.get('payment_confirmed', False),
             status='pending',
+            amount_total=0,
+            amount_paid=0,
+            amount_balance=0,
             tenant=tenant
         )
         new_sale.save()
-
-        items_data = data.get('items', [])
-        for item_data in items_data:
-            product_id = item_data.get('product_id')
-            quantity = int(item_data.get('quantity', 1))
-
-            if not product_id:
-                continue
-
-            # Filter product by tenant to ensure valid access
-            try:
-                product = Product.objects.get(id=ObjectId(product_id), tenant=tenant)
-            except DoesNotExist:
-                continue
-
-            # Validate stock
-            if product.total_stock < quantity:
-                rollback_stock()
-                new_sale.delete()
-                return jsonify({
-                    'error': f'Stock insuficiente para {product.name}. Disponible: {product.total_stock}, Solicitado: {quantity}'
-                }), 400
-
-            # Deduct stock (FIFO)
-            remaining_to_deduct = quantity
-            available_lots = sorted(
-                [l for l in product.lots if l.quantity_current > 0],
-                key=lambda x: x.created_at
-            )
-
-            for lot in available_lots:
-                if remaining_to_deduct <= 0:
-                    break
-                # Track original quantity before modification
-                modified_lots.append((lot, lot.quantity_current))
-                deduct = min(lot.quantity_current, remaining_to_deduct)
-                lot.quantity_current -= deduct
-                remaining_to_deduct -= deduct
-                lot.save()
-
-            if remaining_to_deduct > 0:
-                rollback_stock()
-                new_sale.delete()
-                return jsonify({'error': f'Error de consistencia de inventario para {product.name}'}), 400
-
-            # If this is a bundle product, also deduct stock from components
-            bundle_components = ProductBundle.objects(bundle=product)
-            for bundle_comp in bundle_components:
-                if not bundle_comp.component:
+        record_sale(new_sale)
+
+        # Descontar stock (FIFO) de todos los items como una sola asignación
+        lines = []  # (product, quantity)
+        bundle_graph = get_bundle_graph(tenant)
+        loader = get_loader()
+        with StockAllocation(tenant) as allocation:
+            for item_data in data.get('items', []):
+                product_id = item_data.get('product_id')
+                quantity = int(item_data.get('quantity', 1))
+
+                if not product_id:
                     continue
 
-                component_product = bundle_comp.component
+                # Filter product by tenant to ensure valid access
+                try:
+                    product = Product.objects.get(id=ObjectId(product_id), tenant=tenant)
+                except DoesNotExist:
+                    continue
 
-                # Calculate total quantity needed
-                total_component_qty = bundle_comp.quantity * quantity
+                allocation.deduct(product, quantity)
+
+                # If this is a bundle product, also deduct stock from components
+                components = bundle_graph.get(product.pk, [])
+                found = loader.load(Product, [component_id for component_id, _ in components])
+                for component_id, component_qty in components:
+                    if not found.get(component_id):
+                        continue
+                    allocation.deduct(
+                        found[component_id],
+                        component_qty * quantity,
+                        message=f'Stock insuficiente del componente "{{name}}" en el bundle "{product.name}". Disponible: {{available}}, Necesario: {{requested}}'
+                    )
 
-                # Check if component has enough stock
-                if component_product.total_stock < total_component_qty:
-                    rollback_stock()
-                    new_sale.delete()
-                    return jsonify({
-                        'error': f'Stock insuficiente del componente "{component_product.name}" en el bundle "{product.name}". Disponible: {component_product.total_stock}, Necesario: {total_component_qty}'
-                    }), 400
+                lines.append((product, quantity))
 
-                # Deduct component stock
-                remaining_component = total_component_qty
-                available_component_lots = sorted(
-                    [l for l in component_product.lots if l.quantity_current > 0],
-                    key=lambda x: x.created_at
-                )
+            total = sum(quantity * float(product.base_price or 0) for product, quantity in lines)
 
-                for lot in available_component_lots:
-                    if remaining_component <= 0:
-                        break
-                    # Track original quantity before modification
-                    modified_lots.append((lot, lot.quantity_current))
-                    deduct = min(lot.quantity_current, remaining_component)
-                    lot.quantity_current -= deduct
-                    remaining_component -= deduct
-                    lot.save()
-
-                if remaining_component > 0:
-                    rollback_stock()
-                    new_sale.delete()
+            # Validar pago inicial antes de confirmar el descuento de stock
+            initial_payment = data.get('initial_payment')
+            if initial_payment and initial_payment.get('amount', 0) > 0:
+                payment_amount = float(initial_payment['amount'])
+                if payment_amount > total:
+                    allocation.cancel()
+                    discard_sale(new_sale)
                     return jsonify({
-                        'error': f'Error de consistencia de inventario para componente {component_product.name}'
+                        'error': f'El pago inicial (${payment_amount:,.0f}) no puede ser mayor al total de la venta (${total:,.0f})'
                     }), 400
 
-            sale_item = SaleItem(
+        for product, quantity in lines:
+            SaleItem(
                 sale=new_sale,
                 product=product,
                 quantity=quantity,
                 unit_price=product.base_price or 0
-            )
-            sale_item.save()
-
-        # Calculate total for logging
-        total = sum(item.quantity * float(item.unit_price) for item in new_sale.items)
-        items_count = new_sale.items.count()
+            ).save()
+        add_to_totals(new_sale, amount=total, units=sum(quantity for _, quantity in lines))
+        items_count = len(lines)
 
         # Registrar pago inicial si existe
-        if 'initial_payment' in data and data['initial_payment'].get('amount', 0) > 0:
-            initial_payment = data['initial_payment']
-            payment_amount = float(initial_payment['amount'])
-
-            # Validar que no exceda el total
-            if payment_amount > total:
-                rollback_stock()
-                new_sale.delete()
-                return jsonify({
-                    'error': f'El pago inicial (${payment_amount:,.0f}) no puede ser mayor al total de la venta (${total:,.0f})'
-                }), 400
-
+        if initial_payment and initial_payment.get('amount', 0) > 0:
             # Crear registro de pago
             payment = Payment(
                 sale=new_sale,
@@ -978,6 +684,7 @@ def create_sale():
                 created_by=current_user
             )
             payment.save()
+            add_to_totals(new_sale, paid=payment_amount)
 
             # Actualizar payment_status
             new_sale.payment_status = new_sale.computed_payment_status
@@ -997,6 +704,7 @@ def create_sale():
                 created_by=current_user
             )
             payment.save()
+            add_to_totals(new_sale, paid=total)
             new_sale.payment_status = 'pagado'
             new_sale.save()
 
@@ -1013,12 +721,18 @@ def create_sale():
         )
 
         return jsonify({'message': 'Venta creada', 'id': str(new_sale.id)}), 201
+    except InventoryError as e:
+        # La asignación ya se revirtió al salir del bloque with
+        discard_sale(new_sale)
+        status = 409 if isinstance(e, StockConflictError) else 400
+        return jsonify({'error': str(e)}), status
     except Exception as e:
         # Rollback stock on any unexpected error
-        rollback_stock()
+        if allocation is not None:
+            allocation.cancel()
         if 'new_sale' in locals() and new_sale.id:
             try:
-                new_sale.delete()
+                discard_sale(new_sale)
             except Exception as del_err:
                 current_app.logger.error(f'Error eliminando venta fallida: {del_err}')
         return jsonify({'error': str(e)}), 500
@@ -1140,6 +854,7 @@ def add_payment(id):
             created_by=current_user
         )
         payment.save()
+        add_to_totals(sale, paid=amount)
 
         # Actualizar payment_status en Sale
         sale.payment_status = sale.computed_payment_status
@@ -1185,7 +900,8 @@ def get_sale_payments(id):
     except DoesNotExist:
         return jsonify({'error': 'Venta no encontrada'}), 404
 
-    payments = Payment.objects(sale=sale).order_by('-date_created')
+    payments = get_loader().resolve(list(Payment.objects(sale=sale).order_by('-date_created')), 'created_by')
+    sale._prefetched_payments = payments
 
     return jsonify({
         'success': True,
@@ -1227,6 +943,19 @@ def get_system_user(tenant):
     return system_user
 
 
+def find_item_product(tenant, sku, name):
+    """Find product by SKU or name; si no hay coincidencia exacta, palabras del nombre como prefijos"""
+    product = None
+    if sku:
+        product = Product.objects(sku__iexact=sku, tenant=tenant).first()
+    if not product and name:
+        product = Product.objects(name__iexact=name, tenant=tenant).first()
+        # Un nombre sin palabras buscables ('???', '🍕') no coincide con ningún producto
+        if not product and search_filter(name):
+            product = search_products(tenant, name).first()
+    return product
+
+
 @bp.route('/sales/webhook', methods=['POST'])
 @limiter.limit("10 per minute")
 @limiter.limit("100 per hour")
@@ -1282,13 +1011,7 @@ def webhook_create_sale():
     if not system_user:
         return jsonify({'error': 'No hay usuario administrador configurado'}), 500
     
-    # Track modified lots for rollback
-    modified_lots = []
-    
-    def rollback_stock():
-        for lot, original_qty in modified_lots:
-            lot.quantity_current = original_qty
-            lot.save()
+    allocation = None
     
     try:
         # Create sale
@@ -1301,88 +1024,73 @@ def webhook_create_sale():
             delivery_status='pendiente',
             payment_status='pendiente',
             status='pending',
+            amount_total=0,
+            amount_paid=0,
+            amount_balance=0,
             tenant=tenant
         )
         new_sale.save()
+        record_sale(new_sale)
         
         processed_items = []
         errors = []
         
-        for item_data in items_data:
-            sku = item_data.get('sku', '').strip()
-            name = item_data.get('name', '').strip()
-            quantity = int(item_data.get('quantity', 1))
-            
-            if quantity <= 0:
-                errors.append(f'Cantidad inválida para item: {sku or name}')
-                continue
-            
-            # Find product by SKU or name
-            product = None
-            if sku:
-                product = Product.objects(sku__iexact=sku, tenant=tenant).first()
-            if not product and name:
-                product = Product.objects(name__iexact=name, tenant=tenant).first()
+        with StockAllocation(tenant) as allocation:
+            for item_data in items_data:
+                sku = item_data.get('sku', '').strip()
+                name = item_data.get('name', '').strip()
+                quantity = int(item_data.get('quantity', 1))
+                
+                if quantity <= 0:
+                    errors.append(f'Cantidad inválida para item: {sku or name}')
+                    continue
+                
+                product = find_item_product(tenant, sku, name)
+                
                 if not product:
-                    # Try partial match
-                    product = Product.objects(name__icontains=name, tenant=tenant).first()
-            
-            if not product:
-                errors.append(f'Producto no encontrado: {sku or name}')
-                continue
-            
-            # Validate stock
-            if product.total_stock < quantity:
-                errors.append(f'Stock insuficiente para {product.name}: disponible {product.total_stock}, solicitado {quantity}')
-                continue
-            
-            # Deduct stock (FIFO)
-            remaining = quantity
-            available_lots = sorted(
-                [l for l in product.lots if l.quantity_current > 0],
-                key=lambda x: x.created_at
-            )
-            
-            for lot in available_lots:
-                if remaining <= 0:
-                    break
-                modified_lots.append((lot, lot.quantity_current))
-                deduct = min(lot.quantity_current, remaining)
-                lot.quantity_current -= deduct
-                remaining -= deduct
-                lot.save()
-            
-            if remaining > 0:
-                errors.append(f'Error de consistencia de inventario para {product.name}')
-                continue
+                    errors.append(f'Producto no encontrado: {sku or name}')
+                    continue
+                
+                # Deduct stock (FIFO); un item sin stock no bloquea al resto
+                try:
+                    allocation.deduct(
+                        product, quantity,
+                        message='Stock insuficiente para {name}: disponible {available}, solicitado {requested}'
+                    )
+                except InsufficientStockError as e:
+                    errors.append(str(e))
+                    continue
+                
+                processed_items.append({
+                    'product': product.name,
+                    'sku': product.sku,
+                    'quantity': quantity,
+                    'unit_price': float(product.base_price or 0),
+                    '_product': product
+                })
             
-            # Create sale item
-            sale_item = SaleItem(
+            # If no items were processed successfully, rollback and delete sale
+            if not processed_items:
+                allocation.cancel()
+                discard_sale(new_sale)
+                return jsonify({
+                    'error': 'No se pudo procesar ningún item',
+                    'details': errors
+                }), 400
+        
+        # Create sale items
+        for item in processed_items:
+            product = item.pop('_product')
+            SaleItem(
                 sale=new_sale,
                 product=product,
-                quantity=quantity,
+                quantity=item['quantity'],
                 unit_price=product.base_price or 0
-            )
-            sale_item.save()
-            
-            processed_items.append({
-                'product': product.name,
-                'sku': product.sku,
-                'quantity': quantity,
-                'unit_price': float(product.base_price or 0)
-            })
-        
-        # If no items were processed successfully, rollback and delete sale
-        if not processed_items:
-            rollback_stock()
-            new_sale.delete()
-            return jsonify({
-                'error': 'No se pudo procesar ningún item',
-                'details': errors
-            }), 400
+            ).save()
         
         # Calculate total
         total = sum(item['quantity'] * item['unit_price'] for item in processed_items)
+        add_to_totals(new_sale, amount=total, units=sum(item['quantity'] for item in processed_items))
         
         # Log activity
         ActivityLog.log(
@@ -1418,11 +1126,16 @@ def webhook_create_sale():
         
         return jsonify(response), 201
         
+    except StockConflictError as e:
+        # La asignación ya se revirtió al salir del bloque with
+        discard_sale(new_sale)
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
-        rollback_stock()
+        if allocation is not None:
+            allocation.cancel()
         if 'new_sale' in locals() and new_sale.id:
             try:
-                new_sale.delete()
+                discard_sale(new_sale)
             except Exception as del_err:
                 current_app.logger.error(f'Error eliminando venta webhook fallida: {del_err}')
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
@@ -1438,3 +1151,78 @@ def webhook_test():
         'usage': 'POST /api/sales/webhook con header X-Webhook-Token',
         'rate_limits': '10/min, 100/hour'
     })
+
+
+@bp.route('/shopify/webhooks/<path:topic>', methods=['POST'])
+@limiter.exempt
+def shopify_webhook(topic):
+    """
+    Webhooks de Shopify: orders/create, orders/updated, customers/update y
+    products/update (registrar en Shopify con la URL del tema, p.ej.
+    /api/shopify/webhooks/orders/create).
+
+    Verifica la firma (header X-Shopify-Hmac-Sha256) y solo guarda el cuerpo
+    en la bandeja ShopifyWebhook; el worker lo procesa por lotes
+    (app.services.shopify_webhooks). Un reenvío responde 200 sin duplicar.
+
+    Returns:
+        200: Recibido (o reenvío ya recibido)
+        401: Firma inválida
+        404: Tema no soportado
+    """
+    if topic not in SHOPIFY_WEBHOOK_TOPICS:
+        return jsonify({'error': f'Tema de webhook no soportado: {topic}'}), 404
+    body = request.get_data()
+    if not verify_hmac(body, request.headers.get(HMAC_HEADER)):
+        return jsonify({'error': 'Firma HMAC inválida'}), 401
+    if request.headers.get('X-Shopify-Topic', topic) != topic:
+        return jsonify({'error': 'El header X-Shopify-Topic no coincide con la URL'}), 400
+    tenant = g.get('current_tenant')
+    if tenant is None:
+        return jsonify({'error': 'No hay tenant configurado'}), 500
+
+    created = store_webhook(tenant, topic, body, request.headers.get('X-Shopify-Webhook-Id'),
+                            request.headers.get('X-Shopify-Shop-Domain'))
+    return jsonify({'success': True, 'duplicate': not created})
+
+
+# ============================================
+# TRABAJOS EN SEGUNDO PLANO
+# ============================================
+def _get_own_job(job_id):
+    """Trabajo del tenant actual, lanzado por el usuario (o cualquiera si es admin)"""
+    try:
+        job = Job.objects.get(id=ObjectId(job_id), tenant=g.current_tenant)
+    except Exception:
+        abort(404)
+    if current_user.role != 'admin' and job._data.get('user') is not None and job._data['user'].id != current_user.id:
+        abort(404)
+    return job
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Estado y progreso de un trabajo (el frontend lo consulta hasta que termina)"""
+    job = _get_own_job(job_id)
+    return jsonify(serialize_job(job))
+
+
+@bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = _get_own_job(job_id)
+    if job.status not in ('queued', 'running'):
+        return jsonify({'error': 'El trabajo ya terminó'}), 409
+    job = request_cancel(job)
+    return jsonify(serialize_job(job))
+
+
+@bp.route('/jobs/<job_id>/download', methods=['GET'])
+@login_required
+def download_job(job_id):
+    """Descarga el archivo generado por un trabajo terminado"""
+    job = _get_own_job(job_id)
+    if job.status != 'done' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        return jsonify({'error': 'Archivo no disponible'}), 404
+    return send_file(job.artifact_path, as_attachment=True, download_name=job.artifact_name)
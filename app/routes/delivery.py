@@ -9,6 +9,7 @@ from flask import Blueprint, render_template, request, jsonify, g, make_response
 from flask_login import login_required, current_user
 from app.models import Sale, User, Tenant, utc_now
 from app.extensions import db
+from app.services.loaders import get_loader
 from bson import ObjectId
 from datetime import datetime
 from urllib.parse import quote
@@ -51,6 +52,7 @@ class DeliverySheet(db.Document):
     
     meta = {
         'collection': 'delivery_sheets',
+        'auto_create_index': False,
         'indexes': [
             'date',
             'status',
@@ -129,6 +131,7 @@ def view_sheet(sheet_id):
     
     # Preparar datos de ventas con links a mapas
     sales_data = []
+    get_loader().prefetch_sale_items(sheet.sales)
     for idx, sale in enumerate(sheet.sales, 1):
         if sale:
             # Crear links para mapas
@@ -357,6 +360,7 @@ def generate_pdf(sheet_id):
     
     # Preparar datos
     sales_data = []
+    get_loader().prefetch_sale_items(sheet.sales)
     for idx, sale in enumerate(sheet.sales, 1):
         if sale:
             products_text = ", ".join([f"{item.product.name} x{item.quantity}" for item in sale.items])
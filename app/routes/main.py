@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, g, session, redirect, url_for, current_app
 from flask_login import login_required, current_user
 from app.models import Product, Sale, SaleItem, ActivityLog
+from app.services.bundles import buildable_units
 from bson import ObjectId
 from datetime import datetime
 
@@ -177,7 +178,8 @@ def dashboard():
 def products_view():
     tenant = g.current_tenant
     products = Product.objects(tenant=tenant)
-    return render_template("products.html", products=products)
+    buildable = buildable_units(tenant)
+    return render_template("products.html", products=products, buildable=buildable)
 
 
 @bp.route("/sales")
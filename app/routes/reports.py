@@ -1,15 +1,19 @@
-from flask import Blueprint, send_file, g, abort, jsonify, request, render_template
+from flask import Blueprint, g, abort, jsonify, request, render_template
 from flask_login import login_required, current_user
 from app.models import Sale, SaleItem, Product, Wastage, InboundOrder, Payment
-import io
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, numbers
+from app.services.loaders import get_loader
+from app.services.inventory import lot_stock
+from app.services.xlsx_export import Column, Styled, MONEY_FORMAT, BOLD_FONT, attach_refs, batched
+from app.services.jobs import export_job, export_response
+from openpyxl.styles import Font
 from datetime import datetime, timedelta
 from functools import wraps
 from collections import defaultdict
 
 bp = Blueprint("reports", __name__, url_prefix="/reports")
 
+EXPORT_BATCH = 1000
+
 
 def permission_required(module, action='view'):
     """Decorator to check permissions before accessing a route"""
@@ -29,78 +33,50 @@ def permission_required(module, action='view'):
 @login_required
 @permission_required('reports', 'export')
 def export_sales_excel():
-    tenant = g.current_tenant
-
-    # Query sales for current tenant
-    sales = Sale.objects(tenant=tenant).order_by('-date_created')
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Ventas"
-
-    # Headers con estilo
-    headers = ["ID", "Fecha", "Cliente", "Estado", "Items", "Total", "Método Pago"]
-    ws.append(headers)
-
-    # Estilo para headers
-    header_fill = PatternFill(
-        start_color="4F81BD", end_color="4F81BD", fill_type="solid"
+    return export_response(sales_export, f"ventas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+
+
+@export_job('reports.sales_excel')
+def sales_export(export, tenant):
+    export.add_sheet("Ventas", [
+        Column("ID", lambda s: str(s['_id'])),
+        Column("Fecha", 'date_created', date_format="%Y-%m-%d %H:%M"),
+        Column("Cliente", 'customer_name'),
+        Column("Estado", 'status'),
+        Column("Items", 'items'),
+        Column("Total", 'total', default=0),
+        Column("Método Pago", 'payment_method'),
+    ], _sales_rows(tenant), header_color="4F81BD")
+
+
+def _sales_rows(tenant):
+    """Ventas del tenant con sus items resumidos, leídas por lotes"""
+    product_cache = {}
+    cursor = Sale._get_collection().find(
+        {'tenant': tenant.id},
+        {'date_created': 1, 'customer_name': 1, 'status': 1, 'payment_method': 1},
+        sort=[('date_created', -1)],
+        batch_size=EXPORT_BATCH
     )
-    header_font = Font(bold=True, color="FFFFFF")
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
-    for sale in sales:
-        # Calculate total and format items string
-        items_str = []
-        total = 0
-        for item in sale.items:
-            subtotal = item.quantity * float(item.unit_price)
-            total += subtotal
-            product_name = item.product.name if item.product else 'N/A'
-            items_str.append(f"{item.quantity}x {product_name}")
-
-        ws.append(
-            [
-                str(sale.id),
-                sale.date_created.strftime("%Y-%m-%d %H:%M"),
-                sale.customer_name,
-                sale.status,
-                ", ".join(items_str),
-                total,
-                sale.payment_method,
-            ]
+    for batch in batched(cursor, EXPORT_BATCH):
+        items = defaultdict(list)
+        item_cursor = SaleItem._get_collection().find(
+            {'sale': {'$in': [s['_id'] for s in batch]}},
+            {'sale': 1, 'product': 1, 'quantity': 1, 'unit_price': 1}
         )
-
-    # Auto-adjust column widths (approximation)
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except (TypeError, AttributeError):  # cell.value puede ser None
-                pass
-        adjusted_width = max_length + 2
-        ws.column_dimensions[column].width = adjusted_width
-
-    # Save to buffer
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"ventas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+        for item in item_cursor:
+            items[item['sale']].append(item)
+        attach_refs(
+            [i for rows in items.values() for i in rows],
+            'product', Product._get_collection(), ('name',), product_cache
+        )
+        for sale in batch:
+            sale_items = items.get(sale['_id'], [])
+            sale['items'] = ", ".join(
+                f"{i.get('quantity') or 0}x {i['product_doc'].get('name') or 'N/A'}" for i in sale_items
+            )
+            sale['total'] = sum((i.get('quantity') or 0) * float(i.get('unit_price') or 0) for i in sale_items)
+            yield sale
 
 
 @bp.route("/warehouse/wastage/excel")
@@ -108,69 +84,32 @@ def export_sales_excel():
 @permission_required('reports', 'export')
 def export_wastage_excel():
     """Exportar historial de mermas a Excel"""
-    tenant = g.current_tenant
-
-    wastages = Wastage.objects(tenant=tenant).order_by('-date_created')
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Mermas"
-
-    # Headers
-    headers = ["ID", "Fecha", "Producto", "SKU", "Cantidad", "Razón", "Notas"]
-    ws.append(headers)
-
-    # Estilo para headers
-    header_fill = PatternFill(
-        start_color="E74C3C", end_color="E74C3C", fill_type="solid"
-    )
-    header_font = Font(bold=True, color="FFFFFF")
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
-    for wastage in wastages:
-        product_name = wastage.product.name if wastage.product else 'N/A'
-        product_sku = wastage.product.sku if wastage.product else 'N/A'
-        ws.append(
-            [
-                str(wastage.id),
-                wastage.date_created.strftime("%Y-%m-%d %H:%M"),
-                product_name,
-                product_sku,
-                wastage.quantity,
-                wastage.reason,
-                wastage.notes or "-",
-            ]
-        )
-
-    # Auto-adjust columns
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except (TypeError, AttributeError):  # cell.value puede ser None
-                pass
-        adjusted_width = min(50, max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"mermas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    return export_response(wastage_export, f"mermas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+
+
+@export_job('reports.wastage_excel')
+def wastage_export(export, tenant):
+    export.add_sheet("Mermas", [
+        Column("ID", lambda w: str(w['_id'])),
+        Column("Fecha", 'date_created', date_format="%Y-%m-%d %H:%M"),
+        Column("Producto", lambda w: w['product_doc'].get('name'), default='N/A'),
+        Column("SKU", lambda w: w['product_doc'].get('sku'), default='N/A'),
+        Column("Cantidad", 'quantity', default=0),
+        Column("Razón", 'reason'),
+        Column("Notas", 'notes', default="-"),
+    ], _with_products(Wastage._get_collection().find(
+        {'tenant': tenant.id},
+        {'product': 1, 'quantity': 1, 'reason': 1, 'notes': 1, 'date_created': 1},
+        sort=[('date_created', -1)],
+        batch_size=EXPORT_BATCH
+    )), header_color="E74C3C", max_width=50)
+
+
+def _with_products(cursor):
+    """Agrega nombre y SKU del producto a cada fila, un $in por lote"""
+    cache = {}
+    for batch in batched(cursor, EXPORT_BATCH):
+        yield from attach_refs(batch, 'product', Product._get_collection(), ('name', 'sku'), cache)
 
 
 @bp.route("/warehouse/inventory/excel")
@@ -178,91 +117,41 @@ def export_wastage_excel():
 @permission_required('reports', 'export')
 def export_inventory_excel():
     """Exportar inventario completo a Excel"""
-    tenant = g.current_tenant
-
-    products = Product.objects(tenant=tenant).order_by('name')
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inventario"
-
-    # Headers
-    headers = [
-        "SKU",
-        "Nombre",
-        "Categoría",
-        "Precio Base",
-        "Stock Total",
-        "Stock Crítico",
-        "Estado",
-        "Vencimiento",
-    ]
-    ws.append(headers)
-
-    # Estilo para headers
-    header_fill = PatternFill(
-        start_color="27AE60", end_color="27AE60", fill_type="solid"
-    )
-    header_font = Font(bold=True, color="FFFFFF")
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
-    for product in products:
-        stock_status = (
-            "CRÍTICO" if product.total_stock <= product.critical_stock else "OK"
-        )
-        expiry = (
-            product.expiry_date.strftime("%Y-%m-%d") if product.expiry_date else "-"
-        )
-
-        ws.append(
-            [
-                product.sku,
-                product.name,
-                product.category or "-",
-                float(product.base_price) if product.base_price else 0,
-                product.total_stock,
-                product.critical_stock,
-                stock_status,
-                expiry,
-            ]
-        )
-
-        # Color para stock crítico
-        if product.total_stock <= product.critical_stock:
-            for cell in ws[ws.max_row]:
-                cell.fill = PatternFill(
-                    start_color="FFCCCC", end_color="FFCCCC", fill_type="solid"
-                )
-
-    # Auto-adjust columns
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except (TypeError, AttributeError):  # cell.value puede ser None
-                pass
-        adjusted_width = min(40, max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"inventario_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    return export_response(inventory_export, f"inventario_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+
+
+@export_job('reports.inventory_excel')
+def inventory_export(export, tenant):
+    export.add_sheet("Inventario", [
+        Column("SKU", 'sku'),
+        Column("Nombre", 'name'),
+        Column("Categoría", 'category', default="-"),
+        Column("Precio Base", 'base_price', default=0),
+        Column("Stock Total", 'stock', default=0),
+        Column("Stock Crítico", 'critical_stock', default=0),
+        Column("Estado", lambda p: "CRÍTICO" if p['is_critical'] else "OK"),
+        Column("Vencimiento", 'expiry_date', default="-", date_format="%Y-%m-%d"),
+    ], _inventory_rows(tenant), header_color="27AE60",
+        row_color=lambda p: "FFCCCC" if p['is_critical'] else None)
+
+
+def _inventory_rows(tenant):
+    cursor = Product._get_collection().find(
+        {'tenant': tenant.id},
+        {'sku': 1, 'name': 1, 'category': 1, 'base_price': 1, 'stock_current': 1,
+         'critical_stock': 1, 'expiry_date': 1},
+        sort=[('name', 1)],
+        batch_size=EXPORT_BATCH
     )
+    for product in cursor:
+        stock = product.get('stock_current')
+        if stock is None:
+            # Producto sin contador (anterior a la migración)
+            stock = lot_stock(product['_id'])
+        critical = product.get('critical_stock')
+        product['stock'] = stock
+        product['is_critical'] = stock <= (critical if critical is not None else 10)
+        yield product
 
 
 @bp.route("/warehouse/orders/excel")
@@ -270,81 +159,27 @@ def export_inventory_excel():
 @permission_required('reports', 'export')
 def export_orders_excel():
     """Exportar pedidos a proveedores a Excel"""
-    tenant = g.current_tenant
-
-    orders = InboundOrder.objects(tenant=tenant).order_by('-date_received')
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Pedidos"
-
-    # Headers
-    headers = [
-        "ID",
-        "Proveedor",
-        "N° Factura",
-        "Estado",
-        "Total",
-        "Fecha Creación",
-        "Fecha Recepción",
-        "Notas",
-    ]
-    ws.append(headers)
-
-    # Estilo para headers
-    header_fill = PatternFill(
-        start_color="3498DB", end_color="3498DB", fill_type="solid"
-    )
-    header_font = Font(bold=True, color="FFFFFF")
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
-    for order in orders:
-        ws.append(
-            [
-                str(order.id),
-                order.supplier_name,
-                order.invoice_number,
-                order.status,
-                float(order.total) if order.total else 0,
-                order.created_at.strftime("%Y-%m-%d %H:%M")
-                if order.created_at
-                else "-",
-                order.date_received.strftime("%Y-%m-%d %H:%M")
-                if order.date_received
-                else "-",
-                order.notes or "-",
-            ]
-        )
-
-    # Auto-adjust columns
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except (TypeError, AttributeError):  # cell.value puede ser None
-                pass
-        adjusted_width = min(40, max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"pedidos_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    return export_response(orders_export, f"pedidos_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+
+
+@export_job('reports.orders_excel')
+def orders_export(export, tenant):
+    export.add_sheet("Pedidos", [
+        Column("ID", lambda o: str(o['_id'])),
+        Column("Proveedor", 'supplier_name', default=None),
+        Column("N° Factura", 'invoice_number', default=None),
+        Column("Estado", 'status'),
+        Column("Total", 'total', default=0),
+        Column("Fecha Creación", 'created_at', default="-", date_format="%Y-%m-%d %H:%M"),
+        Column("Fecha Recepción", 'date_received', default="-", date_format="%Y-%m-%d %H:%M"),
+        Column("Notas", 'notes', default="-"),
+    ], InboundOrder._get_collection().find(
+        {'tenant': tenant.id},
+        {'supplier_name': 1, 'invoice_number': 1, 'status': 1, 'total': 1,
+         'created_at': 1, 'date_received': 1, 'notes': 1},
+        sort=[('date_received', -1)],
+        batch_size=EXPORT_BATCH
+    ), header_color="3498DB")
 
 
 # ============================================
@@ -388,6 +223,7 @@ def cashflow_api():
         date_created__gte=date_from,
         date_created__lt=date_to
     ).order_by('date_created')
+    payments = get_loader().resolve(list(payments), 'sale')
 
     ingresos_by_period = defaultdict(float)
     ingresos_by_method = defaultdict(float)
@@ -453,12 +289,27 @@ def cashflow_api():
         })
 
     # --- Ventas pendientes de cobro ---
-    pending_sales = Sale.objects(
+    # Suma del saldo guardado en cada venta; las ventas sin totales guardados
+    # (anteriores a la migración) se calculan desde items y pagos
+    pending_statuses = ['pendiente', 'parcial']
+    balance_result = list(Sale._get_collection().aggregate([
+        {'$match': {
+            'tenant': tenant.id,
+            'payment_status': {'$in': pending_statuses},
+            'balance': {'$type': 'number'}
+        }},
+        {'$group': {'_id': None, 'total': {'$sum': '$balance'}}}
+    ]))
+    total_por_cobrar = balance_result[0]['total'] if balance_result else 0
+    legacy_sales = list(Sale.objects(
         tenant=tenant,
-        payment_status__in=['pendiente', 'parcial']
-    )
-    total_por_cobrar = 0
-    for s in pending_sales:
+        payment_status__in=pending_statuses,
+        amount_balance=None
+    ))
+    loader = get_loader()
+    loader.prefetch_sale_items(legacy_sales, with_products=False)
+    loader.prefetch_payments(legacy_sales)
+    for s in legacy_sales:
         total_por_cobrar += s.total_amount - s.total_paid
 
     return jsonify({
@@ -500,11 +351,14 @@ def _period_key(dt, group_by):
 @permission_required('reports', 'export')
 def export_cashflow_excel():
     """Exportar flujo de caja a Excel"""
-    tenant = g.current_tenant
+    return export_response(
+        cashflow_export, f"flujo_caja_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
+        date_from_str=request.args.get('from'), date_to_str=request.args.get('to')
+    )
 
-    date_from_str = request.args.get('from')
-    date_to_str = request.args.get('to')
 
+@export_job('reports.cashflow_excel')
+def cashflow_export(export, tenant, date_from_str=None, date_to_str=None):
     now = datetime.utcnow()
     if date_from_str:
         date_from = datetime.strptime(date_from_str, '%Y-%m-%d')
@@ -516,141 +370,89 @@ def export_cashflow_excel():
     else:
         date_to = now + timedelta(days=1)
 
-    wb = Workbook()
-
-    # === Hoja 1: Resumen ===
-    ws_resumen = wb.active
-    ws_resumen.title = "Resumen"
-
-    green_fill = PatternFill(start_color="27AE60", end_color="27AE60", fill_type="solid")
-    red_fill = PatternFill(start_color="E74C3C", end_color="E74C3C", fill_type="solid")
-    blue_fill = PatternFill(start_color="3498DB", end_color="3498DB", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    money_fmt = '#,##0'
-
-    ws_resumen.append(["Flujo de Caja — Puerto Distribución"])
-    ws_resumen['A1'].font = Font(bold=True, size=14)
-    ws_resumen.append([f"Período: {date_from.strftime('%d/%m/%Y')} — {(date_to - timedelta(days=1)).strftime('%d/%m/%Y')}"])
-    ws_resumen.append([])
-
-    # Pagos recibidos agrupados por día
-    payments = Payment.objects(
-        tenant=tenant,
-        date_created__gte=date_from,
-        date_created__lt=date_to
-    ).order_by('date_created')
+    payment_query = {'tenant': tenant.id, 'date_created': {'$gte': date_from, '$lt': date_to}}
+    order_query = {
+        'tenant': tenant.id,
+        'date_received': {'$gte': date_from, '$lt': date_to},
+        'status': {'$in': ['received', 'paid']},
+    }
 
+    # Totales diarios agregados en MongoDB (las hojas de detalle se leen después)
     daily = defaultdict(lambda: {'ingresos': 0, 'egresos': 0})
-    total_in = 0
-    for p in payments:
-        key = p.date_created.strftime('%Y-%m-%d')
-        amt = float(p.amount)
-        daily[key]['ingresos'] += amt
-        total_in += amt
-
-    orders = InboundOrder.objects(
-        tenant=tenant,
-        date_received__gte=date_from,
-        date_received__lt=date_to,
-        status__in=['received', 'paid']
-    ).order_by('date_received')
-
-    total_out = 0
-    for o in orders:
-        if o.date_received:
-            key = o.date_received.strftime('%Y-%m-%d')
-            amt = float(o.total) if o.total else 0
-            daily[key]['egresos'] += amt
-            total_out += amt
-
-    # Tabla resumen diario
-    headers = ["Fecha", "Ingresos", "Egresos", "Neto", "Balance Acumulado"]
-    ws_resumen.append(headers)
-    for cell in ws_resumen[4]:
-        cell.fill = blue_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
+    for key, collection, match, date_field, amount_field in (
+        ('ingresos', Payment._get_collection(), payment_query, '$date_created', '$amount'),
+        ('egresos', InboundOrder._get_collection(), order_query, '$date_received', '$total'),
+    ):
+        pipeline = [
+            {'$match': match},
+            {'$group': {
+                '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': date_field}},
+                'total': {'$sum': amount_field},
+            }},
+        ]
+        for row in collection.aggregate(pipeline):
+            daily[row['_id']][key] += float(row['total'] or 0)
+
+    summary = []
     balance = 0
     for key in sorted(daily.keys()):
         d = daily[key]
         neto = d['ingresos'] - d['egresos']
         balance += neto
-        ws_resumen.append([key, d['ingresos'], d['egresos'], neto, balance])
-        row = ws_resumen.max_row
-        for col in [2, 3, 4, 5]:
-            ws_resumen.cell(row=row, column=col).number_format = money_fmt
-        if neto < 0:
-            ws_resumen.cell(row=row, column=4).font = Font(color="E74C3C")
-
-    # Totales
-    ws_resumen.append([])
-    ws_resumen.append(["TOTAL", total_in, total_out, total_in - total_out, ""])
-    row = ws_resumen.max_row
-    ws_resumen.cell(row=row, column=1).font = Font(bold=True)
-    for col in [2, 3, 4]:
-        ws_resumen.cell(row=row, column=col).font = Font(bold=True)
-        ws_resumen.cell(row=row, column=col).number_format = money_fmt
+        summary.append({'date': key, 'ingresos': d['ingresos'], 'egresos': d['egresos'],
+                        'neto': neto, 'balance': balance})
+    total_in = sum(d['ingresos'] for d in daily.values())
+    total_out = sum(d['egresos'] for d in daily.values())
 
-    # === Hoja 2: Ingresos (detalle) ===
-    ws_ing = wb.create_sheet("Ingresos")
-    headers_ing = ["Fecha", "Cliente", "Monto", "Método", "Referencia"]
-    ws_ing.append(headers_ing)
-    for cell in ws_ing[1]:
-        cell.fill = green_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
+    red_font = Font(color="E74C3C")
 
-    for p in payments:
-        customer = p.sale.customer_name if p.sale else ''
-        ws_ing.append([
-            p.date_created.strftime('%Y-%m-%d %H:%M'),
-            customer,
-            float(p.amount),
-            p.payment_via,
-            p.payment_reference or ''
-        ])
-        ws_ing.cell(row=ws_ing.max_row, column=3).number_format = money_fmt
-
-    # === Hoja 3: Egresos (detalle) ===
-    ws_egr = wb.create_sheet("Egresos")
-    headers_egr = ["Fecha Recepción", "Proveedor", "N° Factura", "Monto"]
-    ws_egr.append(headers_egr)
-    for cell in ws_egr[1]:
-        cell.fill = red_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
+    # === Hoja 1: Resumen ===
+    export.add_sheet("Resumen", [
+        Column("Fecha", 'date'),
+        Column("Ingresos", 'ingresos', number_format=MONEY_FORMAT),
+        Column("Egresos", 'egresos', number_format=MONEY_FORMAT),
+        Column("Neto", 'neto', number_format=MONEY_FORMAT, font=lambda v: red_font if v < 0 else None),
+        Column("Balance Acumulado", 'balance', number_format=MONEY_FORMAT),
+    ], summary, header_color="3498DB", preamble=[
+        [Styled("Flujo de Caja — Puerto Distribución", font=Font(bold=True, size=14))],
+        [f"Período: {date_from.strftime('%d/%m/%Y')} — {(date_to - timedelta(days=1)).strftime('%d/%m/%Y')}"],
+        [],
+    ], footer=[
+        [],
+        [Styled("TOTAL", font=BOLD_FONT)] + [
+            Styled(v, font=BOLD_FONT, number_format=MONEY_FORMAT)
+            for v in (total_in, total_out, total_in - total_out)
+        ] + [""],
+    ])
 
-    for o in orders:
-        ws_egr.append([
-            o.date_received.strftime('%Y-%m-%d %H:%M') if o.date_received else '',
-            o.supplier_name or '',
-            o.invoice_number or '',
-            float(o.total) if o.total else 0
-        ])
-        ws_egr.cell(row=ws_egr.max_row, column=4).number_format = money_fmt
-
-    # Auto-width en todas las hojas
-    for ws in [ws_resumen, ws_ing, ws_egr]:
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except (TypeError, AttributeError):
-                    pass
-            ws.column_dimensions[column].width = min(40, max_length + 2)
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"flujo_caja_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    # === Hoja 2: Ingresos (detalle) ===
+    sale_cache = {}
+    payments = Payment._get_collection().find(
+        payment_query,
+        {'date_created': 1, 'amount': 1, 'payment_via': 1, 'payment_reference': 1, 'sale': 1},
+        sort=[('date_created', 1)],
+        batch_size=EXPORT_BATCH
     )
+    export.add_sheet("Ingresos", [
+        Column("Fecha", 'date_created', date_format='%Y-%m-%d %H:%M'),
+        Column("Cliente", lambda p: p['sale_doc'].get('customer_name')),
+        Column("Monto", 'amount', default=0, number_format=MONEY_FORMAT),
+        Column("Método", 'payment_via'),
+        Column("Referencia", 'payment_reference'),
+    ], (
+        p for batch in batched(payments, EXPORT_BATCH)
+        for p in attach_refs(batch, 'sale', Sale._get_collection(), ('customer_name',), sale_cache)
+    ), header_color="27AE60")
+
+    # === Hoja 3: Egresos (detalle) ===
+    export.add_sheet("Egresos", [
+        Column("Fecha Recepción", 'date_received', date_format='%Y-%m-%d %H:%M'),
+        Column("Proveedor", 'supplier_name'),
+        Column("N° Factura", 'invoice_number'),
+        Column("Monto", 'total', default=0, number_format=MONEY_FORMAT),
+    ], InboundOrder._get_collection().find(
+        order_query,
+        {'date_received': 1, 'supplier_name': 1, 'invoice_number': 1, 'total': 1},
+        sort=[('date_received', 1)],
+        batch_size=EXPORT_BATCH
+    ), header_color="E74C3C")
@@ -5,7 +5,11 @@ Gestiona operaciones diarias del almacén: pedidos, recepciones, mermas
 
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, g, abort, send_file
 from flask_login import login_required, current_user
-from app.models import Product, InboundOrder, InboundOrderLineItem, Wastage, Lot, Supplier, ProductBundle, ActivityLog, utc_now
+from app.models import Product, InboundOrder, InboundOrderLineItem, Wastage, Lot, Supplier, ActivityLog, utc_now
+from app.services.inventory import adjust_stock, StockAllocation, InsufficientStockError, StockConflictError
+from app.services.loaders import get_loader
+from app.services.bundles import get_components
+from app.services.cache import api_cache
 from datetime import datetime, timedelta
 from bson import ObjectId
 from mongoengine import DoesNotExist
@@ -378,7 +382,10 @@ def get_orders():
     """Obtener todos los pedidos"""
     try:
         tenant = g.current_tenant
-        orders = InboundOrder.objects(tenant=tenant).order_by('-created_at')
+        orders = list(InboundOrder.objects(tenant=tenant).order_by('-created_at'))
+        loader = get_loader()
+        loader.resolve(orders, 'supplier')
+        loader.resolve([li for o in orders for li in o.line_items], 'product')
 
         def serialize_order(o):
             data = {
@@ -668,6 +675,8 @@ def get_receiving_orders():
             tenant=tenant,
             status__in=['pending', 'partially_received']
         ).order_by('-created_at')
+        orders = list(orders)
+        get_loader().resolve([li for o in orders for li in o.line_items], 'product')
 
         result = []
         for o in orders:
@@ -790,6 +799,7 @@ def confirm_receiving(order_id):
                 expiry_date=expiry_date,
             )
             lot.save()
+            adjust_stock(product, quantity, tenant=tenant)
 
             created_lots.append({
                 "lot_id": str(lot.id),
@@ -859,7 +869,7 @@ def receiving_summary(order_id):
         if order.tenant != tenant:
             return jsonify({"success": False, "error": "Acceso denegado"}), 403
 
-        lots = Lot.objects(order=order)
+        lots = get_loader().resolve(list(Lot.objects(order=order)), 'product')
         lots_data = [{
             "lot_code": lot.lot_code,
             "product_name": lot.product.name if lot.product else 'N/A',
@@ -939,15 +949,6 @@ def register_wastage():
         if product.tenant != tenant:
             return jsonify({"success": False, "error": "Acceso denegado"}), 403
 
-        # Verificar stock disponible
-        if product.total_stock < quantity:
-            return jsonify(
-                {
-                    "success": False,
-                    "error": f"Stock insuficiente. Disponible: {product.total_stock}, solicitado: {quantity}",
-                }
-            ), 400
-
         # Registrar merma
         wastage_record = Wastage(
             product=product,
@@ -958,27 +959,16 @@ def register_wastage():
         )
 
         # Reducir stock (FIFO - del lote más antiguo)
-        remaining_to_deduct = quantity
-        available_lots = sorted(
-            [l for l in product.lots if l.quantity_current > 0],
-            key=lambda x: x.created_at,
-        )
-
-        if not available_lots:
-            return jsonify(
-                {
-                    "success": False,
-                    "error": "No hay lotes disponibles para este producto",
-                }
-            ), 400
-
-        for lot in available_lots:
-            if remaining_to_deduct <= 0:
-                break
-            deduct = min(lot.quantity_current, remaining_to_deduct)
-            lot.quantity_current -= deduct
-            remaining_to_deduct -= deduct
-            lot.save()
+        try:
+            with StockAllocation(tenant) as allocation:
+                allocation.deduct(
+                    product, quantity,
+                    message="Stock insuficiente. Disponible: {available}, solicitado: {requested}"
+                )
+        except InsufficientStockError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except StockConflictError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
 
         wastage_record.save()
 
@@ -1020,7 +1010,7 @@ def wastage_history():
     """Obtener historial de mermas"""
     try:
         tenant = g.current_tenant
-        wastages = Wastage.objects(tenant=tenant).order_by('-date_created')
+        wastages = get_loader().resolve(list(Wastage.objects(tenant=tenant).order_by('-date_created')), 'product')
 
         return jsonify(
             {
@@ -1198,6 +1188,7 @@ def update_expiry(product_id):
 
 @bp.route("/api/alerts", methods=["GET"])
 @login_required
+@api_cache.cached(ttl=30)
 def get_alerts():
     """Obtener alertas de vencimientos próximos y stock crítico"""
     try:
@@ -1289,7 +1280,10 @@ def assemble_box():
         if bundle_product.tenant != tenant:
             return jsonify({"success": False, "error": "Acceso denegado"}), 403
 
-        if not bundle_product.is_bundle:
+        # 2. Verificar componentes (grafo de bundles en caché)
+        components = get_components(tenant, bundle_product)
+
+        if not components:
             return jsonify(
                 {
                     "success": False,
@@ -1297,52 +1291,25 @@ def assemble_box():
                 }
             ), 400
 
-        # 2. Verificar componentes y stock
-        components = ProductBundle.objects(bundle=bundle_product)
-
-        if components.count() == 0:
+        found = get_loader().load(Product, [component_id for component_id, _ in components])
+        if not all(found.values()):
             return jsonify(
-                {"success": False, "error": "Este kit no tiene componentes definidos"}
+                {"success": False, "error": "Este kit tiene componentes que ya no existen"}
             ), 400
 
-        # Pre-chequeo de stock
-        for comp_rel in components:
-            comp_product = comp_rel.component
-            needed_qty = comp_rel.quantity * quantity
-
-            if comp_product.total_stock < needed_qty:
-                return jsonify(
-                    {
-                        "success": False,
-                        "error": f'Stock insuficiente de componente "{comp_product.name}". Requerido: {needed_qty}, Disponible: {comp_product.total_stock}',
-                    }
-                ), 400
-
-        # 3. Descontar stock de componentes (FIFO)
-        for comp_rel in components:
-            comp_product = comp_rel.component
-            total_needed = comp_rel.quantity * quantity
-            remaining_to_deduct = total_needed
-
-            # Obtener lotes disponibles ordenados por fecha (FIFO)
-            available_lots = sorted(
-                [l for l in comp_product.lots if l.quantity_current > 0],
-                key=lambda x: x.created_at,
-            )
-
-            for lot in available_lots:
-                if remaining_to_deduct <= 0:
-                    break
-
-                deduct = min(lot.quantity_current, remaining_to_deduct)
-                lot.quantity_current -= deduct
-                remaining_to_deduct -= deduct
-                lot.save()
-
-            if remaining_to_deduct > 0:
-                raise Exception(
-                    f"Error concurrente de inventario en {comp_product.name}"
-                )
+        # 3. Descontar stock de componentes (FIFO) como una sola asignación
+        try:
+            with StockAllocation(tenant) as allocation:
+                for component_id, component_qty in components:
+                    allocation.deduct(
+                        found[component_id],
+                        component_qty * quantity,
+                        message='Stock insuficiente de componente "{name}". Requerido: {requested}, Disponible: {available}'
+                    )
+        except InsufficientStockError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except StockConflictError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
 
         # 4. Crear Lote para el Bundle
         # Buscamos o creamos una Orden de Entrada "interna" para asignar el lote
@@ -1396,6 +1363,7 @@ def assemble_box():
             created_at=utc_now(),
         )
         new_lot.save()
+        adjust_stock(bundle_product, quantity, tenant=tenant)
 
         # Log activity
         ActivityLog.log(
@@ -0,0 +1,3 @@
+"""
+Servicios de dominio compartidos por los blueprints, scripts y el servidor MCP.
+"""
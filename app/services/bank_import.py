@@ -0,0 +1,320 @@
+"""
+Importación de cartolas bancarias (Excel o CSV) a BankTransaction.
+
+Antes se leía el archivo completo a memoria y, por cada fila, se consultaba
+si ya existía una transacción igual y se guardaba con `save()`: dos viajes
+a la base por fila. Ahora:
+
+- `read_rows` recorre el archivo sin cargarlo entero: openpyxl en modo
+  read-only para .xlsx y un lector CSV incremental (la codificación y el
+  separador se detectan con una muestra del inicio).
+- `detect_columns` busca la fila de encabezados en las primeras 30 filas.
+- Cada fila se normaliza con `parse_row` y recibe una huella (`fingerprint`)
+  determinística de (tenant, fecha, monto con signo, referencia,
+  descripción). El índice único (tenant, fingerprint) hace la deduplicación.
+- Las filas se insertan en bloques de CHUNK_ROWS con
+  `insert_many(ordered=False)`: los errores de clave duplicada se cuentan
+  como "ya importadas" y el resto del bloque se inserta igual.
+
+Las transacciones importadas antes de la huella se completan con
+`python scripts/maintenance.py bank-fingerprints`.
+"""
+import codecs
+import csv
+import hashlib
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import chain, islice
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.models import BankTransaction, utc_now
+from app.services.inventory import _as_id
+
+CHUNK_ROWS = 1000
+HEADER_SCAN_ROWS = 30
+SAMPLE_BYTES = 64 * 1024
+DUPLICATE_KEY = 11000
+
+DATE_FORMATS = ['%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d', '%d.%m.%Y']
+
+# Alias de encabezados por columna
+COLUMN_ALIASES = {
+    'date': ['fecha', 'date', 'fec', 'fecha operación', 'fecha_operacion'],
+    'amount': ['monto', 'amount', 'valor', 'importe', 'cargo', 'abono', 'total'],
+    'description': ['descripción', 'descripcion', 'description', 'detalle', 'glosa', 'concepto', 'movimiento'],
+    'reference': ['referencia', 'reference', 'ref', 'número', 'numero', 'nro', 'operación', 'operacion',
+                  'documento', 'n° documento'],
+}
+
+
+class BankImportError(ValueError):
+    """Archivo que no se puede importar (se responde 400 con `hint`)"""
+
+    def __init__(self, message, hint=None):
+        super().__init__(message)
+        self.hint = hint
+
+
+class RowError(ValueError):
+    pass
+
+
+# ============================================
+# LECTURA
+# ============================================
+def _detect_encoding(sample):
+    try:
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def _csv_rows(stream):
+    sample = stream.read(SAMPLE_BYTES)
+    stream.seek(0)
+    encoding = _detect_encoding(sample)
+    text_sample = sample.decode(encoding, errors='ignore')[:2000]
+    delimiter = ';' if text_sample.count(';') > text_sample.count(',') else ','
+    lines = codecs.getreader(encoding)(stream, errors='replace')
+    for row in csv.reader(lines, delimiter=delimiter):
+        yield [cell.strip() for cell in row]
+
+
+def _xlsx_rows(stream):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def read_rows(stream, filename):
+    """Itera las filas del archivo como listas de celdas (CSV: strings; Excel: valores)"""
+    if filename.lower().endswith('.csv'):
+        return _csv_rows(stream)
+    return _xlsx_rows(stream)
+
+
+def _header_text(cell):
+    return str(cell).lower().strip() if cell not in (None, '') else ''
+
+
+def detect_columns(rows):
+    """
+    Busca la fila de encabezados en las primeras HEADER_SCAN_ROWS filas.
+    Retorna (col_map, filas de datos, número de la primera fila de datos).
+    """
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+    if len(head) < 2:
+        raise BankImportError('El archivo está vacío o no tiene datos')
+    for idx, row in enumerate(head):
+        col_map = {}
+        for col_idx, text in enumerate(_header_text(cell) for cell in row):
+            for column, aliases in COLUMN_ALIASES.items():
+                if column not in col_map and any(alias in text for alias in aliases):
+                    col_map[column] = col_idx
+                    break
+        if 'date' in col_map and 'amount' in col_map:
+            return col_map, chain(head[idx + 1:], rows), idx + 2
+    raise BankImportError(
+        'No se pudieron detectar las columnas de Fecha y Monto.',
+        hint=f'Asegúrate de que el archivo tenga encabezados con "Fecha" y "Monto" '
+             f'(se buscó en las primeras {HEADER_SCAN_ROWS} filas)'
+    )
+
+
+# ============================================
+# FILAS
+# ============================================
+def _cell(row, idx):
+    if idx is None or idx >= len(row):
+        return None
+    return row[idx]
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    # Una cartola repite pocas fechas distintas: strptime es lo más caro de cada fila
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        parsed = _parse_date_text(value.strip())
+        if parsed is None:
+            raise RowError(f'formato de fecha no reconocido "{value}"')
+        return parsed
+    return None
+
+
+def _parse_amount(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    if isinstance(value, str):
+        clean = value.replace('$', '').replace('.', '').replace(',', '.').replace(' ', '').strip()
+        try:
+            return Decimal(clean)
+        except InvalidOperation:
+            raise RowError(f'monto inválido "{value}"')
+    return None
+
+
+def parse_row(row, col_map):
+    """
+    Retorna {'date', 'amount' (con signo), 'description', 'reference'}, None si la
+    fila no tiene fecha o monto, o lanza RowError si no se puede interpretar.
+    """
+    date_val = _cell(row, col_map['date'])
+    if date_val in (None, ''):
+        return None
+    tx_date = _parse_date(date_val)
+    if tx_date is None:
+        return None
+    amount_val = _cell(row, col_map['amount'])
+    if amount_val in (None, ''):
+        return None
+    amount = _parse_amount(amount_val)
+    if amount is None:
+        return None
+    description = _cell(row, col_map.get('description'))
+    reference = _cell(row, col_map.get('reference'))
+    return {
+        'date': tx_date,
+        'amount': amount.quantize(Decimal('0.01')),
+        'description': str(description if description is not None else '').strip()[:500],
+        'reference': str(reference if reference is not None else '').strip()[:100],
+    }
+
+
+def fingerprint(tenant_id, date, amount, reference, description):
+    """Huella de una transacción: sha1 de (tenant, fecha, monto con signo, referencia, descripción)"""
+    key = '\x1f'.join([str(tenant_id), date.isoformat(), f'{amount:.2f}',
+                       (reference or '').strip(), (description or '').strip()])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# ============================================
+# IMPORTACIÓN
+# ============================================
+def _insert(collection, docs):
+    """Inserta el bloque; retorna (insertadas, duplicadas, otros errores)"""
+    if not docs:
+        return 0, 0, []
+    try:
+        result = collection.insert_many(docs, ordered=False)
+        return len(result.inserted_ids), 0, []
+    except BulkWriteError as e:
+        details = e.details
+        write_errors = details.get('writeErrors', [])
+        duplicates = sum(1 for err in write_errors if err.get('code') == DUPLICATE_KEY)
+        others = [f"Fila {docs[err['index']].get('row_number')}: {err.get('errmsg')}"
+                  for err in write_errors if err.get('code') != DUPLICATE_KEY]
+        return details.get('nInserted', 0), duplicates, others
+
+
+def import_statement(stream, filename, tenant):
+    """
+    Importa la cartola. Retorna {'created', 'duplicates', 'errors'}.
+    Lanza BankImportError si no se detectan las columnas.
+    """
+    tenant_id = _as_id(tenant)
+    col_map, rows, first_row = detect_columns(read_rows(stream, filename))
+    collection = BankTransaction._get_collection()
+    now = utc_now()
+    created = duplicates = 0
+    errors = []
+    seen = set()
+    chunk = []
+
+    def flush():
+        nonlocal created, duplicates
+        inserted, dupes, failed = _insert(collection, chunk)
+        created += inserted
+        duplicates += dupes
+        errors.extend(failed)
+        chunk.clear()
+
+    for row_number, row in enumerate(rows, start=first_row):
+        if not row or all(cell in (None, '') for cell in row):
+            continue
+        try:
+            parsed = parse_row(row, col_map)
+        except RowError as e:
+            errors.append(f'Fila {row_number}: {e}')
+            continue
+        if parsed is None:
+            continue
+        key = fingerprint(tenant_id, parsed['date'], parsed['amount'], parsed['reference'], parsed['description'])
+        # Filas repetidas dentro del mismo archivo
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        chunk.append({
+            'date': parsed['date'],
+            'amount': float(abs(parsed['amount'])),
+            'description': parsed['description'],
+            'reference': parsed['reference'],
+            'transaction_type': 'credit' if parsed['amount'] > 0 else 'debit',
+            'status': 'pending',
+            'source_file': filename[:200],
+            'row_number': row_number,
+            'created_at': now,
+            'tenant': tenant_id,
+            'fingerprint': key,
+        })
+        if len(chunk) >= CHUNK_ROWS:
+            flush()
+    flush()
+    return {'created': created, 'duplicates': duplicates, 'errors': errors}
+
+
+def backfill_fingerprints(tenant=None, batch_size=1000):
+    """
+    Calcula la huella de las transacciones importadas antes de que existiera.
+    Las que repiten la huella de otra ya guardada quedan sin ella (son
+    duplicados previos). Retorna {'updated', 'duplicates'}.
+    """
+    collection = BankTransaction._get_collection()
+    query = {'fingerprint': {'$exists': False}}
+    if tenant is not None:
+        query['tenant'] = _as_id(tenant)
+    projection = {'tenant': 1, 'date': 1, 'amount': 1, 'reference': 1, 'description': 1, 'transaction_type': 1}
+    updated = duplicates = 0
+    ops = []
+
+    def flush():
+        nonlocal updated, duplicates
+        if not ops:
+            return
+        try:
+            updated += collection.bulk_write(ops, ordered=False).modified_count
+        except BulkWriteError as e:
+            updated += e.details.get('nModified', 0)
+            duplicates += sum(1 for err in e.details.get('writeErrors', []) if err.get('code') == DUPLICATE_KEY)
+        ops.clear()
+
+    for doc in collection.find(query, projection, batch_size=batch_size):
+        amount = Decimal(str(doc.get('amount') or 0)).quantize(Decimal('0.01'))
+        if doc.get('transaction_type') == 'debit':
+            amount = -amount
+        key = fingerprint(doc.get('tenant'), doc['date'], amount, doc.get('reference'), doc.get('description'))
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'fingerprint': key}}))
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    return {'updated': updated, 'duplicates': duplicates}
@@ -0,0 +1,175 @@
+"""
+Grafo de composición de bundles (kits/cajas) por tenant.
+
+`ProductBundle` guarda una fila por (bundle, componente). En vez de consultar
+esa colección por cada producto, cada worker mantiene en memoria el grafo
+completo del tenant:
+
+    {bundle_id: [(component_id, cantidad), ...]}
+
+El grafo se invalida con `Tenant.bundle_version`: toda escritura en
+`product_bundles` debe pasar por `set_bundle_components` /
+`remove_product_from_bundles` (o llamar a `bump_bundle_version`), que
+incrementan la versión. Los demás workers detectan el cambio al leer la
+versión (un find_one por _id) y reconstruyen su copia.
+
+`Product.is_bundle` es un flag persistido que se mantiene en las mismas
+funciones; `rebuild_bundle_flags` lo recalcula para datos existentes (lo
+ejecuta `maintenance.py migrate` en cada deploy).
+"""
+import threading
+
+from pymongo import UpdateOne
+
+from app.models import Product, ProductBundle, Tenant
+from app.services.inventory import _as_id, lot_stock
+
+_graph_cache = {}  # tenant_id -> (versión, grafo)
+_graph_lock = threading.Lock()
+
+
+def bundle_version(tenant):
+    doc = Tenant._get_collection().find_one({'_id': _as_id(tenant)}, {'bundle_version': 1})
+    return (doc or {}).get('bundle_version') or 0
+
+
+def bump_bundle_version(tenant):
+    """Invalida el grafo de bundles del tenant en todos los workers"""
+    Tenant._get_collection().update_one({'_id': _as_id(tenant)}, {'$inc': {'bundle_version': 1}})
+
+
+def _load_graph(tenant_id):
+    graph = {}
+    cursor = ProductBundle._get_collection().find(
+        {'tenant': tenant_id}, {'bundle': 1, 'component': 1, 'quantity': 1}
+    )
+    for row in cursor:
+        if not row.get('bundle') or not row.get('component'):
+            continue
+        graph.setdefault(row['bundle'], []).append((row['component'], int(row.get('quantity') or 1)))
+    return graph
+
+
+def get_bundle_graph(tenant):
+    """
+    Retorna {bundle_id: [(component_id, cantidad)]} del tenant.
+
+    El resultado es compartido entre requests: no debe modificarse.
+    """
+    tenant_id = _as_id(tenant)
+    version = bundle_version(tenant_id)
+    cached = _graph_cache.get(tenant_id)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _graph_lock:
+        cached = _graph_cache.get(tenant_id)
+        if cached and cached[0] == version:
+            return cached[1]
+        graph = _load_graph(tenant_id)
+        _graph_cache[tenant_id] = (version, graph)
+        return graph
+
+
+def get_components(tenant, product):
+    """Componentes [(component_id, cantidad)] de un producto (vacío si no es bundle)"""
+    return get_bundle_graph(tenant).get(_as_id(product), [])
+
+
+def max_buildable(graph, stock):
+    """
+    Unidades armables de cada bundle según el stock de sus componentes.
+
+    `graph` es {bundle_id: [(component_id, cantidad)]} y `stock` es
+    {product_id: unidades}; los componentes sin entrada cuentan como 0.
+    Retorna {bundle_id: unidades}.
+    """
+    result = {}
+    for bundle_id, components in graph.items():
+        if not components:
+            continue
+        result[bundle_id] = min(
+            max(stock.get(component_id, 0) or 0, 0) // max(qty, 1)
+            for component_id, qty in components
+        )
+    return result
+
+
+def buildable_units(tenant, graph=None):
+    """Unidades armables de todos los bundles del tenant (una consulta de stock)"""
+    graph = get_bundle_graph(tenant) if graph is None else graph
+    component_ids = {component_id for components in graph.values() for component_id, _ in components}
+    if not component_ids:
+        return {}
+    stock = {}
+    for doc in Product._get_collection().find({'_id': {'$in': list(component_ids)}}, {'stock_current': 1}):
+        current = doc.get('stock_current')
+        stock[doc['_id']] = current if current is not None else lot_stock(doc['_id'])
+    return max_buildable(graph, stock)
+
+
+def set_bundle_components(product, components, tenant):
+    """
+    Reemplaza los componentes de `product`.
+
+    `components` es una lista de dicts {'component_id', 'quantity'} (formato
+    del formulario de productos). Actualiza el flag is_bundle e invalida el
+    grafo del tenant.
+    """
+    rows = []
+    for component in components or []:
+        rows.append(ProductBundle(
+            bundle=product,
+            component=Product.objects.get(id=_as_id(component['component_id']), tenant=tenant),
+            quantity=int(component['quantity']),
+            tenant=tenant
+        ))
+    ProductBundle.objects(bundle=product).delete()
+    if rows:
+        ProductBundle.objects.insert(rows, load_bulk=False)
+    Product._get_collection().update_one({'_id': product.pk}, {'$set': {'is_bundle': bool(rows)}})
+    product._data['is_bundle'] = bool(rows)
+    bump_bundle_version(tenant)
+    return rows
+
+
+def remove_product_from_bundles(product, tenant):
+    """Elimina las relaciones de bundle de un producto que se va a borrar"""
+    bundles = ProductBundle._get_collection()
+    affected_ids = bundles.distinct('bundle', {'component': product.pk})
+    bundles.delete_many({'$or': [{'component': product.pk}, {'bundle': product.pk}]})
+
+    # Los bundles que quedaron sin componentes dejan de serlo
+    still_bundles = set(bundles.distinct('bundle', {'bundle': {'$in': affected_ids}}))
+    empty = [b for b in affected_ids if b not in still_bundles]
+    if empty:
+        Product._get_collection().update_many({'_id': {'$in': empty}}, {'$set': {'is_bundle': False}})
+    bump_bundle_version(tenant)
+
+
+def rebuild_bundle_flags(tenant=None):
+    """
+    Recalcula Product.is_bundle desde product_bundles y completa el tenant de
+    las relaciones antiguas que no lo tienen. Solo escribe los flags que
+    difieren, así que se puede repetir en cada deploy. Retorna la cantidad
+    de bundles.
+    """
+    bundles = ProductBundle._get_collection()
+    products = Product._get_collection()
+
+    # Relaciones sin tenant: heredan el del producto bundle
+    ops = []
+    for row in bundles.find({'tenant': None}, {'bundle': 1}):
+        owner = products.find_one({'_id': row.get('bundle')}, {'tenant': 1})
+        if owner and owner.get('tenant'):
+            ops.append(UpdateOne({'_id': row['_id']}, {'$set': {'tenant': owner['tenant']}}))
+    if ops:
+        bundles.bulk_write(ops, ordered=False)
+
+    match = {'tenant': _as_id(tenant)} if tenant is not None else {}
+    bundle_ids = bundles.distinct('bundle', match)
+    products.update_many(dict(match, _id={'$in': bundle_ids}, is_bundle={'$ne': True}), {'$set': {'is_bundle': True}})
+    products.update_many(dict(match, _id={'$nin': bundle_ids}, is_bundle=True), {'$set': {'is_bundle': False}})
+
+    tenant_filter = {'_id': _as_id(tenant)} if tenant is not None else {}
+    Tenant._get_collection().update_many(tenant_filter, {'$inc': {'bundle_version': 1}})
+    return len(bundle_ids)
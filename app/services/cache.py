@@ -0,0 +1,297 @@
+"""
+Microcaché de respuestas JSON por tenant.
+
+Los endpoints que el frontend consulta periódicamente (dashboard, alertas,
+estadísticas de clientes y de conciliación) se recalculan en cada pestaña
+abierta. `api_cache.cached(ttl)` guarda la respuesta del GET unos segundos,
+con clave (tenant, versión, endpoint, argumentos):
+
+    @bp.route('/dashboard', methods=['GET'])
+    @login_required
+    @api_cache.cached(ttl=30)
+    def get_dashboard_stats(): ...
+
+El decorador va después de los de autenticación/permisos, que se siguen
+evaluando en cada request. Solo se guardan respuestas 200.
+
+Invalidación: `Tenant.cache_version` forma parte de la clave, así que
+incrementarla descarta todas las entradas del tenant en todos los workers.
+`invalidate(tenant)` lo hace; dentro de un request se acumula y se aplica
+una sola vez al terminar. Los servicios que escriben ventas, pagos y lotes
+la llaman, y toda escritura (POST/PUT/DELETE exitoso) en los blueprints de
+`INVALIDATING_BLUEPRINTS` invalida el tenant actual.
+
+Backends (`API_CACHE_BACKEND`):
+    local  LRU en memoria de cada worker (por defecto)
+    mongo  colección `api_cache` compartida por todos los workers, con
+           índice TTL sobre `expires_at`
+    none   sin caché
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from bson import Binary, DBRef, ObjectId
+from flask import Response, current_app, g, has_request_context, make_response, request
+
+from app.models import Tenant
+
+INVALIDATING_BLUEPRINTS = {'api', 'warehouse', 'customers', 'reconciliation', 'delivery'}
+MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+# ============================================
+# BACKENDS
+# ============================================
+class NullCache:
+    name = 'none'
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def clear(self, tenant_id=None):
+        return 0
+
+    def size(self):
+        return 0
+
+
+class LocalCache:
+    """LRU en memoria con expiración por entrada (thread-safe)"""
+    name = 'local'
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            prefix = f'{tenant_id}:'
+            keys = [k for k in self._entries if k.startswith(prefix)]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+    def size(self):
+        return len(self._entries)
+
+
+class MongoCache:
+    """
+    Entradas en la colección `api_cache`, compartidas entre workers.
+    MongoDB borra las vencidas con el índice TTL (registrado en
+    app.services.indexes); mientras tanto se filtran al leer.
+    """
+    name = 'mongo'
+    collection_name = 'api_cache'
+
+    def _collection(self):
+        return Tenant._get_db()[self.collection_name]
+
+    def get(self, key):
+        doc = self._collection().find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+        if doc is None:
+            return None
+        return bytes(doc['body']), doc.get('mimetype')
+
+    def set(self, key, value, ttl):
+        body, mimetype = value
+        self._collection().replace_one(
+            {'_id': key},
+            {
+                'tenant': key.split(':', 1)[0],
+                'body': Binary(body),
+                'mimetype': mimetype,
+                'expires_at': datetime.utcnow() + timedelta(seconds=ttl),
+            },
+            upsert=True
+        )
+
+    def clear(self, tenant_id=None):
+        query = {'tenant': str(tenant_id)} if tenant_id is not None else {}
+        return self._collection().delete_many(query).deleted_count
+
+    def size(self):
+        return self._collection().estimated_document_count()
+
+
+BACKENDS = {'none': NullCache, 'local': LocalCache, 'mongo': MongoCache}
+
+
+# ============================================
+# VERSIÓN POR TENANT
+# ============================================
+def _as_id(tenant):
+    # Igual que app.services.inventory._as_id; inventory importa este módulo
+    if isinstance(tenant, ObjectId):
+        return tenant
+    if isinstance(tenant, DBRef):
+        return tenant.id
+    if hasattr(tenant, 'pk'):
+        return tenant.pk
+    return ObjectId(str(tenant))
+
+
+def cache_version(tenant):
+    """
+    Versión de caché del tenant. Si es un Tenant cargado en este request se
+    usa el valor leído (sin otra consulta).
+    """
+    if isinstance(tenant, Tenant):
+        return tenant._data.get('cache_version') or 0
+    doc = Tenant._get_collection().find_one({'_id': _as_id(tenant)}, {'cache_version': 1})
+    return (doc or {}).get('cache_version') or 0
+
+
+def bump_cache_versions(tenant_ids):
+    tenant_ids = [_as_id(t) for t in tenant_ids if t is not None]
+    if tenant_ids:
+        Tenant._get_collection().update_many({'_id': {'$in': tenant_ids}}, {'$inc': {'cache_version': 1}})
+
+
+def invalidate(tenant):
+    """
+    Descarta las respuestas en caché del tenant. Dentro de un request el
+    incremento se difiere al final (una sola escritura aunque se llame por
+    cada item); fuera de uno se aplica de inmediato.
+    """
+    if tenant is None:
+        return
+    if has_request_context():
+        pending = g.get('cache_invalidate')
+        if pending is None:
+            pending = g.cache_invalidate = set()
+        pending.add(_as_id(tenant))
+    else:
+        bump_cache_versions([tenant])
+
+
+# ============================================
+# EXTENSIÓN
+# ============================================
+class ApiCache:
+    def __init__(self):
+        self.backend = NullCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        name = app.config.get('API_CACHE_BACKEND') or 'local'
+        if name not in BACKENDS:
+            raise ValueError(f'API_CACHE_BACKEND inválido: {name}')
+        if name == 'local':
+            self.backend = LocalCache(app.config.get('API_CACHE_SIZE') or 512)
+        else:
+            self.backend = BACKENDS[name]()
+        app.after_request(self._mark_write)
+        app.teardown_request(self._flush_invalidations)
+
+    def _mark_write(self, response):
+        if (request.method in MUTATING_METHODS
+                and request.blueprint in INVALIDATING_BLUEPRINTS
+                and response.status_code < 400):
+            invalidate(g.get('current_tenant'))
+        return response
+
+    def _flush_invalidations(self, exc=None):
+        pending = g.pop('cache_invalidate', None)
+        if not pending:
+            return
+        try:
+            bump_cache_versions(pending)
+        except Exception as e:
+            current_app.logger.error(f'Error invalidando caché: {e}')
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def key(self, tenant):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        view_args = ','.join(f'{k}={v}' for k, v in sorted((request.view_args or {}).items()))
+        return f'{_as_id(tenant)}:{cache_version(tenant)}:{request.endpoint}:{view_args}:{args}'
+
+    def cached(self, ttl=30):
+        """Guarda `ttl` segundos la respuesta 200 del GET decorado"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                tenant = g.get('current_tenant')
+                if tenant is None or request.method != 'GET' or isinstance(self.backend, NullCache):
+                    return f(*args, **kwargs)
+
+                key = self.key(tenant)
+                try:
+                    value = self.backend.get(key)
+                except Exception as e:
+                    current_app.logger.error(f'Error leyendo caché: {e}')
+                    value = None
+                if value is not None:
+                    self._count(hit=True)
+                    body, mimetype = value
+                    response = Response(body, mimetype=mimetype)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self._count(hit=False)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    try:
+                        self.backend.set(key, (response.get_data(), response.mimetype), ttl)
+                    except Exception as e:
+                        current_app.logger.error(f'Error guardando caché: {e}')
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
+
+    def clear(self, tenant=None):
+        return self.backend.clear(_as_id(tenant) if tenant is not None else None)
+
+    def stats(self):
+        """Contadores de este worker"""
+        total = self.hits + self.misses
+        return {
+            'backend': self.backend.name,
+            'pid': os.getpid(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0,
+            'entries': self.backend.size(),
+        }
+
+
+api_cache = ApiCache()
@@ -0,0 +1,304 @@
+"""
+Importación de clientes desde Excel a ShopifyCustomer.
+
+Antes el archivo completo se cargaba a una lista y, por cada fila, se
+consultaba si el email ya existía y se guardaba con `save()`: dos viajes a
+la base por fila, y dos rutas `/api/customers/import` con lógicas
+distintas. Ahora ambas usan `import_workbook`:
+
+- Las filas se leen con openpyxl en modo read-only, sin cargar el archivo.
+- Se procesan en bloques de CHUNK_ROWS. Dentro del archivo, las filas que
+  repiten el email de una fila anterior (o, sin email, su teléfono) se
+  cuentan como duplicadas y se omiten.
+- Por bloque, una sola consulta `$in` (email y `phone_keys`) trae los
+  clientes existentes del tenant y un `bulk_write` desordenado escribe
+  todo: los existentes se actualizan con los datos no vacíos de la fila y
+  los nuevos se insertan con un upsert. Las ventas de los clientes
+  actualizados recalculan sus tokens de conciliación.
+- Una fila inválida (o rechazada por la base) queda en `errors` con su
+  número de fila y el resto del bloque se escribe igual.
+"""
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.models import ShopifyCustomer, utc_now
+from app.services.inventory import _as_id
+from app.services.match_tokens import refresh_account_tokens
+from app.services.search import customer_search_fields, phone_keys
+
+CHUNK_ROWS = 1000
+PREVIEW_ROWS = 100
+DEFAULT_COUNTRY = 'Chile'
+
+# Orden de las columnas cuando el archivo no tiene encabezados reconocibles
+FIELDS = ('name', 'email', 'phone', 'city', 'province', 'country')
+
+COLUMN_ALIASES = {
+    'nombre': 'name', 'name': 'name',
+    'email': 'email', 'correo': 'email',
+    'teléfono': 'phone', 'telefono': 'phone', 'phone': 'phone',
+    'ciudad': 'city', 'city': 'city',
+    'provincia': 'province', 'province': 'province', 'región': 'province', 'region': 'province',
+    'país': 'country', 'pais': 'country', 'country': 'country',
+}
+
+# Campo de la fila -> campo de ShopifyCustomer (y su largo máximo)
+DOCUMENT_FIELDS = {
+    'name': ('name', 200),
+    'email': ('email', 200),
+    'phone': ('phone', 50),
+    'city': ('address_city', 100),
+    'province': ('address_province', 100),
+    'country': ('address_country', 100),
+}
+
+
+class CustomerImportError(ValueError):
+    """Archivo que no se puede importar (se responde 400)"""
+
+
+class RowError(ValueError):
+    pass
+
+
+# ============================================
+# LECTURA
+# ============================================
+def read_rows(stream):
+    """Itera las filas de la primera hoja del Excel como tuplas de valores"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def detect_columns(header):
+    """{campo: índice} desde la fila de encabezados (o por posición si no se reconoce ninguno)"""
+    col_map = {}
+    for idx, cell in enumerate(header or ()):
+        field = COLUMN_ALIASES.get(str(cell).strip().lower()) if cell not in (None, '') else None
+        if field and field not in col_map:
+            col_map[field] = idx
+    if not col_map:
+        col_map = {field: idx for idx, field in enumerate(FIELDS)}
+    if 'name' not in col_map:
+        raise CustomerImportError('La columna "Nombre" es requerida en el archivo Excel')
+    return col_map
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Teléfonos guardados como número en Excel: 56912345678.0
+        value = int(value)
+    return str(value).strip()
+
+
+def parse_row(row, col_map):
+    """
+    {campo: texto} de la fila ('' si falta), None si no tiene nombre, o
+    lanza RowError si algún valor excede el largo del campo.
+    """
+    fields = {field: _text(row[idx]) if idx < len(row) else '' for field, idx in col_map.items()}
+    for field in FIELDS:
+        fields.setdefault(field, '')
+    if not fields['name']:
+        return None
+    for field, (_, max_length) in DOCUMENT_FIELDS.items():
+        if len(fields[field]) > max_length:
+            raise RowError(f'{field} excede {max_length} caracteres')
+    return fields
+
+
+def _data_rows(stream):
+    """(col_map, filas de datos numeradas desde 2)"""
+    rows = read_rows(stream)
+    header = next(rows, None)
+    if header is None:
+        raise CustomerImportError('El archivo está vacío')
+    return detect_columns(header), enumerate(rows, start=2)
+
+
+def preview_workbook(stream, limit=PREVIEW_ROWS):
+    """Primeras `limit` filas interpretadas y el total de filas con nombre, sin escribir nada"""
+    col_map, rows = _data_rows(stream)
+    preview = []
+    total = 0
+    for _, row in rows:
+        try:
+            fields = parse_row(row, col_map)
+        except RowError:
+            continue
+        if fields is None:
+            continue
+        total += 1
+        if len(preview) < limit:
+            preview.append(fields)
+    return {'total': total, 'rows': preview}
+
+
+# ============================================
+# IMPORTACIÓN
+# ============================================
+def _repeated(fields, emails, phones):
+    """
+    La fila repite el cliente de una fila anterior del archivo, con la misma
+    regla que _match: por email si lo tiene, por teléfono si no. Registra
+    las claves de las filas nuevas.
+    """
+    email = fields['email'].lower()
+    keys = phone_keys(fields['phone'])
+    if email in emails if email else any(key in phones for key in keys):
+        return True
+    if email:
+        emails.add(email)
+    phones.update(keys)
+    return False
+
+
+def _existing(collection, tenant_id, chunk):
+    """Clientes del tenant que coinciden por email o teléfono con el bloque: (por email, por teléfono)"""
+    emails = set()
+    phones = set()
+    for _, fields in chunk:
+        if fields['email']:
+            emails.update((fields['email'], fields['email'].lower()))
+        phones.update(phone_keys(fields['phone']))
+    conditions = []
+    if emails:
+        conditions.append({'email': {'$in': sorted(emails)}})
+    if phones:
+        conditions.append({'phone_keys': {'$in': sorted(phones)}})
+    by_email, by_phone = {}, {}
+    if not conditions:
+        return by_email, by_phone
+    projection = {document_field: 1 for document_field, _ in DOCUMENT_FIELDS.values()}
+    projection['phone_keys'] = 1
+    for doc in collection.find({'tenant': tenant_id, '$or': conditions}, projection):
+        if doc.get('email'):
+            by_email.setdefault(doc['email'].lower(), doc)
+        for key in doc.get('phone_keys') or []:
+            by_phone.setdefault(key, doc)
+    return by_email, by_phone
+
+
+def _match(fields, by_email, by_phone):
+    if fields['email'] and fields['email'].lower() in by_email:
+        return by_email[fields['email'].lower()]
+    for key in phone_keys(fields['phone']):
+        doc = by_phone.get(key)
+        # Un teléfono compartido no une clientes con emails distintos
+        if doc is not None and not (fields['email'] and doc.get('email')):
+            return doc
+    return None
+
+
+def _same(field, value, current):
+    """El valor de la fila ya es el del cliente (email sin mayúsculas, teléfono por dígitos)"""
+    if field == 'email':
+        return value.lower() == (current or '').lower()
+    if field == 'phone':
+        return bool(set(phone_keys(value)) & set(phone_keys(current))) or value == current
+    return value == current
+
+
+def _update(doc, fields, now):
+    """UpdateOne con los datos no vacíos de la fila que cambian el cliente, o None"""
+    changes = {}
+    for field, (document_field, _) in DOCUMENT_FIELDS.items():
+        if fields[field] and not _same(field, fields[field], doc.get(document_field)):
+            changes[document_field] = fields[field]
+    if not changes:
+        return None
+    # El cliente queda con los datos de la fila: otra fila del bloque con su
+    # teléfono y otro email ya no se une a él
+    doc.update(changes)
+    changes.update(customer_search_fields(doc.get('name'), doc.get('email'), doc.get('phone')))
+    return UpdateOne({'_id': doc['_id']}, {'$set': {**changes, 'updated_at': now}})
+
+
+def _insert(tenant_id, fields, shopify_id, now):
+    document = {document_field: fields[field] or None for field, (document_field, _) in DOCUMENT_FIELDS.items()}
+    document['address_country'] = document['address_country'] or DEFAULT_COUNTRY
+    document.update(customer_search_fields(fields['name'], fields['email'], fields['phone']))
+    document.update({'source': 'import', 'tags': [], 'total_orders': 0, 'total_spent': 0.0,
+                     'created_at': now, 'updated_at': now})
+    return UpdateOne({'tenant': tenant_id, 'shopify_id': shopify_id}, {'$setOnInsert': document}, upsert=True)
+
+
+def _write(collection, ops, row_numbers):
+    """Escribe el bloque; retorna (creados, actualizados, errores por fila)"""
+    if not ops:
+        return 0, 0, []
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        return result.upserted_count, result.modified_count, []
+    except BulkWriteError as e:
+        details = e.details
+        errors = [f"Fila {row_numbers[err['index']]}: {err.get('errmsg')}" for err in details.get('writeErrors', [])]
+        return details.get('nUpserted', 0), details.get('nModified', 0), errors
+
+
+def import_workbook(stream, tenant, stamp=None):
+    """
+    Importa los clientes del Excel. Retorna {'created', 'updated',
+    'unchanged', 'duplicates', 'total', 'errors'}. Lanza
+    CustomerImportError si falta la columna de nombre.
+    """
+    tenant_id = _as_id(tenant)
+    col_map, rows = _data_rows(stream)
+    collection = ShopifyCustomer._get_collection()
+    now = utc_now()
+    stamp = stamp or int(now.timestamp())
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0, 'total': 0}
+    errors = []
+    seen_emails, seen_phones = set(), set()
+    chunk = []
+
+    def flush():
+        by_email, by_phone = _existing(collection, tenant_id, chunk)
+        ops = []
+        row_numbers = []
+        updated_ids = []
+        for row_number, fields in chunk:
+            doc = _match(fields, by_email, by_phone)
+            if doc is None:
+                op = _insert(tenant_id, fields, f'IMPORT-{row_number}-{stamp}', now)
+            else:
+                op = _update(doc, fields, now)
+                if op is None:
+                    stats['unchanged'] += 1
+                    continue
+                updated_ids.append(doc['_id'])
+            ops.append(op)
+            row_numbers.append(row_number)
+        created, updated, failed = _write(collection, ops, row_numbers)
+        if updated_ids:
+            refresh_account_tokens(tenant_id, updated_ids)
+        stats['created'] += created
+        stats['updated'] += updated
+        errors.extend(failed)
+        chunk.clear()
+
+    for row_number, row in rows:
+        try:
+            fields = parse_row(row, col_map)
+        except RowError as e:
+            errors.append(f'Fila {row_number}: {e}')
+            continue
+        if fields is None:
+            continue
+        stats['total'] += 1
+        if _repeated(fields, seen_emails, seen_phones):
+            stats['duplicates'] += 1
+            continue
+        chunk.append((row_number, fields))
+        if len(chunk) >= CHUNK_ROWS:
+            flush()
+    if chunk:
+        flush()
+    return {**stats, 'errors': errors}
@@ -0,0 +1,388 @@
+"""
+Métricas del dashboard calculadas en MongoDB.
+
+Cada endpoint de `/api/dashboard/*` se resuelve con una agregación por
+colección (`$facet` para obtener todas las secciones en un solo viaje) en
+lugar de recorrer ventas e items en Python:
+
+- `stats_metrics`: serie de ingresos (día o mes con `$dateTrunc`) y totales
+  desde `sales_daily`.
+- `finance_metrics`: comparación mes actual vs anterior, ventas por canal y
+  antigüedad de las ventas impagas (`$bucket`) desde `sales`, usando los
+  totales guardados en cada venta.
+- `operations_metrics`: clientes nuevos, stock crítico, pedidos pendientes y
+  últimas ventas.
+
+Requiere MongoDB 5.0+ (`$dateTrunc`) y que los totales de ventas estén
+calculados (`python scripts/maintenance.py sale-totals`).
+"""
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from app.models import Sale, SalesDaily, Product, InboundOrder, ShopifyCustomer, SALES_CHANNELS
+from app.services.inventory import _as_id
+from app.services.loaders import get_loader
+
+UNPAID_STATUSES = ['pendiente', 'parcial']
+# Límites inferiores (días) de los tramos de antigüedad de ventas impagas
+AGING_BOUNDARIES = [0, 8, 31, 61, 91]
+AGING_LABELS = {0: '0-7', 8: '8-30', 31: '31-60', 61: '61-90', 'over': '90+'}
+
+
+def _pct_change(current, previous):
+    if previous > 0:
+        return (current - previous) / previous * 100
+    return 100.0 if current > 0 else 0
+
+
+def _midnight(d):
+    return datetime.combine(d, datetime.min.time())
+
+
+# ============================================
+# STATS (gráfico de ingresos)
+# ============================================
+def resolve_range(range_type, month_str=None, today=None):
+    """
+    Traduce el parámetro `range` del dashboard a (inicio, fin, agrupación).
+
+    Las fechas son `date` inclusivas. Para 'all_time' el inicio es None: se
+    toma del primer día con ventas.
+    """
+    end_date = today
+    start_date = end_date - timedelta(days=6)
+    group_by = 'day'
+
+    if range_type == 'last_30':
+        start_date = end_date - timedelta(days=29)
+    elif range_type == 'this_month':
+        start_date = end_date.replace(day=1)
+    elif range_type == 'last_month':
+        start_date = (end_date.replace(day=1) - relativedelta(months=1))
+        end_date = end_date.replace(day=1) - timedelta(days=1)
+    elif range_type == 'year':
+        start_date = end_date.replace(month=1, day=1)
+        group_by = 'month'
+    elif range_type == 'last_6_months':
+        start_date = (end_date.replace(day=1) - relativedelta(months=5))
+        group_by = 'month'
+    elif range_type == 'all_time':
+        start_date = None
+        group_by = 'month'
+    elif range_type == 'specific_month':
+        start_date = end_date.replace(day=1)
+        if month_str:
+            try:
+                start_date = datetime.strptime(month_str, '%Y-%m').date()
+                end_date = start_date + relativedelta(months=1) - timedelta(days=1)
+            except ValueError:
+                start_date = end_date.replace(day=1)
+
+    return start_date, end_date, group_by
+
+
+def build_series(values, start_date, end_date, group_by):
+    """
+    Arma etiquetas, valores y claves del gráfico rellenando con 0 los
+    días/meses sin ventas. `values` es {date: ingresos} (primer día del mes
+    si la agrupación es mensual).
+    """
+    labels, series, keys = [], [], []
+    if group_by == 'day':
+        for i in range((end_date - start_date).days + 1):
+            d = start_date + timedelta(days=i)
+            labels.append(d.strftime('%d/%m'))
+            series.append(values.get(d, 0))
+            keys.append(d.strftime('%Y-%m-%d'))
+    else:
+        curr = start_date
+        while curr <= end_date:
+            labels.append(curr.strftime('%B'))
+            series.append(values.get(curr, 0))
+            keys.append(curr.strftime('%Y-%m'))
+            curr = curr + relativedelta(months=1)
+    return {'labels': labels, 'values': series, 'keys': keys}
+
+
+def stats_metrics(tenant, range_type='last_7', month_str=None, today=None):
+    """Totales y serie de ingresos del dashboard en una sola agregación sobre sales_daily"""
+    today = today or datetime.utcnow().date()
+    start_date, end_date, group_by = resolve_range(range_type, month_str, today)
+
+    series_match = {}
+    if start_date is not None:
+        series_match['day'] = {'$gte': _midnight(start_date), '$lt': _midnight(end_date + timedelta(days=1))}
+
+    pipeline = [
+        {'$match': {'tenant': _as_id(tenant)}},
+        {'$facet': {
+            'totals': [
+                {'$group': {'_id': None, 'sales': {'$sum': '$sales_count'}, 'revenue': {'$sum': '$revenue'}}},
+            ],
+            'first_day': [
+                {'$match': {'sales_count': {'$gt': 0}}},
+                {'$sort': {'day': 1}},
+                {'$limit': 1},
+                {'$project': {'_id': 0, 'day': 1}},
+            ],
+            'series': [
+                {'$match': series_match},
+                {'$group': {
+                    '_id': {'$dateTrunc': {'date': '$day', 'unit': group_by}},
+                    'revenue': {'$sum': '$revenue'},
+                }},
+            ],
+        }},
+    ]
+    result = next(SalesDaily._get_collection().aggregate(pipeline), {})
+    totals = (result.get('totals') or [{}])[0]
+
+    if start_date is None:
+        first = result.get('first_day') or []
+        start_date = first[0]['day'].date().replace(day=1) if first else end_date.replace(day=1)
+
+    values = {row['_id'].date(): row['revenue'] for row in result.get('series', [])}
+    return {
+        'total_sales': totals.get('sales', 0),
+        'total_revenue': totals.get('revenue', 0),
+        'chart_data': build_series(values, start_date, end_date, group_by),
+    }
+
+
+# ============================================
+# FINANZAS
+# ============================================
+def finance_metrics(tenant, now=None):
+    """Comparación mensual, ventas por canal y cuentas por cobrar en un solo $facet"""
+    now = now or datetime.utcnow()
+    current_month_start = _midnight(now.date().replace(day=1))
+    next_month = current_month_start + relativedelta(months=1)
+    prev_month_start = current_month_start - relativedelta(months=1)
+
+    revenue = {'$ifNull': ['$total_amount', 0]}
+    in_current_month = {'date_created': {'$gte': current_month_start, '$lt': next_month}}
+    unpaid_stages = [
+        {'$match': {'payment_status': {'$in': UNPAID_STATUSES}}},
+        {'$addFields': {
+            'pending': {'$subtract': [revenue, {'$ifNull': ['$total_paid', 0]}]},
+            'days_old': {'$cond': [
+                {'$ifNull': ['$date_created', False]},
+                {'$floor': {'$divide': [{'$subtract': [now, '$date_created']}, 86400000]}},
+                0
+            ]},
+        }},
+        {'$match': {'pending': {'$gt': 0}}},
+    ]
+
+    pipeline = [
+        {'$match': {
+            'tenant': _as_id(tenant),
+            '$or': [
+                {'date_created': {'$gte': prev_month_start, '$lt': next_month}},
+                {'payment_status': {'$in': UNPAID_STATUSES}},
+            ],
+        }},
+        {'$facet': {
+            'months': [
+                {'$match': {'date_created': {'$gte': prev_month_start, '$lt': next_month}}},
+                {'$group': {
+                    '_id': {'$cond': [{'$gte': ['$date_created', current_month_start]}, 'current', 'prev']},
+                    'count': {'$sum': 1},
+                    'revenue': {'$sum': revenue},
+                }},
+            ],
+            'by_channel': [
+                {'$match': in_current_month},
+                {'$group': {'_id': '$sales_channel', 'count': {'$sum': 1}, 'revenue': {'$sum': revenue}}},
+            ],
+            'unpaid': unpaid_stages + [
+                {'$group': {
+                    '_id': None,
+                    'count': {'$sum': 1},
+                    'total_pending': {'$sum': '$pending'},
+                    'avg_age': {'$avg': '$days_old'},
+                }},
+            ],
+            'oldest_unpaid': unpaid_stages + [
+                {'$sort': {'date_created': 1, '_id': 1}},
+                {'$limit': 5},
+                {'$project': {
+                    'customer_name': 1, 'payment_status': 1,
+                    'total_amount': revenue, 'pending': 1, 'days_old': 1,
+                }},
+            ],
+            'aging': unpaid_stages + [
+                {'$bucket': {
+                    'groupBy': '$days_old',
+                    'boundaries': AGING_BOUNDARIES,
+                    'default': 'over',
+                    'output': {'count': {'$sum': 1}, 'total': {'$sum': '$pending'}},
+                }},
+            ],
+        }},
+    ]
+    result = next(Sale._get_collection().aggregate(pipeline, allowDiskUse=True), {})
+
+    months = {row['_id']: row for row in result.get('months', [])}
+    current = months.get('current', {})
+    prev = months.get('prev', {})
+    current_count, prev_count = current.get('count', 0), prev.get('count', 0)
+    current_revenue, prev_revenue = current.get('revenue', 0), prev.get('revenue', 0)
+
+    channels = {row['_id']: row for row in result.get('by_channel', [])}
+    by_channel = {
+        key: {'count': channels.get(key, {}).get('count', 0), 'revenue': channels.get(key, {}).get('revenue', 0)}
+        for key in SALES_CHANNELS
+    }
+
+    unpaid = (result.get('unpaid') or [{}])[0]
+    buckets = {row['_id']: row for row in result.get('aging', [])}
+    aging = [
+        {
+            'range': AGING_LABELS[key],
+            'count': buckets.get(key, {}).get('count', 0),
+            'total': buckets.get(key, {}).get('total', 0),
+        }
+        for key in AGING_BOUNDARIES[:-1] + ['over']
+    ]
+
+    return {
+        'comparison': {
+            'current_month_sales': current_count,
+            'current_month_revenue': current_revenue,
+            'prev_month_sales': prev_count,
+            'prev_month_revenue': prev_revenue,
+            'sales_change_pct': round(_pct_change(current_count, prev_count), 1),
+            'revenue_change_pct': round(_pct_change(current_revenue, prev_revenue), 1)
+        },
+        'by_channel': by_channel,
+        'pending_payments': {
+            'total_pending': unpaid.get('total_pending', 0),
+            'count': unpaid.get('count', 0),
+            'avg_age_days': round(unpaid.get('avg_age') or 0, 1),
+            'oldest_unpaid': [
+                {
+                    'id': str(row['_id']),
+                    'customer': row.get('customer_name') or 'Sin nombre',
+                    'total': row['total_amount'],
+                    'pending': row['pending'],
+                    'days_old': int(row['days_old']),
+                    'status': row.get('payment_status')
+                }
+                for row in result.get('oldest_unpaid', [])
+            ],
+            'aging': aging
+        }
+    }
+
+
+# ============================================
+# OPERACIONES
+# ============================================
+def _new_customers(tenant, now):
+    current_month_start = _midnight(now.date().replace(day=1))
+    next_month = current_month_start + relativedelta(months=1)
+    prev_month_start = current_month_start - relativedelta(months=1)
+
+    pipeline = [
+        {'$match': {'tenant': _as_id(tenant), 'created_at': {'$gte': prev_month_start, '$lt': next_month}}},
+        {'$group': {
+            '_id': {'$cond': [{'$gte': ['$created_at', current_month_start]}, 'current', 'prev']},
+            'count': {'$sum': 1},
+        }},
+    ]
+    counts = {row['_id']: row['count'] for row in ShopifyCustomer._get_collection().aggregate(pipeline)}
+    current, prev = counts.get('current', 0), counts.get('prev', 0)
+    return {
+        'current_month': current,
+        'prev_month': prev,
+        'change_pct': round(_pct_change(current, prev), 1)
+    }
+
+
+def _critical_stock(tenant):
+    """Productos en o bajo su stock crítico (los que no tienen contador se suman desde lotes)"""
+    critical = {'$ifNull': ['$critical_stock', 10]}
+    project = {'name': 1, 'sku': 1, 'critical': critical, 'stock': 1}
+    pipeline = [
+        {'$match': {'tenant': _as_id(tenant)}},
+        {'$facet': {
+            'counted': [
+                {'$match': {'stock_current': {'$type': 'number'}}},
+                {'$addFields': {'stock': '$stock_current'}},
+                {'$match': {'$expr': {'$lte': ['$stock', critical]}}},
+                {'$project': project},
+            ],
+            'uncounted': [
+                {'$match': {'stock_current': None}},
+                {'$lookup': {
+                    'from': 'lots',
+                    'let': {'product_id': '$_id'},
+                    'pipeline': [
+                        {'$match': {'$expr': {'$and': [
+                            {'$eq': ['$product', '$$product_id']},
+                            {'$gt': ['$quantity_current', 0]},
+                        ]}}},
+                        {'$group': {'_id': None, 'total': {'$sum': '$quantity_current'}}},
+                    ],
+                    'as': 'lot_stock',
+                }},
+                {'$addFields': {'stock': {'$ifNull': [{'$first': '$lot_stock.total'}, 0]}}},
+                {'$match': {'$expr': {'$lte': ['$stock', critical]}}},
+                {'$project': project},
+            ],
+        }},
+    ]
+    result = next(Product._get_collection().aggregate(pipeline), {})
+    rows = sorted(result.get('counted', []) + result.get('uncounted', []), key=lambda r: r['_id'])
+    return [
+        {
+            'id': str(row['_id']),
+            'name': row.get('name'),
+            'stock': row['stock'],
+            'critical': row['critical'],
+            'sku': row.get('sku') or ''
+        }
+        for row in rows
+    ]
+
+
+def operations_metrics(tenant, now=None):
+    """Clientes nuevos, stock crítico, pedidos pendientes y últimas ventas"""
+    now = now or datetime.utcnow()
+
+    loader = get_loader()
+    orders = list(InboundOrder.objects(tenant=tenant, status='pending').order_by('-created_at').limit(10))
+    loader.resolve(orders, 'supplier')
+    pending_orders = []
+    for order in orders:
+        supplier_name = order.supplier_name or (order.supplier.name if order.supplier else None)
+        pending_orders.append({
+            'id': str(order.id),
+            'supplier': supplier_name or 'Sin proveedor',
+            'status': order.status,
+            'created_at': order.created_at.strftime('%Y-%m-%d') if order.created_at else '',
+            'total': float(order.total) if order.total else 0
+        })
+
+    recent_sales = []
+    sales = list(Sale.objects(tenant=tenant).order_by('-date_created').limit(10))
+    # Ventas sin totales guardados: sus items se cargan en una consulta
+    loader.prefetch_sale_items([s for s in sales if s.amount_total is None], with_products=False)
+    for sale in sales:
+        recent_sales.append({
+            'id': str(sale.id),
+            'customer': sale.customer_name or 'Sin nombre',
+            'total': sale.total_amount,
+            'status': sale.status,
+            'channel': sale.sales_channel or 'manual',
+            'date': sale.date_created.strftime('%Y-%m-%d') if sale.date_created else ''
+        })
+
+    return {
+        'new_customers': _new_customers(tenant, now),
+        'critical_stock': _critical_stock(tenant),
+        'pending_orders': pending_orders,
+        'recent_sales': recent_sales
+    }
@@ -0,0 +1,282 @@
+"""
+Registro central de índices de MongoDB.
+
+Los modelos tienen `auto_create_index: False`: en vez de que cada worker de
+gunicorn ejecute `create_index` en el primer acceso a cada colección, los
+índices se crean offline con:
+
+    python scripts/maintenance.py indexes --diff     # muestra diferencias
+    python scripts/maintenance.py indexes --apply    # crea los faltantes
+
+`INDEXES` agrupa los índices compuestos por colección. Casi todos empiezan por
+`tenant` (todas las consultas de la app filtran por tenant); los parciales
+cubren solo los documentos que la consulta puede devolver (lotes con stock,
+ventas con pedido de Shopify). Los índices simples declarados en
+`meta['indexes']` de cada modelo se siguen respetando.
+
+`collscan_report` resume las consultas que el profiler de MongoDB registró
+recorriendo la colección completa.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from mongoengine import Document
+from mongoengine.base.common import _document_registry
+
+WITH_STOCK = {'quantity_current': {'$gt': 0}}
+
+INDEXES = {
+    'products': [
+        IndexModel([('tenant', ASCENDING), ('sku', ASCENDING)], name='tenant_sku'),
+        IndexModel([('tenant', ASCENDING), ('name', ASCENDING)], name='tenant_name'),
+        IndexModel([('tenant', ASCENDING), ('category', ASCENDING)], name='tenant_category'),
+        IndexModel([('tenant', ASCENDING), ('shopify_id', ASCENDING)], name='tenant_shopify_id',
+                   partialFilterExpression={'shopify_id': {'$type': 'string'}}),
+        # Búsqueda por prefijos de nombre/SKU (ver app.services.search)
+        IndexModel([('tenant', ASCENDING), ('search_tokens', ASCENDING)], name='tenant_search_tokens'),
+    ],
+    'product_bundles': [
+        IndexModel([('tenant', ASCENDING), ('bundle', ASCENDING)], name='tenant_bundle'),
+        IndexModel([('component', ASCENDING)], name='component'),
+    ],
+    'lots': [
+        IndexModel([('product', ASCENDING), ('quantity_current', ASCENDING)], name='product_quantity'),
+        # Orden FIFO de StockAllocation.deduct
+        IndexModel([('product', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)],
+                   name='product_fifo_with_stock', partialFilterExpression=WITH_STOCK),
+        IndexModel([('tenant', ASCENDING), ('expiry_date', ASCENDING)],
+                   name='tenant_expiry_with_stock', partialFilterExpression=WITH_STOCK),
+        IndexModel([('order', ASCENDING)], name='order'),
+    ],
+    'sales': [
+        # Listados paginados por cursor: (campo de orden, _id), ver app.services.pagination
+        IndexModel([('tenant', ASCENDING), ('date_created', DESCENDING), ('_id', DESCENDING)],
+                   name='tenant_date'),
+        IndexModel([('tenant', ASCENDING), ('payment_status', ASCENDING), ('date_created', DESCENDING)],
+                   name='tenant_payment_status_date'),
+        IndexModel([('tenant', ASCENDING), ('delivery_status', ASCENDING), ('date_created', DESCENDING)],
+                   name='tenant_delivery_status_date'),
+        IndexModel([('tenant', ASCENDING), ('sales_channel', ASCENDING), ('date_created', DESCENDING)],
+                   name='tenant_channel_date'),
+        IndexModel([('tenant', ASCENDING), ('shopify_order_id', ASCENDING)], name='tenant_shopify_order',
+                   partialFilterExpression={'shopify_order_id': {'$type': 'string'}}),
+    ],
+    'sale_items': [
+        IndexModel([('sale', ASCENDING)], name='sale'),
+        IndexModel([('product', ASCENDING)], name='product'),
+    ],
+    'wastages': [
+        IndexModel([('tenant', ASCENDING), ('date_created', DESCENDING)], name='tenant_date'),
+        IndexModel([('product', ASCENDING)], name='product'),
+    ],
+    'payments': [
+        IndexModel([('tenant', ASCENDING), ('date_created', DESCENDING)], name='tenant_date'),
+    ],
+    'shopify_orders': [
+        IndexModel([('tenant', ASCENDING), ('shopify_id', ASCENDING)], name='tenant_shopify_id'),
+    ],
+    'bank_transactions': [
+        IndexModel([('tenant', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='tenant_date'),
+        IndexModel([('tenant', ASCENDING), ('status', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)],
+                   name='tenant_status_date'),
+        # Estadísticas de conciliación sin leer documentos (índice cubriente)
+        IndexModel([('tenant', ASCENDING), ('status', ASCENDING), ('transaction_type', ASCENDING),
+                    ('amount', ASCENDING)], name='tenant_status_type_amount'),
+        # Anti-join de ventas sin conciliar ($lookup por matched_sale)
+        IndexModel([('matched_sale', ASCENDING), ('status', ASCENDING)], name='matched_sale_status'),
+        # Deduplicación de cartolas importadas (ver app.services.bank_import)
+        IndexModel([('tenant', ASCENDING), ('fingerprint', ASCENDING)], name='tenant_fingerprint', unique=True,
+                   partialFilterExpression={'fingerprint': {'$type': 'string'}}),
+    ],
+    'shopify_customers': [
+        IndexModel([('tenant', ASCENDING), ('total_spent', DESCENDING), ('_id', DESCENDING)],
+                   name='tenant_total_spent'),
+        # Upserts de la sincronización (ver app.services.shopify)
+        IndexModel([('tenant', ASCENDING), ('shopify_id', ASCENDING)], name='tenant_shopify_id',
+                   partialFilterExpression={'shopify_id': {'$type': 'string'}}),
+        # Búsqueda (ver app.services.search): igualdad sobre el token y ya ordenado por total_spent
+        IndexModel([('tenant', ASCENDING), ('search_tokens', ASCENDING), ('total_spent', DESCENDING),
+                    ('_id', DESCENDING)], name='tenant_search_total_spent'),
+        IndexModel([('tenant', ASCENDING), ('phone_keys', ASCENDING)], name='tenant_phone_keys'),
+        # Coincidencias por email de la importación Excel (ver app.services.customer_import)
+        IndexModel([('tenant', ASCENDING), ('email', ASCENDING)], name='tenant_email'),
+    ],
+    'activity_logs': [
+        IndexModel([('tenant', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='tenant_created'),
+    ],
+    'jobs': [
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)], name='status_created'),
+        IndexModel([('tenant', ASCENDING), ('status', ASCENDING), ('started_at', ASCENDING)],
+                   name='tenant_status_started'),
+    ],
+    # Backend compartido de app.services.cache (sin modelo)
+    'api_cache': [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+        IndexModel([('tenant', ASCENDING)], name='tenant'),
+    ],
+}
+
+
+def _document_classes():
+    """Modelos concretos registrados en MongoEngine (incluye los definidos en blueprints)"""
+    classes = []
+    for cls in _document_registry.values():
+        if issubclass(cls, Document) and not cls._meta.get('abstract') and cls._meta.get('collection'):
+            classes.append(cls)
+    return sorted(classes, key=lambda c: c._get_collection_name())
+
+
+INDEX_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+def _key(spec):
+    return tuple((field, int(direction) if isinstance(direction, float) else direction)
+                 for field, direction in spec)
+
+
+def _options(spec):
+    # unique/sparse en False equivalen a no declararlos
+    return {k: spec[k] for k in INDEX_OPTIONS if spec.get(k)}
+
+
+def wanted_indexes():
+    """
+    Índices esperados por colección: {colección: [(nombre, key, opciones)]}.
+
+    Incluye los de `meta['indexes']` de cada modelo (nombre None = el que
+    asigne MongoDB) y los del registro.
+    """
+    wanted = {}
+    for cls in _document_classes():
+        collection = cls._get_collection_name()
+        for spec in cls._meta.get('index_specs') or []:
+            options = _options(spec)
+            wanted.setdefault(collection, []).append((spec.get('name'), _key(spec['fields']), options))
+    for collection, models in INDEXES.items():
+        for model in models:
+            document = model.document
+            options = _options(document)
+            wanted.setdefault(collection, []).append((document['name'], _key(document['key'].items()), options))
+    return wanted
+
+
+def index_diff(database):
+    """
+    Compara los índices existentes con los esperados.
+
+    Retorna {colección: {'missing': [...], 'changed': [...], 'extra': [...]}}
+    solo para las colecciones con diferencias. Un índice está "changed" si
+    existe uno con el mismo nombre o las mismas claves pero distintas opciones.
+    """
+    existing_collections = set(database.list_collection_names())
+    diff = {}
+    for collection, wanted in wanted_indexes().items():
+        current = {}
+        if collection in existing_collections:
+            current = database[collection].index_information()
+        by_key = {_key(info['key']): name for name, info in current.items()}
+        matched = {'_id_'}
+        missing, changed = [], []
+        for name, key, options in wanted:
+            existing_name = name if name in current else by_key.get(key)
+            if existing_name is None:
+                missing.append((name, key, options))
+                continue
+            matched.add(existing_name)
+            info = current[existing_name]
+            current_options = _options(info)
+            if _key(info['key']) != key or current_options != options:
+                changed.append((existing_name, key, options))
+        extra = sorted(name for name in current if name not in matched)
+        if missing or changed or extra:
+            diff[collection] = {'missing': missing, 'changed': changed, 'extra': extra}
+    return diff
+
+
+def apply_indexes(database, drop_changed=False):
+    """
+    Crea los índices faltantes. Con `drop_changed` también reemplaza los que
+    difieren en opciones (no elimina índices "extra"). Retorna la cantidad
+    de índices creados.
+    """
+    created = 0
+    for collection, changes in index_diff(database).items():
+        if drop_changed:
+            for name, key, options in changes['changed']:
+                database[collection].drop_index(name)
+                changes['missing'].append((name, key, options))
+        for name, key, options in changes['missing']:
+            kwargs = dict(options)
+            if name:
+                kwargs['name'] = name
+            database[collection].create_index(list(key), background=True, **kwargs)
+            created += 1
+    return created
+
+
+# ============================================
+# PROFILER
+# ============================================
+def query_shape(value):
+    """Reemplaza los valores de un filtro por 1, conservando campos y operadores"""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = [query_shape(v) for v in value]
+        if all(not isinstance(s, (dict, list)) for s in shapes):
+            return 1
+        return shapes
+    return 1
+
+
+def _profile_filter(entry):
+    command = entry.get('command') or {}
+    if 'filter' in command:
+        return command['filter']
+    if 'q' in command:
+        return command['q']
+    if 'pipeline' in command:
+        for stage in command['pipeline']:
+            if '$match' in stage:
+                return stage['$match']
+    return command.get('query') or entry.get('query') or {}
+
+
+def collscan_report(database, limit=50):
+    """
+    Agrupa las entradas de `system.profile` con plan COLLSCAN por
+    (colección, operación, forma del filtro).
+
+    Retorna una lista de dicts ordenada por tiempo total, con count,
+    total_ms, max_ms y docs_examined.
+    """
+    groups = {}
+    cursor = database['system.profile'].find(
+        {'planSummary': {'$regex': 'COLLSCAN'}},
+        {'ns': 1, 'op': 1, 'command': 1, 'query': 1, 'millis': 1, 'docsExamined': 1}
+    )
+    for entry in cursor:
+        ns = entry.get('ns', '')
+        if ns.endswith('.system.profile'):
+            continue
+        shape = query_shape(_profile_filter(entry))
+        key = (ns, entry.get('op'), repr(shape))
+        group = groups.setdefault(key, {
+            'ns': ns, 'op': entry.get('op'), 'shape': shape,
+            'count': 0, 'total_ms': 0, 'max_ms': 0, 'docs_examined': 0,
+        })
+        millis = entry.get('millis') or 0
+        group['count'] += 1
+        group['total_ms'] += millis
+        group['max_ms'] = max(group['max_ms'], millis)
+        group['docs_examined'] += entry.get('docsExamined') or 0
+    return sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)[:limit]
+
+
+def set_profiling(database, level, slowms=None):
+    """Activa (1 = solo lentas, 2 = todas) o desactiva (0) el profiler"""
+    kwargs = {'slowms': slowms} if slowms is not None else {}
+    try:
+        return database.command('profile', level, **kwargs)
+    except OperationFailure as e:
+        raise RuntimeError(f'No se pudo configurar el profiler: {e}') from e
@@ -0,0 +1,418 @@
+"""
+Inventario: contadores de stock materializados y asignación FIFO de lotes.
+
+El stock real sigue siendo la suma de `Lot.quantity_current`, pero cada
+producto guarda una copia en `Product.stock_current` (y cada tenant el total
+de unidades en `Tenant.stock_units`) para no recorrer los lotes en cada
+lectura. Todo camino que modifica lotes debe llamar a `adjust_stock` con la
+variación aplicada.
+
+Los descuentos de stock (ventas, mermas, ajustes, armado de kits) pasan por
+`StockAllocation`, que descuenta lote a lote en orden FIFO con `$inc`
+condicionado a `quantity_current >= n`, de modo que dos workers concurrentes
+nunca dejan un lote en negativo.
+"""
+import random
+import time
+
+from bson import ObjectId, DBRef
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import PyMongoError
+
+from app.models import Product, Lot, Tenant
+from app.services.cache import invalidate
+
+
+def _as_id(value):
+    """Retorna el ObjectId de un documento, DBRef o id en string"""
+    if value is None:
+        return None
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, DBRef):
+        return value.id
+    if hasattr(value, 'pk'):
+        return value.pk
+    return ObjectId(str(value))
+
+
+def lot_stock(product, session=None):
+    """Suma quantity_current de los lotes del producto (fuente de verdad)"""
+    pipeline = [
+        {'$match': {'product': _as_id(product), 'quantity_current': {'$gt': 0}}},
+        {'$group': {'_id': None, 'total': {'$sum': '$quantity_current'}}},
+    ]
+    result = list(Lot._get_collection().aggregate(pipeline, session=session))
+    return int(result[0]['total']) if result else 0
+
+
+def refresh_stock(product, session=None):
+    """Recalcula el contador de un producto desde sus lotes"""
+    product_id = _as_id(product)
+    stock = lot_stock(product_id, session=session)
+    Product._get_collection().update_one(
+        {'_id': product_id}, {'$set': {'stock_current': stock}}, session=session
+    )
+    return stock
+
+
+def adjust_stock(product, delta, tenant=None, session=None):
+    """
+    Aplica `delta` unidades al contador del producto y de su tenant.
+
+    Usa $inc atómico. Si el producto todavía no tiene contador (datos
+    anteriores a la migración) se recalcula desde los lotes, que ya incluyen
+    el cambio.
+    """
+    delta = int(delta or 0)
+    if not delta:
+        return
+    product_id = _as_id(product)
+
+    result = Product._get_collection().update_one(
+        {'_id': product_id, 'stock_current': {'$type': 'number'}},
+        {'$inc': {'stock_current': delta}},
+        session=session
+    )
+    if result.matched_count == 0:
+        refresh_stock(product_id, session=session)
+
+    if tenant is None and isinstance(product, Product):
+        tenant = product._data.get('tenant')
+    adjust_tenant_stock(tenant, delta, session=session)
+
+
+def adjust_tenant_stock(tenant, delta, session=None):
+    """Aplica `delta` unidades a `Tenant.stock_units` e invalida el caché del tenant"""
+    tenant_id = _as_id(tenant)
+    if not tenant_id or not delta:
+        return
+    invalidate(tenant_id)
+    # Sin contador de tenant se espera al próximo rebuild
+    Tenant._get_collection().update_one(
+        {'_id': tenant_id, 'stock_units': {'$type': 'number'}},
+        {'$inc': {'stock_units': int(delta)}},
+        session=session
+    )
+
+
+def rebuild_stock_counters(tenant=None):
+    """
+    Reconstruye los contadores de stock desde `lots` con una sola agregación.
+
+    Retorna un dict con la cantidad de productos y tenants actualizados.
+    """
+    match = {'quantity_current': {'$gt': 0}}
+    product_filter = {}
+    if tenant is not None:
+        match['tenant'] = _as_id(tenant)
+        product_filter['tenant'] = _as_id(tenant)
+
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': '$product',
+            'tenant': {'$first': '$tenant'},
+            'total': {'$sum': '$quantity_current'},
+        }},
+    ]
+    by_product = {}
+    by_tenant = {}
+    for row in Lot._get_collection().aggregate(pipeline, allowDiskUse=True):
+        by_product[row['_id']] = int(row['total'])
+        if row.get('tenant'):
+            by_tenant[row['tenant']] = by_tenant.get(row['tenant'], 0) + int(row['total'])
+
+    products = Product._get_collection()
+    ops = []
+    updated = 0
+    for doc in products.find(product_filter, {'_id': 1}):
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'stock_current': by_product.get(doc['_id'], 0)}}))
+        if len(ops) >= 1000:
+            updated += products.bulk_write(ops, ordered=False).matched_count
+            ops = []
+    if ops:
+        updated += products.bulk_write(ops, ordered=False).matched_count
+
+    tenant_ids = [_as_id(tenant)] if tenant is not None else [t['_id'] for t in Tenant._get_collection().find({}, {'_id': 1})]
+    tenant_ops = [UpdateOne({'_id': tid}, {'$set': {'stock_units': by_tenant.get(tid, 0)}}) for tid in tenant_ids]
+    if tenant_ops:
+        Tenant._get_collection().bulk_write(tenant_ops, ordered=False)
+
+    return {'products': updated, 'tenants': len(tenant_ops)}
+
+
+# ============================================
+# ASIGNACIÓN FIFO
+# ============================================
+class InventoryError(Exception):
+    """Error base de inventario"""
+
+
+class InsufficientStockError(InventoryError):
+    """No hay stock suficiente en los lotes para cubrir la cantidad pedida"""
+
+    def __init__(self, product, requested, available, message=None):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        name = getattr(product, 'name', None) or str(_as_id(product))
+        if message:
+            text = message.format(name=name, requested=requested, available=available)
+        else:
+            text = f'Stock insuficiente para {name}. Disponible: {available}, Solicitado: {requested}'
+        super().__init__(text)
+
+
+class StockConflictError(InventoryError):
+    """La transacción chocó con otra escritura concurrente; se puede reintentar"""
+
+    def __init__(self, message='El inventario fue modificado por otra operación, intente nuevamente'):
+        super().__init__(message)
+
+
+_transaction_support = {}
+
+
+def transactions_supported():
+    """True si el servidor acepta transacciones multi-documento (replica set o mongos)"""
+    client = Lot._get_collection().database.client
+    key = id(client)
+    if key not in _transaction_support:
+        try:
+            hello = client.admin.command('hello')
+            _transaction_support[key] = bool(hello.get('setName') or hello.get('msg') == 'isdbgrid')
+        except PyMongoError:
+            _transaction_support[key] = False
+    return _transaction_support[key]
+
+
+class StockAllocation:
+    """
+    Descuenta stock de varios productos como una sola operación.
+
+    Uso:
+        with StockAllocation(tenant) as allocation:
+            allocation.deduct(product, 3)
+            allocation.deduct(component, 6)
+
+    Si el servidor soporta transacciones, todo ocurre dentro de una, que se
+    repite con backoff ante conflictos con otras ventas; `Tenant.stock_units`
+    se actualiza recién después del commit, fuera de la sesión. Si no,
+    cada lote se descuenta con un $inc condicionado y, ante un error, los
+    descuentos ya aplicados se compensan con el $inc inverso. Cualquier
+    excepción dentro del bloque revierte la asignación completa; `cancel()`
+    la revierte de forma explícita, incluso después de confirmada (por
+    ejemplo si falla el guardado de la venta).
+    """
+
+    MAX_PASSES = 10
+    # Reintentos de la transacción ante WriteConflict y commits inciertos
+    MAX_RETRIES = 8
+    BACKOFF_BASE = 0.01
+    BACKOFF_MAX = 0.5
+
+    def __init__(self, tenant=None, use_transaction=None):
+        self.tenant = tenant
+        self.use_transaction = transactions_supported() if use_transaction is None else use_transaction
+        self.session = None
+        self.applied = []  # (lot_id, product_id, tenant_id, cantidad)
+        self.requests = []  # (producto, cantidad, mensaje) para repetir la transacción
+        self.tenant_deltas = {}  # tenant_id -> unidades, se aplican después del commit
+        self.state = 'open'  # open, committed, cancelled
+
+    def __enter__(self):
+        if self.use_transaction:
+            client = Lot._get_collection().database.client
+            self.session = client.start_session()
+            self.session.start_transaction()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.state != 'open':
+            return False
+        if exc_type is not None:
+            self.cancel()
+            return False
+        self.commit()
+        return False
+
+    def deduct(self, product, quantity, message=None):
+        """
+        Descuenta `quantity` unidades del producto en orden FIFO.
+
+        Retorna la lista de (lot_id, cantidad) descontados. Si no alcanza el
+        stock lanza InsufficientStockError sin dejar descuentos parciales de
+        este producto. Dentro de una transacción, un WriteConflict con otra
+        venta aborta la transacción y la repite completa (como
+        `with_transaction`); StockConflictError solo se lanza si se agotan
+        los reintentos.
+        """
+        quantity = int(quantity)
+        if quantity <= 0:
+            return []
+        if self.session is None:
+            return self._deduct(product, quantity, message)
+
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                if attempt:
+                    self._restart(attempt)
+                taken = self._deduct(product, quantity, message)
+                break
+            except PyMongoError as e:
+                if not e.has_error_label('TransientTransactionError'):
+                    raise
+                if attempt + 1 >= self.MAX_RETRIES:
+                    raise StockConflictError() from e
+        self.requests.append((product, quantity, message))
+        return taken
+
+    def _deduct(self, product, quantity, message):
+        product_id = _as_id(product)
+        lots = Lot._get_collection()
+        taken = []
+        remaining = quantity
+
+        for _ in range(self.MAX_PASSES):
+            candidates = list(lots.find(
+                {'product': product_id, 'quantity_current': {'$gt': 0}},
+                {'quantity_current': 1},
+                sort=[('created_at', ASCENDING), ('_id', ASCENDING)],
+                session=self.session
+            ))
+            available = sum(lot['quantity_current'] for lot in candidates)
+            if available < remaining:
+                self._undo(taken, product_id)
+                raise InsufficientStockError(product, quantity, quantity - remaining + available, message)
+
+            for lot in candidates:
+                if remaining <= 0:
+                    break
+                take = min(lot['quantity_current'], remaining)
+                result = lots.update_one(
+                    {'_id': lot['_id'], 'quantity_current': {'$gte': take}},
+                    {'$inc': {'quantity_current': -take}},
+                    session=self.session
+                )
+                if result.modified_count:
+                    taken.append((lot['_id'], take))
+                    remaining -= take
+                # Si otro worker ganó el lote se vuelve a leer en la siguiente pasada
+
+            if remaining <= 0:
+                break
+        else:
+            self._undo(taken, product_id)
+            raise StockConflictError()
+
+        tenant_id = _as_id(self._tenant_for(product))
+        if self.session is None:
+            adjust_stock(product_id, -quantity, tenant=tenant_id)
+        else:
+            # El contador del tenant es un solo documento que tocan todas las
+            # ventas: dentro de la transacción sería un WriteConflict seguro
+            adjust_stock(product_id, -quantity, session=self.session)
+            if tenant_id:
+                self.tenant_deltas[tenant_id] = self.tenant_deltas.get(tenant_id, 0) - quantity
+
+        self.applied.extend((lot_id, product_id, tenant_id, qty) for lot_id, qty in taken)
+        return taken
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt)))
+
+    def _restart(self, attempt):
+        """Aborta la transacción, espera y la repite con los descuentos ya pedidos"""
+        if self.session.in_transaction:
+            self.session.abort_transaction()
+        self._backoff(attempt)
+        self.applied = []
+        self.tenant_deltas = {}
+        self.session.start_transaction()
+        for product, quantity, message in self.requests:
+            self._deduct(product, quantity, message)
+
+    def commit(self):
+        if self.state != 'open':
+            return
+        self.state = 'committed'
+        if self.session is None:
+            return
+        try:
+            self._commit_with_retry()
+        except PyMongoError as e:
+            # La transacción no se aplicó: no hay nada que compensar
+            self.state = 'cancelled'
+            self.applied = []
+            if e.has_error_label('TransientTransactionError') or e.has_error_label('UnknownTransactionCommitResult'):
+                raise StockConflictError() from e
+            raise
+        except InventoryError:
+            self.state = 'cancelled'
+            self.applied = []
+            raise
+        finally:
+            self.session.end_session()
+
+        for tenant_id, delta in self.tenant_deltas.items():
+            adjust_tenant_stock(tenant_id, delta)
+        self.tenant_deltas = {}
+
+    def _commit_with_retry(self):
+        """
+        Confirma la transacción. Un commit de resultado incierto se repite
+        tal cual; uno que falló por conflicto repite la transacción completa.
+        """
+        restart = False
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                if restart:
+                    restart = False
+                    self._restart(attempt)
+                self.session.commit_transaction()
+                return
+            except PyMongoError as e:
+                if attempt + 1 >= self.MAX_RETRIES:
+                    raise
+                if e.has_error_label('UnknownTransactionCommitResult'):
+                    self._backoff(attempt)
+                    continue
+                if not e.has_error_label('TransientTransactionError'):
+                    raise
+                restart = True
+
+    def cancel(self):
+        """Revierte todos los descuentos de esta asignación"""
+        if self.state == 'cancelled':
+            return
+        was_open = self.state == 'open'
+        self.state = 'cancelled'
+        if was_open and self.session is not None:
+            try:
+                self.session.abort_transaction()
+            finally:
+                self.session.end_session()
+            self.applied = []
+            return
+        by_product = {}
+        for lot_id, product_id, tenant_id, qty in self.applied:
+            Lot._get_collection().update_one({'_id': lot_id}, {'$inc': {'quantity_current': qty}})
+            by_product[(product_id, tenant_id)] = by_product.get((product_id, tenant_id), 0) + qty
+        for (product_id, tenant_id), qty in by_product.items():
+            adjust_stock(product_id, qty, tenant=tenant_id)
+        self.applied = []
+
+    def _undo(self, taken, product_id):
+        """Devuelve los descuentos parciales de un deduct que no se completó"""
+        for lot_id, qty in taken:
+            Lot._get_collection().update_one(
+                {'_id': lot_id}, {'$inc': {'quantity_current': qty}}, session=self.session
+            )
+
+    def _tenant_for(self, product):
+        if self.tenant is not None:
+            return self.tenant
+        if isinstance(product, Product):
+            return product._data.get('tenant')
+        return None
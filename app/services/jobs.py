@@ -0,0 +1,369 @@
+"""
+Tareas en segundo plano (exportaciones, sincronizaciones, auto-conciliación).
+
+Los endpoints largos encolan un `Job` y responden 202 de inmediato; el
+proceso `scripts/job_worker.py` (pool de threads) toma los trabajos de la
+colección `jobs` y los ejecuta. El navegador consulta `GET /api/jobs/<id>`
+hasta que termina y descarga el archivo generado, si lo hay.
+
+Registrar un tipo de trabajo:
+
+    @job_handler('reports.sales_excel')
+    def sales_excel_job(ctx):
+        ctx.progress(10, 'Leyendo ventas')
+        path = ctx.artifact('ventas.xlsx')
+        ...
+        return {'rows': count}          # queda en job.result
+
+`ctx.progress` actualiza el avance y lanza `JobCancelled` si el usuario
+canceló. Cada tenant puede tener a lo sumo `JOBS_PER_TENANT` trabajos en
+ejecución; los demás esperan en la cola.
+"""
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from flask import current_app, g, jsonify, request, url_for
+from flask_login import current_user
+from pymongo import ReturnDocument
+
+from app.models import Job, utc_now
+from app.services.stream_export import stream_response
+from app.services.xlsx_export import XlsxExport
+
+JOBS_PER_TENANT = 2
+STALE_AFTER = timedelta(minutes=10)  # sin heartbeat: el worker murió
+PROGRESS_INTERVAL = 1.0  # segundos mínimos entre escrituras de progreso
+
+_handlers = {}
+
+
+class JobCancelled(BaseException):
+    """
+    El usuario pidió cancelar el trabajo. Hereda de BaseException (como
+    KeyboardInterrupt) para que los `except Exception` de las
+    sincronizaciones, que acumulan errores por fila, no la atrapen.
+    """
+
+
+def job_handler(kind):
+    """Registra la función que ejecuta los trabajos de tipo `kind`"""
+    def decorator(f):
+        _handlers[kind] = f
+        return f
+    return decorator
+
+
+def get_handler(kind):
+    return _handlers.get(kind)
+
+
+def artifact_root(app=None):
+    app = app or current_app
+    return app.config.get('JOB_ARTIFACT_DIR') or os.path.join(app.instance_path, 'jobs')
+
+
+# ============================================
+# ENCOLAR / CONSULTAR
+# ============================================
+def wants_async():
+    """El cliente pidió ejecución en segundo plano (?async=1)"""
+    return request.args.get('async') in ('1', 'true')
+
+
+def enqueue(kind, tenant, user=None, params=None):
+    if kind not in _handlers:
+        raise ValueError(f'Tipo de trabajo desconocido: {kind}')
+    job = Job(kind=kind, tenant=tenant, user=user, params=params or {})
+    job.save()
+    return job
+
+
+def job_accepted(job):
+    """Respuesta 202 con la URL para consultar el estado"""
+    return jsonify({
+        'success': True,
+        'job_id': str(job.id),
+        'status': job.status,
+        'status_url': url_for('api.get_job', job_id=str(job.id)),
+    }), 202
+
+
+def serialize_job(job):
+    data = {
+        'id': str(job.id),
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress or 0,
+        'message': job.message,
+        'result': job.result or {},
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == 'done' and job.artifact_path:
+        data['download_url'] = url_for('api.download_job', job_id=str(job.id))
+    return data
+
+
+def request_cancel(job):
+    """Cancela un trabajo en cola de inmediato; uno en ejecución se detiene en su próximo progreso"""
+    now = utc_now()
+    jobs = Job._get_collection()
+    result = jobs.update_one(
+        {'_id': job.pk, 'status': 'queued'},
+        {'$set': {'status': 'cancelled', 'finished_at': now, 'cancel_requested': True}}
+    )
+    if not result.modified_count:
+        jobs.update_one({'_id': job.pk, 'status': 'running'}, {'$set': {'cancel_requested': True}})
+    job.reload()
+    return job
+
+
+def enqueue_current(kind, params=None):
+    """Encola un trabajo para el tenant y usuario del request y responde 202"""
+    job = enqueue(kind, g.current_tenant, current_user._get_current_object(), params)
+    return job_accepted(job)
+
+
+# ============================================
+# EXPORTACIONES
+# ============================================
+def export_job(kind):
+    """
+    Registra `builder(export, tenant, **args)`, que llena un XlsxExport, como
+    trabajo de tipo `kind`. `export_response` usa el mismo builder para la
+    descarga directa y la en segundo plano.
+    """
+    def decorator(builder):
+        @job_handler(kind)
+        def run(ctx):
+            export = XlsxExport(progress=lambda rows: ctx.progress(message=f'{rows} filas escritas'))
+            try:
+                builder(export, ctx.tenant, **ctx.params.get('args', {}))
+                ctx.progress(95, 'Guardando archivo', force=True)
+            except BaseException:
+                export.discard()
+                raise
+            export.save(ctx.artifact(ctx.params['filename']))
+            return {'rows': export.rows}
+        builder.job_kind = kind
+        return builder
+    return decorator
+
+
+def export_response(builder, filename, **args):
+    """
+    Envía el Excel en la respuesta o, con ?async=1, lo encola y responde 202.
+    Con ?format=csv|ndjson envía los datos por streaming (sin trabajo: la
+    memoria es constante y la respuesta empieza de inmediato).
+    """
+    fmt = request.args.get('format') or 'xlsx'
+    if fmt != 'xlsx':
+        return stream_response(builder, filename, fmt, **args)
+    if wants_async():
+        return enqueue_current(builder.job_kind, {'filename': filename, 'args': args})
+    export = XlsxExport()
+    try:
+        builder(export, g.current_tenant, **args)
+    except BaseException:
+        export.discard()
+        raise
+    return export.send(filename)
+
+
+# ============================================
+# EJECUCIÓN
+# ============================================
+class JobContext:
+    """Acceso del handler a su trabajo: parámetros, progreso, cancelación y archivos"""
+
+    def __init__(self, job, app):
+        self.job = job
+        self.app = app
+        self.params = job.params or {}
+        self._last_progress = 0.0
+
+    @property
+    def tenant(self):
+        return self.job.tenant
+
+    @property
+    def user(self):
+        return self.job.user
+
+    def progress(self, percent=None, message=None, force=False):
+        """Guarda el avance (como mucho una vez por segundo) y verifica cancelación"""
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        update = {'heartbeat_at': utc_now()}
+        if percent is not None:
+            update['progress'] = max(0, min(100, int(percent)))
+        if message is not None:
+            update['message'] = message[:200]
+        doc = Job._get_collection().find_one_and_update(
+            {'_id': self.job.pk}, {'$set': update},
+            projection={'cancel_requested': 1}, return_document=ReturnDocument.AFTER
+        )
+        if doc and doc.get('cancel_requested'):
+            raise JobCancelled()
+
+    def check_cancelled(self):
+        self.progress(force=True)
+
+    def artifact(self, filename):
+        """Ruta donde el handler debe escribir el archivo resultado"""
+        directory = os.path.join(artifact_root(self.app), str(self.job.pk))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename)
+        Job._get_collection().update_one(
+            {'_id': self.job.pk}, {'$set': {'artifact_path': path, 'artifact_name': filename}}
+        )
+        return path
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim_next(worker):
+    """
+    Toma el trabajo en cola más antiguo de un tenant que no haya llegado a
+    su límite de concurrencia. Retorna el Job o None.
+    """
+    jobs = Job._get_collection()
+    full = set()
+    candidates = jobs.find({'status': 'queued'}, {'tenant': 1}, sort=[('created_at', 1)], limit=50)
+    for candidate in candidates:
+        tenant_id = candidate.get('tenant')
+        if tenant_id in full:
+            continue
+        if jobs.count_documents({'tenant': tenant_id, 'status': 'running'}) >= JOBS_PER_TENANT:
+            full.add(tenant_id)
+            continue
+        now = utc_now()
+        doc = jobs.find_one_and_update(
+            {'_id': candidate['_id'], 'status': 'queued'},
+            {'$set': {'status': 'running', 'worker': worker, 'started_at': now, 'heartbeat_at': now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            continue  # otro worker lo tomó
+        # Dos workers pueden tomar a la vez el último cupo: se quedan los que
+        # empezaron primero y el que sobra vuelve a la cola
+        first = jobs.find(
+            {'tenant': tenant_id, 'status': 'running'}, {'_id': 1},
+            sort=[('started_at', 1), ('_id', 1)], limit=JOBS_PER_TENANT
+        )
+        if doc['_id'] not in {d['_id'] for d in first}:
+            jobs.update_one(
+                {'_id': doc['_id'], 'status': 'running', 'worker': worker},
+                {'$set': {'status': 'queued', 'worker': None, 'started_at': None}}
+            )
+            full.add(tenant_id)
+            continue
+        return Job.objects(id=doc['_id']).first()
+    return None
+
+
+def _finish(job, status, **fields):
+    fields.update(status=status, finished_at=utc_now())
+    if status == 'done':
+        fields['progress'] = 100
+    Job._get_collection().update_one({'_id': job.pk, 'status': 'running'}, {'$set': fields})
+
+
+def run_job(job, app):
+    """Ejecuta un trabajo ya tomado (status 'running') dentro de un app context"""
+    handler = get_handler(job.kind)
+    with app.app_context():
+        if handler is None:
+            _finish(job, 'failed', error=f'Tipo de trabajo desconocido: {job.kind}')
+            return
+        g.current_tenant = job.tenant
+        ctx = JobContext(job, app)
+        try:
+            result = handler(ctx)
+        except JobCancelled:
+            _finish(job, 'cancelled', message='Cancelado por el usuario')
+        except Exception as e:
+            app.logger.error(f'Job {job.pk} ({job.kind}) falló: {traceback.format_exc()}')
+            _finish(job, 'failed', error=str(e)[:1000])
+        else:
+            _finish(job, 'done', result=result or {})
+
+
+def fail_stale_jobs(now=None):
+    """Marca como fallidos los trabajos cuyo worker dejó de reportar"""
+    now = now or utc_now()
+    return Job._get_collection().update_many(
+        {'status': 'running', 'heartbeat_at': {'$lt': now - STALE_AFTER}},
+        {'$set': {'status': 'failed', 'error': 'El worker se detuvo durante la ejecución', 'finished_at': now}}
+    ).modified_count
+
+
+def purge_jobs(older_than_days=7, app=None):
+    """Elimina trabajos terminados (y sus archivos) más antiguos que N días"""
+    cutoff = utc_now() - timedelta(days=older_than_days)
+    query = {'status': {'$in': ['done', 'failed', 'cancelled']}, 'finished_at': {'$lt': cutoff}}
+    jobs = Job._get_collection()
+    ids = [doc['_id'] for doc in jobs.find(query, {'_id': 1})]
+    for job_id in ids:
+        shutil.rmtree(os.path.join(artifact_root(app), str(job_id)), ignore_errors=True)
+    if ids:
+        jobs.delete_many({'_id': {'$in': ids}})
+    return len(ids)
+
+
+class JobWorker:
+    """Pool de threads que consume la cola hasta recibir stop()"""
+
+    def __init__(self, app, threads=2, poll_interval=2.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        worker = worker_id()
+        while not self._stop.is_set():
+            with self.app.app_context():
+                job = claim_next(worker)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            run_job(job, self.app)
+
+    def _heartbeat(self):
+        # Los trabajos que no reportan progreso igual muestran que el worker vive
+        while not self._stop.wait(60):
+            with self.app.app_context():
+                prefix = re.escape(f'{socket.gethostname()}:{os.getpid()}:')
+                Job._get_collection().update_many(
+                    {'status': 'running', 'worker': {'$regex': f'^{prefix}'}},
+                    {'$set': {'heartbeat_at': utc_now()}}
+                )
+                fail_stale_jobs()
+
+    def run(self):
+        with self.app.app_context():
+            fail_stale_jobs()
+        workers = [threading.Thread(target=self._loop, daemon=True) for _ in range(self.threads)]
+        workers.append(threading.Thread(target=self._heartbeat, daemon=True))
+        for t in workers:
+            t.start()
+        while not self._stop.is_set():
+            self._stop.wait(1)
+        for t in workers[:-1]:
+            t.join()
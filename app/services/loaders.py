@@ -0,0 +1,118 @@
+"""
+Carga en lote de referencias (identity map por request).
+
+Los listados que acceden a `item.product`, `payment.sale` o `sale.items` por
+fila generan un `find_one` por cada acceso. `BatchLoader` junta los ObjectIds
+que un serializador va a necesitar, los resuelve con una consulta `$in` por
+colección y deja los documentos cacheados para el resto del request.
+
+Uso:
+    loader = get_loader()
+    loader.prefetch_sale_items(sales)        # sale.items + item.product
+    loader.resolve(payments, 'sale')         # payment.sale sin consultas extra
+"""
+from bson import DBRef, ObjectId
+from flask import g, has_app_context
+from mongoengine import Document
+from mongoengine.base import BaseDocument
+
+from app.models import SaleItem, Payment
+
+
+def _ref_id(value):
+    if isinstance(value, DBRef):
+        return value.id
+    if isinstance(value, ObjectId):
+        return value
+    return getattr(value, 'pk', None)
+
+
+class BatchLoader:
+    """Identity map: un documento por (colección, id) durante el request"""
+
+    def __init__(self):
+        self._cache = {}  # nombre de colección -> {id: documento o None}
+
+    def _bucket(self, document_cls):
+        return self._cache.setdefault(document_cls._get_collection_name(), {})
+
+    def load(self, document_cls, ids):
+        """Retorna {id: documento} resolviendo con un solo $in los que faltan"""
+        bucket = self._bucket(document_cls)
+        ids = {i for i in ids if i is not None}
+        missing = [i for i in ids if i not in bucket]
+        if missing:
+            for doc in document_cls.objects(id__in=missing):
+                bucket[doc.pk] = doc
+            for i in missing:
+                bucket.setdefault(i, None)
+        return {i: bucket[i] for i in ids}
+
+    def get(self, document_cls, id):
+        return self.load(document_cls, [id]).get(id)
+
+    def add(self, docs):
+        """Registra documentos ya cargados en el identity map"""
+        for doc in docs:
+            if doc is not None and doc.pk is not None:
+                self._bucket(type(doc))[doc.pk] = doc
+        return docs
+
+    def resolve(self, docs, field, document_cls=None):
+        """
+        Resuelve `field` (ReferenceField) en todos los documentos de una vez.
+        Acepta también documentos embebidos (p. ej. line_items de un pedido).
+
+        Las referencias a documentos inexistentes quedan en None, igual que
+        un campo vacío.
+        """
+        docs = [d for d in docs if isinstance(d, BaseDocument)]
+        if not docs:
+            return docs
+        if document_cls is None:
+            document_cls = docs[0]._fields[field].document_type
+        ids = {_ref_id(d._data.get(field)) for d in docs if d._data.get(field) is not None}
+        found = self.load(document_cls, ids)
+        for d in docs:
+            value = d._data.get(field)
+            if isinstance(value, (DBRef, ObjectId)):
+                d._data[field] = found.get(_ref_id(value))
+        return docs
+
+    def prefetch_sale_items(self, sales, with_products=True):
+        """Carga los items de todas las ventas con una consulta (y sus productos con otra)"""
+        sales = self.add([s for s in sales if isinstance(s, Document)])
+        pending = [s for s in sales if getattr(s, '_prefetched_items', None) is None]
+        if pending:
+            by_sale = {s.pk: [] for s in pending}
+            for item in SaleItem.objects(sale__in=list(by_sale)):
+                by_sale[_ref_id(item._data.get('sale'))].append(item)
+            for s in pending:
+                s._prefetched_items = by_sale[s.pk]
+                for item in s._prefetched_items:
+                    item._data['sale'] = s
+        if with_products:
+            self.resolve([item for s in sales for item in s._prefetched_items], 'product')
+        return sales
+
+    def prefetch_payments(self, sales):
+        """Carga los pagos de todas las ventas con una consulta"""
+        sales = [s for s in sales if isinstance(s, Document)]
+        pending = [s for s in sales if getattr(s, '_prefetched_payments', None) is None]
+        if pending:
+            by_sale = {s.pk: [] for s in pending}
+            for payment in Payment.objects(sale__in=list(by_sale)):
+                by_sale[_ref_id(payment._data.get('sale'))].append(payment)
+            for s in pending:
+                s._prefetched_payments = by_sale[s.pk]
+        return sales
+
+
+def get_loader():
+    """Loader del request actual (o uno nuevo fuera de un contexto Flask)"""
+    if not has_app_context():
+        return BatchLoader()
+    loader = getattr(g, 'batch_loader', None)
+    if loader is None:
+        loader = g.batch_loader = BatchLoader()
+    return loader
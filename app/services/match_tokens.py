@@ -0,0 +1,193 @@
+"""
+Tokens de conciliación: nombres normalizados, RUT y números de pedido.
+
+Las transferencias suelen traer en la glosa el nombre (a veces truncado)
+o el RUT de quien paga, o el número de pedido. Cada venta guarda en
+`Sale.match_tokens` los tokens de su cliente y su pedido Shopify (se
+calculan al guardar, ver Sale.clean), así que vienen en la misma consulta
+de candidatas y comparar una transacción con una venta es una intersección
+de conjuntos: O(tokens), sin consultas extra.
+
+Las ventas de Shopify suman además los datos del titular de la cuenta
+(ShopifyCustomer enlazado a la orden: nombre, parte local del email y
+teléfono), que puede no ser quien figura en el pedido. Sus palabras se
+guardan con ACCOUNT_MARK ('@maria') y se comparan como un nombre aparte,
+para no diluir la similitud del nombre del pedido.
+
+    tokenize('TRANSF DE JUAN PÉREZ 12.345.678-9')
+    -> {'juan', 'perez', '12345678'}
+
+Cuando la sincronización o la importación cambian un ShopifyCustomer,
+`refresh_account_tokens` recalcula las ventas de sus pedidos. Las ventas
+anteriores se completan con `python scripts/maintenance.py rebuild-match-tokens`.
+"""
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+from app.models import Sale, ShopifyCustomer, ShopifyOrder
+from app.services.inventory import _as_id
+
+MIN_WORD = 3
+MIN_NUMBER = 4
+ACCOUNT_MARK = '@'  # prefijo de las palabras del titular de la cuenta Shopify
+
+# Palabras de las glosas bancarias y nombres genéricos que no identifican a nadie
+STOPWORDS = {
+    'abono', 'banco', 'bancos', 'cliente', 'cta', 'cte', 'cuenta', 'del', 'desde', 'las', 'los',
+    'ltda', 'nombre', 'otros', 'pago', 'para', 'rut', 'shopify', 'sin', 'spa', 'tef', 'transf',
+    'transferencia', 'www',
+}
+
+RUT_RE = re.compile(r'\b(\d{1,2})\.?(\d{3})\.?(\d{3})-?[\dk]\b')
+WORD_RE = re.compile(r'[a-z]+|\d+')
+
+
+def normalize(text):
+    """Minúsculas y sin tildes"""
+    return unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().lower()
+
+
+def tokenize(*texts):
+    """
+    Conjunto de tokens de los textos: palabras de 3+ letras (sin stopwords),
+    números de 4+ dígitos (pedidos) y el cuerpo de los RUT sin puntos ni DV.
+    """
+    tokens = set()
+    for text in texts:
+        if not text:
+            continue
+        text = normalize(text)
+        for match in RUT_RE.finditer(text):
+            tokens.add(''.join(match.groups()))
+        for word in WORD_RE.findall(text):
+            if word.isdigit():
+                if len(word) >= MIN_NUMBER:
+                    tokens.add(word)
+            elif len(word) >= MIN_WORD and word not in STOPWORDS:
+                tokens.add(word)
+    return tokens
+
+
+def sale_tokens(customer_name, order_number=None, *extra, account=()):
+    """
+    Tokens de una venta (lista ordenada para guardar en Sale.match_tokens).
+    `account` son los textos del ShopifyCustomer enlazado (account_texts):
+    sus números cuentan como los del pedido y sus palabras llevan ACCOUNT_MARK.
+    """
+    tokens = tokenize(customer_name, str(order_number) if order_number else None, *extra)
+    for token in tokenize(*account):
+        tokens.add(token if token.isdigit() else ACCOUNT_MARK + token)
+    return sorted(tokens)
+
+
+def account_texts(customer):
+    """Textos de un ShopifyCustomer para sale_tokens: nombre, parte local del email y teléfono solo dígitos"""
+    if not customer:
+        return ()
+    email = (customer.get('email') or '').split('@')[0]
+    phone = re.sub(r'\D', '', customer.get('phone') or '')
+    return (customer.get('name'), email, phone)
+
+
+def linked_customers(customer_ids):
+    """{_id: account_texts} de los ShopifyCustomer enlazados, en una consulta"""
+    ids = list({customer_id for customer_id in customer_ids if customer_id})
+    if not ids:
+        return {}
+    return {doc['_id']: account_texts(doc) for doc in ShopifyCustomer._get_collection().find(
+        {'_id': {'$in': ids}}, {'name': 1, 'email': 1, 'phone': 1}
+    )}
+
+
+def name_similarity(tx_tokens, tokens):
+    """
+    Similitud (0-1) entre los tokens de una glosa y los de una venta.
+    Un RUT, teléfono o número de pedido en común vale 1; si no, la mayor
+    fracción de las palabras de un nombre (el del pedido o el del titular
+    de la cuenta) que aparecen en la glosa (completas o truncadas).
+    """
+    if not tx_tokens or not tokens:
+        return 0.0
+    words, account = [], []
+    for token in tokens:
+        if token.isdigit():
+            if token in tx_tokens:
+                return 1.0
+        elif token.startswith(ACCOUNT_MARK):
+            account.append(token[len(ACCOUNT_MARK):])
+        else:
+            words.append(token)
+    prefixes = [t for t in tx_tokens if not t.isdigit()]
+    best = 0.0
+    for group in (words, account):
+        if group:
+            hits = sum(1 for word in group
+                       if word in tx_tokens or any(word.startswith(prefix) for prefix in prefixes))
+            best = max(best, hits / len(group))
+    return best
+
+
+def rebuild_match_tokens(tenant=None, batch_size=1000):
+    """
+    Recalcula Sale.match_tokens (con la nota del pedido Shopify y el titular
+    de su cuenta). Retorna las ventas actualizadas.
+    """
+    query = {} if tenant is None else {'tenant': _as_id(tenant)}
+    return _rebuild(query, batch_size)
+
+
+def refresh_account_tokens(tenant, customer_ids, batch_size=1000):
+    """
+    Recalcula los tokens de las ventas cuyos pedidos Shopify están enlazados
+    a `customer_ids` (después de cambiar su nombre, email o teléfono).
+    Retorna las ventas actualizadas.
+    """
+    tenant_id = _as_id(tenant)
+    ids = list({_as_id(customer_id) for customer_id in customer_ids if customer_id})
+    if not ids:
+        return 0
+    order_ids = ShopifyOrder._get_collection().distinct(
+        'shopify_id', {'tenant': tenant_id, 'customer': {'$in': ids}}
+    )
+    if not order_ids:
+        return 0
+    return _rebuild({'tenant': tenant_id, 'shopify_order_id': {'$in': order_ids}}, batch_size)
+
+
+def _rebuild(query, batch_size):
+    """Recalcula los tokens de las ventas de `query`; solo escribe las que cambian"""
+    projection = {'customer_name': 1, 'shopify_order_number': 1, 'shopify_order_id': 1, 'match_tokens': 1}
+    sales = Sale._get_collection()
+    updated = 0
+    batch = []
+
+    def flush():
+        nonlocal updated
+        order_ids = [doc['shopify_order_id'] for doc in batch if doc.get('shopify_order_id')]
+        orders = {}
+        if order_ids:
+            orders = {order['shopify_id']: order for order in ShopifyOrder._get_collection().find(
+                {'shopify_id': {'$in': order_ids}}, {'note': 1, 'shopify_id': 1, 'customer': 1}
+            )}
+        accounts = linked_customers(order.get('customer') for order in orders.values())
+        ops = []
+        for doc in batch:
+            order = orders.get(doc.get('shopify_order_id')) or {}
+            tokens = sale_tokens(
+                doc.get('customer_name'), doc.get('shopify_order_number'), order.get('note'),
+                account=accounts.get(order.get('customer'), ())
+            )
+            if tokens != doc.get('match_tokens'):
+                ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'match_tokens': tokens}}))
+        if ops:
+            updated += sales.bulk_write(ops, ordered=False).modified_count
+        batch.clear()
+
+    for doc in sales.find(query, projection, batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return updated
@@ -0,0 +1,486 @@
+"""
+Auto-conciliación de transacciones bancarias con ventas.
+
+Antes, por cada transacción pendiente se consultaban las ventas de ±3 días y,
+por cada venta, si ya estaba conciliada y su total: O(tx × ventas × 2)
+consultas, y la asignación era "el primero que llega": una transacción
+temprana podía quedarse con la venta que otra explicaba mejor.
+
+Ahora:
+
+1. `load_candidates` lee con tres consultas las transacciones de crédito
+   pendientes, las ventas por cobrar del rango de fechas (con sus totales
+   guardados) y las ventas ya conciliadas.
+2. `SaleIndex` agrupa las ventas por día y las ordena por total, así cada
+   transacción busca con bisect solo en los días de su ventana.
+3. `assign` resuelve la asignación uno a uno de forma global: separa el
+   grafo transacción-venta en componentes conexas y resuelve cada una con
+   el método húngaro, maximizando la suma de `confidence` (a igual
+   confianza prefiere la venta del mismo día o anterior a la transferencia).
+   Las componentes muy grandes (p. ej. un mismo precio todos los días) se
+   resuelven en bloques ordenados por fecha.
+4. `apply_matches` escribe todo con operaciones bulk: transacciones,
+   pagos, totales y estado de las ventas y el rollup diario.
+
+La puntuación es la misma que la de las sugerencias manuales (`confidence`,
+`suggest`) e incluye la similitud entre la glosa y los tokens del cliente
+o pedido de la venta (ver app.services.match_tokens).
+"""
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+
+from bson import Decimal128, ObjectId
+from pymongo import UpdateOne
+
+from app.models import BankTransaction, Payment, Sale, utc_now
+from app.services.inventory import _as_id
+from app.services.match_tokens import name_similarity, tokenize
+from app.services.sales import bump_daily_many, compute_totals
+
+AMOUNT_TOLERANCE = 0.01  # ±1% del monto
+DATE_WINDOW = timedelta(days=3)
+MIN_CONFIDENCE = 80
+NAME_WEIGHT = 15  # puntos extra por nombre/RUT/pedido en la glosa
+OPEN_PAYMENT_STATUSES = ['pendiente', 'parcial']
+LATE_SALE_TIEBREAK = 0.01  # la transferencia suele llegar después de la venta
+MAX_EXACT_CELLS = 10000  # filas × columnas máximas para el método húngaro
+BLOCK_TRANSACTIONS = 50
+
+
+def _number(value):
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    return float(value or 0)
+
+
+def confidence(amount, sale_total, tx_date, sale_date, similarity=0.0):
+    """
+    Confianza de que la venta corresponda a la transacción: 100 - 5 por
+    cada 1% de diferencia de monto - 10 por cada día + hasta NAME_WEIGHT
+    según `similarity` (0-1, ver match_tokens.name_similarity).
+    """
+    amount_diff = abs(sale_total - amount) / amount * 100
+    date_diff = abs((sale_date - tx_date).days)
+    return 100 - (amount_diff * 5) - (date_diff * 10) + NAME_WEIGHT * similarity
+
+
+def transaction_tokens(tx):
+    """Tokens de la glosa y referencia de una transacción (dict o documento)"""
+    if isinstance(tx, dict):
+        return tokenize(tx.get('description'), tx.get('reference'))
+    return tokenize(tx.description, tx.reference)
+
+
+# ============================================
+# CARGA
+# ============================================
+def load_candidates(tenant):
+    """
+    Retorna (transacciones, ventas) como listas de dicts:
+    transacción {'_id', 'amount', 'date', 'description', 'tokens'} y
+    venta {'_id', 'total', 'date', 'channel', 'stored', 'tokens'} (solo
+    ventas por cobrar, sin conciliar, dentro de la ventana de alguna
+    transacción).
+    """
+    tenant_id = _as_id(tenant)
+    transactions = []
+    for doc in BankTransaction._get_collection().find(
+        {'tenant': tenant_id, 'status': 'pending', 'transaction_type': 'credit'},
+        {'amount': 1, 'date': 1, 'description': 1, 'reference': 1}
+    ):
+        amount = _number(doc.get('amount'))
+        if amount > 0 and doc.get('date'):
+            transactions.append({'_id': doc['_id'], 'amount': amount, 'date': doc['date'],
+                                 'description': doc.get('description'), 'tokens': transaction_tokens(doc)})
+    if not transactions:
+        return [], []
+
+    date_min = min(t['date'] for t in transactions) - DATE_WINDOW
+    date_max = max(t['date'] for t in transactions) + DATE_WINDOW
+    matched = set(BankTransaction._get_collection().distinct(
+        'matched_sale', {'tenant': tenant_id, 'status': 'matched'}
+    ))
+
+    sales = []
+    legacy = []
+    for doc in Sale._get_collection().find(
+        {'tenant': tenant_id, 'payment_status': {'$in': OPEN_PAYMENT_STATUSES},
+         'date_created': {'$gte': date_min, '$lte': date_max}},
+        {'date_created': 1, 'total_amount': 1, 'sales_channel': 1, 'match_tokens': 1}
+    ):
+        if doc['_id'] in matched:
+            continue
+        sale = {'_id': doc['_id'], 'date': doc['date_created'], 'channel': doc.get('sales_channel'),
+                'total': None, 'stored': isinstance(doc.get('total_amount'), (int, float)),
+                'tokens': doc.get('match_tokens')}
+        if sale['stored']:
+            sale['total'] = float(doc['total_amount'])
+        else:
+            legacy.append(sale)
+        sales.append(sale)
+
+    # Ventas anteriores a los totales guardados: una agregación para todas
+    if legacy:
+        totals = compute_totals([s['_id'] for s in legacy])
+        for sale in legacy:
+            sale['total'] = totals[sale['_id']][0]
+    return transactions, sales
+
+
+# ============================================
+# ÍNDICE DE CANDIDATOS
+# ============================================
+class SaleIndex:
+    """Ventas agrupadas por día y ordenadas por total dentro de cada día"""
+
+    def __init__(self, sales):
+        by_day = defaultdict(list)
+        for idx, sale in enumerate(sales):
+            by_day[sale['date'].toordinal()].append((sale['total'], idx))
+        self._days = {}
+        for day, entries in by_day.items():
+            entries.sort()
+            self._days[day] = ([total for total, _ in entries], [idx for _, idx in entries])
+        self.sales = sales
+
+    def candidates(self, amount, date):
+        """Índices de las ventas con total ±1% y fecha ±3 días"""
+        amount_min = amount * (1 - AMOUNT_TOLERANCE)
+        amount_max = amount * (1 + AMOUNT_TOLERANCE)
+        date_min = date - DATE_WINDOW
+        date_max = date + DATE_WINDOW
+        for day in range(date_min.toordinal(), date_max.toordinal() + 1):
+            bucket = self._days.get(day)
+            if bucket is None:
+                continue
+            totals, indexes = bucket
+            start = bisect.bisect_left(totals, amount_min)
+            end = bisect.bisect_right(totals, amount_max)
+            for idx in indexes[start:end]:
+                if date_min <= self.sales[idx]['date'] <= date_max:
+                    yield idx
+
+
+def build_edges(transactions, sales, min_confidence=MIN_CONFIDENCE):
+    """
+    Pares posibles: {tx_idx: {sale_idx: confianza}}. El umbral se aplica a
+    la confianza por monto y fecha; el nombre solo ordena a las que lo pasan
+    (una glosa con el nombre no concilia sola una venta de monto o fecha
+    lejanos).
+    """
+    index = SaleIndex(sales)
+    edges = {}
+    for t_idx, tx in enumerate(transactions):
+        row = {}
+        tx_tokens = tx.get('tokens')
+        for s_idx in index.candidates(tx['amount'], tx['date']):
+            sale = sales[s_idx]
+            score = confidence(tx['amount'], sale['total'], tx['date'], sale['date'])
+            if score >= min_confidence:
+                row[s_idx] = score + NAME_WEIGHT * name_similarity(tx_tokens, sale.get('tokens'))
+        if row:
+            edges[t_idx] = row
+    return edges
+
+
+# ============================================
+# ASIGNACIÓN
+# ============================================
+def hungarian(cost):
+    """
+    Asignación de costo mínimo (método húngaro con potenciales, O(n²m)).
+    `cost` es una matriz n × m con n <= m; retorna la columna de cada fila.
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    result = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            result[p[j] - 1] = j - 1
+    return result
+
+
+def _solve_exact(tx_ids, edges):
+    """Asignación óptima de un grupo: máxima suma de confianza"""
+    sale_ids = sorted({s for t in tx_ids for s in edges[t]})
+    transpose = len(tx_ids) > len(sale_ids)
+    rows, cols = (sale_ids, tx_ids) if transpose else (tx_ids, sale_ids)
+    cost = []
+    for r in rows:
+        if transpose:
+            cost.append([-edges[c][r] if r in edges[c] else 0.0 for c in cols])
+        else:
+            cost.append([-edges[r][c] if c in edges[r] else 0.0 for c in cols])
+    pairs = []
+    for r_idx, c_idx in enumerate(hungarian(cost)):
+        if c_idx < 0:
+            continue
+        t, s = (cols[c_idx], rows[r_idx]) if transpose else (rows[r_idx], cols[c_idx])
+        if s in edges[t]:
+            pairs.append((t, s))
+    return pairs
+
+
+def _solve_greedy(tx_ids, edges, used_sales):
+    pairs = []
+    used_tx = set()
+    ranked = sorted(((-edges[t][s], t, s) for t in tx_ids for s in edges[t]))
+    for _, t, s in ranked:
+        if t not in used_tx and s not in used_sales:
+            used_tx.add(t)
+            used_sales.add(s)
+            pairs.append((t, s))
+    return pairs
+
+
+def _components(edges):
+    """Componentes conexas del grafo transacción-venta (listas de tx)"""
+    parent = {}
+
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for t, row in edges.items():
+        for s in row:
+            a, b = find(('t', t)), find(('s', s))
+            if a != b:
+                parent[a] = b
+    groups = defaultdict(list)
+    for t in edges:
+        groups[find(('t', t))].append(t)
+    return list(groups.values())
+
+
+def assign(transactions, sales, min_confidence=MIN_CONFIDENCE):
+    """
+    Asignación uno a uno. Retorna [(tx_idx, sale_idx, confianza)].
+
+    Cada componente se resuelve con el método húngaro si su matriz tiene a
+    lo sumo MAX_EXACT_CELLS celdas. Si no, sus transacciones se ordenan por
+    fecha y se resuelven en bloques de BLOCK_TRANSACTIONS contra las ventas
+    aún libres (óptimo dentro de cada bloque).
+    """
+    edges = build_edges(transactions, sales, min_confidence)
+    # Pesos de la asignación: la confianza, con un desempate contra las
+    # ventas posteriores a la transacción (la confianza no distingue el signo
+    # de la diferencia de días)
+    weights = {
+        t: {s: score - (LATE_SALE_TIEBREAK if sales[s]['date'] > transactions[t]['date'] else 0)
+            for s, score in row.items()}
+        for t, row in edges.items()
+    }
+    pairs = []
+    for group in _components(weights):
+        sale_count = len({s for t in group for s in weights[t]})
+        if len(group) * sale_count <= MAX_EXACT_CELLS:
+            pairs.extend(_solve_exact(sorted(group), weights))
+            continue
+        used_sales = set()
+        group.sort(key=lambda t: (transactions[t]['date'], t))
+        for start in range(0, len(group), BLOCK_TRANSACTIONS):
+            block = group[start:start + BLOCK_TRANSACTIONS]
+            free = {t: {s: c for s, c in weights[t].items() if s not in used_sales} for t in block}
+            block = [t for t in block if free[t]]
+            if not block:
+                continue
+            block_sales = len({s for t in block for s in free[t]})
+            if len(block) * block_sales <= MAX_EXACT_CELLS:
+                chosen = _solve_exact(block, free)
+                used_sales.update(s for _, s in chosen)
+            else:
+                chosen = _solve_greedy(block, free, used_sales)
+            pairs.extend(chosen)
+    return [(t, s, edges[t][s]) for t, s in sorted(pairs)]
+
+
+# ============================================
+# SUGERENCIAS
+# ============================================
+def suggest(tenant, tx, limit=10):
+    """
+    Ventas candidatas para conciliar manualmente una transacción, de mayor a
+    menor confianza. Filtra monto y fecha en la consulta (índice
+    tenant_payment_status_date), descarta las ya conciliadas y trae los
+    tokens de cada venta en la misma consulta.
+    """
+    tenant_id = _as_id(tenant)
+    amount = float(tx.amount)
+    amount_min = amount * (1 - AMOUNT_TOLERANCE)
+    amount_max = amount * (1 + AMOUNT_TOLERANCE)
+    sales = list(Sale._get_collection().find(
+        {'tenant': tenant_id, 'payment_status': {'$in': OPEN_PAYMENT_STATUSES},
+         'date_created': {'$gte': tx.date - DATE_WINDOW, '$lte': tx.date + DATE_WINDOW},
+         '$or': [{'total_amount': {'$gte': amount_min, '$lte': amount_max}}, {'total_amount': None}]},
+        {'customer_name': 1, 'date_created': 1, 'total_amount': 1, 'match_tokens': 1}
+    ))
+    legacy = [doc['_id'] for doc in sales if doc.get('total_amount') is None]
+    if legacy:
+        totals = compute_totals(legacy)
+        for doc in sales:
+            if doc.get('total_amount') is None:
+                doc['total_amount'] = totals[doc['_id']][0]
+    sales = [doc for doc in sales if amount_min <= _number(doc['total_amount']) <= amount_max]
+    if not sales:
+        return []
+    matched = set(BankTransaction._get_collection().distinct(
+        'matched_sale', {'matched_sale': {'$in': [doc['_id'] for doc in sales]}, 'status': 'matched'}
+    ))
+
+    tx_tokens = transaction_tokens(tx)
+    suggestions = []
+    for doc in sales:
+        if doc['_id'] in matched:
+            continue
+        sale_total = _number(doc['total_amount'])
+        similarity = name_similarity(tx_tokens, doc.get('match_tokens'))
+        suggestions.append({
+            'sale_id': str(doc['_id']),
+            'customer': doc.get('customer_name'),
+            'total': sale_total,
+            'date': doc['date_created'].strftime('%Y-%m-%d'),
+            'confidence': confidence(amount, sale_total, tx.date, doc['date_created'], similarity),
+            'amount_diff': round(abs(sale_total - amount) / amount * 100, 2),
+            'date_diff': abs((doc['date_created'] - tx.date).days),
+            'name_score': round(similarity * 100),
+        })
+    suggestions.sort(key=lambda item: item['confidence'], reverse=True)
+    for item in suggestions:
+        item['confidence'] = round(max(0, min(100, item['confidence'])))
+    return suggestions[:limit]
+
+
+# ============================================
+# ESCRITURA
+# ============================================
+def apply_matches(tenant, user, transactions, sales, matches):
+    """
+    Guarda las conciliaciones con escrituras bulk. Una transacción que otro
+    usuario concilió mientras tanto se omite (el filtro exige status
+    'pending'). Retorna la cantidad de transacciones conciliadas.
+    """
+    if not matches:
+        return 0
+    tenant_id = _as_id(tenant)
+    user_id = _as_id(user) if user is not None else None
+    now = utc_now()
+    run_id = ObjectId()
+    tx_collection = BankTransaction._get_collection()
+
+    tx_collection.bulk_write([
+        UpdateOne(
+            {'_id': transactions[t]['_id'], 'status': 'pending'},
+            {'$set': {'status': 'matched', 'matched_sale': sales[s]['_id'], 'match_type': 'auto',
+                      'match_run': run_id, 'matched_at': now, 'matched_by': user_id}}
+        ) for t, s, _ in matches
+    ], ordered=False)
+    # Solo las que quedaron con esta ejecución (no las que alguien tomó antes,
+    # aunque otra auto-conciliación haya escrito el mismo matched_at)
+    confirmed = {(doc['_id'], doc['matched_sale']) for doc in tx_collection.find(
+        {'_id': {'$in': [transactions[t]['_id'] for t, _, _ in matches]},
+         'status': 'matched', 'match_run': run_id},
+        {'matched_sale': 1}
+    )}
+    matches = [m for m in matches if (transactions[m[0]]['_id'], sales[m[1]]['_id']) in confirmed]
+    if not matches:
+        return 0
+
+    payments = []
+    for t, s, _ in matches:
+        tx = transactions[t]
+        payments.append({
+            'sale': sales[s]['_id'],
+            'tenant': tenant_id,
+            'amount': round(tx['amount'], 2),
+            'payment_via': 'transferencia',
+            'payment_reference': f"Conciliación bancaria #{str(tx['_id'])[-6:]}",
+            'notes': f"Auto-conciliado desde cartola: {tx['description'] or ''}"[:500],
+            'date_created': now,
+            'created_by': user_id,
+        })
+    Payment._get_collection().insert_many(payments, ordered=False)
+
+    # Totales y estado de pago de las ventas en una pipeline por venta
+    # (las ventas sin totales guardados se recalculan incluyendo el pago nuevo)
+    legacy_ids = [sales[s]['_id'] for _, s, _ in matches if not sales[s]['stored']]
+    legacy = compute_totals(legacy_ids) if legacy_ids else {}
+    sale_ops = []
+    daily = defaultdict(lambda: {'paid': 0.0})
+    for t, s, _ in matches:
+        sale = sales[s]
+        paid = transactions[t]['amount']
+        daily[(tenant_id, sale['date'], sale['channel'])]['paid'] += paid
+        if sale['stored']:
+            pipeline = [
+                {'$set': {'total_paid': {'$add': [{'$ifNull': ['$total_paid', 0]}, paid]}}},
+                {'$set': {'balance': {'$subtract': ['$total_amount', '$total_paid']}}},
+            ]
+        else:
+            total, stored_paid, _ = legacy[sale['_id']]
+            pipeline = [{'$set': {'total_amount': total, 'total_paid': stored_paid,
+                                  'balance': total - stored_paid}}]
+        pipeline.append({'$set': {'payment_status': {'$switch': {
+            'branches': [
+                {'case': {'$gte': ['$total_paid', '$total_amount']}, 'then': 'pagado'},
+                {'case': {'$gt': ['$total_paid', 0]}, 'then': 'parcial'},
+            ],
+            'default': 'pendiente',
+        }}}})
+        sale_ops.append(UpdateOne({'_id': sale['_id']}, pipeline))
+    Sale._get_collection().bulk_write(sale_ops, ordered=False)
+    bump_daily_many(daily)
+    return len(matches)
+
+
+def auto_match(tenant, user, progress=None, min_confidence=MIN_CONFIDENCE):
+    """Carga, asigna y guarda. Retorna {'matched', 'candidates', 'transactions'}"""
+    if progress:
+        progress(5, 'Cargando transacciones y ventas')
+    transactions, sales = load_candidates(tenant)
+    if progress:
+        progress(40, f'Asignando {len(transactions)} transacciones')
+    matches = assign(transactions, sales, min_confidence)
+    if progress:
+        progress(80, f'Guardando {len(matches)} conciliaciones')
+    matched = apply_matches(tenant, user, transactions, sales, matches)
+    return {'matched': matched, 'candidates': len(matches), 'transactions': len(transactions)}
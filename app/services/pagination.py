@@ -0,0 +1,190 @@
+"""
+Paginación de listados por cursor (keyset) o por número de página.
+
+`skip((page - 1) * per_page)` obliga a MongoDB a recorrer todas las filas
+anteriores, y el `count()` exacto de cada request recorre todas las que
+coinciden: en las páginas profundas de un tenant con 200k ventas ambos
+crecen linealmente. Con cursor, cada página continúa desde la última fila
+de la anterior, ordenando por `(campo, _id)` y filtrando
+`campo < v OR (campo == v AND _id < id)`. Con un índice
+`(tenant, campo, _id)` cada página cuesta lo mismo.
+
+Parámetros del request:
+    cursor    token `next_cursor` de la respuesta anterior (vacío = primera
+              página). Si el parámetro está presente se usa el modo cursor
+    page      número de página (modo clásico, con skip; por compatibilidad)
+    per_page  filas por página (máximo MAX_PER_PAGE)
+    count     exact | estimate | none. Por defecto `exact` con `page` y
+              `none` con `cursor`. `estimate` cuenta hasta COUNT_CAP filas
+
+    try:
+        page = paginate(query, 'date_created', default_per_page=20)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'sales': [...], 'current_page': page.page, **page.meta()})
+
+Ambos modos retornan `next_cursor` y `has_more`, así que un cliente puede
+pasar de páginas numeradas a cursor en cualquier momento.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from bson import ObjectId
+from flask import request
+from mongoengine.queryset.visitor import Q
+
+MAX_PER_PAGE = 500
+COUNT_CAP = 10000
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# ============================================
+# TOKENS
+# ============================================
+def encode_cursor(field, value, doc_id):
+    """Token opaco (base64url de JSON) con el campo, su valor y el _id de la última fila"""
+    if isinstance(value, datetime):
+        encoded = {'t': 'dt', 'v': value.isoformat()}
+    elif isinstance(value, Decimal):
+        encoded = {'v': float(value)}
+    else:
+        encoded = {'v': value}
+    payload = {'f': field, 'id': str(doc_id), **encoded}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, field):
+    """Retorna (valor, _id). Lanza InvalidCursor si el token no es de este listado"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        if payload.get('f') != field:
+            raise ValueError(field)
+        value = payload.get('v')
+        if payload.get('t') == 'dt':
+            value = datetime.fromisoformat(value)
+        elif value is not None and not isinstance(value, (int, float, str)):
+            raise ValueError(value)
+        return value, ObjectId(payload['id'])
+    except Exception:
+        raise InvalidCursor('Cursor inválido')
+
+
+def after_filter(field, value, doc_id, descending=True):
+    """
+    Q de las filas que siguen a (value, doc_id) en el orden (field, _id).
+    MongoDB ordena los null antes que cualquier valor, así que en orden
+    descendente van al final y en ascendente al principio.
+    """
+    op = 'lt' if descending else 'gt'
+    same_value = Q(**{field: value, f'id__{op}': doc_id})
+    if value is None:
+        if descending:
+            return same_value
+        return same_value | Q(**{f'{field}__ne': None})
+    after = Q(**{f'{field}__{op}': value}) | same_value
+    if descending:
+        after = after | Q(**{field: None})
+    return after
+
+
+# ============================================
+# PÁGINA
+# ============================================
+class Page:
+    def __init__(self, items, per_page, page=None, next_cursor=None, total=None, total_exact=True):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_exact = total_exact
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return (self.total + self.per_page - 1) // self.per_page
+
+    def meta(self):
+        return {
+            'total': self.total,
+            'total_exact': self.total_exact,
+            'pages': self.pages,
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'has_more': self.has_more,
+        }
+
+
+def per_page_arg(args, default_per_page):
+    """per_page del request, entre 1 y MAX_PER_PAGE"""
+    try:
+        per_page = int(args.get('per_page', default_per_page))
+    except (TypeError, ValueError):
+        per_page = default_per_page
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def page_arg(args):
+    try:
+        return max(1, int(args.get('page', 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _count(queryset, mode):
+    if mode == 'none':
+        return None, True
+    if mode == 'estimate':
+        # count_documents con limit se detiene al llegar al tope
+        total = queryset.limit(COUNT_CAP).count(with_limit_and_skip=True)
+        return total, total < COUNT_CAP
+    return queryset.count(), True
+
+
+def paginate(queryset, field, descending=True, default_per_page=50, args=None):
+    """
+    Pagina un QuerySet ordenado por (field, _id). Lee cursor/page/per_page/
+    count de `args` (por defecto request.args).
+    """
+    args = request.args if args is None else args
+    per_page = per_page_arg(args, default_per_page)
+
+    cursor_mode = 'cursor' in args
+    count_mode = args.get('count') or ('none' if cursor_mode else 'exact')
+    if count_mode not in COUNT_MODES:
+        count_mode = 'exact'
+    total, total_exact = _count(queryset, count_mode)
+
+    prefix = '-' if descending else '+'
+    ordered = queryset.order_by(f'{prefix}{field}', f'{prefix}id')
+    page = None
+    if cursor_mode:
+        token = args.get('cursor')
+        if token:
+            value, doc_id = decode_cursor(token, field)
+            ordered = ordered.filter(after_filter(field, value, doc_id, descending))
+    else:
+        page = page_arg(args)
+        ordered = ordered.skip((page - 1) * per_page)
+
+    # Una fila extra indica si hay otra página
+    items = list(ordered.limit(per_page + 1))
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(field, getattr(last, field), last.pk)
+    return Page(items, per_page, page=page, next_cursor=next_cursor, total=total, total_exact=total_exact)
@@ -0,0 +1,111 @@
+"""
+Consultas de conciliación bancaria resueltas en MongoDB.
+
+- `transaction_stats`: conteos por estado y montos de créditos pendientes y
+  conciliados en una sola agregación (`$facet`). Antes eran cuatro count()
+  y dos recorridos de todas las transacciones en Python. El índice
+  `tenant_status_type_amount` cubre la consulta: no se leen documentos.
+- `unmatched_sales`: ventas por cobrar sin transacción conciliada, con un
+  anti-join `$lookup` contra bank_transactions (índice `matched_sale_status`)
+  en vez de armar en Python la lista de todas las ventas conciliadas para
+  un `$nin`. Orden y paginación (página o cursor, ver
+  app.services.pagination) en el servidor.
+"""
+from app.models import BankTransaction, Sale
+from app.services.inventory import _as_id
+from app.services.matching import OPEN_PAYMENT_STATUSES
+from app.services.pagination import (
+    after_filter, decode_cursor, encode_cursor, page_arg, per_page_arg
+)
+from app.services.sales import compute_totals
+
+STATUSES = ('pending', 'matched', 'ignored')
+
+
+def transaction_stats(tenant):
+    """Retorna {'total', 'pending', 'matched', 'ignored', 'pending_amount', 'matched_amount'}"""
+    pipeline = [
+        {'$match': {'tenant': _as_id(tenant)}},
+        {'$project': {'_id': 0, 'status': 1, 'transaction_type': 1, 'amount': 1}},
+        {'$facet': {
+            'counts': [
+                {'$group': {'_id': '$status', 'count': {'$sum': 1}}},
+            ],
+            'credits': [
+                {'$match': {'transaction_type': 'credit', 'status': {'$in': ['pending', 'matched']}}},
+                {'$group': {'_id': '$status', 'amount': {'$sum': '$amount'}}},
+            ],
+        }},
+    ]
+    result = next(BankTransaction._get_collection().aggregate(pipeline), {'counts': [], 'credits': []})
+    counts = {row['_id']: row['count'] for row in result['counts']}
+    amounts = {row['_id']: float(row['amount'] or 0) for row in result['credits']}
+    stats = {status: counts.get(status, 0) for status in STATUSES}
+    stats['total'] = sum(counts.values())
+    stats['pending_amount'] = amounts.get('pending', 0.0)
+    stats['matched_amount'] = amounts.get('matched', 0.0)
+    return stats
+
+
+def unmatched_sales_pipeline(tenant, per_page, after=None, skip=0):
+    """
+    Pipeline de ventas pendientes/parciales sin transacción conciliada,
+    ordenadas por (date_created, _id) descendente. `after` es el
+    (valor, _id) del cursor. Trae per_page + 1 filas para saber si hay más.
+    """
+    match = {'tenant': _as_id(tenant), 'payment_status': {'$in': OPEN_PAYMENT_STATUSES}}
+    if after is not None:
+        match = {'$and': [match, after_filter('date_created', *after).to_query(Sale)]}
+    pipeline = [
+        {'$match': match},
+        {'$sort': {'date_created': -1, '_id': -1}},
+        {'$project': {'customer_name': 1, 'date_created': 1, 'payment_status': 1, 'total_amount': 1}},
+        {'$lookup': {
+            'from': BankTransaction._get_collection_name(),
+            'localField': '_id',
+            'foreignField': 'matched_sale',
+            'pipeline': [{'$match': {'status': 'matched'}}, {'$limit': 1}, {'$project': {'_id': 1}}],
+            'as': 'matches',
+        }},
+        {'$match': {'matches': {'$size': 0}}},
+    ]
+    if skip:
+        pipeline.append({'$skip': skip})
+    pipeline.append({'$limit': per_page + 1})
+    return pipeline
+
+
+def unmatched_sales(tenant, args, default_per_page=100):
+    """
+    Página de ventas sin conciliar según `args` (cursor/page/per_page).
+    Retorna (filas, meta) con next_cursor y has_more.
+    Lanza InvalidCursor si el cursor no es válido.
+    """
+    per_page = per_page_arg(args, default_per_page)
+    after = None
+    page = None
+    if 'cursor' in args:
+        if args.get('cursor'):
+            after = decode_cursor(args['cursor'], 'date_created')
+        skip = 0
+    else:
+        page = page_arg(args)
+        skip = (page - 1) * per_page
+
+    rows = list(Sale._get_collection().aggregate(
+        unmatched_sales_pipeline(tenant, per_page, after, skip), allowDiskUse=True
+    ))
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor('date_created', rows[-1].get('date_created'), rows[-1]['_id'])
+
+    # Ventas anteriores a los totales guardados
+    legacy = [row['_id'] for row in rows if row.get('total_amount') is None]
+    totals = compute_totals(legacy) if legacy else {}
+    for row in rows:
+        if row.get('total_amount') is None:
+            row['total_amount'] = totals[row['_id']][0]
+
+    meta = {'page': page, 'per_page': per_page, 'next_cursor': next_cursor, 'has_more': next_cursor is not None}
+    return rows, meta
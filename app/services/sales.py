@@ -0,0 +1,293 @@
+"""
+Totales materializados de ventas y rollup diario.
+
+Cada venta guarda `total_amount` (suma de sus items), `total_paid` (suma de
+sus pagos) y `balance` para que listados, conciliación y reportes no
+consulten `sale_items` / `payments` por fila, y para que las agregaciones
+puedan hacer `$sum` sobre `sales` directamente.
+
+Además `sales_daily` acumula por (tenant, día, canal) la cantidad de ventas,
+unidades, ingresos y monto pagado, que es lo que leen los gráficos del
+dashboard.
+
+Todo camino que crea una venta debe llamar a `record_sale`; todo camino que
+crea o elimina un `SaleItem` o un `Payment` debe llamar a `add_to_totals`
+con la variación, y las ventas que se descartan (rollback) se eliminan con
+`discard_sale`. Si la venta aún no tiene totales (datos anteriores a la
+migración) se recalculan desde items y pagos, que ya incluyen el cambio.
+`rebuild_sale_totals` y `rebuild_sales_daily` recalculan todo desde cero.
+"""
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+
+from app.models import Sale, SaleItem, Payment, SalesDaily
+from app.services.cache import invalidate
+from app.services.inventory import _as_id
+
+TOTAL_FIELDS = {'total_amount': 1, 'total_paid': 1, 'balance': 1}
+ROLLUP_FIELDS = {'tenant': 1, 'date_created': 1, 'sales_channel': 1}
+
+
+def _store(sale, doc):
+    """Copia los totales guardados al documento en memoria (sin marcarlo como modificado)"""
+    if not isinstance(sale, Sale) or not doc:
+        return
+    for db_field, attr in (('total_amount', 'amount_total'), ('total_paid', 'amount_paid'), ('balance', 'amount_balance')):
+        sale._data[attr] = Sale._fields[attr].to_python(doc.get(db_field))
+
+
+def _day(value):
+    return datetime(value.year, value.month, value.day)
+
+
+# ============================================
+# ROLLUP DIARIO
+# ============================================
+def bump_daily(tenant, date, channel, sales_count=0, units=0, revenue=0, paid=0):
+    """Suma las variaciones al rollup del día (lo crea si no existe)"""
+    if tenant is None or date is None:
+        return
+    inc = {
+        'sales_count': int(sales_count),
+        'units': int(units),
+        'revenue': float(revenue or 0),
+        'paid': float(paid or 0),
+    }
+    inc = {k: v for k, v in inc.items() if v}
+    if not inc:
+        return
+    # Ventas y pagos cambian las métricas en caché del tenant
+    invalidate(tenant)
+    SalesDaily._get_collection().update_one(
+        {'tenant': _as_id(tenant), 'day': _day(date), 'channel': channel or 'manual'},
+        {'$inc': inc},
+        upsert=True
+    )
+
+
+def bump_daily_many(increments):
+    """
+    Versión bulk de bump_daily: `increments` es {(tenant, fecha, canal): {campo: delta}}.
+    Agrupa por día y escribe todo en un solo bulk_write.
+    """
+    merged = {}
+    for (tenant, date, channel), deltas in increments.items():
+        if tenant is None or date is None:
+            continue
+        key = (_as_id(tenant), _day(date), channel or 'manual')
+        inc = merged.setdefault(key, {})
+        for field, value in deltas.items():
+            inc[field] = inc.get(field, 0) + value
+    ops = []
+    for (tenant_id, day, channel), inc in merged.items():
+        inc = {k: v for k, v in inc.items() if v}
+        if inc:
+            ops.append(UpdateOne({'tenant': tenant_id, 'day': day, 'channel': channel},
+                                 {'$inc': inc}, upsert=True))
+    if not ops:
+        return
+    for tenant_id in {key[0] for key in merged}:
+        invalidate(tenant_id)
+    SalesDaily._get_collection().bulk_write(ops, ordered=False)
+
+
+def _rollup_key(sale, doc=None):
+    """(tenant, fecha, canal) de la venta, desde el documento o leyendo solo esos campos"""
+    if isinstance(sale, Sale) and sale.date_created is not None:
+        return sale._data.get('tenant'), sale.date_created, sale.sales_channel
+    if doc is None or 'date_created' not in doc:
+        doc = Sale._get_collection().find_one({'_id': _as_id(sale)}, ROLLUP_FIELDS) or {}
+    return doc.get('tenant'), doc.get('date_created'), doc.get('sales_channel')
+
+
+def record_sale(sale):
+    """Cuenta una venta recién creada en el rollup de su día"""
+    tenant, date, channel = _rollup_key(sale)
+    bump_daily(tenant, date, channel, sales_count=1)
+
+
+# ============================================
+# TOTALES POR VENTA
+# ============================================
+def compute_totals(sale_ids):
+    """Retorna {sale_id: (total_items, total_pagos, unidades)} con dos agregaciones"""
+    sale_ids = list(sale_ids)
+    totals = {sale_id: [0.0, 0.0, 0] for sale_id in sale_ids}
+    item_pipeline = [
+        {'$match': {'sale': {'$in': sale_ids}}},
+        {'$group': {
+            '_id': '$sale',
+            'total': {'$sum': {'$multiply': ['$quantity', '$unit_price']}},
+            'units': {'$sum': '$quantity'},
+        }},
+    ]
+    for row in SaleItem._get_collection().aggregate(item_pipeline, allowDiskUse=True):
+        totals[row['_id']][0] = float(row['total'] or 0)
+        totals[row['_id']][2] = int(row['units'] or 0)
+    payment_pipeline = [
+        {'$match': {'sale': {'$in': sale_ids}}},
+        {'$group': {'_id': '$sale', 'total': {'$sum': '$amount'}}},
+    ]
+    for row in Payment._get_collection().aggregate(payment_pipeline, allowDiskUse=True):
+        totals[row['_id']][1] = float(row['total'] or 0)
+    return {sale_id: tuple(values) for sale_id, values in totals.items()}
+
+
+def refresh_totals(sale):
+    """Recalcula los totales de una venta desde sus items y pagos"""
+    sale_id = _as_id(sale)
+    total, paid, _ = compute_totals([sale_id])[sale_id]
+    doc = {'total_amount': total, 'total_paid': paid, 'balance': total - paid}
+    Sale._get_collection().update_one({'_id': sale_id}, {'$set': doc})
+    _store(sale, doc)
+    return doc
+
+
+def add_to_totals(sale, amount=0, paid=0, units=0):
+    """
+    Suma `amount` al total de items y `paid` al total pagado de la venta, y
+    las mismas variaciones (más `units`) al rollup diario.
+
+    Es una sola actualización atómica (pipeline) que también recalcula el
+    saldo, así dos workers registrando pagos a la vez no se pisan.
+    """
+    amount = float(amount or 0)
+    paid = float(paid or 0)
+    if not amount and not paid and not units:
+        return
+    doc = Sale._get_collection().find_one_and_update(
+        {
+            '_id': _as_id(sale),
+            'total_amount': {'$type': 'number'},
+            'total_paid': {'$type': 'number'},
+        },
+        [
+            {'$set': {
+                'total_amount': {'$add': ['$total_amount', amount]},
+                'total_paid': {'$add': ['$total_paid', paid]},
+            }},
+            {'$set': {'balance': {'$subtract': ['$total_amount', '$total_paid']}}},
+        ],
+        projection=dict(TOTAL_FIELDS, **ROLLUP_FIELDS),
+        return_document=ReturnDocument.AFTER
+    )
+    if doc is None:
+        refresh_totals(sale)
+    else:
+        _store(sale, doc)
+
+    tenant, date, channel = _rollup_key(sale, doc)
+    bump_daily(tenant, date, channel, units=units, revenue=amount, paid=paid)
+
+
+def delete_payments(sale, **filters):
+    """Elimina pagos de la venta (filtrados por `filters`) descontándolos del total pagado"""
+    payments = Payment.objects(sale=sale, **filters)
+    removed = sum(float(p.amount or 0) for p in payments.only('amount'))
+    count = payments.delete()
+    if count:
+        add_to_totals(sale, paid=-removed)
+    return count
+
+
+def discard_sale(sale):
+    """
+    Elimina una venta con sus items y pagos (rollback de una creación
+    fallida) y la descuenta del rollup diario.
+    """
+    sale_id = _as_id(sale)
+    total, paid, units = compute_totals([sale_id])[sale_id]
+    tenant, date, channel = _rollup_key(sale)
+    SaleItem._get_collection().delete_many({'sale': sale_id})
+    Payment._get_collection().delete_many({'sale': sale_id})
+    if Sale._get_collection().delete_one({'_id': sale_id}).deleted_count:
+        bump_daily(tenant, date, channel, sales_count=-1, units=-units, revenue=-total, paid=-paid)
+
+
+# ============================================
+# RECONSTRUCCIÓN
+# ============================================
+def _sale_batches(query, projection, batch_size):
+    batch = {}
+    for doc in Sale._get_collection().find(query, projection):
+        batch[doc['_id']] = doc
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def rebuild_sale_totals(tenant=None, verify=False, batch_size=1000):
+    """
+    Recalcula los totales de todas las ventas (opcionalmente de un tenant).
+
+    Con `verify=True` no escribe nada: solo cuenta las ventas cuyos totales
+    guardados no coinciden con los calculados. Retorna un dict con
+    'checked', 'mismatched' y 'updated'.
+    """
+    sales = Sale._get_collection()
+    query = {'tenant': _as_id(tenant)} if tenant is not None else {}
+    result = {'checked': 0, 'mismatched': 0, 'updated': 0}
+
+    for batch in _sale_batches(query, TOTAL_FIELDS, batch_size):
+        computed = compute_totals(batch)
+        ops = []
+        for sale_id, stored in batch.items():
+            total, paid, _ = computed[sale_id]
+            expected = {'total_amount': total, 'total_paid': paid, 'balance': total - paid}
+            if any(stored.get(k) is None or abs(float(stored[k]) - v) > 0.005 for k, v in expected.items()):
+                result['mismatched'] += 1
+                ops.append(UpdateOne({'_id': sale_id}, {'$set': expected}))
+        result['checked'] += len(batch)
+        if ops and not verify:
+            result['updated'] += sales.bulk_write(ops, ordered=False).modified_count
+    return result
+
+
+def rebuild_sales_daily(tenant=None, batch_size=1000):
+    """
+    Reconstruye `sales_daily` desde ventas, items y pagos.
+
+    Reemplaza las filas del alcance (un tenant o todos); los gráficos pueden
+    mostrar cifras parciales mientras corre. Retorna la cantidad de filas.
+    """
+    query = {'tenant': _as_id(tenant)} if tenant is not None else {}
+    rows = {}
+    for batch in _sale_batches(query, ROLLUP_FIELDS, batch_size):
+        computed = compute_totals(batch)
+        for sale_id, doc in batch.items():
+            if not doc.get('tenant') or not doc.get('date_created'):
+                continue
+            key = (doc['tenant'], _day(doc['date_created']), doc.get('sales_channel') or 'manual')
+            row = rows.setdefault(key, {'sales_count': 0, 'units': 0, 'revenue': 0.0, 'paid': 0.0})
+            total, paid, units = computed[sale_id]
+            row['sales_count'] += 1
+            row['units'] += units
+            row['revenue'] += total
+            row['paid'] += paid
+
+    collection = SalesDaily._get_collection()
+    collection.delete_many(query)
+    docs = [dict(tenant=t, day=d, channel=c, **values) for (t, d, c), values in rows.items()]
+    for start in range(0, len(docs), batch_size):
+        collection.insert_many(docs[start:start + batch_size], ordered=False)
+    return len(docs)
+
+
+def read_daily(tenant, start=None, end=None):
+    """
+    Filas del rollup del tenant entre `start` (incluido) y `end` (excluido),
+    ordenadas por día. Una sola lectura sobre el índice (tenant, day, channel).
+    """
+    query = {'tenant': _as_id(tenant)}
+    if start is not None or end is not None:
+        query['day'] = {}
+        if start is not None:
+            query['day']['$gte'] = start
+        if end is not None:
+            query['day']['$lt'] = end
+    return list(SalesDaily._get_collection().find(
+        query, {'_id': 0, 'tenant': 0}, sort=[('day', 1)]
+    ))
@@ -0,0 +1,137 @@
+"""
+Búsqueda indexada de clientes y productos.
+
+Antes se buscaba con `$regex` sin ancla y `$options: 'i'` (o `__icontains`)
+sobre nombre, email y teléfono: ningún índice sirve para eso y cada
+búsqueda recorría la colección completa. Ahora cada documento guarda:
+
+- `search_tokens`: prefijos (edge n-grams) de cada palabra normalizada
+  (minúsculas y sin tildes) de nombre y email, o nombre y SKU:
+  'Pérez' -> ['p', 'pe', 'per', 'pere', 'perez'].
+- `phone_keys` (clientes): el teléfono solo con dígitos, con y sin el 56.
+
+Una búsqueda es entonces `search_tokens: {$all: [palabras]}` (igualdad
+sobre un arreglo indexado: cada palabra de la búsqueda debe ser el
+comienzo de alguna palabra del cliente) o, si son dígitos, un prefijo
+anclado sobre `phone_keys`; ambas las resuelve el índice
+`(tenant, search_tokens, total_spent)` ya ordenadas por `total_spent`.
+
+Los campos se calculan al guardar (ShopifyCustomer.clean, Product.clean)
+y en los upserts de Shopify; los documentos anteriores se completan con
+`python scripts/maintenance.py rebuild-search`.
+
+    search_filter('juan pér')
+    -> {'search_tokens': {'$all': ['juan', 'per']}}
+"""
+import re
+
+from pymongo import UpdateOne
+
+from app.models import Product, ShopifyCustomer
+from app.services.inventory import _as_id
+from app.services.match_tokens import normalize
+
+MAX_GRAM = 15  # palabras más largas se buscan por sus primeros 15 caracteres
+MIN_PHONE = 4  # dígitos desde los que una búsqueda también mira el teléfono
+COUNTRY_CODE = '56'
+REBUILD_BATCH = 1000
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+PHONE_QUERY_RE = re.compile(r'^[\d\s+().-]+$')
+
+
+def words(*texts):
+    found = []
+    for text in texts:
+        if text:
+            found.extend(WORD_RE.findall(normalize(text)))
+    return found
+
+
+def search_tokens(*texts):
+    """Prefijos de cada palabra de los textos (lista ordenada para guardar)"""
+    tokens = set()
+    for word in words(*texts):
+        for size in range(1, min(len(word), MAX_GRAM) + 1):
+            tokens.add(word[:size])
+    return sorted(tokens)
+
+
+def phone_keys(phone):
+    """Dígitos del teléfono, con y sin código de país: '+56 9 1234 5678' -> ['56912345678', '912345678']"""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) < MIN_PHONE:
+        return []
+    keys = [digits]
+    if digits.startswith(COUNTRY_CODE) and len(digits) > 9:
+        keys.append(digits[len(COUNTRY_CODE):])
+    return keys
+
+
+def customer_search_fields(name=None, email=None, phone=None):
+    return {'search_tokens': search_tokens(name, email), 'phone_keys': phone_keys(phone)}
+
+
+def product_search_fields(name=None, sku=None):
+    return {'search_tokens': search_tokens(name, sku)}
+
+
+def search_filter(query, phones=False):
+    """
+    Filtro de Mongo (para `__raw__`) para el texto buscado, o None si no
+    tiene nada buscable. Con `phones`, una búsqueda de solo dígitos también
+    se compara como prefijo con `phone_keys`.
+    """
+    terms = sorted({word[:MAX_GRAM] for word in words(query)})
+    if not terms:
+        return None
+    condition = {'search_tokens': {'$all': terms}}
+    digits = re.sub(r'\D', '', query)
+    if phones and len(digits) >= MIN_PHONE and PHONE_QUERY_RE.match(query):
+        # Prefijo anclado y sensible a mayúsculas: usa el índice
+        return {'$or': [condition, {'phone_keys': {'$regex': f'^{digits}'}}]}
+    return condition
+
+
+def search_products(tenant, query):
+    """
+    QuerySet de productos del tenant que coinciden con `query`: todos si la
+    búsqueda está vacía y ninguno si no tiene palabras buscables ('???', '🍕').
+    """
+    products = Product.objects(tenant=tenant)
+    if not (query or '').strip():
+        return products
+    condition = search_filter(query)
+    return products.filter(__raw__=condition) if condition else products.none()
+
+
+# ============================================
+# RECONSTRUCCIÓN
+# ============================================
+def rebuild_search_fields(tenant=None):
+    """
+    Recalcula los campos de búsqueda de clientes y productos (todos o de un
+    tenant) con bulk_write por lotes. Retorna {'customers', 'products'}
+    con la cantidad de documentos modificados.
+    """
+    query = {} if tenant is None else {'tenant': _as_id(tenant)}
+    sources = {
+        'customers': (ShopifyCustomer, {'name': 1, 'email': 1, 'phone': 1},
+                      lambda doc: customer_search_fields(doc.get('name'), doc.get('email'), doc.get('phone'))),
+        'products': (Product, {'name': 1, 'sku': 1},
+                     lambda doc: product_search_fields(doc.get('name'), doc.get('sku'))),
+    }
+    result = {}
+    for key, (document, projection, fields) in sources.items():
+        collection = document._get_collection()
+        modified = 0
+        ops = []
+        for doc in collection.find(query, projection, batch_size=REBUILD_BATCH):
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': fields(doc)}))
+            if len(ops) >= REBUILD_BATCH:
+                modified += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            modified += collection.bulk_write(ops, ordered=False).modified_count
+        result[key] = modified
+    return result
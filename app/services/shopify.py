@@ -0,0 +1,972 @@
+"""
+Cliente de la API REST de Shopify y upserts bulk de clientes y órdenes.
+
+Antes cada sincronización (la del blueprint de clientes, el preview y
+scripts/sync_shopify.py) hacía `requests.get` sueltos: una conexión TLS
+nueva por página, sin reintentos ante 429, y por cada registro un
+`find().first()` + `save()`. Ahora:
+
+- `ShopifyClient` usa un `requests.Session` con pool de conexiones,
+  respeta el límite de llamadas (header `X-Shopify-Shop-Api-Call-Limit`,
+  balde de 40 que se vacía a 2 por segundo): si el balde está casi lleno
+  espera antes de la siguiente llamada, y ante 429 espera `Retry-After`
+  y reintenta. Los 5xx y errores de conexión se reintentan con backoff.
+- `client.pages(...)` sigue el header `Link` (paginación por cursor) y
+  pide la página siguiente en un hilo mientras se procesa la actual.
+- `upsert_customers` / `upsert_orders` escriben cada página con un solo
+  `bulk_write` de `UpdateOne(upsert=True)`; al final `refresh_customer_stats`
+  recalcula las estadísticas de los clientes tocados con `$group` + `$merge`.
+- `checkpointed_pages` pide solo lo modificado desde la última corrida
+  (`updated_at_min`) y guarda el cursor de cada página en
+  ShopifySyncState para retomar después de una caída.
+- `sales_from_orders` convierte las órdenes nuevas en ventas con mapas de
+  productos precargados e `insert_many` por lotes.
+- Cada documento sincronizado guarda `sync_hash` (hash del payload
+  normalizado): los upserts y `sync_preview` comparan contra un mapa
+  precargado con una sola consulta proyectada y omiten lo que no cambió.
+
+    client = ShopifyClient(get_shopify_headers())
+    for customers in checkpointed_pages(client, tenant, 'customers'):
+        upsert_customers(tenant, customers)
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import islice
+
+import requests
+from requests.adapters import HTTPAdapter
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.models import (
+    InboundOrder, Lot, Product, Sale, SaleItem, ShopifyCustomer, ShopifyOrder, ShopifyOrderLineItem,
+    ShopifySyncState, utc_now
+)
+from app.services.inventory import _as_id, adjust_stock
+from app.services.match_tokens import linked_customers, refresh_account_tokens, sale_tokens
+from app.services.search import customer_search_fields
+from app.services.sales import bump_daily_many
+
+SHOPIFY_API_VERSION = '2026-01'
+PAGE_LIMIT = 250
+CALL_LIMIT_HEADER = 'X-Shopify-Shop-Api-Call-Limit'
+LEAK_RATE = 2.0  # llamadas por segundo que libera el balde (plan estándar)
+THROTTLE_AT = 0.8  # fracción del balde desde la que se espera
+MAX_RETRIES = 5
+TIMEOUT = 30
+# Margen de la marca incremental: cubre relojes desfasados y registros
+# modificados mientras corría la sincronización anterior
+OVERLAP = timedelta(minutes=5)
+EXPIRED_CURSOR_STATUSES = (400, 404, 422)
+# Sobre este número de clientes tocados se recalcula el tenant completo
+# (un $in enorme no le gana a recorrer el índice por tenant)
+MAX_IN_IDS = 20000
+SALE_BATCH = 1000
+# Registros que sync_preview lista por categoría (los totales de `summary` son exactos)
+PREVIEW_LIMIT = 250
+
+
+def shopify_base_url(store=None):
+    store = store or os.environ.get('SHOPIFY_STORE_DOMAIN', '')
+    return f'https://{store}/admin/api/{SHOPIFY_API_VERSION}'
+
+
+class ShopifyError(RuntimeError):
+    """Respuesta no exitosa de Shopify (después de los reintentos)"""
+
+    def __init__(self, status_code, message=''):
+        super().__init__(message or f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+class Page(list):
+    """Página de un listado; `next_url` es el cursor de la siguiente (None en la última)"""
+
+    def __init__(self, items, next_url=None):
+        super().__init__(items)
+        self.next_url = next_url
+
+
+class ShopifyClient:
+    def __init__(self, headers, base_url=None, max_retries=MAX_RETRIES, sleep=time.sleep):
+        self.base_url = (base_url or shopify_base_url()).rstrip('/')
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._wait_until = 0.0
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _url(self, path):
+        if path.startswith('http'):
+            return path
+        return f'{self.base_url}/{path.lstrip("/")}'
+
+    def _throttle(self, response):
+        """Con el balde casi lleno, programa una espera hasta que quede a la mitad"""
+        used, _, limit = response.headers.get(CALL_LIMIT_HEADER, '').partition('/')
+        try:
+            used, limit = int(used), int(limit)
+        except ValueError:
+            return
+        if limit and used >= limit * THROTTLE_AT:
+            self._wait_until = time.monotonic() + (used - limit / 2) / LEAK_RATE
+
+    def get(self, path, params=None):
+        """
+        GET con reintentos. Retorna la respuesta (también las 4xx distintas de
+        429, para que el llamador decida, p. ej. 403 por falta de scope).
+        """
+        attempt = 0
+        while True:
+            wait = self._wait_until - time.monotonic()
+            if wait > 0:
+                self.sleep(wait)
+            try:
+                response = self.session.get(self._url(path), params=params, timeout=TIMEOUT)
+            except requests.ConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+                self.sleep(2 ** attempt)
+                attempt += 1
+                continue
+            self._throttle(response)
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt >= self.max_retries:
+                    return response
+                try:
+                    delay = float(response.headers.get('Retry-After', ''))
+                except ValueError:
+                    delay = 2.0 if response.status_code == 429 else 2 ** attempt
+                self.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def get_json(self, path, params=None):
+        response = self.get(path, params)
+        if response.status_code != 200:
+            raise ShopifyError(response.status_code, response.text[:200])
+        return response.json(), response
+
+    def pages(self, path, key, params=None, prefetch=True, start_url=None):
+        """
+        Itera las páginas de un listado (cada una es una `Page`, la lista
+        bajo `key`). Con `prefetch` la página siguiente se descarga mientras
+        el llamador procesa la actual. `start_url` retoma desde el cursor
+        (`Page.next_url`) de una corrida anterior. Lanza ShopifyError si una
+        página falla.
+        """
+        params = {'limit': PAGE_LIMIT, **(params or {})}
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            data, response = self.get_json(start_url) if start_url else self.get_json(path, params)
+            while True:
+                items = data.get(key, [])
+                next_url = response.links.get('next', {}).get('url') if items else None
+                pending = None
+                if next_url:
+                    # La URL de `next` ya trae page_info y limit
+                    pending = executor.submit(self.get_json, next_url) if executor else next_url
+                if items:
+                    yield Page(items, next_url)
+                if pending is None:
+                    return
+                data, response = pending.result() if executor else self.get_json(pending)
+        finally:
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ============================================
+# SINCRONIZACIÓN INCREMENTAL
+# ============================================
+def sync_state(tenant, resource):
+    state = ShopifySyncState.objects(tenant=tenant, resource=resource).first()
+    return state or ShopifySyncState(tenant=tenant, resource=resource)
+
+
+def _shopify_time(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat(timespec='seconds')
+
+
+def checkpointed_pages(client, tenant, resource, params=None, full=False, incremental=True):
+    """
+    Páginas de `resource` ('customers', 'orders' o 'products') con punto de
+    control en ShopifySyncState:
+
+    - Incremental: pide solo lo modificado desde `updated_at_min` (inicio
+      de la última corrida completa menos OVERLAP). Con `incremental=False`
+      se recorre todo, pero igual se guarda el cursor.
+    - Después de que el llamador procesa cada página se guarda su cursor.
+      Si el proceso cae (o el llamador lanza una excepción), la corrida
+      siguiente retoma desde la página que no se terminó; si Shopify ya no
+      acepta ese cursor, empieza de nuevo desde la marca.
+    - `full` descarta marca y cursor (resincronización completa).
+
+    La marca avanza solo cuando se recorrieron todas las páginas.
+    """
+    state = sync_state(tenant, resource)
+    if full:
+        state.updated_at_min = None
+        state.cursor = None
+    path = f'{resource}.json'
+    params = dict(params or {})
+    resume = state.cursor
+    if not resume:
+        state.run_started_at = utc_now()
+        state.records = 0
+        if incremental and state.updated_at_min:
+            params['updated_at_min'] = _shopify_time(state.updated_at_min)
+    state.save()
+
+    processed = 0
+    pages = client.pages(path, resource, params, start_url=resume)
+    try:
+        for page in pages:
+            yield page
+            processed += 1
+            state.records += len(page)
+            state.cursor = page.next_url
+            state.save()
+    except ShopifyError as e:
+        if not resume or processed or e.status_code not in EXPIRED_CURSOR_STATUSES:
+            raise
+        # Cursor vencido: otra corrida desde la marca (upserts idempotentes)
+        state.cursor = None
+        state.save()
+        yield from checkpointed_pages(client, tenant, resource, params, incremental=incremental)
+        return
+    finally:
+        pages.close()
+
+    state.cursor = None
+    state.last_completed_at = utc_now()
+    if incremental:
+        state.updated_at_min = state.run_started_at - OVERLAP
+    state.save()
+
+
+# ============================================
+# DOCUMENTOS
+# ============================================
+def parse_datetime(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _full_name(data):
+    data = data or {}
+    return f"{data.get('first_name') or ''} {data.get('last_name') or ''}".strip()
+
+
+def _tags(raw):
+    if isinstance(raw, list):
+        return [t.strip().lower() for t in raw if t and t.strip()]
+    return [t.strip().lower() for t in (raw or '').split(',') if t.strip()]
+
+
+def customer_fields(data):
+    """Campos de ShopifyCustomer desde un cliente de customers.json (con los de búsqueda)"""
+    address = data.get('default_address') or {}
+    name = _full_name(data)
+    phone = data.get('phone') or address.get('phone')
+    return {
+        'name': name,
+        'email': data.get('email'),
+        'phone': phone,
+        **customer_search_fields(name, data.get('email'), phone),
+        'address_city': address.get('city'),
+        'address_province': address.get('province'),
+        'address_country': address.get('country'),
+        'tags': _tags(data.get('tags')),
+        'total_orders': data.get('orders_count', 0) or 0,
+        'total_spent': float(data.get('total_spent') or 0),
+        'created_at': parse_datetime(data.get('created_at')),
+    }
+
+
+def customer_from_order(order_data):
+    """Campos de un cliente que solo conocemos por una orden (sin scope read_customers)"""
+    data = order_data.get('customer') or {}
+    shipping = order_data.get('shipping_address') or {}
+    name = _full_name(data) or 'Cliente Shopify'
+    email = data.get('email') or order_data.get('email')
+    phone = shipping.get('phone') or data.get('phone')
+    return {
+        'name': name,
+        'email': email,
+        'phone': phone,
+        **customer_search_fields(name, email, phone),
+        'address_city': shipping.get('city'),
+        'address_province': shipping.get('province'),
+        'address_country': shipping.get('country', 'Chile'),
+        'created_at': utc_now(),
+    }
+
+
+def order_fields(data):
+    """Campos de ShopifyOrder (sin cliente) desde una orden de orders.json"""
+    shipping = data.get('shipping_address') or {}
+    line_items = [ShopifyOrderLineItem(
+        title=item.get('title'),
+        sku=item.get('sku'),
+        quantity=item.get('quantity', 1),
+        price=float(item.get('price') or 0),
+        variant_title=item.get('variant_title'),
+        product_shopify_id=str(item['product_id']) if item.get('product_id') else None,
+    ).to_mongo().to_dict() for item in data.get('line_items', [])]
+    return {
+        'order_number': data.get('order_number'),
+        'customer_name': _full_name(data.get('customer')),
+        'email': data.get('email'),
+        'total_price': float(data.get('total_price') or 0),
+        'subtotal_price': float(data.get('subtotal_price') or 0),
+        'financial_status': data.get('financial_status'),
+        'fulfillment_status': data.get('fulfillment_status'),
+        'shipping_address1': shipping.get('address1'),
+        'shipping_address2': shipping.get('address2'),
+        'shipping_city': shipping.get('city'),
+        'shipping_province': shipping.get('province'),
+        'shipping_phone': shipping.get('phone'),
+        'note': data.get('note'),
+        'line_items': line_items,
+        'created_at': parse_datetime(data.get('created_at')),
+    }
+
+
+def _drop_none_dates(fields):
+    # Sin fecha en Shopify se conserva la que ya tenía el documento
+    if fields.get('created_at') is None:
+        fields.pop('created_at', None)
+    return fields
+
+
+# ============================================
+# UPSERTS
+# ============================================
+def content_hash(fields):
+    """Hash estable (sha1) de los campos normalizados que la sincronización escribe"""
+    payload = json.dumps(fields, sort_keys=True, default=str, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def product_hash(data):
+    """Hash de los campos de un producto de products.json que usa la sincronización (incluye stock)"""
+    variant = (data.get('variants') or [{}])[0]
+    return content_hash({
+        'title': data.get('title'),
+        'body_html': data.get('body_html'),
+        'product_type': data.get('product_type'),
+        'tags': data.get('tags'),
+        'sku': variant.get('sku'),
+        'price': variant.get('price'),
+        'inventory_quantity': variant.get('inventory_quantity'),
+    })
+
+
+def known_hashes(document, tenant, shopify_ids=None):
+    """
+    {shopify_id: sync_hash} de los documentos del tenant (o solo de
+    `shopify_ids`), con una consulta proyectada: basta para decidir en
+    memoria qué registros de Shopify son nuevos, cuáles cambiaron y cuáles no.
+    """
+    query = {'tenant': _as_id(tenant), 'shopify_id': {'$type': 'string'}}
+    if shopify_ids is not None:
+        query['shopify_id'] = {'$in': list(shopify_ids)}
+    return {doc['shopify_id']: doc.get('sync_hash') for doc in document._get_collection().find(
+        query, {'_id': 0, 'shopify_id': 1, 'sync_hash': 1}
+    )}
+
+
+def upsert_customers(tenant, customers_data, known=None):
+    """
+    Upsert de una página de clientes. Solo escribe los nuevos o los que
+    cambiaron (según `sync_hash`). `known` es el mapa de known_hashes
+    precargado para toda la sincronización (se actualiza con lo escrito);
+    sin él se consulta el de la página. Los tokens de conciliación de las
+    ventas de los clientes actualizados se recalculan (refresh_account_tokens).
+    Retorna {'created', 'updated', 'unchanged'}.
+    """
+    tenant_id = _as_id(tenant)
+    if known is None:
+        known = known_hashes(ShopifyCustomer, tenant_id, {str(data['id']) for data in customers_data})
+    now = utc_now()
+    ops = []
+    unchanged = 0
+    for data in customers_data:
+        shopify_id = str(data['id'])
+        fields = _drop_none_dates(customer_fields(data))
+        digest = content_hash(fields)
+        if known.get(shopify_id) == digest:
+            unchanged += 1
+            continue
+        known[shopify_id] = digest
+        ops.append(UpdateOne(
+            {'tenant': tenant_id, 'shopify_id': shopify_id},
+            {'$set': {**fields, 'sync_hash': digest, 'updated_at': now},
+             '$setOnInsert': {'source': 'shopify'}},
+            upsert=True
+        ))
+    if not ops:
+        return {'created': 0, 'updated': 0, 'unchanged': unchanged}
+    collection = ShopifyCustomer._get_collection()
+    result = collection.bulk_write(ops, ordered=False)
+    # Los clientes que cambiaron pueden ser titulares de pedidos ya convertidos en venta
+    changed = [op._filter['shopify_id'] for idx, op in enumerate(ops) if idx not in result.upserted_ids]
+    if changed:
+        refresh_account_tokens(tenant_id, [doc['_id'] for doc in collection.find(
+            {'tenant': tenant_id, 'shopify_id': {'$in': changed}}, {'_id': 1}
+        )])
+    return {'created': result.upserted_count, 'updated': len(ops) - result.upserted_count, 'unchanged': unchanged}
+
+
+def _order_document(data, customer_map):
+    """Campos que la sincronización escribe para una orden (con su cliente enlazado)"""
+    fields = _drop_none_dates(order_fields(data))
+    fields['customer'] = customer_map.get(str((data.get('customer') or {}).get('id') or ''))
+    return fields
+
+
+def upsert_orders(tenant, orders_data, create_customers=False, known=None):
+    """
+    Upsert de una página de órdenes, enlazadas a su cliente. Con
+    `create_customers` crea los clientes que falten desde los datos de la
+    orden. Solo escribe las órdenes nuevas o que cambiaron (`sync_hash`,
+    incluye el cliente enlazado); `known` como en upsert_customers.
+    Retorna {'created', 'updated', 'unchanged', 'customers_created',
+    'customer_ids'}; `customer_ids` son los clientes de las órdenes escritas,
+    para pasarlos a refresh_customer_stats al terminar la sincronización.
+    """
+    tenant_id = _as_id(tenant)
+    customers = ShopifyCustomer._get_collection()
+    now = utc_now()
+    customer_ids = {str(o['customer']['id']) for o in orders_data if (o.get('customer') or {}).get('id')}
+
+    customers_created = 0
+    if create_customers and customer_ids:
+        first_order = {}
+        for data in orders_data:
+            customer_id = str((data.get('customer') or {}).get('id') or '')
+            if customer_id and customer_id not in first_order:
+                first_order[customer_id] = data
+        # $setOnInsert: los clientes existentes no se tocan
+        result = customers.bulk_write([UpdateOne(
+            {'tenant': tenant_id, 'shopify_id': customer_id},
+            {'$setOnInsert': {**customer_from_order(data), 'source': 'shopify', 'tags': [],
+                              'total_orders': 0, 'total_spent': 0.0, 'updated_at': now}},
+            upsert=True
+        ) for customer_id, data in first_order.items()], ordered=False)
+        customers_created = result.upserted_count
+
+    customer_map = {}
+    if customer_ids:
+        customer_map = {doc['shopify_id']: doc['_id'] for doc in customers.find(
+            {'tenant': tenant_id, 'shopify_id': {'$in': list(customer_ids)}}, {'shopify_id': 1}
+        )}
+    if known is None:
+        known = known_hashes(ShopifyOrder, tenant_id, {str(data['id']) for data in orders_data})
+
+    ops = []
+    touched = set()
+    unchanged = 0
+    for data in orders_data:
+        shopify_id = str(data['id'])
+        fields = _order_document(data, customer_map)
+        digest = content_hash(fields)
+        if known.get(shopify_id) == digest:
+            unchanged += 1
+            continue
+        known[shopify_id] = digest
+        if fields['customer'] is not None:
+            touched.add(fields['customer'])
+        fields['sync_hash'] = digest
+        fields['updated_at'] = now
+        ops.append(UpdateOne({'tenant': tenant_id, 'shopify_id': shopify_id}, {'$set': fields}, upsert=True))
+    stats = {'created': 0, 'updated': 0, 'unchanged': unchanged,
+             'customers_created': customers_created, 'customer_ids': touched}
+    if ops:
+        result = ShopifyOrder._get_collection().bulk_write(ops, ordered=False)
+        stats['created'] = result.upserted_count
+        stats['updated'] = len(ops) - result.upserted_count
+    return stats
+
+
+def upsert_product(tenant, data, known):
+    """
+    Crea o actualiza el Product de un producto de products.json (por SKU y
+    luego por shopify_id) y deja su stock en el lote SHOPIFY-<sku>. `known`
+    es el mapa de known_hashes(Product, ...): si el hash no cambió no
+    escribe nada. Retorna 'created', 'updated' o 'unchanged'.
+    """
+    shopify_id = str(data['id'])
+    sync_hash = product_hash(data)
+    if known.get(shopify_id) == sync_hash:
+        return 'unchanged'
+    variants = data.get('variants', [])
+    variant = variants[0] if variants else {}
+    sku = variant.get('sku', '')
+    price = Decimal(str(variant.get('price', '0')))
+    inv_qty = variant.get('inventory_quantity', 0)
+
+    # Strip HTML
+    desc_html = data.get('body_html', '') or ''
+    description = re.sub(r'<[^>]+>', '', desc_html).strip()
+
+    # Find or create product
+    existing = None
+    if sku:
+        existing = Product.objects(sku=sku, tenant=tenant).first()
+    if not existing:
+        existing = Product.objects(shopify_id=shopify_id, tenant=tenant).first()
+
+    if existing:
+        existing.name = data.get('title', existing.name)
+        existing.base_price = price
+        existing.shopify_id = shopify_id
+        existing.sync_hash = sync_hash
+        if description:
+            existing.description = description[:500]
+        existing.save()
+        outcome = 'updated'
+        product = existing
+    else:
+        product = Product(
+            name=data.get('title', 'Sin nombre'),
+            sku=sku or f"SHP-{shopify_id[-6:]}",
+            base_price=price,
+            description=description[:500] if description else '',
+            category=data.get('product_type', 'Shopify'),
+            shopify_id=shopify_id,
+            sync_hash=sync_hash,
+            critical_stock=10,
+            stock_current=0,
+            tenant=tenant
+        )
+        product.save()
+        outcome = 'created'
+    known[shopify_id] = sync_hash
+
+    # Update stock via Lot
+    if inv_qty > 0:
+        lot = Lot.objects(product=product, lot_code=f'SHOPIFY-{product.sku}').first()
+        if lot:
+            previous_qty = lot.quantity_current
+            lot.quantity_current = inv_qty
+            lot.quantity_initial = max(lot.quantity_initial, inv_qty)
+            lot.save()
+            adjust_stock(product, inv_qty - previous_qty, tenant=tenant)
+        else:
+            # Create inbound order if needed
+            today_str = utc_now().strftime('%Y%m%d')
+            order = InboundOrder.objects(
+                invoice_number=f'SHOPIFY-SYNC-{today_str}',
+                tenant=tenant
+            ).first()
+            if not order:
+                order = InboundOrder(
+                    supplier_name='Sync Shopify',
+                    invoice_number=f'SHOPIFY-SYNC-{today_str}',
+                    status='received',
+                    date_received=utc_now(),
+                    notes='Stock sincronizado desde Shopify',
+                    tenant=tenant,
+                    created_at=utc_now()
+                )
+                order.save()
+
+            lot = Lot(
+                product=product,
+                order=order,
+                tenant=tenant,
+                lot_code=f'SHOPIFY-{product.sku}',
+                quantity_initial=inv_qty,
+                quantity_current=inv_qty
+            )
+            lot.save()
+            adjust_stock(product, inv_qty, tenant=tenant)
+    return outcome
+
+
+def refresh_customer_stats(tenant, customer_ids=None):
+    """
+    Recalcula total_orders, total_spent y fechas de primera/última compra
+    de los clientes desde sus órdenes, en una sola agregación: `$group`
+    sobre shopify_orders y `$merge` en shopify_customers (sin traer
+    documentos a Python). Con `customer_ids` solo esos clientes (los
+    tocados en la sincronización); con None, todos los del tenant (o de
+    todos los tenants si `tenant` es None). Los clientes sin órdenes
+    conservan sus valores.
+    """
+    match = {'customer': {'$ne': None}}
+    if tenant is not None:
+        match['tenant'] = _as_id(tenant)
+    if customer_ids is not None:
+        customer_ids = [cid for cid in customer_ids if cid is not None]
+        if not customer_ids:
+            return
+        if len(customer_ids) <= MAX_IN_IDS:
+            match['customer'] = {'$in': customer_ids}
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': '$customer',
+            'total_orders': {'$sum': 1},
+            'total_spent': {'$sum': {'$ifNull': ['$total_price', 0]}},
+            'first_order_date': {'$min': '$created_at'},
+            'last_order_date': {'$max': '$created_at'},
+        }},
+        {'$merge': {
+            'into': ShopifyCustomer._get_collection_name(),
+            'on': '_id',
+            'whenMatched': 'merge',
+            'whenNotMatched': 'discard',
+        }},
+    ]
+    ShopifyOrder._get_collection().aggregate(pipeline, allowDiskUse=True)
+
+
+# ============================================
+# VENTAS DESDE ÓRDENES
+# ============================================
+SHIPPING_FIELDS = ('shipping_address1', 'shipping_address2', 'shipping_city', 'shipping_province')
+ORDER_PROJECTION = {
+    'shopify_id': 1, 'order_number': 1, 'customer_name': 1, 'note': 1, 'created_at': 1,
+    'financial_status': 1, 'fulfillment_status': 1, 'shipping_phone': 1, 'line_items': 1, 'customer': 1,
+    **{field: 1 for field in SHIPPING_FIELDS},
+}
+
+
+def _shipping_address(order):
+    return ', '.join(order[field] for field in SHIPPING_FIELDS if order.get(field))
+
+
+def _product_maps(tenant_id):
+    """({sku: product_id}, {shopify_id: product_id}) del tenant en una consulta"""
+    by_sku, by_shopify_id = {}, {}
+    for doc in Product._get_collection().find({'tenant': tenant_id}, {'sku': 1, 'shopify_id': 1}):
+        if doc.get('sku'):
+            by_sku.setdefault(doc['sku'], doc['_id'])
+        if doc.get('shopify_id'):
+            by_shopify_id.setdefault(doc['shopify_id'], doc['_id'])
+    return by_sku, by_shopify_id
+
+
+def converted_orders(tenant_id, order_filter=None, projection=None):
+    """{shopify_order_id: venta} de las órdenes del tenant que ya tienen venta (una consulta proyectada)"""
+    return {doc['shopify_order_id']: doc for doc in Sale._get_collection().find(
+        {'tenant': tenant_id, 'shopify_order_id': order_filter or {'$type': 'string'}},
+        projection or {'shopify_order_id': 1}
+    )}
+
+
+def sales_from_orders(tenant, refresh_addresses=False, batch_size=SALE_BATCH, order_ids=None):
+    """
+    Crea una venta (Sale + SaleItem) por cada ShopifyOrder del tenant que
+    aún no tiene una. Los productos (por SKU y luego por shopify_id) y las
+    órdenes ya convertidas se cargan una vez; las ventas e items se arman
+    en memoria con sus totales y se insertan con `insert_many` por lotes,
+    sumando el rollup diario con un solo bulk por lote.
+
+    Con `refresh_addresses` completa la dirección y el teléfono de las
+    ventas ya creadas si la orden trae datos más completos. Con `order_ids`
+    (shopify_id) solo considera esas órdenes (webhooks).
+    Retorna {'created', 'skipped', 'updated'}.
+    """
+    tenant_id = _as_id(tenant)
+    order_filter = {'$type': 'string'} if order_ids is None else {'$in': list(order_ids)}
+    projection = {'shopify_order_id': 1}
+    if refresh_addresses:
+        projection.update(address=1, phone=1)
+    existing = converted_orders(tenant_id, order_filter, projection)
+    by_sku, by_shopify_id = _product_maps(tenant_id)
+    stats = {'created': 0, 'skipped': 0, 'updated': 0}
+    sales, items, updates, rollup = [], [], [], {}
+
+    def flush():
+        if sales:
+            Sale._get_collection().insert_many(sales)
+            if items:
+                SaleItem._get_collection().insert_many(items)
+            bump_daily_many(rollup)
+            stats['created'] += len(sales)
+        if updates:
+            stats['updated'] += Sale._get_collection().bulk_write(updates, ordered=False).modified_count
+        sales.clear()
+        items.clear()
+        updates.clear()
+        rollup.clear()
+
+    now = utc_now()
+    query = {'tenant': tenant_id}
+    if order_ids is not None:
+        query['shopify_id'] = order_filter
+    orders = ShopifyOrder._get_collection().find(query, ORDER_PROJECTION, batch_size=batch_size)
+    while True:
+        chunk = list(islice(orders, batch_size))
+        if not chunk:
+            break
+        # Titular de la cuenta de las órdenes sin venta: tokens de conciliación
+        accounts = linked_customers(order.get('customer') for order in chunk if order['shopify_id'] not in existing)
+        for order in chunk:
+            address = _shipping_address(order)
+            phone = order.get('shipping_phone') or ''
+            current = existing.get(order['shopify_id'])
+            if current is not None:
+                stats['skipped'] += 1
+                if refresh_addresses:
+                    changes = {}
+                    if not current.get('address') or len(current['address']) < len(address):
+                        changes['address'] = address[:200]
+                    if not current.get('phone') and phone:
+                        changes['phone'] = phone[:20]
+                    if changes:
+                        updates.append(UpdateOne({'_id': current['_id']}, {'$set': changes}))
+                continue
+
+            # Documentos crudos (mismos campos que Sale/SaleItem.to_mongo()): construir y
+            # validar documentos MongoEngine costaba más que la escritura misma
+            sale_id = ObjectId()
+            total = 0.0
+            units = 0
+            for line in order.get('line_items') or []:
+                product_id = by_sku.get(line.get('sku')) if line.get('sku') else None
+                if product_id is None and line.get('product_shopify_id'):
+                    product_id = by_shopify_id.get(line['product_shopify_id'])
+                if product_id is None:
+                    continue
+                quantity = int(line.get('quantity') or 1)
+                unit_price = round(float(line.get('price') or 0), 2)
+                items.append({'sale': sale_id, 'product': product_id, 'quantity': quantity, 'unit_price': unit_price})
+                total += quantity * unit_price
+                units += quantity
+
+            customer_name = order.get('customer_name') or 'Cliente Shopify'
+            date_created = order.get('created_at') or now
+            total = round(total, 2)
+            sales.append({
+                '_id': sale_id,
+                'customer_name': customer_name[:100],
+                'address': address[:200],
+                'phone': phone[:20],
+                'status': 'pending',
+                'payment_confirmed': False,
+                'sale_type': 'con_despacho',
+                'sales_channel': 'shopify',
+                'delivery_status': 'entregado' if order.get('fulfillment_status') == 'fulfilled' else 'pendiente',
+                'payment_status': 'pagado' if order.get('financial_status') == 'paid' else 'pendiente',
+                'date_created': date_created,
+                'shopify_order_id': order['shopify_id'],
+                'shopify_order_number': order.get('order_number'),
+                # La nota del pedido suele traer el RUT para la boleta/factura
+                'match_tokens': sale_tokens(customer_name, order.get('order_number'), order.get('note'),
+                                            account=accounts.get(order.get('customer'), ())),
+                'total_amount': total,
+                'total_paid': 0.0,
+                'balance': total,
+                'tenant': tenant_id,
+            })
+            existing[order['shopify_id']] = {'_id': sale_id}
+            deltas = rollup.setdefault((tenant_id, date_created, 'shopify'),
+                                       {'sales_count': 0, 'units': 0, 'revenue': 0.0})
+            deltas['sales_count'] += 1
+            deltas['units'] += units
+            deltas['revenue'] += total
+            if len(sales) >= batch_size or len(updates) >= batch_size:
+                flush()
+    flush()
+    return stats
+
+
+# ============================================
+# PREVIEW
+# ============================================
+def _preview_pages(client, tenant, resource, params=None, full=False):
+    """Páginas que traería la próxima sincronización (solo lectura: no toca el punto de control)"""
+    params = dict(params or {})
+    state = sync_state(tenant, resource)
+    if not full and state.updated_at_min and resource != 'products':
+        params['updated_at_min'] = _shopify_time(state.updated_at_min)
+    return client.pages(f'{resource}.json', resource, params)
+
+
+def _add(section, kind, entry, limit):
+    section['counts'][kind] += 1
+    if len(section[kind]) < limit:
+        section[kind].append(entry)
+
+
+def sync_preview(client, tenant, full=False, limit=PREVIEW_LIMIT):
+    """
+    Qué haría la sincronización sin aplicarla: para productos, clientes y
+    órdenes, cuáles son nuevos, cuáles cambiaron y cuántos no cambiaron; en
+    `sales`, las órdenes que terminarían convertidas en venta (las traídas
+    y las ya guardadas en `shopify_orders` que aún no tienen venta).
+
+    Un solo recorrido de las páginas que pediría la sincronización contra
+    un mapa en memoria de cada colección (una consulta proyectada por
+    colección): un registro cambió si su hash de contenido difiere del
+    `sync_hash` guardado, igual que en los upserts. Las listas se cortan en
+    `limit`; los conteos de `summary` son exactos.
+    """
+    tenant_id = _as_id(tenant)
+    preview = {
+        'products': {'new': [], 'update': [], 'unchanged': 0},
+        'customers': {'new': [], 'update': [], 'unchanged': 0},
+        'orders': {'new': [], 'update': [], 'unchanged': 0},
+        'sales': {'new': []},
+        'errors': []
+    }
+    for section in ('products', 'customers', 'orders', 'sales'):
+        preview[section]['counts'] = {'new': 0, 'update': 0}
+
+    # ---- Productos (siempre completos, como en la sincronización) ----
+    section = preview['products']
+    try:
+        by_sku, by_shopify_id = {}, {}
+        for doc in Product._get_collection().find(
+            {'tenant': tenant_id},
+            {'sku': 1, 'shopify_id': 1, 'sync_hash': 1, 'name': 1, 'base_price': 1, 'stock_current': 1}
+        ):
+            if doc.get('sku'):
+                by_sku[doc['sku']] = doc
+            if doc.get('shopify_id'):
+                by_shopify_id[doc['shopify_id']] = doc
+
+        for page in _preview_pages(client, tenant_id, 'products', full=full):
+            for p_data in page:
+                shopify_id = str(p_data['id'])
+                known = by_shopify_id.get(shopify_id)
+                if known and known.get('sync_hash') == product_hash(p_data):
+                    section['unchanged'] += 1
+                    continue
+                variant = (p_data.get('variants') or [{}])[0]
+                sku = variant.get('sku') or ''
+                entry = {
+                    'sku': sku or f"SHP-{shopify_id[-6:]}",
+                    'name': p_data.get('title', 'Sin nombre'),
+                    'price': float(variant.get('price') or 0),
+                    'stock': variant.get('inventory_quantity', 0)
+                }
+                existing = (by_sku.get(sku) if sku else None) or known
+                if not existing:
+                    _add(section, 'new', entry, limit)
+                    continue
+                changes = []
+                if existing.get('name') != entry['name']:
+                    changes.append(f"nombre: {existing.get('name')} → {entry['name']}")
+                if float(str(existing.get('base_price') or 0)) != entry['price']:
+                    changes.append(f"precio: ${existing.get('base_price')} → ${entry['price']}")
+                if (existing.get('stock_current') or 0) != entry['stock']:
+                    changes.append(f"stock: {existing.get('stock_current') or 0} → {entry['stock']}")
+                entry['changes'] = changes or ['otros campos']
+                _add(section, 'update', entry, limit)
+    except ShopifyError as e:
+        preview['errors'].append(f'Error al obtener productos: {e.status_code}')
+
+    # ---- Clientes (lo modificado desde la última sincronización) ----
+    section = preview['customers']
+    customer_map = {}
+    try:
+        known = {}
+        for doc in ShopifyCustomer._get_collection().find(
+            {'tenant': tenant_id, 'shopify_id': {'$type': 'string'}},
+            {'shopify_id': 1, 'sync_hash': 1, 'name': 1, 'email': 1}
+        ):
+            known[doc['shopify_id']] = doc
+            customer_map[doc['shopify_id']] = doc['_id']
+
+        for page in _preview_pages(client, tenant_id, 'customers', full=full):
+            for c_data in page:
+                fields = _drop_none_dates(customer_fields(c_data))
+                existing = known.get(str(c_data['id']))
+                if existing and existing.get('sync_hash') == content_hash(fields):
+                    section['unchanged'] += 1
+                    continue
+                entry = {'name': fields['name'], 'email': fields['email'] or ''}
+                if not existing:
+                    _add(section, 'new', entry, limit)
+                    continue
+                changes = []
+                if existing.get('name') != fields['name']:
+                    changes.append('nombre')
+                if (existing.get('email') or '') != entry['email']:
+                    changes.append('email')
+                entry['changes'] = changes or ['otros campos']
+                _add(section, 'update', entry, limit)
+    except ShopifyError as e:
+        # 403: sin scope read_customers (la sincronización los extrae de las órdenes)
+        preview['errors'].append(f'Error al obtener clientes: {e.status_code}')
+
+    # ---- Órdenes ----
+    section = preview['orders']
+    sales = preview['sales']
+    known = known_hashes(ShopifyOrder, tenant_id)
+    converted = converted_orders(tenant_id)
+    fetched = set()
+    try:
+        for page in _preview_pages(client, tenant_id, 'orders', {'status': 'any'}, full=full):
+            for o_data in page:
+                shopify_id = str(o_data['id'])
+                fetched.add(shopify_id)
+                entry = {
+                    'order_number': o_data.get('order_number'),
+                    'customer': _full_name(o_data.get('customer') or {}),
+                    'total': float(o_data.get('total_price') or 0),
+                    'status': o_data.get('financial_status')
+                }
+                if shopify_id not in converted:
+                    _add(sales, 'new', entry, limit)
+                if shopify_id in known and known[shopify_id] == content_hash(_order_document(o_data, customer_map)):
+                    section['unchanged'] += 1
+                    continue
+                _add(section, 'update' if shopify_id in known else 'new', entry, limit)
+    except ShopifyError as e:
+        preview['errors'].append(f'Error al obtener órdenes: {e.status_code}')
+
+    # Órdenes ya guardadas sin venta: la sincronización también las convierte
+    pending = sorted(set(known) - set(converted) - fetched)
+    sales['counts']['new'] += len(pending)
+    slots = limit - len(sales['new'])
+    if pending and slots > 0:
+        for doc in ShopifyOrder._get_collection().find(
+            {'tenant': tenant_id, 'shopify_id': {'$in': pending[:slots]}},
+            {'order_number': 1, 'customer_name': 1, 'total_price': 1, 'financial_status': 1}
+        ):
+            sales['new'].append({
+                'order_number': doc.get('order_number'),
+                'customer': doc.get('customer_name') or '',
+                'total': float(str(doc.get('total_price') or 0)),
+                'status': doc.get('financial_status')
+            })
+
+    summary = {}
+    for name in ('products', 'customers', 'orders'):
+        counts = preview[name].pop('counts')
+        summary[f'{name}_new'] = counts['new']
+        summary[f'{name}_update'] = counts['update']
+        summary[f'{name}_unchanged'] = preview[name]['unchanged']
+    summary['sales_new'] = preview['sales'].pop('counts')['new']
+    summary['has_changes'] = any(v for k, v in summary.items() if not k.endswith('_unchanged'))
+    preview['summary'] = summary
+    return preview
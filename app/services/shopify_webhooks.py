@@ -0,0 +1,269 @@
+"""
+Webhooks de Shopify: recepción inmediata y consumo por lotes.
+
+La sincronización (`/customers/api/customers/sync`) recorre la tienda
+completa cada vez. Con los webhooks `orders/create`, `orders/updated`,
+`customers/update` y `products/update` Shopify avisa cada cambio:
+
+- `POST /api/shopify/webhooks/<tema>` verifica la firma HMAC, guarda el
+  cuerpo crudo en la bandeja (`ShopifyWebhook`) con un solo upsert y
+  responde. Shopify reintenta si no recibe 2xx en 5 segundos, así que no
+  se procesa nada en el request.
+- `WebhookConsumer` (corre en `scripts/job_worker.py`) toma lotes de la
+  bandeja y los aplica con los mismos upserts de la sincronización
+  (app.services.shopify): una página de clientes u órdenes por tenant,
+  luego estadísticas de clientes y ventas de las órdenes nuevas.
+
+Idempotencia: un reenvío trae el mismo `X-Shopify-Webhook-Id` y el upsert
+de la bandeja (`$setOnInsert` por tenant + webhook_id) no lo duplica. Si
+igual llega dos veces el mismo registro (reenvío tras un error, varias
+actualizaciones seguidas), dentro del lote se aplica solo la versión más
+reciente y el hash de contenido (`sync_hash`) hace que reaplicarla no
+escriba nada.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import traceback
+from datetime import timedelta
+
+from app.models import Product, ShopifyWebhook, utc_now
+from app.services.inventory import _as_id
+from app.services.jobs import worker_id
+from app.services.shopify import (
+    known_hashes, parse_datetime, refresh_customer_stats, sales_from_orders, upsert_customers, upsert_orders,
+    upsert_product
+)
+
+HMAC_HEADER = 'X-Shopify-Hmac-Sha256'
+WEBHOOK_BATCH = 250
+MAX_ATTEMPTS = 5
+STALE_AFTER = timedelta(minutes=10)  # 'processing' sin terminar: el consumidor murió
+# Orden de aplicación dentro de un lote: los clientes antes que las órdenes que los enlazan
+RESOURCES = ('customers', 'orders', 'products')
+
+
+def webhook_secret():
+    """Secreto con el que Shopify firma los webhooks (el client secret de la app)"""
+    return os.environ.get('SHOPIFY_WEBHOOK_SECRET') or os.environ.get('SHOPIFY_CLIENT_SECRET', '')
+
+
+def sign(body, secret):
+    """Firma de Shopify: HMAC-SHA256 del cuerpo crudo, en base64"""
+    return base64.b64encode(hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()).decode()
+
+
+def verify_hmac(body, signature, secret=None):
+    secret = webhook_secret() if secret is None else secret
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign(body, secret), signature)
+
+
+# ============================================
+# BANDEJA DE ENTRADA
+# ============================================
+def store_webhook(tenant, topic, body, webhook_id=None, shop_domain=None):
+    """
+    Guarda el webhook en la bandeja con un upsert por (tenant, webhook_id).
+    Retorna False si ya estaba (reenvío de Shopify).
+    """
+    if not webhook_id:
+        webhook_id = 'sha1:' + hashlib.sha1(topic.encode('utf-8') + b'\n' + body).hexdigest()
+    result = ShopifyWebhook._get_collection().update_one(
+        {'tenant': _as_id(tenant), 'webhook_id': webhook_id},
+        {'$setOnInsert': {
+            'topic': topic,
+            'shop_domain': shop_domain,
+            'body': body.decode('utf-8'),
+            'status': 'pending',
+            'attempts': 0,
+            'received_at': utc_now(),
+        }},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+
+def claim_batch(worker, batch_size=WEBHOOK_BATCH):
+    """Toma hasta `batch_size` webhooks pendientes, los más antiguos primero"""
+    inbox = ShopifyWebhook._get_collection()
+    now = utc_now()
+    ids = [doc['_id'] for doc in inbox.find(
+        {'status': 'pending'}, {'_id': 1}, sort=[('received_at', 1)], limit=batch_size
+    )]
+    if not ids:
+        return []
+    inbox.update_many(
+        {'_id': {'$in': ids}, 'status': 'pending'},
+        {'$set': {'status': 'processing', 'worker': worker, 'claimed_at': now}, '$inc': {'attempts': 1}}
+    )
+    # Otro consumidor pudo tomar parte del lote entre el find y el update
+    return list(inbox.find({'_id': {'$in': ids}, 'status': 'processing', 'worker': worker},
+                           sort=[('received_at', 1)]))
+
+
+def release_stale(now=None):
+    """Devuelve a la cola los webhooks que un consumidor caído dejó en 'processing'"""
+    now = now or utc_now()
+    return ShopifyWebhook._get_collection().update_many(
+        {'status': 'processing', 'claimed_at': {'$lt': now - STALE_AFTER}},
+        {'$set': {'status': 'pending', 'worker': None}}
+    ).modified_count
+
+
+def _finish(docs, error=None, retry=True):
+    inbox = ShopifyWebhook._get_collection()
+    now = utc_now()
+    ids = [doc['_id'] for doc in docs]
+    if error is None:
+        inbox.update_many({'_id': {'$in': ids}},
+                          {'$set': {'status': 'done', 'processed_at': now, 'error': None}})
+        return
+    # Se reintenta en las pasadas siguientes hasta MAX_ATTEMPTS
+    pending = [doc['_id'] for doc in docs if retry and doc.get('attempts', 0) < MAX_ATTEMPTS]
+    failed = [i for i in ids if i not in set(pending)]
+    if pending:
+        inbox.update_many({'_id': {'$in': pending}}, {'$set': {'status': 'pending', 'error': error}})
+    if failed:
+        inbox.update_many({'_id': {'$in': failed}},
+                          {'$set': {'status': 'failed', 'processed_at': now, 'error': error}})
+
+
+# ============================================
+# CONSUMO
+# ============================================
+def _version(payload):
+    updated_at = parse_datetime(payload.get('updated_at'))
+    return (updated_at is not None, updated_at)
+
+
+def _group(docs):
+    """
+    {(tenant, recurso): {shopify_id: (payload, [webhooks])}} con la versión
+    más reciente de cada registro. Los cuerpos que no son JSON válido
+    terminan como 'failed' sin reintentos.
+    """
+    groups = {}
+    invalid = []
+    for doc in docs:
+        try:
+            payload = json.loads(doc['body'])
+            shopify_id = str(payload['id'])
+        except (ValueError, TypeError, KeyError):
+            invalid.append(doc)
+            continue
+        records = groups.setdefault((doc['tenant'], doc['topic'].split('/')[0]), {})
+        current = records.get(shopify_id)
+        if current is None:
+            records[shopify_id] = (payload, [doc])
+        elif _version(payload) >= _version(current[0]):
+            records[shopify_id] = (payload, current[1] + [doc])
+        else:
+            current[1].append(doc)
+    if invalid:
+        _finish(invalid, error='Cuerpo JSON inválido', retry=False)
+    return groups
+
+
+def process_batch(docs):
+    """
+    Aplica un lote de webhooks tomados con claim_batch. Cada (tenant,
+    recurso) se escribe con un upsert bulk; si falla, solo esos webhooks
+    vuelven a la cola. Retorna {'customers', 'orders', 'products',
+    'sales_created', 'failed'} con la cantidad de registros aplicados.
+    """
+    stats = {'customers': 0, 'orders': 0, 'products': 0, 'sales_created': 0, 'failed': 0}
+    groups = _group(docs)
+    touched = {}  # tenant -> (clientes con órdenes escritas, shopify_id de las órdenes del lote)
+    for tenant_id, resource in sorted(groups, key=lambda key: (str(key[0]), RESOURCES.index(key[1]))):
+        records = groups[(tenant_id, resource)]
+        payloads = [payload for payload, _ in records.values()]
+        webhooks = [doc for _, group in records.values() for doc in group]
+        try:
+            if resource == 'customers':
+                result = upsert_customers(tenant_id, payloads)
+                stats['customers'] += result['created'] + result['updated']
+            elif resource == 'orders':
+                # Los clientes que aún no existen se crean desde la orden
+                result = upsert_orders(tenant_id, payloads, create_customers=True)
+                stats['orders'] += result['created'] + result['updated']
+                customer_ids, order_ids = touched.setdefault(tenant_id, (set(), set()))
+                customer_ids |= result['customer_ids']
+                order_ids.update(records)
+            else:
+                known = known_hashes(Product, tenant_id, records)
+                for payload in payloads:
+                    if upsert_product(tenant_id, payload, known) != 'unchanged':
+                        stats['products'] += 1
+        except Exception as e:
+            stats['failed'] += len(webhooks)
+            _finish(webhooks, error=f'{type(e).__name__}: {e}'[:1000])
+            continue
+        _finish(webhooks)
+
+    for tenant_id, (customer_ids, order_ids) in touched.items():
+        # Las órdenes ya quedaron guardadas: si esto falla, la próxima sincronización lo completa
+        refresh_customer_stats(tenant_id, customer_ids)
+        stats['sales_created'] += sales_from_orders(tenant_id, order_ids=order_ids)['created']
+    return stats
+
+
+def drain(batch_size=WEBHOOK_BATCH, worker=None):
+    """
+    Procesa lotes hasta vaciar la bandeja. Se detiene en el primer lote con
+    errores, para que los reintentos esperen a la pasada siguiente.
+    Retorna la cantidad de webhooks procesados.
+    """
+    worker = worker or worker_id()
+    processed = 0
+    while True:
+        docs = claim_batch(worker, batch_size)
+        if not docs:
+            return processed
+        stats = process_batch(docs)
+        processed += len(docs)
+        if stats['failed']:
+            return processed
+
+
+def purge_webhooks(older_than_days=7):
+    """Elimina los webhooks procesados más antiguos que N días (los fallidos se conservan)"""
+    cutoff = utc_now() - timedelta(days=older_than_days)
+    return ShopifyWebhook._get_collection().delete_many(
+        {'status': 'done', 'processed_at': {'$lt': cutoff}}
+    ).deleted_count
+
+
+class WebhookConsumer:
+    """Thread que vacía la bandeja de webhooks cada `poll_interval` segundos hasta recibir stop()"""
+
+    def __init__(self, app, batch_size=WEBHOOK_BATCH, poll_interval=2.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        worker = worker_id()
+        with self.app.app_context():
+            release_stale()
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    drain(self.batch_size, worker)
+                    release_stale()
+                except Exception:
+                    self.app.logger.error(f'Consumidor de webhooks Shopify: {traceback.format_exc()}')
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,146 @@
+"""
+Exportación en CSV y NDJSON por streaming.
+
+Las integraciones y las descargas muy grandes no necesitan un libro con
+estilos. `StreamExport` acepta los mismos builders que `XlsxExport`
+(`add_sheet(title, columns, rows, ...)`), pero no lee nada al llamarse:
+guarda la hoja y sus filas (cursores proyectados de pymongo, sin crear
+documentos de MongoEngine) y las recorre recién cuando Flask envía la
+respuesta, en bloques de `CHUNK_ROWS` filas. La memoria no depende del
+total de filas.
+
+Los estilos, `preamble` y `footer` se ignoran: solo se exportan los datos.
+Un archivo CSV tiene una sola tabla; si el builder escribe varias hojas se
+elige con `?sheet=<título>` (por defecto la primera). En NDJSON, sin
+`sheet`, se emiten todas y cada línea lleva la clave `sheet`.
+"""
+import csv
+import io
+import json
+import re
+import unicodedata
+from datetime import date, datetime
+from decimal import Decimal
+
+from bson import Decimal128, ObjectId
+from flask import Response, g, jsonify, request, stream_with_context
+
+CHUNK_ROWS = 500
+
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def column_key(column):
+    """Clave de la columna en NDJSON: `Column.key`, el campo leído o el encabezado normalizado"""
+    if getattr(column, 'key', None):
+        return column.key
+    if isinstance(column.value, str):
+        return column.value
+    text = unicodedata.normalize('NFKD', column.header).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def _plain(value):
+    """Valor serializable: fechas en ISO 8601, ObjectId y Decimal128 como texto"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class StreamExport:
+    """Hojas registradas por un builder, recorridas al enviar la respuesta"""
+
+    def __init__(self, fmt, sheet=None):
+        if fmt not in MIMETYPES:
+            raise ValueError(f'Formato no soportado: {fmt}')
+        self.format = fmt
+        self.sheet = sheet
+        self.sheets = []
+        self.rows = 0
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.format]
+
+    def add_sheet(self, title, columns, rows, **styling):
+        self.sheets.append((title, columns, rows))
+
+    def _selected(self):
+        if self.sheet:
+            wanted = self.sheet.strip().lower()
+            selected = [s for s in self.sheets if s[0].lower() == wanted]
+            if not selected:
+                raise ValueError(f'Hoja no encontrada: {self.sheet}')
+            return selected
+        if self.format == 'csv':
+            return self.sheets[:1]
+        return self.sheets
+
+    def validate(self):
+        """Valida `sheet` antes de empezar a enviar (después ya no hay código de error)"""
+        self._selected()
+
+    def chunks(self):
+        """Genera el archivo en bloques de texto"""
+        if self.format == 'csv':
+            return self._csv_chunks()
+        return self._ndjson_chunks()
+
+    def _csv_chunks(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for title, columns, rows in self._selected():
+            writer.writerow([c.header for c in columns])
+            for idx, row in enumerate(rows, start=1):
+                writer.writerow([_plain(c.extract(row)) for c in columns])
+                self.rows += 1
+                if idx % CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    def _ndjson_chunks(self):
+        sheets = self._selected()
+        tagged = len(sheets) > 1
+        lines = []
+        for title, columns, rows in sheets:
+            keys = [column_key(c) for c in columns]
+            for row in rows:
+                record = {'sheet': title} if tagged else {}
+                record.update(zip(keys, (_plain(c.extract(row)) for c in columns)))
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+                self.rows += 1
+                if len(lines) >= CHUNK_ROWS:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+
+def stream_response(builder, filename, fmt, **args):
+    """
+    Ejecuta el builder con un StreamExport y envía el resultado por partes.
+    `filename` cambia su extensión por la del formato.
+    """
+    try:
+        export = StreamExport(fmt, sheet=request.args.get('sheet'))
+        builder(export, g.current_tenant, **args)
+        export.validate()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    name = f"{filename.rsplit('.', 1)[0]}.{fmt}"
+    return Response(
+        stream_with_context(export.chunks()),
+        mimetype=export.mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{name}"'}
+    )
@@ -0,0 +1,246 @@
+"""
+Exportación a Excel en modo write-only.
+
+Un `Workbook` normal de openpyxl mantiene todas las celdas en memoria y el
+auto-ajuste de anchos recorría cada celda de cada columna. `XlsxExport` usa
+`Workbook(write_only=True)`: las filas se escriben a disco a medida que
+llegan, los anchos se estiman con las primeras `sample_size` filas y el
+archivo se guarda en un temporal que se envía por partes. La memoria queda
+acotada por el lote que produce el generador de filas, no por el total.
+
+Uso:
+    export = XlsxExport()
+    export.add_sheet('Ventas', [
+        Column('ID', lambda s: str(s['_id'])),
+        Column('Fecha', 'date_created', date_format='%Y-%m-%d %H:%M'),
+        Column('Total', 'total', number_format=MONEY_FORMAT),
+    ], rows=cursor, header_color='4F81BD')
+    return export.send('ventas.xlsx')
+
+Las filas pueden ser cualquier objeto (normalmente dicts de un cursor
+proyectado); cada `Column` sabe extraer su valor.
+"""
+import tempfile
+from datetime import date, datetime
+from itertools import chain, islice
+
+from flask import send_file
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MONEY_FORMAT = '#,##0'
+HEADER_FONT = Font(bold=True, color='FFFFFF')
+BOLD_FONT = Font(bold=True)
+CENTER = Alignment(horizontal='center')
+
+_fills = {}
+
+
+def solid_fill(color):
+    """PatternFill sólido (compartido: openpyxl registra cada estilo una vez)"""
+    if color not in _fills:
+        _fills[color] = PatternFill(start_color=color, end_color=color, fill_type='solid')
+    return _fills[color]
+
+
+def batched(iterable, size):
+    """Agrupa un iterable en listas de `size` elementos"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def attach_refs(rows, field, collection, fields, cache):
+    """
+    Agrega a cada fila (dict) el documento referenciado en `field`, como
+    `fila[field + '_doc']` (dict vacío si no existe). Resuelve con un solo
+    `$in` los ids que no están en `cache` ({id: doc}), que se reutiliza
+    entre lotes.
+    """
+    missing = {row.get(field) for row in rows} - cache.keys()
+    missing.discard(None)
+    if missing:
+        for doc in collection.find({'_id': {'$in': list(missing)}}, {f: 1 for f in fields}):
+            cache[doc['_id']] = doc
+        for ref_id in missing:
+            cache.setdefault(ref_id, {})
+    for row in rows:
+        row[field + '_doc'] = cache.get(row.get(field)) or {}
+    return rows
+
+
+class Column:
+    """
+    Columna de una hoja.
+
+    `value` es la clave del dict de la fila o una función fila -> valor.
+    `default` reemplaza valores None o vacíos; `date_format` convierte
+    fechas a texto; `number_format` y `font` (función valor -> Font o None)
+    dan estilo a la celda. `key` es el nombre del campo en las exportaciones
+    NDJSON (ver stream_export.column_key).
+    """
+
+    def __init__(self, header, value, default='', date_format=None, number_format=None, font=None,
+                 key=None):
+        self.header = header
+        self.key = key
+        self.value = value
+        self.default = default
+        self.date_format = date_format
+        self.number_format = number_format
+        self.font = font
+
+    def extract(self, row):
+        value = self.value(row) if callable(self.value) else row.get(self.value)
+        if self.date_format and isinstance(value, (date, datetime)):
+            value = value.strftime(self.date_format)
+        if value is None or value == '':
+            return self.default
+        return value
+
+
+class Styled:
+    """Valor con estilo para filas fijas (títulos, totales)"""
+
+    def __init__(self, value, font=None, number_format=None):
+        self.value = value
+        self.font = font
+        self.number_format = number_format
+
+
+def _text_length(value, number_format=None):
+    if value is None:
+        return 0
+    if number_format and isinstance(value, (int, float)):
+        return len(f'{value:,.0f}')
+    return len(str(value))
+
+
+def estimate_widths(columns, sample, max_width=40, min_width=6):
+    """Ancho de cada columna según el encabezado y las filas de muestra"""
+    widths = []
+    for idx, column in enumerate(columns):
+        longest = max(
+            [len(column.header)] + [_text_length(values[idx], column.number_format) for values in sample]
+        )
+        widths.append(max(min_width, min(max_width, longest + 2)))
+    return widths
+
+
+class XlsxExport:
+    """
+    Libro en modo write-only. `progress` (opcional) se llama con la cantidad
+    de filas escritas cada `PROGRESS_EVERY` filas; lo usan los trabajos en
+    segundo plano para informar avance y detectar cancelación.
+    """
+    PROGRESS_EVERY = 1000
+
+    def __init__(self, sample_size=200, max_width=40, progress=None):
+        self.workbook = Workbook(write_only=True)
+        self.sample_size = sample_size
+        self.max_width = max_width
+        self.progress = progress
+        self.rows = 0
+
+    def _cell(self, ws, value, font=None, number_format=None, fill=None, alignment=None):
+        cell = WriteOnlyCell(ws, value=value)
+        if font is not None:
+            cell.font = font
+        if number_format:
+            cell.number_format = number_format
+        if fill is not None:
+            cell.fill = fill
+        if alignment is not None:
+            cell.alignment = alignment
+        return cell
+
+    def _fixed_row(self, ws, row):
+        cells = []
+        for value in row:
+            if isinstance(value, Styled):
+                value = self._cell(ws, value.value, font=value.font, number_format=value.number_format)
+            cells.append(value)
+        return cells
+
+    def _data_row(self, ws, columns, values, fill):
+        # Las celdas sin estilo se escriben como valores simples (más rápido)
+        cells = []
+        for column, value in zip(columns, values):
+            font = column.font(value) if column.font else None
+            if fill is None and font is None and not column.number_format:
+                cells.append(value)
+            else:
+                cells.append(self._cell(ws, value, font=font, number_format=column.number_format, fill=fill))
+        return cells
+
+    def add_sheet(self, title, columns, rows, header_color='4F81BD', row_color=None,
+                  preamble=(), footer=(), max_width=None):
+        """
+        Escribe una hoja y retorna la cantidad de filas de datos.
+
+        `row_color` es una función fila -> color de relleno (o None).
+        `preamble` y `footer` son filas fijas (listas de valores o `Styled`)
+        antes del encabezado y después de los datos.
+        """
+        ws = self.workbook.create_sheet(title)
+        rows = iter(rows)
+        sample = [(row, [c.extract(row) for c in columns]) for row in islice(rows, self.sample_size)]
+
+        # En write-only los anchos se fijan antes de escribir la primera fila
+        widths = estimate_widths(columns, [v for _, v in sample], max_width or self.max_width)
+        for idx, width in enumerate(widths, start=1):
+            ws.column_dimensions[get_column_letter(idx)].width = width
+
+        for row in preamble:
+            ws.append(self._fixed_row(ws, row))
+        header_fill = solid_fill(header_color)
+        ws.append([
+            self._cell(ws, c.header, font=HEADER_FONT, fill=header_fill, alignment=CENTER) for c in columns
+        ])
+
+        count = 0
+        remaining = ((row, [c.extract(row) for c in columns]) for row in rows)
+        for row, values in chain(sample, remaining):
+            color = row_color(row) if row_color else None
+            ws.append(self._data_row(ws, columns, values, solid_fill(color) if color else None))
+            count += 1
+            self.rows += 1
+            if self.progress and self.rows % self.PROGRESS_EVERY == 0:
+                self.progress(self.rows)
+
+        for row in footer:
+            ws.append(self._fixed_row(ws, row))
+        return count
+
+    def save(self, target):
+        """Guarda el libro en una ruta o archivo abierto"""
+        if not self.workbook.worksheets:
+            self.workbook.create_sheet()
+        self.workbook.save(target)
+
+    def discard(self):
+        """
+        Libera los temporales de las hojas de un libro que no se va a guardar
+        (exportación cancelada o con error). openpyxl solo los borra al guardar.
+        """
+        for ws in self.workbook.worksheets:
+            writer = ws._writer
+            if writer is None or ws.closed:
+                continue
+            try:
+                ws.close()
+            finally:
+                writer.cleanup()
+
+    def send(self, filename):
+        """Guarda el libro en un temporal y lo envía por partes (se borra al cerrar)"""
+        output = tempfile.TemporaryFile()
+        self.save(output)
+        output.seek(0)
+        return send_file(output, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
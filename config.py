@@ -26,3 +26,10 @@ class Config:
 
     # Token de reset expira en 1 hora
     PASSWORD_RESET_TOKEN_MAX_AGE = 3600
+
+    # Caché de endpoints JSON: local (por worker), mongo (compartida) o none
+    API_CACHE_BACKEND = os.environ.get('API_CACHE_BACKEND') or 'local'
+    API_CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE') or 512)
+
+    # Trabajos en segundo plano: archivos generados (compartido con el worker)
+    JOB_ARTIFACT_DIR = os.environ.get('JOB_ARTIFACT_DIR')  # default: instance/jobs
@@ -26,6 +26,8 @@ from app.models import (
     Tenant, Product, Lot, InboundOrder, Sale, SaleItem,
     Wastage, ProductBundle, ActivityLog
 )
+from app.services.loaders import BatchLoader
+from app.services.search import search_products
 
 # Load environment variables
 load_dotenv()
@@ -62,7 +64,7 @@ def serialize_product(product: Product) -> dict:
         "base_price": float(product.base_price) if product.base_price else 0.0,
         "critical_stock": product.critical_stock,
         "total_stock": product.total_stock,  # Computed property
-        "is_bundle": product.is_bundle,  # Computed property
+        "is_bundle": product.is_bundle,
         "expiry_date": product.expiry_date.isoformat() if product.expiry_date else None,
         "tenant": product.tenant.slug if product.tenant else None,
     }
@@ -377,6 +379,10 @@ async def handle_call_tool(
         # Get tenant for all other operations
         tenant = get_tenant(arguments.get("tenant"))
 
+        # Resuelve referencias en lote (una consulta $in por colección)
+        loader = BatchLoader()
+        loader.add([tenant])
+
         if name == "get_products":
             query = {"tenant": tenant}
 
@@ -385,11 +391,10 @@ async def handle_call_tool(
                 query["category"] = arguments["category"]
 
             if "search" in arguments:
-                search_term = arguments["search"]
-                from mongoengine.queryset.visitor import Q
-                query_obj = Product.objects(tenant=tenant).filter(
-                    Q(name__icontains=search_term) | Q(sku__icontains=search_term)
-                )
+                # Prefijos de palabras de nombre y SKU, con índice (app.services.search)
+                query_obj = search_products(tenant, arguments["search"])
+                if "category" in arguments:
+                    query_obj = query_obj.filter(category=arguments["category"])
                 products = list(query_obj)
             else:
                 products = list(Product.objects(**query))
@@ -398,6 +403,7 @@ async def handle_call_tool(
             if arguments.get("low_stock_only"):
                 products = [p for p in products if p.total_stock < p.critical_stock]
 
+            loader.resolve(products, 'tenant')
             serialized = [serialize_product(p) for p in products]
 
             return [
@@ -417,16 +423,22 @@ async def handle_call_tool(
             if not product:
                 return [types.TextContent(type="text", text="Product not found")]
 
+            loader.resolve([product], 'tenant')
             result = serialize_product(product)
 
             # Add lot information
-            lots = [serialize_lot(lot) for lot in product.lots if lot.quantity_current > 0]
+            product_lots = list(Lot.objects(product=product, quantity_current__gt=0))
+            loader.add([product])
+            loader.resolve(product_lots, 'product')
+            loader.resolve(product_lots, 'order')
+            lots = [serialize_lot(lot) for lot in product_lots]
             result["lots"] = lots
 
             # Add bundle components if applicable
             if product.is_bundle:
                 components = []
-                for comp in ProductBundle.objects(bundle=product, tenant=tenant):
+                bundle_rels = loader.resolve(list(ProductBundle.objects(bundle=product, tenant=tenant)), 'component')
+                for comp in bundle_rels:
                     components.append({
                         "component_name": comp.component.name if comp.component else None,
                         "component_id": str(comp.component.id) if comp.component else None,
@@ -468,6 +480,8 @@ Available Lots ({len(lots)}):
             if arguments.get("available_only"):
                 lots = [lot for lot in lots if lot.quantity_current > 0]
 
+            loader.resolve(lots, 'product')
+            loader.resolve(lots, 'order')
             serialized = [serialize_lot(lot) for lot in lots]
 
             return [
@@ -485,11 +499,13 @@ Available Lots ({len(lots)}):
             days = arguments.get("days", 30)
             expiry_threshold = datetime.now() + timedelta(days=days)
 
-            lots = Lot.objects(
+            lots = list(Lot.objects(
                 tenant=tenant,
                 expiry_date__lte=expiry_threshold,
                 quantity_current__gt=0
-            ).order_by('expiry_date')
+            ).order_by('expiry_date'))
+            loader.resolve(lots, 'product')
+            loader.resolve(lots, 'order')
 
             expiring_products = {}
             for lot in lots:
@@ -527,6 +543,8 @@ Available Lots ({len(lots)}):
             limit = arguments.get("limit", 50)
             sales = sales[:limit]
 
+            loader.prefetch_sale_items(sales, with_products=False)
+
             result = f"Found {len(sales)} sales for tenant '{tenant.slug}':\n\n"
             for sale in sales:
                 items_count = len(list(sale.items))
@@ -540,6 +558,7 @@ Available Lots ({len(lots)}):
             if not sale:
                 return [types.TextContent(type="text", text="Sale not found")]
 
+            loader.prefetch_sale_items([sale])
             serialized = serialize_sale(sale)
 
             details = f"""Sale Details:
@@ -608,6 +627,7 @@ Items ({len(serialized['items'])}):
             limit = arguments.get("limit", 50)
             wastage_records = wastage_records[:limit]
 
+            loader.resolve(wastage_records, 'product')
             serialized = [serialize_wastage(w) for w in wastage_records]
 
             result = f"Found {len(serialized)} wastage records for tenant '{tenant.slug}':\n\n"
@@ -620,10 +640,9 @@ Items ({len(serialized['items'])}):
             # Get stats
             total_products = Product.objects(tenant=tenant).count()
 
-            low_stock_products = [
-                p for p in Product.objects(tenant=tenant)
-                if p.total_stock < p.critical_stock
-            ]
+            # Una sola pasada: total_stock lee el contador materializado
+            products = list(Product.objects(tenant=tenant))
+            low_stock_products = [p for p in products if p.total_stock < p.critical_stock]
             low_stock_count = len(low_stock_products)
 
             pending_orders = InboundOrder.objects(tenant=tenant, status="pending").count()
@@ -634,14 +653,16 @@ Items ({len(serialized['items'])}):
 
             # Total stock value (approximation)
             total_value = 0.0
-            for product in Product.objects(tenant=tenant):
+            for product in products:
                 total_value += product.total_stock * float(product.base_price or 0)
+            total_units = tenant.stock_units if tenant.stock_units is not None else sum(p.total_stock for p in products)
 
             stats = f"""Dashboard Statistics for '{tenant.slug}':
 
 Products:
 - Total Products: {total_products}
 - Low Stock Alerts: {low_stock_count}
+- Total Units in Stock: {total_units}
 - Total Inventory Value: ${total_value:,.2f}
 
 Orders:
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Benchmark de la búsqueda de clientes: `$regex` sin ancla (anterior) vs
+tokens de prefijo indexados (app/services/search.py).
+
+Necesita MongoDB: crea un tenant temporal con N clientes sintéticos, crea
+los índices del registro para `shopify_customers`, mide la primera página
+(50 clientes por total_spent) de cada búsqueda con los dos métodos e
+informa latencia (mediana y p95) y documentos examinados (explain). Al
+terminar elimina el tenant y sus clientes (salvo --keep).
+
+Uso:
+    python scripts/benchmark_customer_search.py [--customers 200000] [--repeat 20] [--keep]
+"""
+import sys
+import os
+import argparse
+import random
+import re
+import statistics
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import ShopifyCustomer, Tenant
+from app.services.indexes import INDEXES
+from app.services.search import customer_search_fields, search_filter
+
+FIRST_NAMES = ['Juan', 'María', 'Pedro', 'Camila', 'José', 'Francisca', 'Luis', 'Valentina', 'Diego', 'Javiera',
+               'Matías', 'Constanza', 'Sebastián', 'Catalina', 'Benjamín', 'Antonia', 'Vicente', 'Isidora']
+LAST_NAMES = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda',
+              'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya', 'Flores', 'Espinoza',
+              'Valenzuela', 'Castillo', 'Tapia', 'Reyes', 'Gutiérrez', 'Castro', 'Pizarro', 'Álvarez', 'Vásquez']
+DOMAINS = ['gmail.com', 'hotmail.com', 'yahoo.com', 'outlook.com', 'empresa.cl']
+QUERIES = ['jua', 'juan', 'juan perez', 'sepulveda', 'valenzuela cat', 'hotmail', 'zzzz', '91234', '+56 9 8765']
+PAGE = 50
+
+
+def synthetic(tenant_id, count, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}'
+        first, last = name.split()[:2]
+        email = f'{first.lower()}.{last.lower()}{i}@{rng.choice(DOMAINS)}'
+        phone = f'+569{rng.randrange(10 ** 8):08d}'
+        yield {
+            'tenant': tenant_id, 'name': name, 'email': email, 'phone': phone, 'source': 'import',
+            'total_spent': float(rng.randrange(0, 500000)), 'total_orders': rng.randrange(0, 30), 'tags': [],
+            **customer_search_fields(name, email, phone),
+        }
+
+
+def regex_filter(query):
+    """Búsqueda anterior: substring sin ancla, sin distinguir mayúsculas"""
+    return {'$or': [{field: {'$regex': re.escape(query), '$options': 'i'}} for field in ('name', 'email', 'phone')]}
+
+
+def measure(collection, tenant_id, condition, repeat):
+    query = {'tenant': tenant_id, **condition}
+    sort = [('total_spent', -1), ('_id', -1)]
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(collection.find(query, {'name': 1}).sort(sort).limit(PAGE + 1))
+        timings.append((time.perf_counter() - started) * 1000)
+    stats = collection.find(query).sort(sort).limit(PAGE + 1).explain()['executionStats']
+    p95 = sorted(timings)[max(0, int(len(timings) * 0.95) - 1)]
+    return statistics.median(timings), p95, stats['totalDocsExamined'], stats['nReturned']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la búsqueda de clientes')
+    parser.add_argument('--customers', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20, help='Repeticiones por búsqueda')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='No eliminar el tenant temporal')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.app_context().push()
+    collection = ShopifyCustomer._get_collection()
+    collection.create_indexes(INDEXES['shopify_customers'])
+
+    slug = f'bench-search-{int(time.time())}'
+    tenant = Tenant(name=slug, slug=slug)
+    tenant.save()
+    try:
+        started = time.perf_counter()
+        batch = []
+        for doc in synthetic(tenant.pk, args.customers, args.seed):
+            batch.append(doc)
+            if len(batch) == 5000:
+                collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+        print(f"📊 {args.customers} clientes insertados en {time.perf_counter() - started:.1f} s (tenant {slug})")
+
+        print(f"{'Búsqueda':<16} {'Método':<8} {'Mediana':>9} {'p95':>9} {'Examinados':>11} {'Filas':>6}")
+        for query in QUERIES:
+            for method, condition in (('regex', regex_filter(query)), ('tokens', search_filter(query, phones=True))):
+                median, p95, examined, returned = measure(collection, tenant.pk, condition, args.repeat)
+                print(f"{query:<16} {method:<8} {median:>7.1f}ms {p95:>7.1f}ms {examined:>11} {returned:>6}")
+    finally:
+        if not args.keep:
+            collection.delete_many({'tenant': tenant.pk})
+            tenant.delete()
+
+
+if __name__ == '__main__':
+    main()
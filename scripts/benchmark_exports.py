@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Benchmark de exportaciones: Excel (openpyxl write-only) vs CSV vs NDJSON.
+
+Sin --tenant usa filas sintéticas con la forma de la exportación de ventas
+(no necesita MongoDB). Con --tenant ejecuta el builder real contra la base.
+
+Uso:
+    python scripts/benchmark_exports.py [--rows 50000] [--memory]
+    python scripts/benchmark_exports.py --tenant puerto-distribucion [--export sales]
+"""
+import sys
+import os
+import argparse
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bson import ObjectId
+
+from app.services.stream_export import StreamExport
+from app.services.xlsx_export import Column, MONEY_FORMAT, XlsxExport
+
+COLUMNS = [
+    Column("ID", lambda s: str(s['_id'])),
+    Column("Fecha", 'date_created', date_format="%Y-%m-%d %H:%M"),
+    Column("Cliente", 'customer_name'),
+    Column("Estado", 'status'),
+    Column("Items", 'items'),
+    Column("Total", 'total', default=0, number_format=MONEY_FORMAT),
+    Column("Método Pago", 'payment_method'),
+]
+
+
+def synthetic_builder(count):
+    def builder(export, tenant):
+        start = datetime(2026, 1, 1)
+        rows = ({
+            '_id': ObjectId(),
+            'date_created': start + timedelta(minutes=i),
+            'customer_name': f'Cliente {i % 5000}',
+            'status': 'pending' if i % 3 else 'paid',
+            'items': f'{i % 4 + 1}x Caja Mensual, 1x Promo jurel',
+            'total': 12990.0 + i % 1000,
+            'payment_method': 'transferencia',
+        } for i in range(count))
+        export.add_sheet("Ventas", COLUMNS, rows)
+    return builder
+
+
+def run_xlsx(builder, tenant):
+    export = XlsxExport()
+    builder(export, tenant)
+    with tempfile.TemporaryFile() as output:
+        export.save(output)
+        size = output.tell()
+    return export.rows, size
+
+
+def run_stream(fmt):
+    def run(builder, tenant):
+        export = StreamExport(fmt)
+        builder(export, tenant)
+        size = sum(len(chunk.encode('utf-8')) for chunk in export.chunks())
+        return export.rows, size
+    return run
+
+
+def measure(name, runner, builder, tenant, memory):
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    rows, size = runner(builder, tenant)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    rate = rows / elapsed if elapsed else 0
+    peak_text = f"{peak / 1024 / 1024:>8.1f} MB" if peak is not None else f"{'-':>11}"
+    print(f"{name:<8} {rows:>9} {elapsed:>8.2f} s {rate:>10.0f} filas/s {size / 1024 / 1024:>8.1f} MB {peak_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de formatos de exportación')
+    parser.add_argument('--rows', type=int, default=50000, help='Filas sintéticas')
+    parser.add_argument('--tenant', help='Slug del tenant: usa el builder real contra MongoDB')
+    parser.add_argument('--export', default='sales',
+                        choices=['sales', 'inventory', 'wastage', 'orders', 'customers', 'reconciliation'])
+    parser.add_argument('--memory', action='store_true', help='Mide el pico de memoria (más lento)')
+    args = parser.parse_args()
+
+    tenant = None
+    app = None
+    if args.tenant:
+        from app import create_app
+        from app.models import Tenant
+        from app.routes import customers, reconciliation, reports
+
+        app = create_app()
+        app.app_context().push()
+        tenant = Tenant.objects(slug=args.tenant).first()
+        if not tenant:
+            print(f"❌ Error: Tenant '{args.tenant}' no encontrado")
+            sys.exit(1)
+        builder = {
+            'sales': reports.sales_export,
+            'inventory': reports.inventory_export,
+            'wastage': reports.wastage_export,
+            'orders': reports.orders_export,
+            'customers': customers.customers_export,
+            'reconciliation': reconciliation.reconciliation_export,
+        }[args.export]
+        print(f"📊 Exportación '{args.export}' del tenant {tenant.slug}")
+    else:
+        builder = synthetic_builder(args.rows)
+        print(f"📊 {args.rows} filas sintéticas (forma de la exportación de ventas)")
+
+    print(f"{'Formato':<8} {'Filas':>9} {'Tiempo':>10} {'Velocidad':>17} {'Tamaño':>11} {'Pico mem':>11}")
+    for name, runner in (('xlsx', run_xlsx), ('csv', run_stream('csv')), ('ndjson', run_stream('ndjson'))):
+        measure(name, runner, builder, tenant, args.memory)
+
+
+if __name__ == '__main__':
+    main()
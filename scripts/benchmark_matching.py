@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmark de la asignación de auto-conciliación (sin MongoDB).
+
+Genera transacciones y ventas sintéticas con pocos precios distintos (como
+las cajas y promociones de un tenant real) y compara la asignación global
+de app/services/matching.py con la antigua "primera transacción se queda
+con su mejor venta".
+
+Uso:
+    python scripts/benchmark_matching.py [--transactions 10000] [--sales 50000]
+"""
+import sys
+import os
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.match_tokens import name_similarity, sale_tokens, tokenize
+from app.services.matching import SaleIndex, assign, confidence, MIN_CONFIDENCE, NAME_WEIGHT
+
+PRICES = [9990, 12990, 14990, 19990, 24990, 29990, 34990, 39990, 49990, 59990]
+FIRST_NAMES = ['Juan', 'María', 'Pedro', 'Camila', 'José', 'Francisca', 'Luis', 'Valentina', 'Diego', 'Javiera']
+LAST_NAMES = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda',
+              'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela']
+
+
+def synthetic(transactions, sales, days, seed):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+
+    def when():
+        return start + timedelta(days=rng.randrange(days), minutes=rng.randrange(24 * 60))
+
+    sale_rows = []
+    for i in range(sales):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        sale_rows.append({'_id': i, 'total': float(rng.choice(PRICES) + rng.choice([0, 0, 0, 2990, 5000])),
+                          'date': when(), 'channel': 'manual', 'stored': True, 'name': name,
+                          'tokens': sale_tokens(name)})
+    tx_rows = []
+    for i in range(transactions):
+        sale = rng.choice(sale_rows)
+        # Transferencia por el monto exacto o con una pequeña diferencia, 0-3 días después;
+        # la mayoría trae el nombre (a veces truncado) en la glosa
+        amount = sale['total'] * rng.choice([1, 1, 1, 0.998, 1.004])
+        description = rng.choice(['', f'TRANSF DE {sale["name"].upper()}', f'TEF {sale["name"].upper()[:12]}'])
+        tx_rows.append({'_id': i, 'sale': sale['_id'], 'amount': round(amount), 'description': description,
+                        'tokens': tokenize(description), 'date': sale['date'] + timedelta(days=rng.randrange(4))})
+    return tx_rows, sale_rows
+
+
+def first_come(transactions, sales):
+    """Asignación anterior: cada transacción, en orden, toma su mejor venta libre"""
+    index = SaleIndex(sales)
+    used = set()
+    matches = []
+    for t_idx, tx in enumerate(transactions):
+        best, best_score = None, 0
+        for s_idx in index.candidates(tx['amount'], tx['date']):
+            if s_idx in used:
+                continue
+            score = confidence(tx['amount'], sales[s_idx]['total'], tx['date'], sales[s_idx]['date'])
+            if score < MIN_CONFIDENCE:
+                continue
+            score += NAME_WEIGHT * name_similarity(tx['tokens'], sales[s_idx]['tokens'])
+            if score > best_score:
+                best, best_score = s_idx, score
+        if best is not None:
+            used.add(best)
+            matches.append((t_idx, best, best_score))
+    return matches
+
+
+def report(name, runner, transactions, sales):
+    started = time.perf_counter()
+    matches = runner(transactions, sales)
+    elapsed = time.perf_counter() - started
+    score = sum(m[2] for m in matches)
+    average = score / len(matches) if matches else 0
+    # Conciliaciones con la venta que originó la transacción sintética
+    correct = sum(1 for t, s, _ in matches if transactions[t]['sale'] == sales[s]['_id'])
+    print(f"{name:<12} {len(matches):>9} {correct:>10} {average:>12.2f} {elapsed:>9.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la auto-conciliación')
+    parser.add_argument('--transactions', type=int, default=10000)
+    parser.add_argument('--sales', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=365, help='Días que abarcan las ventas')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    transactions, sales = synthetic(args.transactions, args.sales, args.days, args.seed)
+    print(f"📊 {len(transactions)} transacciones × {len(sales)} ventas en {args.days} días")
+    print(f"{'Método':<12} {'Concilia':>9} {'Correctas':>10} {'Conf. media':>12} {'Tiempo':>11}")
+    report('anterior', first_come, transactions, sales)
+    report('global', assign, transactions, sales)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,8 +14,10 @@ import sys
 from app import create_app
 from app.models import (
     Tenant, User, Product, Sale, SaleItem, Lot, InboundOrder,
-    Wastage, ProductBundle, Supplier, ActivityLog, Payment
+    Wastage, ProductBundle, Supplier, ActivityLog, Payment, SalesDaily
 )
+from app.services.bundles import bump_bundle_version
+from app.services.inventory import rebuild_stock_counters
 
 app = create_app()
 
@@ -77,6 +79,7 @@ def clear_tenant_data(tenant, keep_admin=True):
     # 4. Sales
     count = Sale.objects(tenant=tenant).count()
     Sale.objects(tenant=tenant).delete()
+    SalesDaily.objects(tenant=tenant).delete()
     print(f"  - Sales eliminados: {count}")
 
     # 5. Wastages
@@ -109,6 +112,12 @@ def clear_tenant_data(tenant, keep_admin=True):
     Supplier.objects(tenant=tenant).delete()
     print(f"  - Suppliers eliminados: {count}")
 
+    # Contadores materializados: sin lotes Tenant.stock_units queda en 0, y
+    # los workers descartan el grafo de bundles en caché
+    rebuild_stock_counters(tenant)
+    bump_bundle_version(tenant)
+    print("  - Contadores de stock y grafo de bundles reiniciados")
+
     # 11. Users (opcional, mantener admin)
     if keep_admin:
         # Eliminar todos excepto admins
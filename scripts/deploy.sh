@@ -62,9 +62,13 @@ if [ ! -f /var/lib/docker/volumes/sipud_certbot_certs/_data/live/sipud.cloud/ful
     cp nginx/nginx-initial.conf nginx/nginx.conf
 fi
 
-# Build y levantar
-docker compose build --no-cache web
+# Build y levantar (migrate aplica índices y backfills antes de que arranquen web y worker)
+docker compose build --no-cache web worker migrate
 docker compose up -d
+if [ "$(docker inspect -f '{{.State.ExitCode}}' sipud_migrate)" != "0" ]; then
+    echo "  ⚠ Falló la migración (índices o backfills):"
+    docker compose logs --tail=30 migrate
+fi
 
 echo ""
 echo "  Contenedores:"
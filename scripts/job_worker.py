@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Worker de trabajos en segundo plano (exportaciones, sincronizaciones,
+auto-conciliación). Toma los trabajos de la colección `jobs` que encolan
+los endpoints llamados con ?async=1, y vacía la bandeja de webhooks de
+Shopify (app.services.shopify_webhooks) salvo con --no-webhooks.
+
+Uso:
+    python scripts/job_worker.py [--threads 2] [--poll 2] [--no-webhooks]
+"""
+import sys
+import os
+import argparse
+import signal
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.services.jobs import JobWorker
+from app.services.shopify_webhooks import WebhookConsumer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker de trabajos en segundo plano de SIPUD')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('JOB_WORKER_THREADS', 2)),
+                        help='Trabajos en paralelo en este proceso')
+    parser.add_argument('--poll', type=float, default=2.0, help='Segundos entre consultas a la cola vacía')
+    parser.add_argument('--no-webhooks', action='store_true', help='No procesar los webhooks de Shopify')
+    args = parser.parse_args()
+
+    app = create_app()
+    worker = JobWorker(app, threads=args.threads, poll_interval=args.poll)
+    consumer = consumer_thread = None
+    if not args.no_webhooks:
+        consumer = WebhookConsumer(app, poll_interval=args.poll)
+        consumer_thread = consumer.start()
+
+    def shutdown(signum, frame):
+        print("🛑 Deteniendo worker (se terminan los trabajos en curso)...")
+        worker.stop()
+        if consumer:
+            consumer.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"🚀 Worker de trabajos iniciado ({args.threads} threads)")
+    worker.run()
+    if consumer_thread:
+        consumer_thread.join()
+
+
+if __name__ == '__main__':
+    main()
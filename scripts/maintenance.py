@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Tareas de mantenimiento de datos de SIPUD.
+
+Uso:
+    python scripts/maintenance.py rebuild-stock [--tenant puerto-distribucion]
+    python scripts/maintenance.py rebuild-bundles [--tenant puerto-distribucion]
+    python scripts/maintenance.py sale-totals [--verify] [--tenant puerto-distribucion]
+    python scripts/maintenance.py rebuild-sales-daily [--tenant puerto-distribucion]
+    python scripts/maintenance.py indexes [--diff | --apply [--replace-changed]]
+    python scripts/maintenance.py migrate
+    python scripts/maintenance.py collscan-report [--enable [--slowms 50] | --disable] [--limit 30]
+    python scripts/maintenance.py purge-jobs [--days 7]
+    python scripts/maintenance.py bank-fingerprints [--tenant puerto-distribucion]
+    python scripts/maintenance.py rebuild-match-tokens [--tenant puerto-distribucion]
+    python scripts/maintenance.py rebuild-customer-stats [--tenant puerto-distribucion]
+    python scripts/maintenance.py rebuild-search [--tenant puerto-distribucion]
+"""
+import sys
+import os
+import argparse
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import Tenant
+
+
+def _get_tenant(slug):
+    if not slug:
+        return None
+    tenant = Tenant.objects(slug=slug).first()
+    if not tenant:
+        print(f"❌ Error: Tenant '{slug}' no encontrado")
+        sys.exit(1)
+    return tenant
+
+
+def rebuild_stock(args):
+    """Reconstruye Product.stock_current y Tenant.stock_units desde los lotes"""
+    from app.services.inventory import rebuild_stock_counters
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Reconstruyendo contadores de stock desde lotes...")
+    result = rebuild_stock_counters(tenant)
+    print(f"✅ {result['products']} productos y {result['tenants']} tenants actualizados")
+
+
+def rebuild_bundles(args):
+    """Recalcula Product.is_bundle e invalida el grafo de bundles en caché"""
+    from app.services.bundles import rebuild_bundle_flags
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Recalculando flags de bundles...")
+    count = rebuild_bundle_flags(tenant)
+    print(f"✅ {count} bundles marcados")
+
+
+def sale_totals(args):
+    """Verifica o reconstruye los totales guardados en cada venta"""
+    from app.services.sales import rebuild_sale_totals
+
+    tenant = _get_tenant(args.tenant)
+    if args.verify:
+        print("🔍 Verificando totales de ventas...")
+    else:
+        print("🔄 Reconstruyendo totales de ventas desde items y pagos...")
+    result = rebuild_sale_totals(tenant, verify=args.verify)
+    print(f"✅ {result['checked']} ventas revisadas, {result['mismatched']} con diferencias, "
+          f"{result['updated']} actualizadas")
+    if args.verify and result['mismatched']:
+        sys.exit(1)
+
+
+def rebuild_sales_daily(args):
+    """Reconstruye el rollup diario de ventas (sales_daily)"""
+    from app.services.sales import rebuild_sales_daily as rebuild
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Reconstruyendo rollup diario de ventas...")
+    rows = rebuild(tenant)
+    print(f"✅ {rows} filas (tenant, día, canal) generadas")
+
+
+def _get_db():
+    from mongoengine.connection import get_db
+    return get_db()
+
+
+def _format_key(key):
+    return ', '.join(f'{field}:{direction}' for field, direction in key)
+
+
+def indexes(args):
+    """Muestra o aplica las diferencias con el registro de índices"""
+    from app.services.indexes import index_diff, apply_indexes
+
+    db = _get_db()
+    if args.apply:
+        print("🔄 Creando índices faltantes...")
+        created = apply_indexes(db, drop_changed=args.replace_changed)
+        print(f"✅ {created} índices creados")
+        return
+
+    diff = index_diff(db)
+    if not diff:
+        print("✅ Todos los índices están al día")
+        return
+    for collection, changes in diff.items():
+        print(f"\n📁 {collection}")
+        for name, key, options in changes['missing']:
+            print(f"  + {name or '(auto)'} ({_format_key(key)}) {options or ''}")
+        for name, key, options in changes['changed']:
+            print(f"  ~ {name} ({_format_key(key)}) {options or ''}")
+        for name in changes['extra']:
+            print(f"  ? {name} (no está en el registro)")
+    print("\nEjecute con --apply para crear los índices faltantes")
+
+
+def migrate(args):
+    """
+    Paso de deploy (servicio `migrate` de docker-compose): crea los índices
+    faltantes y completa los datos derivados que el código nuevo espera.
+    Cada paso es idempotente.
+    """
+    from app.services.indexes import apply_indexes
+    from app.services.bundles import rebuild_bundle_flags
+
+    print("🔄 Creando índices faltantes...")
+    print(f"✅ {apply_indexes(_get_db())} índices creados")
+    print("🔄 Recalculando flags de bundles...")
+    print(f"✅ {rebuild_bundle_flags()} bundles marcados")
+
+
+def collscan_report(args):
+    """Lista las consultas que el profiler registró con COLLSCAN"""
+    from app.services.indexes import collscan_report as build_report, set_profiling
+
+    db = _get_db()
+    if args.enable:
+        set_profiling(db, 1, slowms=args.slowms)
+        print(f"✅ Profiler activado (consultas > {args.slowms} ms)")
+        return
+    if args.disable:
+        set_profiling(db, 0)
+        print("✅ Profiler desactivado")
+        return
+
+    rows = build_report(db, limit=args.limit)
+    if not rows:
+        print("✅ El profiler no registra consultas con COLLSCAN")
+        return
+    print(f"{'Colección':<30} {'Op':<8} {'Veces':>6} {'Total ms':>9} {'Max ms':>7} {'Docs':>9}  Filtro")
+    for row in rows:
+        print(f"{row['ns']:<30} {row['op'] or '':<8} {row['count']:>6} {row['total_ms']:>9} "
+              f"{row['max_ms']:>7} {row['docs_examined']:>9}  {row['shape']}")
+
+
+def purge_jobs(args):
+    """Elimina los trabajos en segundo plano terminados (y sus archivos) y los webhooks Shopify procesados"""
+    from app.services.jobs import fail_stale_jobs, purge_jobs as purge
+    from app.services.shopify_webhooks import purge_webhooks
+
+    stale = fail_stale_jobs()
+    if stale:
+        print(f"⚠️  {stale} trabajos sin heartbeat marcados como fallidos")
+    removed = purge(older_than_days=args.days)
+    print(f"✅ {removed} trabajos de más de {args.days} días eliminados")
+    removed = purge_webhooks(older_than_days=args.days)
+    print(f"✅ {removed} webhooks Shopify procesados de más de {args.days} días eliminados")
+
+
+def bank_fingerprints(args):
+    """Calcula la huella de deduplicación de las transacciones bancarias antiguas"""
+    from app.services.bank_import import backfill_fingerprints
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Calculando huellas de transacciones bancarias...")
+    result = backfill_fingerprints(tenant)
+    print(f"✅ {result['updated']} transacciones actualizadas, {result['duplicates']} duplicadas sin huella")
+
+
+def rebuild_match_tokens(args):
+    """Recalcula los tokens de conciliación bancaria de las ventas"""
+    from app.services.match_tokens import rebuild_match_tokens as rebuild
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Recalculando tokens de conciliación de ventas...")
+    updated = rebuild(tenant)
+    print(f"✅ {updated} ventas actualizadas")
+
+
+def rebuild_customer_stats(args):
+    """Recalcula las estadísticas de compra de los clientes Shopify desde sus órdenes"""
+    from app.services.shopify import refresh_customer_stats
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Recalculando estadísticas de clientes desde órdenes...")
+    refresh_customer_stats(tenant)
+    print("✅ Estadísticas de clientes actualizadas")
+
+
+def rebuild_search(args):
+    """Recalcula los campos de búsqueda indexada de clientes y productos"""
+    from app.services.search import rebuild_search_fields
+
+    tenant = _get_tenant(args.tenant)
+    print("🔄 Recalculando campos de búsqueda de clientes y productos...")
+    result = rebuild_search_fields(tenant)
+    print(f"✅ {result['customers']} clientes y {result['products']} productos actualizados")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Tareas de mantenimiento de SIPUD')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('rebuild-stock', help='Reconstruye los contadores de stock')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_stock)
+
+    p = subparsers.add_parser('rebuild-bundles', help='Recalcula el flag is_bundle de los productos')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_bundles)
+
+    p = subparsers.add_parser('sale-totals', help='Verifica o reconstruye los totales de ventas')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.add_argument('--verify', action='store_true', help='Solo reporta diferencias, no escribe')
+    p.set_defaults(func=sale_totals)
+
+    p = subparsers.add_parser('rebuild-sales-daily', help='Reconstruye el rollup diario de ventas')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_sales_daily)
+
+    p = subparsers.add_parser('indexes', help='Compara o crea los índices del registro')
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--diff', action='store_true', help='Muestra diferencias (por defecto)')
+    group.add_argument('--apply', action='store_true', help='Crea los índices faltantes')
+    p.add_argument('--replace-changed', action='store_true',
+                   help='Con --apply, recrea los índices cuyas opciones difieren')
+    p.set_defaults(func=indexes)
+
+    p = subparsers.add_parser('migrate', help='Índices y datos derivados (se ejecuta en cada deploy)')
+    p.set_defaults(func=migrate)
+
+    p = subparsers.add_parser('collscan-report', help='Consultas con COLLSCAN según el profiler')
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--enable', action='store_true', help='Activa el profiler para consultas lentas')
+    group.add_argument('--disable', action='store_true', help='Desactiva el profiler')
+    p.add_argument('--slowms', type=int, default=50, help='Umbral de consultas lentas (ms)')
+    p.add_argument('--limit', type=int, default=30, help='Máximo de filas del reporte')
+    p.set_defaults(func=collscan_report)
+
+    p = subparsers.add_parser('purge-jobs', help='Elimina trabajos terminados y webhooks procesados')
+    p.add_argument('--days', type=int, default=7, help='Antigüedad mínima en días')
+    p.set_defaults(func=purge_jobs)
+
+    p = subparsers.add_parser('bank-fingerprints', help='Completa la huella de las transacciones bancarias')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=bank_fingerprints)
+
+    p = subparsers.add_parser('rebuild-match-tokens', help='Recalcula los tokens de conciliación de las ventas')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_match_tokens)
+
+    p = subparsers.add_parser('rebuild-customer-stats', help='Recalcula las estadísticas de los clientes Shopify')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_customer_stats)
+
+    p = subparsers.add_parser('rebuild-search', help='Recalcula los campos de búsqueda de clientes y productos')
+    p.add_argument('--tenant', help='Slug del tenant (por defecto todos)')
+    p.set_defaults(func=rebuild_search)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    app = create_app()
+
+    with app.app_context():
+        args.func(args)
@@ -2,6 +2,11 @@
 import pytest
 import os
 import warnings
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
 
 # Suppress deprecation warnings from dependencies
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="flask_mongoengine")
@@ -17,6 +22,18 @@ os.environ['TESTING'] = '1'
 os.environ['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/sipud_test')
 
 
+def _mongo_available():
+    try:
+        MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=500).admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+
+
+# Tests de integración contra el MongoDB de MONGO_URI; se omiten si no hay servidor
+requires_mongo = pytest.mark.skipif(not _mongo_available(), reason='MongoDB no disponible')
+
+
 @pytest.fixture
 def app():
     """Create application for testing."""
@@ -40,3 +57,104 @@ def app_context(app):
     """Create application context."""
     with app.app_context():
         yield
+
+
+# ============================================
+# COLECCIÓN EN MEMORIA
+# ============================================
+def _type_matches(value, name):
+    return name == 'string' and isinstance(value, str)
+
+
+def _matches(doc, query):
+    """El documento cumple la consulta: igualdad (también contra listas), $in, $ne, $type y $or"""
+    for key, cond in query.items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(key)
+        values = value if isinstance(value, list) else [value]
+        if isinstance(cond, dict) and '$in' in cond:
+            if not any(v in cond['$in'] for v in values):
+                return False
+        elif isinstance(cond, dict) and '$ne' in cond:
+            if cond['$ne'] in values:
+                return False
+        elif isinstance(cond, dict) and '$type' in cond:
+            if not _type_matches(value, cond['$type']):
+                return False
+        elif value != cond and cond not in values:
+            return False
+    return True
+
+
+class FakeCollection:
+    """
+    Colección en memoria con lo que los servicios usan de pymongo: find,
+    distinct, bulk_write de UpdateOne (con upsert), insert_many y aggregate
+    (que retorna `rows`). Con `unique` rechaza con E11000, como el índice
+    único, los documentos que repiten esos campos. Registra las consultas
+    (`finds`), las operaciones de cada bulk_write (`writes`) y los
+    pipelines (`pipelines`).
+    """
+
+    def __init__(self, docs=(), rows=(), unique=None):
+        self.docs = [dict(doc) for doc in docs]
+        self.rows = list(rows)
+        self.unique = unique
+        self.finds = 0
+        self.writes = []
+        self.pipelines = []
+
+    def _duplicate(self, doc):
+        if not self.unique:
+            return False
+        key = tuple(doc.get(field) for field in self.unique)
+        return any(tuple(other.get(field) for field in self.unique) == key for other in self.docs)
+
+    def find(self, query=None, projection=None, **kwargs):
+        self.finds += 1
+        return [dict(doc) for doc in self.docs if _matches(doc, query or {})]
+
+    def distinct(self, field, query=None):
+        values = []
+        for doc in self.docs:
+            if _matches(doc, query or {}) and doc.get(field) not in values:
+                values.append(doc.get(field))
+        return values
+
+    def insert_many(self, docs, ordered=True):
+        errors = []
+        for idx, doc in enumerate(docs):
+            if self._duplicate(doc):
+                errors.append({'index': idx, 'code': 11000, 'errmsg': 'E11000 duplicate key'})
+                continue
+            doc.setdefault('_id', ObjectId())
+            self.docs.append(doc)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(docs) - len(errors)})
+        return SimpleNamespace(inserted_ids=[doc['_id'] for doc in docs])
+
+    def bulk_write(self, ops, ordered=True):
+        self.writes.append(list(ops))
+        upserted_ids, matched, modified = {}, 0, 0
+        for idx, op in enumerate(ops):
+            doc = next((doc for doc in self.docs if _matches(doc, op._filter)), None)
+            if doc is None:
+                if op._upsert:
+                    upserted_ids[idx] = ObjectId()
+                    fields = {key: value for key, value in op._filter.items() if not isinstance(value, dict)}
+                    self.docs.append({'_id': upserted_ids[idx], **fields,
+                                      **op._doc.get('$setOnInsert', {}), **op._doc.get('$set', {})})
+                continue
+            matched += 1
+            if '$set' in op._doc:
+                doc.update(op._doc['$set'])
+                modified += 1
+        return SimpleNamespace(upserted_count=len(upserted_ids), upserted_ids=upserted_ids,
+                               matched_count=matched, modified_count=modified)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return iter(self.rows)
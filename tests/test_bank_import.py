@@ -0,0 +1,136 @@
+"""
+Tests de la importación de cartolas (app/services/bank_import.py)
+"""
+import io
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from openpyxl import Workbook
+
+from app.services import bank_import
+from app.services.bank_import import (
+    BankImportError, RowError, detect_columns, fingerprint, import_statement, parse_row, read_rows
+)
+from app.services.indexes import INDEXES
+from conftest import FakeCollection, requires_mongo
+
+TENANT = ObjectId()
+
+
+def _csv(text, encoding='utf-8'):
+    return io.BytesIO(text.encode(encoding))
+
+
+STATEMENT = (
+    'Banco Ejemplo;Cartola N° 12\n'
+    'Fecha;Descripción;N° Documento;Monto\n'
+    '01/03/2026;Transferencia de Pérez;123;$15.990\n'
+    '02/03/2026;Comisión;;-1.200,50\n'
+    ';;;\n'
+    '31/02/2026;Fecha mala;;100\n'
+)
+
+
+class TestReading:
+    """Tests de lectura y detección de columnas"""
+
+    def test_csv_latin1_semicolon_with_metadata(self):
+        """Test que detecta codificación, separador y encabezado bajo filas de metadata"""
+        col_map, rows, first_row = detect_columns(read_rows(_csv(STATEMENT, 'latin-1'), 'cartola.csv'))
+
+        assert col_map == {'date': 0, 'description': 1, 'reference': 2, 'amount': 3}
+        assert first_row == 3
+        assert next(rows)[1] == 'Transferencia de Pérez'
+
+    def test_xlsx_read_only(self):
+        """Test que lee Excel con fechas y montos nativos"""
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Fecha', 'Glosa', 'Monto'])
+        ws.append([datetime(2026, 3, 1), 'Abono', 15990])
+        output = io.BytesIO()
+        wb.save(output)
+        output.seek(0)
+        col_map, rows, _ = detect_columns(read_rows(output, 'cartola.xlsx'))
+
+        assert parse_row(next(rows), col_map)['amount'] == Decimal('15990.00')
+
+    def test_missing_columns(self):
+        """Test que sin Fecha y Monto se informa el error con sugerencia"""
+        with pytest.raises(BankImportError) as exc:
+            detect_columns(read_rows(_csv('a,b\n1,2\n'), 'x.csv'))
+        assert exc.value.hint
+
+
+class TestRows:
+    """Tests de interpretación de filas y huella"""
+
+    def test_parse_row(self):
+        """Test que interpreta montos chilenos con signo y valida fechas"""
+        col_map = {'date': 0, 'amount': 1, 'description': 2}
+        parsed = parse_row(['02/03/2026', '-1.200,50', ' Comisión '], col_map)
+
+        assert parsed['amount'] == Decimal('-1200.50')
+        assert parsed['description'] == 'Comisión'
+        assert parse_row(['', '100'], col_map) is None
+        with pytest.raises(RowError):
+            parse_row(['31/02/2026', '100'], col_map)
+
+    def test_fingerprint_includes_sign_and_ignores_spaces(self):
+        """Test que la huella distingue abono de cargo y no depende de espacios"""
+        when = datetime(2026, 3, 1)
+        credit = fingerprint(TENANT, when, Decimal('100.00'), '1', 'Pago ')
+        assert credit == fingerprint(TENANT, when, Decimal('100'), '1', 'Pago')
+        assert credit != fingerprint(TENANT, when, Decimal('-100.00'), '1', 'Pago')
+        assert credit != fingerprint(ObjectId(), when, Decimal('100.00'), '1', 'Pago')
+
+
+class TestImport:
+    """Tests de la inserción por bloques"""
+
+    def test_import_counts_duplicates(self, monkeypatch):
+        """Test que los duplicados del índice y del mismo archivo se cuentan como ya importados"""
+        # Rechaza las huellas ya existentes como el índice único (tenant, fingerprint)
+        collection = FakeCollection(unique=('tenant', 'fingerprint'))
+        monkeypatch.setattr(bank_import, 'BankTransaction', SimpleNamespace(_get_collection=lambda: collection))
+        monkeypatch.setattr(bank_import, 'CHUNK_ROWS', 1)
+
+        first = import_statement(_csv(STATEMENT + '01/03/2026;Transferencia de Pérez;123;$15.990\n'),
+                                 'cartola.csv', TENANT)
+        assert first['created'] == 2
+        assert first['duplicates'] == 1
+        assert first['errors'] == ['Fila 6: formato de fecha no reconocido "31/02/2026"']
+        assert collection.docs[1]['transaction_type'] == 'debit'
+        assert collection.docs[1]['amount'] == 1200.5
+
+        again = import_statement(_csv(STATEMENT), 'cartola.csv', TENANT)
+        assert again['created'] == 0
+        assert again['duplicates'] == 2
+
+
+@requires_mongo
+class TestImportOnMongo:
+    """Tests de la deduplicación por el índice único contra MongoDB"""
+
+    @pytest.fixture
+    def collection(self, app_context):
+        from app.models import BankTransaction
+
+        collection = BankTransaction._get_collection()
+        collection.create_indexes(INDEXES['bank_transactions'])
+        yield collection
+        collection.delete_many({'tenant': TENANT})
+
+    def test_unique_index_skips_imported_rows(self, collection, monkeypatch):
+        """Test que el índice (tenant, fingerprint) descarta las filas de una cartola ya importada"""
+        monkeypatch.setattr(bank_import, 'CHUNK_ROWS', 1)
+
+        assert import_statement(_csv(STATEMENT), 'cartola.csv', TENANT)['created'] == 2
+        extended = STATEMENT + '03/03/2026;Transferencia de Soto;124;$9.990\n'
+        again = import_statement(_csv(extended), 'cartola.csv', TENANT)
+
+        assert (again['created'], again['duplicates']) == (1, 2)
+        assert collection.count_documents({'tenant': TENANT}) == 3
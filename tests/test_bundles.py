@@ -0,0 +1,55 @@
+"""
+Tests del cálculo de unidades armables (app/services/bundles.py)
+"""
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from app.models import Product, ProductBundle, Tenant
+from app.services.bundles import max_buildable, rebuild_bundle_flags
+
+
+class TestMaxBuildable:
+    """Tests para max_buildable (sin base de datos)"""
+
+    def test_limited_by_scarcest_component(self):
+        """Test que el componente más escaso define las unidades armables"""
+        box, pan, queso = ObjectId(), ObjectId(), ObjectId()
+        graph = {box: [(pan, 2), (queso, 1)]}
+
+        assert max_buildable(graph, {pan: 9, queso: 10}) == {box: 4}
+        assert max_buildable(graph, {pan: 40, queso: 3}) == {box: 3}
+
+    def test_missing_component_stock_counts_as_zero(self):
+        """Test que un componente sin stock registrado impide armar"""
+        box, pan = ObjectId(), ObjectId()
+
+        assert max_buildable({box: [(pan, 1)]}, {}) == {box: 0}
+
+    def test_all_bundles_at_once(self):
+        """Test varios bundles que comparten componentes"""
+        small, large, pan = ObjectId(), ObjectId(), ObjectId()
+        graph = {small: [(pan, 1)], large: [(pan, 5)], ObjectId(): []}
+
+        assert max_buildable(graph, {pan: 12}) == {small: 12, large: 2}
+
+
+class TestRebuildBundleFlags:
+    """Tests del backfill de Product.is_bundle"""
+
+    def test_only_wrong_flags_are_written(self, monkeypatch):
+        """Test que solo actualiza los productos cuyo flag no coincide con product_bundles"""
+        box = ObjectId()
+        updates = []
+        bundles = SimpleNamespace(find=lambda query, projection=None: [],
+                                  distinct=lambda field, query: [box])
+        products = SimpleNamespace(update_many=lambda query, update: updates.append((query, update)))
+        tenants = SimpleNamespace(update_many=lambda query, update: updates.append((query, update)))
+        monkeypatch.setattr(ProductBundle, '_get_collection', lambda: bundles)
+        monkeypatch.setattr(Product, '_get_collection', lambda: products)
+        monkeypatch.setattr(Tenant, '_get_collection', lambda: tenants)
+
+        assert rebuild_bundle_flags() == 1
+        assert updates[0] == ({'_id': {'$in': [box]}, 'is_bundle': {'$ne': True}}, {'$set': {'is_bundle': True}})
+        assert updates[1] == ({'_id': {'$nin': [box]}, 'is_bundle': True}, {'$set': {'is_bundle': False}})
+        assert updates[2] == ({}, {'$inc': {'bundle_version': 1}})
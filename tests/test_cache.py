@@ -0,0 +1,114 @@
+"""
+Tests de la caché de endpoints (app/services/cache.py)
+"""
+import time
+
+from bson import ObjectId
+from flask import Flask, g, jsonify, request
+
+from app.models import Tenant
+from app.services.cache import ApiCache, LocalCache, invalidate
+
+
+class TestLocalCache:
+    """Tests del backend LRU en memoria"""
+
+    def test_evicts_least_recently_used(self):
+        """Test que al superar el máximo se descarta la entrada menos usada"""
+        cache = LocalCache(max_entries=2)
+        cache.set('t:1:a', 'A', ttl=60)
+        cache.set('t:1:b', 'B', ttl=60)
+        cache.get('t:1:a')
+        cache.set('t:1:c', 'C', ttl=60)
+
+        assert cache.get('t:1:a') == 'A'
+        assert cache.get('t:1:b') is None
+        assert cache.get('t:1:c') == 'C'
+
+    def test_expired_entries_are_misses(self):
+        """Test que una entrada vencida no se retorna"""
+        cache = LocalCache()
+        cache.set('t:1:a', 'A', ttl=0.01)
+        time.sleep(0.02)
+
+        assert cache.get('t:1:a') is None
+        assert cache.size() == 0
+
+    def test_clear_by_tenant(self):
+        """Test que clear(tenant) solo borra las entradas de ese tenant"""
+        cache = LocalCache()
+        cache.set('t1:1:a', 'A', ttl=60)
+        cache.set('t2:1:a', 'B', ttl=60)
+
+        assert cache.clear('t1') == 1
+        assert cache.get('t2:1:a') == 'B'
+
+
+class TestCachedDecorator:
+    """Tests del decorador con una app mínima (sin base de datos)"""
+
+    def _app(self, tenant):
+        app = Flask(__name__)
+        api_cache = ApiCache()
+        api_cache.backend = LocalCache()
+        calls = []
+
+        @app.before_request
+        def set_tenant():
+            g.current_tenant = tenant
+
+        @app.route('/stats')
+        @api_cache.cached(ttl=60)
+        def stats():
+            calls.append(request.args.get('range'))
+            if request.args.get('fail'):
+                return jsonify({'error': 'x'}), 500
+            return jsonify({'calls': len(calls)})
+
+        return app, api_cache, calls
+
+    def test_second_request_is_served_from_cache(self):
+        """Test que el segundo GET con los mismos argumentos no ejecuta la vista"""
+        app, api_cache, calls = self._app(Tenant(id=ObjectId(), name='T', slug='t'))
+        client = app.test_client()
+
+        first = client.get('/stats?range=last_7')
+        second = client.get('/stats?range=last_7')
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.get_json() == {'calls': 1}
+        assert api_cache.stats()['hits'] == 1
+        assert api_cache.stats()['misses'] == 1
+
+    def test_args_and_version_are_part_of_the_key(self):
+        """Test que otros argumentos o una nueva versión del tenant recalculan"""
+        tenant = Tenant(id=ObjectId(), name='T', slug='t', cache_version=1)
+        app, _, calls = self._app(tenant)
+        client = app.test_client()
+
+        client.get('/stats?range=last_7')
+        client.get('/stats?range=last_30')
+        tenant.cache_version = 2
+        client.get('/stats?range=last_7')
+
+        assert calls == ['last_7', 'last_30', 'last_7']
+
+    def test_errors_are_not_cached(self):
+        """Test que las respuestas con error no se guardan"""
+        app, _, calls = self._app(Tenant(id=ObjectId(), name='T', slug='t'))
+        client = app.test_client()
+
+        client.get('/stats?fail=1')
+        client.get('/stats?fail=1')
+
+        assert len(calls) == 2
+
+    def test_invalidate_is_deferred_inside_request(self):
+        """Test que invalidate dentro de un request se acumula en g"""
+        app = Flask(__name__)
+        tenant_id = ObjectId()
+        with app.test_request_context('/'):
+            invalidate(tenant_id)
+            invalidate(tenant_id)
+            assert g.cache_invalidate == {tenant_id}
@@ -0,0 +1,108 @@
+"""
+Tests de la importación de clientes desde Excel (app/services/customer_import.py)
+"""
+import io
+
+import pytest
+from bson import ObjectId
+from openpyxl import Workbook
+
+from app.models import ShopifyCustomer
+from app.services import customer_import
+from app.services.customer_import import CustomerImportError, import_workbook, preview_workbook
+from conftest import FakeCollection
+
+TENANT = ObjectId()
+
+
+def _xlsx(*rows):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(row)
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+@pytest.fixture
+def customers(monkeypatch):
+    collection = FakeCollection([
+        {'_id': ObjectId(), 'tenant': TENANT, 'name': 'Ana Soto', 'email': 'ana@gmail.com', 'phone': None,
+         'phone_keys': [], 'source': 'shopify'},
+        {'_id': ObjectId(), 'tenant': TENANT, 'name': 'Luis Rojas', 'email': None, 'phone': '+56 9 1111 2222',
+         'phone_keys': ['56911112222', '911112222'], 'source': 'manual'},
+        {'_id': ObjectId(), 'tenant': ObjectId(), 'name': 'Otro tenant', 'email': 'pia@empresa.cl'},
+    ])
+    monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: collection)
+    collection.refreshed = []
+    monkeypatch.setattr(customer_import, 'refresh_account_tokens',
+                        lambda tenant, ids: collection.refreshed.extend(ids))
+    return collection
+
+
+class TestImport:
+    """Tests de la importación por bloques"""
+
+    def test_creates_updates_and_skips_duplicates(self, customers):
+        """Test que actualiza los existentes por email o teléfono, crea el resto y omite repetidos"""
+        result = import_workbook(_xlsx(
+            ['Nombre', 'Correo', 'Teléfono', 'Ciudad'],
+            ['Ana Soto', 'ANA@gmail.com', 56922223333, 'Talca'],
+            ['Luis Rojas', None, '911112222', None],
+            ['Pía Díaz', 'pia@empresa.cl', None, None],
+            ['Pía D.', 'pia@empresa.cl', None, None],
+            [None, 'sin-nombre@x.cl', None, None],
+        ), TENANT, stamp=1)
+
+        assert {key: result[key] for key in ('created', 'updated', 'unchanged', 'duplicates', 'total')} == {
+            'created': 1, 'updated': 1, 'unchanged': 1, 'duplicates': 1, 'total': 4}
+        assert result['errors'] == []
+        ana = customers.docs[0]
+        assert (ana['phone'], ana['address_city'], ana['source']) == ('56922223333', 'Talca', 'shopify')
+        assert ana['phone_keys'] == ['56922223333', '922223333'] and 'sot' in ana['search_tokens']
+        pia = customers.docs[-1]
+        assert (pia['tenant'], pia['shopify_id'], pia['source']) == (TENANT, 'IMPORT-4-1', 'import')
+        assert pia['address_country'] == 'Chile' and 'pia' in pia['search_tokens']
+        assert customers.refreshed == [ana['_id']]
+
+    def test_shared_phone_with_different_emails(self, customers):
+        """Test que dos filas con el mismo teléfono y distinto email son dos clientes"""
+        result = import_workbook(_xlsx(
+            ['Nombre', 'Email', 'Teléfono'],
+            ['Marta Vega', 'marta@x.cl', '+56 9 5555 6666'],
+            ['Tomás Vega', 'tomas@x.cl', '+56 9 5555 6666'],
+            ['M. Vega', None, '955556666'],
+            ['Luis Rojas', 'luis@x.cl', '+56 9 1111 2222'],
+            ['Sofía Rojas', 'sofia@x.cl', '+56 9 1111 2222'],
+        ), TENANT)
+
+        assert (result['created'], result['updated'], result['duplicates']) == (3, 1, 1)
+        # El existente sin email toma el de la primera fila; la segunda es otro cliente
+        assert customers.docs[1]['email'] == 'luis@x.cl'
+        assert [doc['email'] for doc in customers.docs[3:]] == ['marta@x.cl', 'tomas@x.cl', 'sofia@x.cl']
+
+    def test_one_query_and_write_per_chunk(self, customers, monkeypatch):
+        """Test que consulta y escribe una vez por bloque"""
+        monkeypatch.setattr(customer_import, 'CHUNK_ROWS', 2)
+        rows = [['Nombre', 'Email']] + [[f'Cliente {i}', f'c{i}@x.cl'] for i in range(5)]
+
+        result = import_workbook(_xlsx(*rows), TENANT)
+
+        assert result['created'] == 5
+        assert customers.finds == 3 and [len(ops) for ops in customers.writes] == [2, 2, 1]
+
+    def test_row_errors_do_not_abort(self, customers):
+        """Test que una fila inválida queda en errores y el resto se importa"""
+        result = import_workbook(_xlsx(['Nombre', 'Email'], ['x' * 201, None], ['Bea', None]), TENANT)
+
+        assert result['created'] == 1
+        assert result['errors'] == ['Fila 2: name excede 200 caracteres']
+
+    def test_positional_columns_and_missing_name(self, customers):
+        """Test que sin encabezados reconocibles usa el orden fijo, y exige la columna de nombre"""
+        preview = preview_workbook(_xlsx(['Cliente', 'Mail'], ['Bea Paz', 'bea@x.cl']))
+        assert preview['total'] == 1 and preview['rows'][0]['email'] == 'bea@x.cl'
+
+        with pytest.raises(CustomerImportError):
+            import_workbook(_xlsx(['Email', 'Ciudad'], ['a@x.cl', 'Talca']), TENANT)
@@ -0,0 +1,51 @@
+"""
+Tests de rangos y series del dashboard (app/services/dashboard_metrics.py)
+"""
+from datetime import date
+
+from app.services.dashboard_metrics import resolve_range, build_series
+
+
+class TestResolveRange:
+    """Tests para resolve_range (sin base de datos)"""
+
+    def test_default_last_7_days(self):
+        """Test rango por defecto: últimos 7 días por día"""
+        assert resolve_range('last_7', today=date(2026, 3, 15)) == (date(2026, 3, 9), date(2026, 3, 15), 'day')
+
+    def test_last_month(self):
+        """Test mes anterior completo"""
+        assert resolve_range('last_month', today=date(2026, 3, 15)) == (date(2026, 2, 1), date(2026, 2, 28), 'day')
+
+    def test_year_grouped_by_month(self):
+        """Test año en curso agrupado por mes"""
+        assert resolve_range('year', today=date(2026, 3, 15)) == (date(2026, 1, 1), date(2026, 3, 15), 'month')
+
+    def test_all_time_start_from_data(self):
+        """Test que all_time deja el inicio para el primer día con ventas"""
+        assert resolve_range('all_time', today=date(2026, 3, 15)) == (None, date(2026, 3, 15), 'month')
+
+    def test_specific_month(self):
+        """Test mes específico e inválido"""
+        assert resolve_range('specific_month', '2025-12', today=date(2026, 3, 15)) == \
+            (date(2025, 12, 1), date(2025, 12, 31), 'day')
+        assert resolve_range('specific_month', 'x', today=date(2026, 3, 15))[0] == date(2026, 3, 1)
+
+
+class TestBuildSeries:
+    """Tests para build_series"""
+
+    def test_days_without_sales_filled_with_zero(self):
+        """Test que los días sin ventas aparecen con 0"""
+        series = build_series({date(2026, 3, 2): 1500.0}, date(2026, 3, 1), date(2026, 3, 3), 'day')
+
+        assert series['values'] == [0, 1500.0, 0]
+        assert series['keys'] == ['2026-03-01', '2026-03-02', '2026-03-03']
+        assert series['labels'][0] == '01/03'
+
+    def test_months(self):
+        """Test serie mensual"""
+        series = build_series({date(2026, 2, 1): 10}, date(2026, 1, 1), date(2026, 3, 15), 'month')
+
+        assert series['keys'] == ['2026-01', '2026-02', '2026-03']
+        assert series['values'] == [0, 10, 0]
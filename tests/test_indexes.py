@@ -0,0 +1,55 @@
+"""
+Tests del registro de índices (app/services/indexes.py)
+"""
+from app.services.indexes import INDEXES, query_shape, wanted_indexes
+
+
+class TestIndexRegistry:
+    """Tests de consistencia del registro (sin base de datos)"""
+
+    def test_names_unique_per_collection(self):
+        """Test que no hay dos índices con el mismo nombre en una colección"""
+        for collection, models in INDEXES.items():
+            names = [m.document['name'] for m in models]
+            assert len(names) == len(set(names)), collection
+
+    def test_hot_query_shapes_covered(self):
+        """Test que las consultas frecuentes tienen un índice que las cubre"""
+        keys = {
+            collection: [tuple(field for field, _ in key) for _, key, _ in specs]
+            for collection, specs in wanted_indexes().items()
+        }
+
+        assert ('product', 'quantity_current') in keys['lots']
+        assert ('tenant', 'date_created', '_id') in keys['sales']
+        assert ('tenant', 'date', '_id') in keys['bank_transactions']
+        assert ('tenant', 'fingerprint') in keys['bank_transactions']
+        assert ('matched_sale', 'status') in keys['bank_transactions']
+        assert ('tenant', 'total_spent', '_id') in keys['shopify_customers']
+        assert ('tenant', 'created_at', '_id') in keys['activity_logs']
+        assert ('tenant', 'payment_status', 'date_created') in keys['sales']
+        assert ('tenant', 'shopify_order_id') in keys['sales']
+        assert ('sale',) in keys['sale_items']
+        assert ('tenant', 'date_created') in keys['wastages']
+        assert ('tenant', 'day', 'channel') in keys['sales_daily']
+
+    def test_models_do_not_auto_create_indexes(self, app):
+        """Test que ningún modelo crea índices al primer acceso"""
+        from app.services.indexes import _document_classes
+
+        for cls in _document_classes():
+            assert cls._meta.get('auto_create_index') is False, cls.__name__
+
+
+class TestQueryShape:
+    """Tests para la normalización de filtros del profiler"""
+
+    def test_values_replaced_keys_kept(self):
+        """Test que se conservan campos y operadores pero no valores"""
+        shape = query_shape({'tenant': 'abc', 'date_created': {'$gte': 1, '$lt': 2}})
+
+        assert shape == {'date_created': {'$gte': 1, '$lt': 1}, 'tenant': 1}
+
+    def test_in_list_collapsed(self):
+        """Test que listas de valores ($in) se reducen a 1"""
+        assert query_shape({'sale': {'$in': [1, 2, 3]}}) == {'sale': {'$in': 1}}
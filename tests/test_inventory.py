@@ -0,0 +1,232 @@
+"""
+Tests del motor de asignación FIFO de stock (app/services/inventory.py)
+
+Los tests de concurrencia necesitan un MongoDB real (MONGO_URI); si no hay
+servidor disponible se omiten.
+"""
+import threading
+import uuid
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from app.services import inventory
+from app.services.inventory import InsufficientStockError, StockAllocation, StockConflictError
+from conftest import requires_mongo
+
+TENANT = ObjectId()
+
+
+
+class TestInsufficientStockError:
+    """Tests para los mensajes de error de stock"""
+
+    def test_default_message(self):
+        """Test mensaje por defecto con nombre, disponible y solicitado"""
+        class FakeProduct:
+            name = 'Arroz'
+
+        error = InsufficientStockError(FakeProduct(), requested=5, available=2)
+
+        assert str(error) == 'Stock insuficiente para Arroz. Disponible: 2, Solicitado: 5'
+        assert error.requested == 5
+        assert error.available == 2
+
+    def test_custom_message(self):
+        """Test que el mensaje acepta plantilla con {name}, {available}, {requested}"""
+        class FakeProduct:
+            name = 'Harina'
+
+        error = InsufficientStockError(
+            FakeProduct(), 10, 3,
+            message='Requerido: {requested}, Disponible: {available} ({name})'
+        )
+
+        assert str(error) == 'Requerido: 10, Disponible: 3 (Harina)'
+
+
+def _labeled(label):
+    return OperationFailure('WriteConflict', 112, {'errorLabels': [label]})
+
+
+class FakeSession:
+    """Sesión que falla los commits indicados con la etiqueta dada"""
+
+    def __init__(self, commit_errors=()):
+        self.commit_errors = list(commit_errors)
+        self.in_transaction = True
+        self.log = []
+
+    def start_transaction(self):
+        self.in_transaction = True
+        self.log.append('start')
+
+    def abort_transaction(self):
+        self.in_transaction = False
+        self.log.append('abort')
+
+    def commit_transaction(self):
+        self.in_transaction = False
+        self.log.append('commit')
+        if self.commit_errors:
+            raise _labeled(self.commit_errors.pop(0))
+
+    def end_session(self):
+        self.log.append('end')
+
+
+class TestTransactionRetry:
+    """Tests de los reintentos de la transacción ante conflictos"""
+
+    @pytest.fixture
+    def allocation(self, monkeypatch):
+        deducted = []
+        tenant_updates = []
+        conflicts = {'count': 0}
+
+        def fake_deduct(self, product, quantity, message):
+            if conflicts['count']:
+                conflicts['count'] -= 1
+                raise _labeled('TransientTransactionError')
+            deducted.append(product)
+            self.tenant_deltas[TENANT] = self.tenant_deltas.get(TENANT, 0) - quantity
+            return [(ObjectId(), quantity)]
+
+        monkeypatch.setattr(StockAllocation, '_deduct', fake_deduct)
+        monkeypatch.setattr(StockAllocation, 'BACKOFF_BASE', 0)
+        monkeypatch.setattr(inventory, 'adjust_tenant_stock', lambda tenant, delta: tenant_updates.append(delta))
+        allocation = StockAllocation(TENANT, use_transaction=True)
+        allocation.session = FakeSession()
+        return allocation, deducted, tenant_updates, conflicts
+
+    def test_write_conflict_replays_transaction(self, allocation):
+        """Test que un WriteConflict aborta y repite los descuentos previos antes de seguir"""
+        allocation, deducted, tenant_updates, conflicts = allocation
+        allocation.deduct('arroz', 2)
+        conflicts['count'] = 1
+        allocation.deduct('harina', 3)
+        assert tenant_updates == []  # Nada toca el tenant dentro de la transacción
+        allocation.commit()
+
+        assert deducted == ['arroz', 'arroz', 'harina']
+        assert allocation.session.log == ['abort', 'start', 'commit', 'end']
+        assert tenant_updates == [-5]
+
+    def test_commit_conflict_and_unknown_result(self, allocation):
+        """Test que un commit incierto se repite y uno en conflicto repite la transacción"""
+        allocation, deducted, tenant_updates, _ = allocation
+        allocation.session.commit_errors = ['UnknownTransactionCommitResult', 'TransientTransactionError']
+        allocation.deduct('arroz', 2)
+        allocation.commit()
+
+        assert deducted == ['arroz', 'arroz']
+        assert allocation.session.log == ['commit', 'commit', 'start', 'commit', 'end']
+        assert allocation.state == 'committed'
+        assert tenant_updates == [-2]
+
+    def test_exhausted_retries_raise_conflict(self, allocation):
+        """Test que al agotar los reintentos se lanza StockConflictError"""
+        allocation, deducted, tenant_updates, conflicts = allocation
+        conflicts['count'] = StockAllocation.MAX_RETRIES
+
+        with pytest.raises(StockConflictError):
+            allocation.deduct('arroz', 2)
+        assert deducted == []
+
+
+@requires_mongo
+class TestStockAllocationConcurrency:
+    """Tests de concurrencia contra MongoDB"""
+
+    @pytest.fixture
+    def stocked_product(self, app_context):
+        from app.models import Tenant, Product, Lot
+        from app.services.inventory import rebuild_stock_counters
+
+        suffix = uuid.uuid4().hex[:8]
+        tenant = Tenant(name=f'Test Stock {suffix}', slug=f'test-stock-{suffix}').save()
+        product = Product(name='Producto concurrente', sku=f'CONC-{suffix}', tenant=tenant).save()
+        for qty in (20, 15, 15):
+            Lot(product=product, tenant=tenant, lot_code=f'L-{uuid.uuid4().hex[:6]}',
+                quantity_initial=qty, quantity_current=qty).save()
+        rebuild_stock_counters(tenant)
+
+        yield tenant, product
+
+        Lot.objects(product=product).delete()
+        product.delete()
+        tenant.delete()
+
+    def test_concurrent_deductions_never_go_negative(self, stocked_product):
+        """Test que muchos hilos descontando el mismo producto no sobrevenden"""
+        from app.models import Lot, Product, Tenant
+
+        tenant, product = stocked_product
+        successes = []
+        failures = []
+        conflicts = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(5):
+                # Un conflicto que agotó los reintentos internos se reintenta aquí
+                for _ in range(3):
+                    try:
+                        with StockAllocation(tenant) as allocation:
+                            allocation.deduct(product, 3)
+                        with lock:
+                            successes.append(3)
+                    except InsufficientStockError:
+                        with lock:
+                            failures.append(3)
+                    except StockConflictError:
+                        with lock:
+                            conflicts.append(3)
+                        continue
+                    break
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        lots = list(Lot.objects(product=product))
+        remaining = sum(lot.quantity_current for lot in lots)
+
+        assert all(lot.quantity_current >= 0 for lot in lots)
+        assert sum(successes) <= 50
+        assert remaining == 50 - sum(successes)
+        assert remaining < 3  # Se vendió todo lo que alcanzaba
+        assert failures
+        assert len(successes) + len(failures) == 16 * 5  # Ningún descuento quedó en conflicto
+        assert len(conflicts) < 16 * 5
+        assert Product.objects.get(id=product.id).stock_current == remaining
+        assert Tenant.objects.get(id=tenant.id).stock_units == remaining
+
+    def test_cancel_restores_all_lots(self, stocked_product):
+        """Test que cancelar una asignación devuelve el stock a los lotes"""
+        from app.models import Lot, Product
+
+        tenant, product = stocked_product
+
+        with StockAllocation(tenant) as allocation:
+            allocation.deduct(product, 30)
+            allocation.cancel()
+
+        assert sum(lot.quantity_current for lot in Lot.objects(product=product)) == 50
+        assert Product.objects.get(id=product.id).stock_current == 50
+
+    def test_fifo_order(self, stocked_product):
+        """Test que se descuenta primero el lote más antiguo"""
+        from app.models import Lot
+
+        tenant, product = stocked_product
+
+        with StockAllocation(tenant) as allocation:
+            taken = allocation.deduct(product, 25)
+
+        assert [qty for _, qty in taken] == [20, 5]
+        quantities = [lot.quantity_current for lot in Lot.objects(product=product).order_by('created_at', 'id')]
+        assert quantities == [0, 10, 15]
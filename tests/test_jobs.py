@@ -0,0 +1,83 @@
+"""
+Tests de los trabajos en segundo plano (app/services/jobs.py)
+"""
+import os
+
+import pytest
+from openpyxl import load_workbook
+
+from app.services.jobs import JobCancelled, enqueue, export_job, get_handler
+from app.services.xlsx_export import Column
+
+
+class FakeContext:
+    """JobContext mínimo: parámetros, progreso y archivo en un directorio temporal"""
+
+    def __init__(self, tmp_path, params, cancel_after=None):
+        self.tmp_path = tmp_path
+        self.params = params
+        self.tenant = None
+        self.calls = 0
+        self.cancel_after = cancel_after
+        self.artifact_path = None
+
+    def progress(self, percent=None, message=None, force=False):
+        self.calls += 1
+        if self.cancel_after is not None and self.calls > self.cancel_after:
+            raise JobCancelled()
+
+    def artifact(self, filename):
+        self.artifact_path = os.path.join(self.tmp_path, filename)
+        return self.artifact_path
+
+
+@export_job('tests.numbers_excel')
+def numbers_export(export, tenant, count=3):
+    export.add_sheet('Números', [Column('N', 'n')], ({'n': i} for i in range(count)))
+
+
+class TestExportJob:
+    """Tests del registro de exportaciones como trabajos"""
+
+    def test_builder_is_registered(self):
+        """Test que export_job registra el handler y marca el builder"""
+        assert numbers_export.job_kind == 'tests.numbers_excel'
+        assert get_handler('tests.numbers_excel') is not None
+
+    def test_handler_writes_artifact(self, tmp_path):
+        """Test que el handler construye el Excel con los argumentos guardados"""
+        ctx = FakeContext(tmp_path, {'filename': 'numeros.xlsx', 'args': {'count': 5}})
+        result = get_handler('tests.numbers_excel')(ctx)
+
+        ws = load_workbook(ctx.artifact_path)['Números']
+        assert result == {'rows': 5}
+        assert [c.value for c in ws['A']] == ['N', 0, 1, 2, 3, 4]
+
+    def test_cancel_stops_export(self, tmp_path):
+        """Test que la cancelación corta la exportación en el próximo progreso"""
+        ctx = FakeContext(tmp_path, {'filename': 'numeros.xlsx', 'args': {'count': 5000}}, cancel_after=1)
+
+        with pytest.raises(JobCancelled):
+            get_handler('tests.numbers_excel')(ctx)
+        assert ctx.artifact_path is None
+
+
+class TestJobCancelled:
+    """Tests de la excepción de cancelación"""
+
+    def test_not_caught_by_generic_handlers(self):
+        """Test que los `except Exception` de las sincronizaciones no la atrapan"""
+        def sync_rows():
+            for _ in range(3):
+                try:
+                    raise JobCancelled()
+                except Exception:
+                    pass
+
+        with pytest.raises(JobCancelled):
+            sync_rows()
+
+    def test_enqueue_unknown_kind(self):
+        """Test que encolar un tipo no registrado falla antes de escribir"""
+        with pytest.raises(ValueError):
+            enqueue('tests.no_existe', tenant=None)
@@ -0,0 +1,45 @@
+"""
+Tests para el BatchLoader (app/services/loaders.py)
+"""
+from bson import DBRef, ObjectId
+
+from app.models import Product, SaleItem, Sale
+from app.services.loaders import BatchLoader
+
+
+class TestBatchLoader:
+    """Tests del identity map sin base de datos (documentos ya registrados)"""
+
+    def test_resolve_uses_identity_map(self):
+        """Test que resolve reutiliza documentos registrados sin consultar"""
+        product = Product(id=ObjectId(), name='Arroz', sku='ARROZ-1')
+        items = [
+            SaleItem(product=DBRef('products', product.id), quantity=1, unit_price=100),
+            SaleItem(product=DBRef('products', product.id), quantity=2, unit_price=100),
+        ]
+
+        loader = BatchLoader()
+        loader.add([product])
+        loader.resolve(items, 'product')
+
+        assert items[0].product is product
+        assert items[1].product is product
+
+    def test_get_returns_cached_document(self):
+        """Test que get retorna el mismo objeto registrado"""
+        product = Product(id=ObjectId(), name='Harina', sku='HAR-1')
+        loader = BatchLoader()
+        loader.add([product])
+
+        assert loader.get(Product, product.id) is product
+
+    def test_prefetched_items_are_used_by_sale(self):
+        """Test que Sale.items y total_amount usan los items precargados"""
+        sale = Sale(id=ObjectId(), customer_name='Cliente')
+        sale._prefetched_items = [
+            SaleItem(quantity=2, unit_price=1000),
+            SaleItem(quantity=1, unit_price=500),
+        ]
+
+        assert len(sale.items) == 2
+        assert sale.total_amount == 2500
@@ -0,0 +1,205 @@
+"""
+Tests de la asignación de la auto-conciliación (app/services/matching.py)
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from app.models import Sale, ShopifyCustomer, ShopifyOrder
+from app.services import matching
+from app.services.match_tokens import (
+    name_similarity, rebuild_match_tokens, refresh_account_tokens, sale_tokens, tokenize
+)
+from app.services.matching import SaleIndex, assign, confidence, hungarian
+
+DAY = datetime(2026, 3, 10, 12, 0)
+
+
+def _tx(amount, days=0):
+    return {'_id': None, 'amount': amount, 'date': DAY + timedelta(days=days), 'description': ''}
+
+
+def _sale(total, days=0):
+    return {'_id': None, 'total': total, 'date': DAY + timedelta(days=days), 'channel': 'manual', 'stored': True}
+
+
+class TestConfidence:
+    """Tests de la puntuación compartida con las sugerencias"""
+
+    def test_penalizes_amount_and_days(self):
+        """Test que resta 5 por cada 1% de diferencia y 10 por cada día"""
+        assert confidence(10000, 10000, DAY, DAY) == 100
+        assert confidence(10000, 10100, DAY, DAY + timedelta(days=1)) == 85
+
+
+class TestSaleIndex:
+    """Tests del índice por día y monto"""
+
+    def test_candidates_within_windows(self):
+        """Test que solo retorna ventas con monto ±1% y fecha ±3 días"""
+        sales = [_sale(10000), _sale(10099, 3), _sale(10200), _sale(10000, 4), _sale(9901, -3)]
+        found = sorted(SaleIndex(sales).candidates(10000, DAY))
+
+        assert found == [0, 1, 4]
+
+
+class TestAssign:
+    """Tests de la asignación uno a uno"""
+
+    def test_optimal_beats_first_come(self):
+        """Test que la transacción temprana no se queda con la venta que otra explica mejor"""
+        # tx0 calza con s0 (80) y s1 (100); tx1 solo con s1 (90).
+        # Tomando la mejor venta de tx0 primero, tx1 quedaría sin venta.
+        transactions = [_tx(10000), _tx(10000, -1)]
+        sales = [_sale(10000, 2), _sale(10000)]
+        pairs = {(t, s) for t, s, _ in assign(transactions, sales)}
+
+        assert pairs == {(0, 0), (1, 1)}
+
+    def test_tie_prefers_earlier_sale(self):
+        """Test que a igual confianza se elige la venta anterior a la transferencia"""
+        transactions = [_tx(10000)]
+        sales = [_sale(10000, 1), _sale(10000, -1)]
+        matches = assign(transactions, sales)
+
+        assert [(t, s) for t, s, _ in matches] == [(0, 1)]
+        assert matches[0][2] == 90
+
+    def test_each_sale_used_once(self):
+        """Test que una venta no se asigna a dos transacciones y respeta el umbral"""
+        transactions = [_tx(5000), _tx(5000), _tx(7000)]
+        sales = [_sale(5000), _sale(7000, 3)]
+        matches = assign(transactions, sales)
+
+        assert len(matches) == 1
+        assert matches[0][1] == 0
+        assert len({s for _, s, _ in matches}) == len(matches)
+
+    def test_large_component_solved_in_blocks(self, monkeypatch):
+        """Test que una componente grande se resuelve por bloques sin repetir ventas"""
+        monkeypatch.setattr(matching, 'MAX_EXACT_CELLS', 30)
+        monkeypatch.setattr(matching, 'BLOCK_TRANSACTIONS', 3)
+        transactions = [_tx(1000, i % 10) for i in range(20)]
+        sales = [_sale(1000, i % 10) for i in range(20)]
+        matches = assign(transactions, sales)
+
+        assert len(matches) == 20
+        assert len({s for _, s, _ in matches}) == 20
+
+    def test_hungarian_minimum_cost(self):
+        """Test que el método húngaro encuentra la asignación de costo mínimo"""
+        cost = [[4, 1, 3], [2, 0, 5]]
+        assert hungarian(cost) == [1, 0] or hungarian(cost) == [2, 1]
+        assert hungarian([[1, 2], [2, 4]]) == [1, 0]
+
+
+class TestNameTokens:
+    """Tests de los tokens de nombre, RUT y pedido"""
+
+    def test_tokenize(self):
+        """Test que normaliza tildes, extrae el cuerpo del RUT y descarta palabras genéricas"""
+        tokens = tokenize('TRANSF DE JUAN PÉREZ 12.345.678-9 pedido #1042')
+
+        assert tokens == {'juan', 'perez', '12345678', 'pedido', '1042'}
+
+    def test_similarity(self):
+        """Test que un RUT o pedido en común vale 1 y los nombres truncados cuentan"""
+        sale = sale_tokens('Juan Pérez Soto', 1042)
+
+        assert name_similarity(tokenize('Pago pedido 1042'), sale) == 1.0
+        assert name_similarity(tokenize('TRANSF JUAN PER'), sale) == pytest.approx(2 / 3)
+        assert name_similarity(tokenize('TRANSF MARIA'), sale) == 0.0
+
+    def test_account_holder_is_a_separate_name(self):
+        """Test que el titular de la cuenta Shopify puntúa como nombre aparte, sin diluir el del pedido"""
+        sale = sale_tokens('Juan Pérez', 1042, account=('María Soto', 'maria.soto', '56912345678'))
+
+        assert '@maria' in sale and 'maria' not in sale
+        assert name_similarity(tokenize('TRANSF JUAN PEREZ'), sale) == 1.0
+        assert name_similarity(tokenize('TRANSF DE MARIA SOTO'), sale) == 1.0
+        assert name_similarity(tokenize('TEF 56912345678'), sale) == 1.0
+        assert name_similarity(tokenize('TRANSF MARIA'), sale) == pytest.approx(1 / 2)
+
+    def test_rebuild_adds_account_holder(self, monkeypatch):
+        """Test que la reconstrucción suma nota y titular de la cuenta con una consulta por lote"""
+        customer = ObjectId()
+        writes = []
+        finds = []
+
+        def collection(docs):
+            return SimpleNamespace(
+                find=lambda query, projection=None, **kwargs: finds.append(query) or [dict(d) for d in docs],
+                bulk_write=lambda ops, ordered=True: writes.extend(ops) or SimpleNamespace(modified_count=len(ops)))
+
+        sales = collection([{'_id': ObjectId(), 'customer_name': 'Regalo', 'shopify_order_number': 1001,
+                             'shopify_order_id': '100'}])
+        orders = collection([{'shopify_id': '100', 'note': 'RUT 12.345.678-9', 'customer': customer}])
+        customers = collection([{'_id': customer, 'name': 'Ana Pérez', 'email': 'ana@x.cl'}])
+        monkeypatch.setattr(Sale, '_get_collection', lambda: sales)
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+
+        assert rebuild_match_tokens() == 1
+        assert writes[0]._doc['$set']['match_tokens'] == ['1001', '12345678', '@ana', '@perez', 'regalo']
+        assert finds[-1] == {'_id': {'$in': [customer]}}
+
+    def test_refresh_account_tokens_writes_changed_sales(self, monkeypatch):
+        """Test que al cambiar el titular solo se reescriben las ventas de sus pedidos con tokens distintos"""
+        tenant, customer = ObjectId(), ObjectId()
+        writes = []
+        sale_queries = []
+        current = sale_tokens('Regalo', 1001, account=('Ana Soto', 'ana', ''))
+        sales_docs = [
+            {'_id': ObjectId(), 'customer_name': 'Regalo', 'shopify_order_number': 1001,
+             'shopify_order_id': '100', 'match_tokens': ['1001', '@ana', '@perez', 'regalo']},
+            {'_id': ObjectId(), 'customer_name': 'Regalo', 'shopify_order_number': 1001,
+             'shopify_order_id': '100', 'match_tokens': current},
+        ]
+        sales = SimpleNamespace(
+            find=lambda query, projection=None, **kwargs: sale_queries.append(query) or [dict(d) for d in sales_docs],
+            bulk_write=lambda ops, ordered=True: writes.extend(ops) or SimpleNamespace(modified_count=len(ops)))
+        orders = SimpleNamespace(
+            distinct=lambda field, query: ['100'] if query['customer'] == {'$in': [customer]} else [],
+            find=lambda query, projection=None: [{'shopify_id': '100', 'customer': customer}])
+        customers = SimpleNamespace(find=lambda query, projection=None: [
+            {'_id': customer, 'name': 'Ana Soto', 'email': 'ana@x.cl'}])
+        monkeypatch.setattr(Sale, '_get_collection', lambda: sales)
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+
+        assert refresh_account_tokens(tenant, [customer]) == 1
+        assert sale_queries == [{'tenant': tenant, 'shopify_order_id': {'$in': ['100']}}]
+        assert writes[0]._filter == {'_id': sales_docs[0]['_id']}
+        assert writes[0]._doc['$set']['match_tokens'] == current
+        assert refresh_account_tokens(tenant, []) == 0
+
+    def test_name_breaks_amount_ties(self):
+        """Test que entre dos ventas iguales en monto y fecha gana la del nombre de la glosa"""
+        transactions = [_tx(10000)]
+        transactions[0]['tokens'] = tokenize('TRANSF DE MARIA GONZALEZ')
+        sales = [_sale(10000), _sale(10000)]
+        sales[0]['tokens'] = sale_tokens('Pedro Rojas')
+        sales[1]['tokens'] = sale_tokens('María González')
+        matches = assign(transactions, sales)
+
+        assert matches[0][1] == 1
+        assert matches[0][2] == 100 + matching.NAME_WEIGHT
+
+    def test_name_does_not_pass_threshold(self):
+        """Test que el nombre no hace auto-conciliar una venta bajo el umbral por monto y fecha"""
+        transactions = [_tx(10000, 3)]
+        transactions[0]['tokens'] = tokenize('TRANSF DE MARIA GONZALEZ')
+        sales = [_sale(10000)]
+        sales[0]['tokens'] = sale_tokens('María González')
+
+        assert confidence(10000, 10000, transactions[0]['date'], DAY, 1.0) >= matching.MIN_CONFIDENCE
+        assert assign(transactions, sales) == []
+
+    def test_sale_clean_sets_tokens(self):
+        """Test que la venta calcula sus tokens al validarse"""
+        sale = Sale(customer_name='Ana Muñoz', shopify_order_number=1001)
+        sale.validate()
+
+        assert sale.match_tokens == ['1001', 'ana', 'munoz']
@@ -146,6 +146,18 @@ class TestProductModel:
         # Verificar que es una property
         assert isinstance(getattr(Product, 'total_stock'), property), "total_stock debería ser una @property"
 
+    def test_product_total_stock_uses_counter(self):
+        """Test que total_stock lee el contador materializado sin consultar lotes"""
+        product = Product(name='Test Product', sku='TEST-001', stock_current=42)
+
+        assert product.total_stock == 42
+
+    def test_product_stock_counter_not_materialized_by_default(self):
+        """Test que un producto sin contador queda en None (se recalcula desde lotes)"""
+        product = Product(name='Test Product', sku='TEST-001')
+
+        assert product.stock_current is None
+
 
 class TestSaleModel:
     """Tests para el modelo Sale"""
@@ -227,6 +239,24 @@ class TestSaleModel:
         # Al menos debería poder rastrear cuándo se creó
         assert has_timestamp or hasattr(sale, 'id'), "Sale debería tener timestamp o ID"
 
+    def test_sale_totals_use_stored_values(self):
+        """Test que los totales leen los valores guardados sin consultar items ni pagos"""
+        sale = Sale(customer_name='Test Customer', amount_total=15000, amount_paid=5000, amount_balance=10000)
+
+        assert sale.total_amount == 15000
+        assert sale.total_paid == 5000
+        assert sale.balance_pending == 10000
+        assert sale.computed_payment_status == 'parcial'
+
+    def test_sale_totals_stored_in_mongo_field_names(self):
+        """Test que los totales se guardan como total_amount/total_paid/balance"""
+        sale = Sale(customer_name='Test Customer', amount_total=100, amount_paid=0, amount_balance=100)
+        doc = sale.to_mongo()
+
+        assert doc['total_amount'] == 100
+        assert doc['total_paid'] == 0
+        assert doc['balance'] == 100
+
 
 class TestTenantModel:
     """Tests para el modelo Tenant (multi-tenancy)"""
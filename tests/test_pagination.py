@@ -0,0 +1,132 @@
+"""
+Tests de la paginación por cursor (app/services/pagination.py)
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from app.models import Sale
+from app.services.pagination import (
+    InvalidCursor, Page, after_filter, decode_cursor, encode_cursor, paginate
+)
+
+
+class FakeQuerySet:
+    """QuerySet mínimo que registra las llamadas y retorna filas fijas"""
+
+    def __init__(self, rows, total=None):
+        self.rows = rows
+        self.total = len(rows) if total is None else total
+        self.calls = []
+
+    def _record(self, *call):
+        self.calls.append(call)
+        return self
+
+    def order_by(self, *keys):
+        return self._record('order_by', keys)
+
+    def filter(self, q):
+        return self._record('filter', q)
+
+    def skip(self, n):
+        return self._record('skip', n)
+
+    def limit(self, n):
+        self._limit = n
+        return self._record('limit', n)
+
+    def count(self, with_limit_and_skip=False):
+        self.calls.append(('count', with_limit_and_skip))
+        return self.total
+
+    def __iter__(self):
+        return iter(self.rows[:self._limit])
+
+
+def _rows(count):
+    return [SimpleNamespace(pk=ObjectId(), date_created=datetime(2026, 1, 1, 12, i)) for i in range(count)]
+
+
+class TestCursorTokens:
+    """Tests de codificación de cursores"""
+
+    @pytest.mark.parametrize('value', [datetime(2026, 3, 1, 10, 30, 15, 123000), 1500.5, 'Ana', None])
+    def test_round_trip(self, value):
+        """Test que el token conserva valor e _id"""
+        doc_id = ObjectId()
+        assert decode_cursor(encode_cursor('date_created', value, doc_id), 'date_created') == (value, doc_id)
+
+    def test_rejects_other_field_and_garbage(self):
+        """Test que un cursor de otro listado o corrupto es inválido"""
+        token = encode_cursor('total_spent', 10, ObjectId())
+        with pytest.raises(InvalidCursor):
+            decode_cursor(token, 'date_created')
+        with pytest.raises(InvalidCursor):
+            decode_cursor('no-es-un-cursor', 'date_created')
+
+
+class TestAfterFilter:
+    """Tests del filtro keyset (campo, _id)"""
+
+    def test_descending_includes_ties_and_nulls(self):
+        """Test que en orden descendente siguen los menores, los empates por _id y los null"""
+        doc_id = ObjectId()
+        when = datetime(2026, 1, 1)
+        query = after_filter('date_created', when, doc_id).to_query(Sale)
+
+        assert query == {'$or': [
+            {'date_created': {'$lt': when}},
+            {'date_created': when, '_id': {'$lt': doc_id}},
+            {'date_created': None},
+        ]}
+
+    def test_null_cursor_descending(self):
+        """Test que después de un null solo quedan nulls con _id menor"""
+        doc_id = ObjectId()
+        query = after_filter('date_created', None, doc_id).to_query(Sale)
+
+        assert query == {'date_created': None, '_id': {'$lt': doc_id}}
+
+
+class TestPaginate:
+    """Tests de los dos modos de paginación"""
+
+    def test_page_mode_is_backward_compatible(self):
+        """Test que ?page usa skip, cuenta exacto y también entrega next_cursor"""
+        qs = FakeQuerySet(_rows(3), total=45)
+        page = paginate(qs, 'date_created', args={'page': '3', 'per_page': '2'})
+
+        assert ('skip', 4) in qs.calls
+        assert ('limit', 3) in qs.calls
+        assert [item.pk for item in page.items] == [r.pk for r in qs.rows[:2]]
+        assert page.meta()['pages'] == 23
+        assert page.page == 3
+        assert decode_cursor(page.next_cursor, 'date_created') == (qs.rows[1].date_created, qs.rows[1].pk)
+
+    def test_cursor_mode_skips_count_and_skip(self):
+        """Test que con cursor no hay count ni skip y se filtra desde el cursor"""
+        rows = _rows(2)
+        token = encode_cursor('date_created', rows[0].date_created, rows[0].pk)
+        qs = FakeQuerySet(rows)
+        page = paginate(qs, 'date_created', args={'cursor': token, 'per_page': '5'})
+
+        kinds = [call[0] for call in qs.calls]
+        assert 'count' not in kinds and 'skip' not in kinds
+        assert 'filter' in kinds
+        assert page.total is None
+        assert page.has_more is False
+
+    def test_estimated_count_is_capped(self):
+        """Test que count=estimate cuenta con límite"""
+        qs = FakeQuerySet(_rows(1), total=10000)
+        page = paginate(qs, 'date_created', args={'cursor': '', 'count': 'estimate'})
+
+        assert ('count', True) in qs.calls
+        assert page.meta()['total_exact'] is False
+
+    def test_meta_without_total(self):
+        """Test que sin conteo pages es None"""
+        assert Page([], 20, total=None).meta()['pages'] is None
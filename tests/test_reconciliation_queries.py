@@ -0,0 +1,119 @@
+"""
+Tests de las agregaciones de conciliación (app/services/reconciliation.py)
+"""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.models import BankTransaction, Sale
+from app.services import reconciliation
+from app.services.pagination import decode_cursor, encode_cursor
+from app.services.reconciliation import transaction_stats, unmatched_sales, unmatched_sales_pipeline
+from conftest import FakeCollection, requires_mongo
+
+TENANT = ObjectId()
+
+
+class TestTransactionStats:
+    """Tests de las estadísticas con $facet"""
+
+    def test_counts_and_amounts(self, monkeypatch):
+        """Test que arma conteos por estado y montos de créditos desde una agregación"""
+        collection = FakeCollection(rows=[{
+            'counts': [{'_id': 'pending', 'count': 3}, {'_id': 'matched', 'count': 5}],
+            'credits': [{'_id': 'pending', 'amount': 1500.5}, {'_id': 'matched', 'amount': 9000}],
+        }])
+        monkeypatch.setattr(BankTransaction, '_get_collection', lambda: collection)
+        stats = transaction_stats(TENANT)
+
+        assert stats == {'pending': 3, 'matched': 5, 'ignored': 0, 'total': 8,
+                         'pending_amount': 1500.5, 'matched_amount': 9000.0}
+        assert len(collection.pipelines) == 1
+        assert '$facet' in collection.pipelines[0][-1]
+
+
+class TestUnmatchedSales:
+    """Tests del anti-join de ventas sin conciliar"""
+
+    def test_pipeline_anti_join_and_cursor(self):
+        """Test que filtra desde el cursor, hace $lookup y descarta las ventas con match"""
+        after = (datetime(2026, 3, 1), ObjectId())
+        pipeline = unmatched_sales_pipeline(TENANT, 20, after=after)
+
+        assert '$and' in pipeline[0]['$match']
+        lookup = next(stage['$lookup'] for stage in pipeline if '$lookup' in stage)
+        assert (lookup['from'], lookup['foreignField']) == ('bank_transactions', 'matched_sale')
+        assert {'$match': {'matches': {'$size': 0}}} in pipeline
+        assert pipeline[-1] == {'$limit': 21}
+
+    def test_page_with_next_cursor_and_legacy_totals(self, monkeypatch):
+        """Test que entrega next_cursor y calcula el total de ventas sin totales guardados"""
+        rows = [{'_id': ObjectId(), 'date_created': datetime(2026, 3, 3 - i), 'total_amount': None}
+                for i in range(3)]
+        collection = FakeCollection(rows=rows)
+        monkeypatch.setattr(Sale, '_get_collection', lambda: collection)
+        monkeypatch.setattr(reconciliation, 'compute_totals',
+                            lambda ids: {sale_id: (1990.0, 0.0, 1) for sale_id in ids})
+        token = encode_cursor('date_created', datetime(2026, 3, 5), ObjectId())
+        page, meta = unmatched_sales(TENANT, {'cursor': token, 'per_page': '2'})
+
+        assert [row['_id'] for row in page] == [rows[0]['_id'], rows[1]['_id']]
+        assert page[0]['total_amount'] == 1990.0
+        assert meta['has_more'] is True
+        assert decode_cursor(meta['next_cursor'], 'date_created') == (rows[1]['date_created'], rows[1]['_id'])
+        assert not any('$skip' in stage for stage in collection.pipelines[0])
+
+
+@requires_mongo
+class TestAggregationsOnMongo:
+    """Tests de las agregaciones de conciliación contra MongoDB"""
+
+    @pytest.fixture
+    def tenants(self, app_context):
+        tenants = [ObjectId(), ObjectId()]
+        yield tenants
+        for document in (BankTransaction, Sale):
+            document._get_collection().delete_many({'tenant': {'$in': tenants}})
+
+    def test_facet_counts_and_credit_amounts(self, tenants):
+        """Test que $facet cuenta por estado y suma solo los créditos pendientes y conciliados del tenant"""
+        tenant, other = tenants
+        BankTransaction._get_collection().insert_many([
+            {'tenant': tenant, 'status': 'pending', 'transaction_type': 'credit', 'amount': 1000.5},
+            {'tenant': tenant, 'status': 'pending', 'transaction_type': 'debit', 'amount': 300.0},
+            {'tenant': tenant, 'status': 'matched', 'transaction_type': 'credit', 'amount': 2500.0},
+            {'tenant': tenant, 'status': 'ignored', 'transaction_type': 'credit', 'amount': 99.0},
+            {'tenant': other, 'status': 'pending', 'transaction_type': 'credit', 'amount': 7.0},
+        ])
+
+        assert transaction_stats(tenant) == {'pending': 2, 'matched': 1, 'ignored': 1, 'total': 4,
+                                             'pending_amount': 1000.5, 'matched_amount': 2500.0}
+        assert transaction_stats(ObjectId())['total'] == 0
+
+    def test_lookup_anti_join_pages(self, tenants):
+        """Test que el $lookup descarta las ventas con transacción conciliada y pagina por cursor"""
+        tenant, other = tenants
+        matched, pending_tx, free, paid = (ObjectId() for _ in range(4))
+        Sale._get_collection().insert_many([
+            {'_id': matched, 'tenant': tenant, 'payment_status': 'pendiente',
+             'date_created': datetime(2026, 3, 4), 'total_amount': 1000.0},
+            {'_id': pending_tx, 'tenant': tenant, 'payment_status': 'parcial',
+             'date_created': datetime(2026, 3, 3), 'total_amount': 2000.0},
+            {'_id': free, 'tenant': tenant, 'payment_status': 'pendiente',
+             'date_created': datetime(2026, 3, 2), 'total_amount': 3000.0},
+            {'_id': paid, 'tenant': tenant, 'payment_status': 'pagado',
+             'date_created': datetime(2026, 3, 5), 'total_amount': 4000.0},
+            {'_id': ObjectId(), 'tenant': other, 'payment_status': 'pendiente',
+             'date_created': datetime(2026, 3, 6), 'total_amount': 5000.0},
+        ])
+        BankTransaction._get_collection().insert_many([
+            {'tenant': tenant, 'status': 'matched', 'matched_sale': matched, 'amount': 1000.0},
+            {'tenant': tenant, 'status': 'pending', 'matched_sale': pending_tx, 'amount': 2000.0},
+        ])
+
+        first, meta = unmatched_sales(tenant, {'cursor': '', 'per_page': '1'})
+        second, last = unmatched_sales(tenant, {'cursor': meta['next_cursor'], 'per_page': '1'})
+
+        assert [row['_id'] for row in first + second] == [pending_tx, free]
+        assert meta['has_more'] is True and last['has_more'] is False
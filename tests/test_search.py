@@ -0,0 +1,109 @@
+"""
+Tests de la búsqueda indexada (app/services/search.py)
+"""
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from app.models import Product, ShopifyCustomer
+from app.services.search import phone_keys, rebuild_search_fields, search_filter, search_products, search_tokens
+from conftest import FakeCollection
+
+
+class TestTokens:
+    """Tests de los tokens de búsqueda"""
+
+    def test_prefixes_are_normalized(self):
+        """Test que guarda los prefijos de cada palabra en minúsculas y sin tildes"""
+        assert search_tokens('Pérez') == ['p', 'pe', 'per', 'pere', 'perez']
+        assert 'ana' in search_tokens('Ana Díaz', 'ana.diaz@gmail.com')
+        assert 'gmail' in search_tokens('Ana Díaz', 'ana.diaz@gmail.com')
+
+    def test_long_words_are_truncated(self):
+        """Test que los prefijos no pasan de MAX_GRAM caracteres"""
+        assert max(map(len, search_tokens('supercalifragilistico'))) == 15
+
+    def test_phone_keys(self):
+        """Test que guarda el teléfono solo con dígitos, con y sin código de país"""
+        assert phone_keys('+56 9 1234 5678') == ['56912345678', '912345678']
+        assert phone_keys('9 1234 5678') == ['912345678']
+        assert phone_keys('12') == [] and phone_keys(None) == []
+
+
+class TestSearchFilter:
+    """Tests del filtro de búsqueda"""
+
+    def test_words_must_all_match(self):
+        """Test que cada palabra buscada es un prefijo obligatorio"""
+        assert search_filter('Juan PÉR') == {'search_tokens': {'$all': ['juan', 'per']}}
+
+    def test_digits_also_match_phone(self):
+        """Test que una búsqueda numérica también compara el prefijo del teléfono"""
+        assert search_filter('+56 9 8765', phones=True) == {'$or': [
+            {'search_tokens': {'$all': ['56', '8765', '9']}},
+            {'phone_keys': {'$regex': '^5698765'}},
+        ]}
+        assert search_filter('8765') == {'search_tokens': {'$all': ['8765']}}
+
+    def test_nothing_searchable(self):
+        """Test que sin palabras no hay filtro"""
+        assert search_filter('  .-  ') is None
+
+
+class TestUnsearchable:
+    """Tests de búsquedas sin palabras buscables"""
+
+    def test_search_products_matches_nothing(self, monkeypatch):
+        """Test que '???' no retorna todo el catálogo"""
+        products = FakeCollection([{'_id': ObjectId(), 'tenant': ObjectId(), 'name': 'Caja Premium'}])
+        monkeypatch.setattr(Product, '_get_collection', lambda: products)
+
+        assert list(search_products(ObjectId(), '???')) == []
+
+    def test_webhook_fallback_not_found(self, monkeypatch):
+        """Test que el webhook de ventas no asigna un producto cualquiera a un nombre sin palabras"""
+        from app.routes import api
+
+        searched = []
+        monkeypatch.setattr(api, 'Product', SimpleNamespace(objects=lambda **kw: SimpleNamespace(first=lambda: None)))
+        monkeypatch.setattr(api, 'search_products',
+                            lambda tenant, name: searched.append(name) or SimpleNamespace(first=lambda: 'Caja Premium'))
+
+        for name in ('???', '🍕', '—'):
+            assert api.find_item_product(ObjectId(), '', name) is None
+        assert searched == []
+        assert api.find_item_product(ObjectId(), '', 'caja prem') == 'Caja Premium'
+
+
+class TestSearchFields:
+    """Tests del cálculo de los campos al guardar y al reconstruir"""
+
+    def test_clean_sets_fields(self):
+        """Test que clean() recalcula los campos de búsqueda"""
+        customer = ShopifyCustomer(name='José Muñoz', email='jm@empresa.cl', phone='+56912345678')
+        customer.clean()
+        assert {'jose', 'munoz', 'empresa'} <= set(customer.search_tokens)
+        assert customer.phone_keys == ['56912345678', '912345678']
+
+        product = Product(name='Caja Regalo', sku='CR-01')
+        product.clean()
+        assert {'caja', 'regalo', 'cr', '01'} <= set(product.search_tokens)
+
+    def test_rebuild_in_batches(self, monkeypatch):
+        """Test que reconstruye los campos del tenant con bulk_write por lotes"""
+        tenant, other = ObjectId(), ObjectId()
+        customers = FakeCollection([
+            {'_id': ObjectId(), 'tenant': tenant, 'name': 'Ana Soto', 'phone': '912345678'},
+            {'_id': ObjectId(), 'tenant': tenant, 'name': 'Luis Rojas'},
+            {'_id': ObjectId(), 'tenant': other, 'name': 'Otro'},
+        ])
+        products = FakeCollection([{'_id': ObjectId(), 'tenant': tenant, 'name': 'Torta', 'sku': 'T1'}])
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+        monkeypatch.setattr(Product, '_get_collection', lambda: products)
+        monkeypatch.setattr('app.services.search.REBUILD_BATCH', 1)
+
+        assert rebuild_search_fields(tenant) == {'customers': 2, 'products': 1}
+        assert [len(ops) for ops in customers.writes] == [1, 1]
+        assert 'sot' in customers.docs[0]['search_tokens'] and customers.docs[0]['phone_keys'] == ['912345678']
+        assert 'search_tokens' not in customers.docs[2]
+        assert 't1' in products.docs[0]['search_tokens']
@@ -0,0 +1,513 @@
+"""
+Tests del cliente Shopify y los upserts bulk (app/services/shopify.py)
+
+El cliente se prueba contra un servidor HTTP local que imita la API REST
+de Shopify (paginación por header Link, 429 y límite de llamadas).
+"""
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from bson import ObjectId
+
+from app.models import Product, Sale, SaleItem, ShopifyCustomer, ShopifyOrder
+from app.services import shopify
+from app.services.shopify import (
+    OVERLAP, ShopifyClient, ShopifyError, checkpointed_pages, content_hash, customer_fields, product_hash,
+    refresh_customer_stats, sync_preview, upsert_customers, upsert_orders
+)
+from conftest import FakeCollection, requires_mongo
+
+TENANT = ObjectId()
+
+
+class FakeShopify(BaseHTTPRequestHandler):
+    pages = {}
+    throttle_once = set()
+    call_limit = '1/40'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-Shopify-Shop-Api-Call-Limit', self.call_limit)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.requests.append((url.path, query))
+        resource = url.path.rsplit('/', 1)[-1].replace('.json', '')
+        if resource in self.throttle_once:
+            self.throttle_once.discard(resource)
+            return self._send(429, {'errors': 'Exceeded 2 calls per second'}, {'Retry-After': '0.0'})
+        if resource not in self.pages:
+            return self._send(403, {'errors': 'Forbidden'})
+        page = int(query.get('page_info', ['0'])[0])
+        pages = self.pages[resource]
+        if page >= len(pages):
+            return self._send(400, {'errors': 'page_info inválido'})
+        headers = {}
+        if page + 1 < len(pages):
+            host = self.headers['Host']
+            headers['Link'] = f'<http://{host}{url.path}?limit=250&page_info={page + 1}>; rel="next"'
+        self._send(200, {resource: pages[page]}, headers)
+
+
+@pytest.fixture
+def shopify_server():
+    FakeShopify.pages = {}
+    FakeShopify.throttle_once = set()
+    FakeShopify.call_limit = '1/40'
+    FakeShopify.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeShopify)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/admin/api/2026-01'
+    server.shutdown()
+    server.server_close()
+
+
+class TestShopifyClient:
+    """Tests del cliente HTTP"""
+
+    def test_pages_follow_link_header(self, shopify_server):
+        """Test que recorre todas las páginas siguiendo el header Link"""
+        FakeShopify.pages['customers'] = [[{'id': 1}, {'id': 2}], [{'id': 3}], [{'id': 4}]]
+        with ShopifyClient({'X-Shopify-Access-Token': 'x'}, base_url=shopify_server) as client:
+            pages = list(client.pages('customers.json', 'customers'))
+
+        assert [[c['id'] for c in page] for page in pages] == [[1, 2], [3], [4]]
+        assert [query.get('page_info') for _, query in FakeShopify.requests] == [None, ['1'], ['2']]
+        assert FakeShopify.requests[0][1]['limit'] == ['250']
+
+    def test_retries_429_with_retry_after(self, shopify_server):
+        """Test que ante 429 espera Retry-After y reintenta"""
+        FakeShopify.pages['orders'] = [[{'id': 10}]]
+        FakeShopify.throttle_once.add('orders')
+        waits = []
+        client = ShopifyClient({}, base_url=shopify_server, sleep=waits.append)
+        pages = list(client.pages('orders.json', 'orders', params={'status': 'any'}))
+
+        assert pages == [[{'id': 10}]]
+        assert waits == [0.0]
+        assert len(FakeShopify.requests) == 2
+        assert FakeShopify.requests[-1][1]['status'] == ['any']
+
+    def test_throttles_when_bucket_is_full(self, shopify_server):
+        """Test que espera antes de la siguiente llamada si el balde está casi lleno"""
+        FakeShopify.pages['products'] = [[{'id': 1}], [{'id': 2}]]
+        FakeShopify.call_limit = '39/40'
+        waits = []
+        client = ShopifyClient({}, base_url=shopify_server, sleep=waits.append)
+        list(client.pages('products.json', 'products', prefetch=False))
+
+        # (39 - 20) / 2 llamadas por segundo
+        assert len(waits) == 1 and 9 < waits[0] <= 9.5
+
+    def test_error_status(self, shopify_server):
+        """Test que un 403 se entrega al llamador y pages lanza ShopifyError"""
+        client = ShopifyClient({}, base_url=shopify_server)
+        assert client.get('customers.json', params={'limit': 1}).status_code == 403
+        with pytest.raises(ShopifyError) as exc:
+            list(client.pages('customers.json', 'customers'))
+        assert exc.value.status_code == 403
+
+
+class FakeState(SimpleNamespace):
+    def __init__(self, **kwargs):
+        defaults = {'updated_at_min': None, 'cursor': None, 'run_started_at': None,
+                    'last_completed_at': None, 'records': 0}
+        super().__init__(**{**defaults, **kwargs})
+        self.saved = []
+
+    def save(self):
+        self.saved.append((self.cursor, self.updated_at_min))
+
+
+class TestCheckpointedPages:
+    """Tests de la sincronización incremental con punto de control"""
+
+    def test_incremental_uses_watermark_and_advances_it(self, shopify_server, monkeypatch):
+        """Test que pide desde updated_at_min y al terminar mueve la marca al inicio de la corrida"""
+        FakeShopify.pages['orders'] = [[{'id': 1}], [{'id': 2}]]
+        state = FakeState(updated_at_min=datetime(2026, 3, 1, 12, 0))
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: state)
+        client = ShopifyClient({}, base_url=shopify_server)
+        pages = list(checkpointed_pages(client, TENANT, 'orders', {'status': 'any'}))
+
+        assert [page[0]['id'] for page in pages] == [1, 2]
+        assert FakeShopify.requests[0][1]['updated_at_min'] == ['2026-03-01T12:00:00+00:00']
+        assert state.cursor is None and state.records == 2
+        assert state.updated_at_min == state.run_started_at - OVERLAP
+
+    def test_resumes_from_cursor_after_failure(self, shopify_server, monkeypatch):
+        """Test que si falla una página, la corrida siguiente retoma desde ella sin mover la marca"""
+        FakeShopify.pages['customers'] = [[{'id': 1}], [{'id': 2}], [{'id': 3}]]
+        watermark = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        state = FakeState(updated_at_min=watermark)
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: state)
+        client = ShopifyClient({}, base_url=shopify_server)
+        with pytest.raises(RuntimeError):
+            for page in checkpointed_pages(client, TENANT, 'customers'):
+                if page[0]['id'] == 2:
+                    raise RuntimeError('caída procesando la página')
+
+        assert 'page_info=1' in state.cursor and state.updated_at_min == watermark
+        FakeShopify.requests.clear()
+        pages = list(checkpointed_pages(client, TENANT, 'customers'))
+
+        assert [page[0]['id'] for page in pages] == [2, 3]
+        assert FakeShopify.requests[0][1]['page_info'] == ['1']
+        assert state.cursor is None and state.updated_at_min > watermark
+
+    def test_expired_cursor_restarts_from_watermark(self, shopify_server, monkeypatch):
+        """Test que un cursor que Shopify ya no acepta reinicia la corrida desde la marca"""
+        FakeShopify.pages['customers'] = [[{'id': 1}]]
+        state = FakeState(cursor=f'{shopify_server}/customers.json?limit=250&page_info=9',
+                          updated_at_min=datetime(2026, 3, 1))
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: state)
+        client = ShopifyClient({}, base_url=shopify_server)
+        pages = list(checkpointed_pages(client, TENANT, 'customers'))
+
+        assert pages == [[{'id': 1}]]
+        assert FakeShopify.requests[-1][1]['updated_at_min'] == ['2026-03-01T00:00:00+00:00']
+
+    def test_full_and_non_incremental(self, shopify_server, monkeypatch):
+        """Test que full descarta la marca y los productos se recorren completos"""
+        FakeShopify.pages['products'] = [[{'id': 1}]]
+        state = FakeState(updated_at_min=datetime.now() - timedelta(days=1))
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: state)
+        client = ShopifyClient({}, base_url=shopify_server)
+        list(checkpointed_pages(client, TENANT, 'products', full=True, incremental=False))
+
+        assert 'updated_at_min' not in FakeShopify.requests[0][1]
+        assert state.updated_at_min is None and state.last_completed_at is not None
+
+
+class TestUpserts:
+    """Tests de los upserts bulk por página"""
+
+    def test_upsert_customers_one_bulk_write(self, monkeypatch):
+        """Test que escribe una página de clientes en un solo bulk_write con upsert"""
+        existing = ObjectId()
+        collection = FakeCollection([{'_id': existing, 'tenant': TENANT, 'shopify_id': '1'}])
+        refreshed = []
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: collection)
+        monkeypatch.setattr(shopify, 'refresh_account_tokens', lambda tenant, ids: refreshed.append(ids))
+        result = upsert_customers(TENANT, [
+            {'id': 1, 'first_name': 'Ana', 'last_name': 'Pérez', 'tags': 'VIP, mayorista', 'total_spent': '1000.50'},
+            {'id': 2, 'first_name': 'Luis', 'last_name': None, 'default_address': {'city': 'Valdivia'}},
+        ])
+
+        assert result == {'created': 1, 'updated': 1, 'unchanged': 0}
+        ops = collection.writes[0]
+        assert len(collection.writes) == 1 and len(ops) == 2
+        assert ops[0]._filter == {'tenant': TENANT, 'shopify_id': '1'} and ops[0]._upsert
+        fields = ops[0]._doc['$set']
+        assert (fields['name'], fields['tags'], fields['total_spent']) == ('Ana Pérez', ['vip', 'mayorista'], 1000.5)
+        assert ops[1]._doc['$set']['name'] == 'Luis'
+        assert ops[1]._doc['$set']['address_city'] == 'Valdivia'
+        assert len(fields['sync_hash']) == 40
+        # Solo el cliente actualizado puede tener ventas con sus tokens
+        assert refreshed == [[existing]]
+
+    def test_skips_unchanged_by_content_hash(self, monkeypatch):
+        """Test que no escribe los clientes cuyo hash no cambió y actualiza el mapa precargado"""
+        collection = FakeCollection()
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: collection)
+        monkeypatch.setattr(shopify, 'refresh_account_tokens', lambda tenant, ids: None)
+        page = [{'id': 1, 'first_name': 'Ana', 'email': 'ana@example.com'}]
+        known = {}
+        assert upsert_customers(TENANT, page, known=known)['created'] == 1
+        assert set(known) == {'1'}
+
+        assert upsert_customers(TENANT, page, known=known) == {'created': 0, 'updated': 0, 'unchanged': 1}
+        assert len(collection.writes) == 1
+        page[0]['email'] = 'ana@otro.cl'
+        assert upsert_customers(TENANT, page, known=known)['unchanged'] == 0
+        assert len(collection.writes) == 2
+
+    def test_upsert_orders_links_and_creates_customers(self, monkeypatch):
+        """Test que crea los clientes faltantes, enlaza las órdenes y refresca estadísticas"""
+        customer_id = ObjectId()
+        customers = FakeCollection([{'_id': customer_id, 'tenant': TENANT, 'shopify_id': '7'}])
+        orders = FakeCollection()
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        result = upsert_orders(TENANT, [{
+            'id': 100, 'order_number': 1001, 'total_price': '19990',
+            'customer': {'id': 7, 'first_name': 'Ana', 'last_name': 'Pérez'},
+            'line_items': [{'title': 'Caja', 'quantity': 2, 'price': '9995', 'product_id': 55}],
+            'created_at': '2026-03-01T10:00:00Z',
+        }], create_customers=True)
+
+        assert result == {'created': 1, 'updated': 0, 'unchanged': 0, 'customers_created': 0,
+                          'customer_ids': {customer_id}}
+        assert '$setOnInsert' in customers.writes[0][0]._doc
+        order = orders.writes[0][0]._doc['$set']
+        assert order['customer'] == customer_id and order['customer_name'] == 'Ana Pérez'
+        assert order['line_items'][0]['product_shopify_id'] == '55'
+
+    def test_refresh_customer_stats_group_and_merge(self, monkeypatch):
+        """Test que recalcula las estadísticas de los clientes tocados con $group y $merge"""
+        orders = FakeCollection()
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        customer_id = ObjectId()
+        refresh_customer_stats(TENANT, {customer_id, None})
+
+        match, group, merge = orders.pipelines[0]
+        assert match['$match'] == {'customer': {'$in': [customer_id]}, 'tenant': TENANT}
+        assert set(group['$group']) == {'_id', 'total_orders', 'total_spent', 'first_order_date', 'last_order_date'}
+        assert merge['$merge'] == {'into': 'shopify_customers', 'on': '_id',
+                                   'whenMatched': 'merge', 'whenNotMatched': 'discard'}
+
+        refresh_customer_stats(TENANT, [ObjectId() for _ in range(shopify.MAX_IN_IDS + 1)])
+        assert orders.pipelines[1][0]['$match'] == {'customer': {'$ne': None}, 'tenant': TENANT}
+
+
+@requires_mongo
+class TestCustomerStatsOnMongo:
+    """Tests del $merge de estadísticas de clientes contra MongoDB"""
+
+    @pytest.fixture
+    def tenant(self, app_context):
+        tenant = ObjectId()
+        yield tenant
+        for document in (ShopifyCustomer, ShopifyOrder):
+            document._get_collection().delete_many({'tenant': tenant})
+
+    def test_merge_updates_only_customers_with_orders(self, tenant):
+        """Test que $merge escribe totales y fechas en los clientes con órdenes y no crea ni toca otros"""
+        buyer, idle, unknown = ObjectId(), ObjectId(), ObjectId()
+        customers = ShopifyCustomer._get_collection()
+        customers.insert_many([
+            {'_id': buyer, 'tenant': tenant, 'name': 'Ana', 'total_orders': 0, 'total_spent': 0.0},
+            {'_id': idle, 'tenant': tenant, 'name': 'Luis', 'total_orders': 3, 'total_spent': 500.0},
+        ])
+        ShopifyOrder._get_collection().insert_many([
+            {'tenant': tenant, 'customer': buyer, 'total_price': 1000.0, 'created_at': datetime(2026, 3, 1)},
+            {'tenant': tenant, 'customer': buyer, 'total_price': 2500.5, 'created_at': datetime(2026, 3, 9)},
+            {'tenant': tenant, 'customer': unknown, 'total_price': 99.0, 'created_at': datetime(2026, 3, 5)},
+            {'tenant': tenant, 'customer': None, 'total_price': 10.0, 'created_at': datetime(2026, 3, 5)},
+        ])
+
+        refresh_customer_stats(tenant, [buyer, idle, unknown])
+
+        ana = customers.find_one({'_id': buyer})
+        assert (ana['total_orders'], ana['total_spent'], ana['name']) == (2, 3500.5, 'Ana')
+        assert (ana['first_order_date'], ana['last_order_date']) == (datetime(2026, 3, 1), datetime(2026, 3, 9))
+        assert customers.find_one({'_id': idle})['total_orders'] == 3
+        assert customers.count_documents({'tenant': tenant}) == 2
+
+
+class FakeStore:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.inserted = []
+        self.writes = []
+        self.finds = 0
+
+    def find(self, query, projection=None, **kwargs):
+        self.finds += 1
+        return iter(self.docs)
+
+    def insert_many(self, docs):
+        self.inserted.append(list(docs))
+
+    def bulk_write(self, ops, ordered=True):
+        self.writes.append(list(ops))
+        return SimpleNamespace(modified_count=len(ops))
+
+
+class TestSalesFromOrders:
+    """Tests de la conversión de órdenes en ventas"""
+
+    def setup_collections(self, monkeypatch, orders, sales=(), products=()):
+        stores = {'orders': FakeStore(orders), 'sales': FakeStore(sales),
+                  'items': FakeStore(), 'products': FakeStore(products)}
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: stores['orders'])
+        monkeypatch.setattr(Sale, '_get_collection', lambda: stores['sales'])
+        monkeypatch.setattr(SaleItem, '_get_collection', lambda: stores['items'])
+        monkeypatch.setattr(Product, '_get_collection', lambda: stores['products'])
+        rollups = []
+        monkeypatch.setattr(shopify, 'bump_daily_many', lambda increments: rollups.append(dict(increments)))
+        return stores, rollups
+
+    def test_builds_sales_in_batches_with_preloaded_maps(self, monkeypatch):
+        """Test que arma ventas e items en memoria, los inserta por lotes y omite las ya convertidas"""
+        by_sku, by_shopify_id = ObjectId(), ObjectId()
+        created = datetime(2026, 3, 1, 10)
+        orders = [
+            {'shopify_id': str(100 + i), 'order_number': 1000 + i, 'customer_name': 'Ana Pérez',
+             'shipping_address1': 'Av. Principal 456', 'shipping_city': 'Valdivia', 'created_at': created,
+             'financial_status': 'paid', 'line_items': [
+                 {'sku': 'CAJA-1', 'quantity': 2, 'price': 9990.0},
+                 {'sku': None, 'product_shopify_id': '55', 'quantity': 1, 'price': 5000.0},
+                 {'sku': 'NO-EXISTE', 'quantity': 1, 'price': 100.0},
+             ]}
+            for i in range(3)
+        ]
+        stores, rollups = self.setup_collections(
+            monkeypatch, orders,
+            sales=[{'_id': ObjectId(), 'shopify_order_id': '100'}],
+            products=[{'_id': by_sku, 'sku': 'CAJA-1'}, {'_id': by_shopify_id, 'shopify_id': '55'}],
+        )
+        result = shopify.sales_from_orders(TENANT, batch_size=1)
+
+        assert result == {'created': 2, 'skipped': 1, 'updated': 0}
+        assert stores['products'].finds == 1 and stores['sales'].finds == 1
+        assert len(stores['sales'].inserted) == 2
+        sale = stores['sales'].inserted[0][0]
+        assert sale['shopify_order_id'] == '101' and sale['sales_channel'] == 'shopify'
+        assert sale['address'] == 'Av. Principal 456, Valdivia'
+        assert (sale['total_amount'], sale['total_paid'], sale['balance']) == (24980.0, 0.0, 24980.0)
+        assert sale['payment_status'] == 'pagado' and '1001' in sale['match_tokens']
+        items = stores['items'].inserted[0]
+        assert [item['product'] for item in items] == [by_sku, by_shopify_id]
+        assert all(item['sale'] == sale['_id'] for item in items)
+        assert rollups[0] == {(TENANT, created, 'shopify'): {'sales_count': 1, 'units': 3, 'revenue': 24980.0}}
+
+    def test_tokens_include_linked_account(self, monkeypatch):
+        """Test que los tokens de conciliación suman el titular de la cuenta, con una consulta por lote"""
+        ana, luis = ObjectId(), ObjectId()
+        orders = [{'shopify_id': str(100 + i), 'order_number': 1000 + i, 'customer_name': 'Regalo Para Mamá',
+                   'customer': customer} for i, customer in enumerate((ana, luis, None))]
+        customers = FakeStore([
+            {'_id': ana, 'name': 'Ana Pérez', 'email': 'ana.perez@gmail.com', 'phone': '+56 9 1234 5678'},
+            {'_id': luis, 'name': 'Luis Soto', 'email': None, 'phone': None},
+        ])
+        stores, _ = self.setup_collections(monkeypatch, orders)
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+
+        shopify.sales_from_orders(TENANT)
+
+        first, second, third = stores['sales'].inserted[0]
+        assert {'regalo', 'mama', '@ana', '@perez', '56912345678'} <= set(first['match_tokens'])
+        assert {'@luis', '@soto'} <= set(second['match_tokens'])
+        assert not any(token.startswith('@') for token in third['match_tokens'])
+        assert customers.finds == 1
+
+    def test_refresh_addresses_of_existing_sales(self, monkeypatch):
+        """Test que completa dirección y teléfono de ventas existentes con un bulk_write"""
+        sale_id = ObjectId()
+        stores, _ = self.setup_collections(
+            monkeypatch,
+            [{'shopify_id': '100', 'shipping_address1': 'Calle 1', 'shipping_city': 'Osorno',
+              'shipping_phone': '+56911111111'}],
+            sales=[{'_id': sale_id, 'shopify_order_id': '100', 'address': 'Osorno', 'phone': None}],
+        )
+        result = shopify.sales_from_orders(TENANT, refresh_addresses=True)
+
+        assert (result['created'], result['updated']) == (0, 1)
+        op = stores['sales'].writes[0][0]
+        assert op._filter == {'_id': sale_id}
+        assert op._doc == {'$set': {'address': 'Calle 1, Osorno', 'phone': '+56911111111'}}
+
+
+class FakePagesClient:
+    def __init__(self, resources):
+        self.resources = resources
+        self.requests = []
+
+    def pages(self, path, key, params=None):
+        self.requests.append((path, params))
+        if key not in self.resources:
+            raise ShopifyError(403, 'forbidden')
+        return iter(self.resources[key])
+
+
+class TestSyncPreview:
+    """Tests del preview de sincronización por hash de contenido"""
+
+    def test_classifies_by_hash_with_exact_counts(self, monkeypatch):
+        """Test que clasifica nuevos, modificados y sin cambios en una pasada y cuenta más allá del límite"""
+        unchanged_product = {'id': 1, 'title': 'Caja', 'variants': [{'sku': 'CAJA', 'price': '9990',
+                                                                     'inventory_quantity': 5}]}
+        changed_product = {'id': 2, 'title': 'Bolsa', 'variants': [{'sku': 'BOLSA', 'price': '1990',
+                                                                    'inventory_quantity': 7}]}
+        customer = {'id': 7, 'first_name': 'Ana', 'email': 'ana@example.com'}
+        customer_id = ObjectId()
+        products = FakeCollection([
+            {'_id': ObjectId(), 'tenant': TENANT, 'sku': 'CAJA', 'shopify_id': '1',
+             'sync_hash': product_hash(unchanged_product)},
+            {'_id': ObjectId(), 'tenant': TENANT, 'sku': 'BOLSA', 'shopify_id': '2', 'sync_hash': 'viejo',
+             'name': 'Bolsa', 'base_price': 1990.0, 'stock_current': 3},
+        ])
+        customers = FakeCollection([{'_id': customer_id, 'tenant': TENANT, 'shopify_id': '7', 'name': 'Ana',
+                                     'sync_hash': content_hash(shopify._drop_none_dates(customer_fields(customer)))}])
+        orders = FakeCollection([{'tenant': TENANT, 'shopify_id': '100', 'sync_hash': 'viejo'}])
+        monkeypatch.setattr(Product, '_get_collection', lambda: products)
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: customers)
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        monkeypatch.setattr(Sale, '_get_collection', lambda: FakeCollection())
+        watermark = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: FakeState(updated_at_min=watermark))
+
+        new_products = [{'id': 10 + i, 'title': f'Nuevo {i}', 'variants': [{'sku': f'N{i}'}]} for i in range(3)]
+        client = FakePagesClient({
+            'products': [[unchanged_product, changed_product], new_products],
+            'customers': [[customer, {'id': 8, 'first_name': 'Luis'}]],
+            'orders': [[{'id': 100, 'order_number': 1001, 'customer': {'id': 7, 'first_name': 'Ana'},
+                         'total_price': '9990'}]],
+        })
+        preview = sync_preview(client, TENANT, limit=2)
+
+        assert preview['summary'] == {
+            'products_new': 3, 'products_update': 1, 'products_unchanged': 1,
+            'customers_new': 1, 'customers_update': 0, 'customers_unchanged': 1,
+            'orders_new': 0, 'orders_update': 1, 'orders_unchanged': 0, 'sales_new': 1, 'has_changes': True,
+        }
+        assert [p['sku'] for p in preview['products']['new']] == ['N0', 'N1']
+        assert preview['products']['update'][0]['changes'] == ['stock: 3 → 7']
+        assert preview['orders']['update'][0]['customer'] == 'Ana'
+        # Clientes y órdenes desde la marca de la última sincronización; productos completos
+        params = dict(client.requests)
+        assert 'updated_at_min' in params['orders.json'] and 'updated_at_min' not in params['products.json']
+        assert preview['errors'] == []
+
+    def test_missing_scope_is_reported(self, monkeypatch):
+        """Test que informa el error de un recurso sin permiso y sigue con los demás"""
+        for document in (Product, ShopifyCustomer, ShopifyOrder, Sale):
+            monkeypatch.setattr(document, '_get_collection', lambda: FakeCollection())
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: FakeState())
+        client = FakePagesClient({'products': [], 'orders': [[{'id': 1, 'order_number': 1}]]})
+        preview = sync_preview(client, TENANT)
+
+        assert preview['errors'] == ['Error al obtener clientes: 403']
+        assert preview['summary']['orders_new'] == 1 and preview['summary']['has_changes']
+
+    def test_counts_mirrored_orders_without_sale(self, monkeypatch):
+        """Test que las órdenes ya guardadas sin venta cuentan como ventas a crear aunque no cambien"""
+        order = {'id': 100, 'order_number': 1001, 'total_price': '9990'}
+        orders = FakeCollection([
+            {'tenant': TENANT, 'shopify_id': '100', 'sync_hash': content_hash(shopify._order_document(order, {}))},
+            {'tenant': TENANT, 'shopify_id': '101', 'order_number': 1002, 'customer_name': 'Ana',
+             'total_price': 5000.0},
+            {'tenant': TENANT, 'shopify_id': '102', 'order_number': 1003},
+        ])
+        monkeypatch.setattr(Product, '_get_collection', lambda: FakeCollection())
+        monkeypatch.setattr(ShopifyCustomer, '_get_collection', lambda: FakeCollection())
+        monkeypatch.setattr(ShopifyOrder, '_get_collection', lambda: orders)
+        sales = FakeCollection([{'tenant': TENANT, 'shopify_order_id': '102'}])
+        monkeypatch.setattr(Sale, '_get_collection', lambda: sales)
+        monkeypatch.setattr(shopify, 'sync_state', lambda tenant, resource: FakeState())
+        client = FakePagesClient({'products': [], 'customers': [], 'orders': [[order]]})
+        preview = sync_preview(client, TENANT)
+
+        assert preview['summary']['orders_unchanged'] == 1 and preview['summary']['orders_new'] == 0
+        assert preview['summary']['sales_new'] == 2 and preview['summary']['has_changes']
+        assert [(o['order_number'], o['customer'], o['total']) for o in preview['sales']['new']] == [
+            (1001, '', 9990.0), (1002, 'Ana', 5000.0)]
@@ -0,0 +1,198 @@
+"""
+Tests de los webhooks de Shopify (app/services/shopify_webhooks.py)
+
+Un emisor falso firma y envía los webhooks como Shopify al endpoint real
+(blueprint api en una app Flask mínima); la bandeja es una colección en
+memoria.
+"""
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from flask import Flask, g
+from flask_login import LoginManager
+
+from app.models import ShopifyWebhook, utc_now
+from app.services import shopify_webhooks
+from app.services.shopify_webhooks import drain, release_stale, sign
+
+TENANT = ObjectId()
+SECRET = 'shpss_secreto'
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            if '$in' in cond and value not in cond['$in']:
+                return False
+            if '$lt' in cond and not (value is not None and value < cond['$lt']):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeInbox:
+    def __init__(self):
+        self.docs = []
+
+    def update_one(self, query, update, upsert=False):
+        if any(_matches(doc, query) for doc in self.docs):
+            return SimpleNamespace(upserted_id=None)
+        doc = {'_id': ObjectId(), **query, **update['$setOnInsert']}
+        self.docs.append(doc)
+        return SimpleNamespace(upserted_id=doc['_id'])
+
+    def find(self, query, projection=None, sort=None, limit=0):
+        found = sorted((doc for doc in self.docs if _matches(doc, query)), key=lambda doc: doc['received_at'])
+        return [dict(doc) for doc in (found[:limit] if limit else found)]
+
+    def update_many(self, query, update):
+        matched = [doc for doc in self.docs if _matches(doc, query)]
+        for doc in matched:
+            doc.update(update.get('$set', {}))
+            for key, delta in update.get('$inc', {}).items():
+                doc[key] = doc.get(key, 0) + delta
+        return SimpleNamespace(modified_count=len(matched))
+
+
+class FakeShopifySender:
+    """Envía webhooks como Shopify: cuerpo JSON firmado con HMAC-SHA256 en base64"""
+
+    def __init__(self, client, secret=SECRET):
+        self.client = client
+        self.secret = secret
+        self.sent = 0
+
+    def send(self, topic, payload, webhook_id=None, signature=None):
+        self.sent += 1
+        body = json.dumps(payload).encode('utf-8')
+        return self.client.post(f'/api/shopify/webhooks/{topic}', data=body, headers={
+            'Content-Type': 'application/json',
+            'X-Shopify-Topic': topic,
+            'X-Shopify-Hmac-Sha256': signature or sign(body, self.secret),
+            'X-Shopify-Webhook-Id': webhook_id or f'wh-{self.sent}',
+            'X-Shopify-Shop-Domain': 'tienda.myshopify.com',
+        })
+
+
+@pytest.fixture
+def inbox(monkeypatch):
+    inbox = FakeInbox()
+    monkeypatch.setattr(ShopifyWebhook, '_get_collection', lambda: inbox)
+    return inbox
+
+
+@pytest.fixture
+def sender(inbox, monkeypatch):
+    from app.routes import api
+
+    monkeypatch.setenv('SHOPIFY_WEBHOOK_SECRET', SECRET)
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    login_manager = LoginManager(app)
+    login_manager.user_loader(lambda user_id: None)
+    app.before_request(lambda: setattr(g, 'current_tenant', TENANT))
+    app.register_blueprint(api.bp)
+    return FakeShopifySender(app.test_client())
+
+
+class TestReceive:
+    """Tests del endpoint que recibe los webhooks"""
+
+    def test_stores_raw_payload(self, sender, inbox):
+        """Test que guarda el cuerpo crudo como pendiente y responde 200"""
+        response = sender.send('orders/create', {'id': 100, 'order_number': 1001})
+
+        assert response.status_code == 200 and response.get_json() == {'success': True, 'duplicate': False}
+        doc, = inbox.docs
+        assert (doc['tenant'], doc['topic'], doc['status']) == (TENANT, 'orders/create', 'pending')
+        assert json.loads(doc['body']) == {'id': 100, 'order_number': 1001}
+
+    def test_redelivery_is_not_duplicated(self, sender, inbox):
+        """Test que un reenvío con el mismo X-Shopify-Webhook-Id no se guarda dos veces"""
+        sender.send('customers/update', {'id': 7}, webhook_id='wh-abc')
+        response = sender.send('customers/update', {'id': 7}, webhook_id='wh-abc')
+
+        assert response.status_code == 200 and response.get_json()['duplicate'] is True
+        assert len(inbox.docs) == 1
+
+    def test_rejects_bad_signature_and_unknown_topic(self, sender, inbox):
+        """Test que rechaza firmas inválidas y temas no soportados sin guardar nada"""
+        assert sender.send('orders/create', {'id': 1}, signature='falsa').status_code == 401
+        forged = FakeShopifySender(sender.client, secret='otro-secreto')
+        assert forged.send('orders/create', {'id': 1}).status_code == 401
+        assert sender.send('orders/delete', {'id': 1}).status_code == 404
+        assert inbox.docs == []
+
+
+class TestConsumer:
+    """Tests del consumidor por lotes de la bandeja"""
+
+    @pytest.fixture
+    def applied(self, monkeypatch):
+        calls = []
+
+        def upsert_customers(tenant, payloads):
+            calls.append(('customers', tenant, payloads))
+            return {'created': len(payloads), 'updated': 0, 'unchanged': 0}
+
+        def upsert_orders(tenant, payloads, create_customers=False):
+            calls.append(('orders', tenant, payloads))
+            return {'created': len(payloads), 'updated': 0, 'unchanged': 0,
+                    'customers_created': 0, 'customer_ids': {'cliente'}}
+
+        monkeypatch.setattr(shopify_webhooks, 'upsert_customers', upsert_customers)
+        monkeypatch.setattr(shopify_webhooks, 'upsert_orders', upsert_orders)
+        monkeypatch.setattr(shopify_webhooks, 'refresh_customer_stats',
+                            lambda tenant, ids: calls.append(('stats', tenant, ids)))
+        monkeypatch.setattr(shopify_webhooks, 'sales_from_orders',
+                            lambda tenant, order_ids: calls.append(('sales', tenant, order_ids)) or {'created': 1})
+        return calls
+
+    def test_batches_and_keeps_latest_version(self, sender, inbox, applied):
+        """Test que aplica un upsert por recurso, con la versión más reciente de cada registro"""
+        sender.send('orders/updated', {'id': 100, 'updated_at': '2026-03-01T10:05:00-03:00', 'note': 'nueva'})
+        sender.send('orders/create', {'id': 100, 'updated_at': '2026-03-01T10:00:00-03:00', 'note': 'vieja'})
+        sender.send('orders/create', {'id': 101, 'updated_at': '2026-03-01T11:00:00-03:00'})
+        sender.send('customers/update', {'id': 7, 'first_name': 'Ana'})
+
+        assert drain(batch_size=10) == 4
+        assert [call[0] for call in applied] == ['customers', 'orders', 'stats', 'sales']
+        orders = applied[1][2]
+        assert {o['id']: o.get('note') for o in orders} == {100: 'nueva', 101: None}
+        assert applied[2][2] == {'cliente'} and applied[3][2] == {'100', '101'}
+        assert {doc['status'] for doc in inbox.docs} == {'done'}
+
+    def test_failure_requeues_only_that_group(self, sender, inbox, applied, monkeypatch):
+        """Test que un error en órdenes deja esos webhooks pendientes y marca el resto"""
+        def broken(tenant, payloads, create_customers=False):
+            raise RuntimeError('mongo caído')
+
+        monkeypatch.setattr(shopify_webhooks, 'upsert_orders', broken)
+        sender.send('customers/update', {'id': 7})
+        sender.send('orders/create', {'id': 100})
+        inbox.docs.append({'_id': ObjectId(), 'tenant': TENANT, 'topic': 'orders/create', 'webhook_id': 'x',
+                           'body': '{no es json', 'status': 'pending', 'attempts': 0, 'received_at': utc_now()})
+
+        drain(batch_size=10)
+        by_topic = {(doc['topic'], doc['webhook_id']): doc for doc in inbox.docs}
+        assert by_topic[('customers/update', 'wh-1')]['status'] == 'done'
+        order = by_topic[('orders/create', 'wh-2')]
+        assert (order['status'], order['attempts']) == ('pending', 1) and 'mongo caído' in order['error']
+        assert by_topic[('orders/create', 'x')]['status'] == 'failed'
+
+        # Al agotar los intentos queda como fallido
+        order['attempts'] = shopify_webhooks.MAX_ATTEMPTS - 1
+        drain(batch_size=10)
+        assert order['status'] == 'failed'
+
+    def test_release_stale_claims(self, inbox):
+        """Test que devuelve a la cola los webhooks de un consumidor caído"""
+        inbox.docs.append({'_id': ObjectId(), 'status': 'processing', 'worker': 'muerto',
+                           'claimed_at': utc_now() - timedelta(hours=1), 'received_at': utc_now()})
+        assert release_stale() == 1
+        assert inbox.docs[0]['status'] == 'pending'
@@ -0,0 +1,108 @@
+"""
+Tests de la exportación CSV/NDJSON por streaming (app/services/stream_export.py)
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Flask, g
+
+from app.services.jobs import export_response
+from app.services.stream_export import StreamExport, column_key
+from app.services.xlsx_export import Column, MONEY_FORMAT
+
+COLUMNS = [
+    Column('ID', lambda r: str(r['_id'])),
+    Column('Fecha', 'date', date_format='%Y-%m-%d'),
+    Column('Método Pago', lambda r: r.get('method'), default='-'),
+    Column('Total', 'total', default=0, number_format=MONEY_FORMAT),
+]
+
+
+def _rows(count):
+    for i in range(count):
+        yield {'_id': ObjectId(), 'date': datetime(2026, 1, i % 28 + 1), 'method': None, 'total': i * 10.0}
+
+
+def _builder(export, tenant):
+    export.add_sheet('Ventas', COLUMNS, _rows(3), header_color='4F81BD')
+    export.add_sheet('Resumen', [Column('Fecha', 'date'), Column('Total', 'total')],
+                     [{'date': '2026-01-01', 'total': 30}], footer=[['TOTAL', 30]])
+
+
+class TestStreamExport:
+    """Tests de los formatos por streaming"""
+
+    def test_csv_first_sheet(self):
+        """Test que CSV escribe encabezado y filas de la primera hoja, sin estilos"""
+        export = StreamExport('csv')
+        _builder(export, None)
+        rows = list(csv.reader(io.StringIO(''.join(export.chunks()))))
+
+        assert rows[0] == ['ID', 'Fecha', 'Método Pago', 'Total']
+        assert rows[1][1:] == ['2026-01-01', '-', '0.0']
+        assert len(rows) == 4
+        assert export.rows == 3
+
+    def test_ndjson_all_sheets_tagged(self):
+        """Test que NDJSON emite todas las hojas con la clave sheet"""
+        export = StreamExport('ndjson')
+        _builder(export, None)
+        lines = [json.loads(line) for line in ''.join(export.chunks()).splitlines()]
+
+        assert len(lines) == 4
+        assert lines[0]['sheet'] == 'Ventas'
+        assert set(lines[0]) == {'sheet', 'id', 'date', 'metodo_pago', 'total'}
+        assert lines[-1] == {'sheet': 'Resumen', 'date': '2026-01-01', 'total': 30}
+
+    def test_rows_are_read_lazily(self):
+        """Test que add_sheet no consume las filas hasta enviar"""
+        consumed = []
+
+        def rows():
+            for i in range(1200):
+                consumed.append(i)
+                yield {'_id': i, 'date': None, 'total': i}
+
+        export = StreamExport('ndjson')
+        export.add_sheet('Ventas', COLUMNS, rows())
+        assert consumed == []
+
+        chunks = export.chunks()
+        next(chunks)
+        assert len(consumed) == 500
+
+    def test_column_key(self):
+        """Test que la clave usa key, el campo o el encabezado normalizado"""
+        assert column_key(Column('Fecha', 'date_created')) == 'date_created'
+        assert column_key(Column('N° Factura', lambda r: r)) == 'n_factura'
+        assert column_key(Column('ID', lambda r: r, key='sale_id')) == 'sale_id'
+
+
+class TestExportResponse:
+    """Tests de la elección de formato en export_response"""
+
+    def _get(self, query):
+        app = Flask(__name__)
+        with app.test_request_context('/export' + query):
+            g.current_tenant = None
+            response = export_response(_builder, 'ventas_20260101.xlsx')
+            if isinstance(response, tuple):
+                response, status = response
+                return status, response.get_json(), response.headers
+            return response.status_code, ''.join(response.response), response.headers
+
+    def test_csv_sheet_selection(self):
+        """Test que ?format=csv&sheet= elige la hoja y cambia la extensión"""
+        status, body, headers = self._get('?format=csv&sheet=resumen')
+
+        assert status == 200
+        assert body.splitlines() == ['Fecha,Total', '2026-01-01,30']
+        assert headers['Content-Disposition'] == 'attachment; filename="ventas_20260101.csv"'
+
+    def test_invalid_format_or_sheet(self):
+        """Test que un formato u hoja inválidos responden 400"""
+        assert self._get('?format=pdf')[0] == 400
+        assert self._get('?format=csv&sheet=otra')[0] == 400
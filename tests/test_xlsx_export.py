@@ -0,0 +1,87 @@
+"""
+Tests del motor de exportación Excel (app/services/xlsx_export.py)
+"""
+import io
+from datetime import datetime
+
+from flask import Flask
+from openpyxl import load_workbook
+
+from app.services.xlsx_export import Column, MONEY_FORMAT, Styled, XlsxExport, attach_refs, estimate_widths
+
+
+def _read(export):
+    app = Flask(__name__)
+    with app.test_request_context('/'):
+        response = export.send('test.xlsx')
+        response.direct_passthrough = False
+        data = response.get_data()
+        response.close()
+    return load_workbook(io.BytesIO(data))
+
+
+class TestXlsxExport:
+    """Tests de escritura en modo write-only"""
+
+    def test_rows_headers_and_styles(self):
+        """Test que se escriben encabezado, filas, formatos y colores de fila"""
+        rows = [
+            {'name': 'Arroz', 'total': 1500.0, 'date': datetime(2026, 1, 5, 10, 30), 'critical': True},
+            {'name': None, 'total': 20.0, 'date': None, 'critical': False},
+        ]
+        export = XlsxExport()
+        count = export.add_sheet('Ventas', [
+            Column('Nombre', 'name', default='N/A'),
+            Column('Total', 'total', number_format=MONEY_FORMAT),
+            Column('Fecha', 'date', date_format='%Y-%m-%d %H:%M', default='-'),
+        ], rows, row_color=lambda r: 'FFCCCC' if r['critical'] else None)
+
+        ws = _read(export)['Ventas']
+        assert count == 2
+        assert [c.value for c in ws[1]] == ['Nombre', 'Total', 'Fecha']
+        assert [c.value for c in ws[2]] == ['Arroz', 1500, '2026-01-05 10:30']
+        assert [c.value for c in ws[3]] == ['N/A', 20, '-']
+        assert ws['B2'].number_format == MONEY_FORMAT
+        assert ws['A2'].fill.start_color.rgb.endswith('FFCCCC')
+        assert ws['A1'].font.bold
+
+    def test_preamble_and_footer(self):
+        """Test que las filas fijas quedan antes del encabezado y después de los datos"""
+        export = XlsxExport()
+        export.add_sheet('Resumen', [Column('Fecha', 'date'), Column('Monto', 'amount')],
+                         [{'date': '2026-01-01', 'amount': 10}],
+                         preamble=[['Título'], []],
+                         footer=[[Styled('TOTAL'), Styled(10, number_format=MONEY_FORMAT)]])
+
+        ws = _read(export)['Resumen']
+        assert ws['A1'].value == 'Título'
+        assert ws['A3'].value == 'Fecha'
+        assert ws['A5'].value == 'TOTAL'
+        assert ws['B5'].number_format == MONEY_FORMAT
+
+    def test_widths_from_sample(self):
+        """Test que el ancho usa encabezado y muestra, con tope"""
+        columns = [Column('ID', 'id'), Column('Descripción', 'text')]
+        widths = estimate_widths(columns, [['1', 'x' * 100], ['22', 'abc']], max_width=40)
+
+        assert widths == [6, 40]
+
+    def test_attach_refs_uses_cache(self):
+        """Test que attach_refs solo consulta los ids que no están en caché"""
+        class FakeCollection:
+            def __init__(self):
+                self.queries = []
+
+            def find(self, query, projection):
+                ids = query['_id']['$in']
+                self.queries.append(sorted(ids))
+                return [{'_id': i, 'name': f'P{i}'} for i in ids if i != 3]
+
+        collection = FakeCollection()
+        cache = {}
+        rows = attach_refs([{'product': 1}, {'product': 3}], 'product', collection, ('name',), cache)
+        attach_refs([{'product': 1}, {'product': 2}], 'product', collection, ('name',), cache)
+
+        assert rows[0]['product_doc']['name'] == 'P1'
+        assert rows[1]['product_doc'] == {}
+        assert collection.queries == [[1, 3], [2]]